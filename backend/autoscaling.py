@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import socket
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional
+
+from arq.constants import default_queue_name, job_key_prefix
+from arq.jobs import deserialize_job
+from redis.exceptions import RedisError
+
+if TYPE_CHECKING:
+    from arq.connections import ArqRedis
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_KEY_PREFIX = "susanoh:l2:throughput:"
+BUCKET_SECONDS = 60
+WINDOW_BUCKETS = 5
+OLDEST_JOB_SAMPLE = 10  # EDF scores are not enqueue order, so sample the head of the queue
+DEFAULT_SERVICE_SECONDS = 2.0  # assumed per-job service time before any worker has reported
+DEFAULT_TARGET_SECONDS = 60.0
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_CACHE_SECONDS = 2.0
+
+
+def _float_env(name: str, default: float) -> float:
+    raw = os.environ.get(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        return default
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def recommend_workers(
+    arrival_rate: float,
+    service_seconds: float,
+    backlog: int,
+    target_seconds: float,
+    slots_per_worker: int,
+) -> int:
+    """
+    Worker count from Little's law, L = lambda * W.
+
+    The demanded rate is the arrival rate plus whatever drains the current
+    backlog within the target time-to-verdict. Multiplying it by the service
+    time gives the jobs that must be in flight, and each worker runs
+    `slots_per_worker` jobs at a time. At least one worker is always kept.
+    """
+    demand = arrival_rate + backlog / max(target_seconds, 1e-9)
+    in_flight = demand * service_seconds
+    return max(1, math.ceil(in_flight / max(slots_per_worker, 1)))
+
+
+class ThroughputRecorder:
+    """
+    Per-minute L2 counters written by API nodes (enqueued jobs) and workers
+    (completed jobs, busy seconds, Gemini prompt tokens) into one expiring
+    Redis hash per minute, with an in-memory fallback.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        worker: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.redis = redis_client
+        self.worker = worker or worker_id()
+        self._clock = clock
+        self._local: dict[int, dict[str, float]] = {}
+
+    def _bucket(self, ts: float) -> int:
+        return int(ts // BUCKET_SECONDS)
+
+    async def _incr(self, fields: dict[str, float]) -> None:
+        bucket = self._bucket(self._clock())
+        local = self._local.setdefault(bucket, {})
+        for name, value in fields.items():
+            local[name] = local.get(name, 0.0) + value
+        for stale in [b for b in self._local if b <= bucket - WINDOW_BUCKETS]:
+            del self._local[stale]
+        if self.redis:
+            try:
+                key = f"{THROUGHPUT_KEY_PREFIX}{bucket}"
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for name, value in fields.items():
+                        pipe.hincrbyfloat(key, name, value)
+                    pipe.expire(key, BUCKET_SECONDS * (WINDOW_BUCKETS + 1))
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis throughput update failed: %s", e)
+
+    async def record_enqueued(self, count: int = 1) -> None:
+        await self._incr({"enqueued": count})
+
+    async def record_completed(self, jobs: int, busy_seconds: float, tokens: int) -> None:
+        await self._incr({
+            f"{self.worker}|completed": jobs,
+            f"{self.worker}|busy": busy_seconds,
+            f"{self.worker}|tokens": tokens,
+        })
+
+    async def window(self) -> tuple[float, dict[str, float]]:
+        """(elapsed seconds, summed fields) over the last WINDOW_BUCKETS minutes, current one included."""
+        now = self._clock()
+        last = self._bucket(now)
+        buckets = range(last - WINDOW_BUCKETS + 1, last + 1)
+        elapsed = now - buckets[0] * BUCKET_SECONDS
+        parts: list[dict[str, Any]] = [self._local.get(b, {}) for b in buckets]
+        if self.redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for b in buckets:
+                        pipe.hgetall(f"{THROUGHPUT_KEY_PREFIX}{b}")
+                    parts = await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis throughput read failed: %s. Using in-memory.", e)
+        totals: dict[str, float] = {}
+        for part in parts:
+            for name, value in part.items():
+                totals[name] = totals.get(name, 0.0) + float(value)
+        return elapsed, totals
+
+
+class AutoscalingSignal:
+    """
+    Scaling signal for L2 workers: arq queue depth and oldest-job age,
+    arrival and per-worker completion rates, Gemini token headroom and a
+    Little's-law worker recommendation. Each poll is a handful of Redis
+    commands, and snapshots are cached for `cache_seconds`.
+    """
+
+    def __init__(
+        self,
+        recorder: ThroughputRecorder,
+        slots_per_worker: int,
+        queue_name: str = default_queue_name,
+        target_seconds: float | None = None,
+        tokens_per_minute: float | None = None,
+        cache_seconds: float = DEFAULT_CACHE_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.recorder = recorder
+        self.slots_per_worker = slots_per_worker
+        self.queue_name = queue_name
+        self.target_seconds = target_seconds or _float_env("SUSANOH_L2_TARGET_VERDICT_SECONDS", DEFAULT_TARGET_SECONDS)
+        self.tokens_per_minute = tokens_per_minute or _float_env(
+            "SUSANOH_GEMINI_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE
+        )
+        self.cache_seconds = cache_seconds
+        self._clock = clock
+        self._cached: tuple[float, dict[str, Any]] | None = None
+
+    async def _queue_stats(self, pool: Optional[ArqRedis]) -> tuple[int, Optional[float]]:
+        if pool is None:
+            return 0, None
+        try:
+            async with pool.pipeline(transaction=False) as pipe:
+                pipe.zcard(self.queue_name)
+                pipe.zrange(self.queue_name, 0, OLDEST_JOB_SAMPLE - 1)
+                depth, head = await pipe.execute()
+            if not head:
+                return int(depth), None
+            ids = [job_id.decode() if isinstance(job_id, bytes) else job_id for job_id in head]
+            raw_jobs = await pool.mget([f"{job_key_prefix}{job_id}" for job_id in ids])
+            enqueue_times = [
+                deserialize_job(raw, deserializer=pool.job_deserializer).enqueue_time.timestamp()
+                for raw in raw_jobs
+                if raw
+            ]
+            oldest = self._clock() - min(enqueue_times) if enqueue_times else None
+            return int(depth), oldest
+        except (RedisError, ValueError) as e:
+            logger.warning("arq queue inspection failed: %s", e)
+            return 0, None
+
+    async def snapshot(self, pool: Optional[ArqRedis] = None) -> dict[str, Any]:
+        now = self._clock()
+        if self._cached and now - self._cached[0] < self.cache_seconds:
+            return self._cached[1]
+
+        depth, oldest = await self._queue_stats(pool)
+        elapsed, totals = await self.recorder.window()
+        elapsed = max(elapsed, 1.0)
+        workers: dict[str, dict[str, float]] = {}
+        for name, value in totals.items():
+            worker, sep, field = name.rpartition("|")
+            if sep:
+                workers.setdefault(worker, {"completed": 0.0, "busy": 0.0, "tokens": 0.0})[field] = value
+
+        completed = sum(w["completed"] for w in workers.values())
+        busy = sum(w["busy"] for w in workers.values())
+        tokens_per_minute = sum(w["tokens"] for w in workers.values()) * 60 / elapsed
+        arrival_rate = totals.get("enqueued", 0.0) / elapsed
+        service_seconds = busy / completed if completed else DEFAULT_SERVICE_SECONDS
+
+        snapshot = {
+            "window_seconds": round(elapsed, 1),
+            "queue": {
+                "depth": depth,
+                "oldest_job_age_seconds": round(oldest, 1) if oldest is not None else None,
+            },
+            "arrival_rate_per_second": round(arrival_rate, 4),
+            "completion_rate_per_second": round(completed / elapsed, 4),
+            "mean_service_seconds": round(service_seconds, 3),
+            "workers": [
+                {
+                    "worker_id": worker,
+                    "jobs_per_second": round(values["completed"] / elapsed, 4),
+                    "busy_ratio": round(values["busy"] / (elapsed * self.slots_per_worker), 4),
+                }
+                for worker, values in sorted(workers.items())
+            ],
+            "gemini_tokens": {
+                "per_minute": round(tokens_per_minute),
+                "budget_per_minute": round(self.tokens_per_minute),
+                "headroom_ratio": round(max(0.0, 1 - tokens_per_minute / self.tokens_per_minute), 4),
+            },
+            "target_time_to_verdict_seconds": self.target_seconds,
+            "slots_per_worker": self.slots_per_worker,
+            "recommended_workers": recommend_workers(
+                arrival_rate, service_seconds, depth, self.target_seconds, self.slots_per_worker
+            ),
+        }
+        self._cached = (now, snapshot)
+        return snapshot
+
+    @staticmethod
+    def prometheus(snapshot: dict[str, Any]) -> str:
+        """Prometheus text exposition of a snapshot."""
+        oldest = snapshot["queue"]["oldest_job_age_seconds"]
+        lines = [
+            "# TYPE susanoh_l2_queue_depth gauge",
+            f"susanoh_l2_queue_depth {snapshot['queue']['depth']}",
+            "# TYPE susanoh_l2_oldest_job_age_seconds gauge",
+            f"susanoh_l2_oldest_job_age_seconds {oldest if oldest is not None else 0}",
+            "# TYPE susanoh_l2_arrival_rate gauge",
+            f"susanoh_l2_arrival_rate {snapshot['arrival_rate_per_second']}",
+            "# TYPE susanoh_l2_completion_rate gauge",
+            f"susanoh_l2_completion_rate {snapshot['completion_rate_per_second']}",
+            "# TYPE susanoh_l2_mean_service_seconds gauge",
+            f"susanoh_l2_mean_service_seconds {snapshot['mean_service_seconds']}",
+            "# TYPE susanoh_l2_worker_jobs_per_second gauge",
+        ]
+        lines += [
+            f'susanoh_l2_worker_jobs_per_second{{worker="{w["worker_id"]}"}} {w["jobs_per_second"]}'
+            for w in snapshot["workers"]
+        ]
+        lines += [
+            "# TYPE susanoh_gemini_tokens_per_minute gauge",
+            f"susanoh_gemini_tokens_per_minute {snapshot['gemini_tokens']['per_minute']}",
+            "# TYPE susanoh_gemini_token_headroom_ratio gauge",
+            f"susanoh_gemini_token_headroom_ratio {snapshot['gemini_tokens']['headroom_ratio']}",
+            "# TYPE susanoh_l2_recommended_workers gauge",
+            f"susanoh_l2_recommended_workers {snapshot['recommended_workers']}",
+        ]
+        return "\n".join(lines) + "\n"
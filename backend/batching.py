@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BatchHandler = Callable[[list[T]], Awaitable[list[R]]]
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesces concurrent `submit` calls into batches for `handler`.
+
+    A batch is flushed when it reaches `max_size` items or `max_wait_seconds`
+    after its first item arrived, whichever comes first. `handler` must return
+    one result per item, in order; each caller receives its own result, or the
+    exception raised by the handler.
+    """
+
+    def __init__(self, handler: BatchHandler, max_size: int = 8, max_wait_seconds: float = 0.05) -> None:
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self._handler = handler
+        self.max_size = max_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: list[tuple[T, asyncio.Future[R]]] = []
+        self._timer: asyncio.Task[None] | None = None
+        self.batches_flushed = 0
+
+    async def submit(self, item: T) -> R:
+        future: asyncio.Future[R] = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            await self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_wait())
+        return await future
+
+    async def _flush_after_wait(self) -> None:
+        await asyncio.sleep(self.max_wait_seconds)
+        self._timer = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches_flushed += 1
+        try:
+            results = await self._handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"batch handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Flush whatever is still pending."""
+        await self._flush()
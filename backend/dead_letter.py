@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import logging
+import random
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional
+
+from redis.exceptions import RedisError
+
+if TYPE_CHECKING:
+    from arq.connections import ArqRedis
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_STREAM = "susanoh:l2:dead_letter"
+DEAD_LETTER_MAXLEN = 10_000
+RETRY_BASE_SECONDS = 2.0
+RETRY_CAP_SECONDS = 300.0
+
+
+def retry_delay(
+    job_try: int,
+    base: float = RETRY_BASE_SECONDS,
+    cap: float = RETRY_CAP_SECONDS,
+    rng: Callable[[], float] = random.random,
+) -> float:
+    """Exponential backoff with equal jitter: uniform in [d/2, d] for d = min(cap, base * 2**(try-1))."""
+    delay = min(cap, base * 2 ** max(0, job_try - 1))
+    return delay / 2 + rng() * delay / 2
+
+
+class DeadLetterQueue:
+    """
+    L2 jobs that exhausted their retries, kept in a capped Redis stream so
+    they can be inspected and replayed instead of silently lost. Without
+    Redis entries are only logged (there is no queue to replay into anyway).
+    """
+
+    def __init__(self, redis_client: Optional[Redis] = None, maxlen: int = DEAD_LETTER_MAXLEN) -> None:
+        self.redis = redis_client
+        self.maxlen = maxlen
+
+    async def push(self, function: str, payload: str, error: str, tries: int) -> Optional[str]:
+        logger.error("Dead-lettering %s after %d tries: %s", function, tries, error)
+        if not self.redis:
+            return None
+        try:
+            return await self.redis.xadd(
+                DEAD_LETTER_STREAM,
+                {"function": function, "payload": payload, "error": error, "tries": tries, "ts": time.time()},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+        except RedisError as e:
+            logger.error("Failed to dead-letter %s: %s", function, e)
+            return None
+
+    async def entries(self, count: int = 100) -> list[dict[str, Any]]:
+        """Oldest entries first."""
+        if not self.redis:
+            return []
+        return [{"id": entry_id, **fields} for entry_id, fields in await self.redis.xrange(DEAD_LETTER_STREAM, count=count)]
+
+    async def replay(self, pool: ArqRedis, count: int = 100) -> int:
+        """Re-enqueue up to `count` oldest entries and remove them from the stream."""
+        replayed = 0
+        for entry in await self.entries(count):
+            payload: Any = entry["payload"]
+            if entry["function"] == "analyze_l2_task":
+                from backend.models import AnalysisRequest
+
+                payload = AnalysisRequest.model_validate_json(payload)
+            await pool.enqueue_job(entry["function"], payload)
+            await self.redis.xdel(DEAD_LETTER_STREAM, entry["id"])
+            replayed += 1
+        return replayed
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from typing import TYPE_CHECKING, Any, Optional
+
+from redis.exceptions import RedisError
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHANNEL = "susanoh:dashboard"
+SUBSCRIBER_QUEUE_SIZE = 256
+RELAY_RETRY_SECONDS = 1.0
+RELAY_RETRY_MAX_SECONDS = 30.0
+
+
+class EventBroadcaster:
+    """
+    Fans dashboard deltas out to in-process stream subscribers.
+    When Redis is available, every message is also published on a pub/sub
+    channel and a single relay task per node forwards messages published by
+    other nodes (and by the arq worker), so Redis load does not grow with the
+    number of connected viewers.
+    """
+
+    def __init__(self, redis_client: Optional[Redis] = None, node_id: str | None = None) -> None:
+        self.redis = redis_client
+        self.node_id = node_id or uuid.uuid4().hex
+        self._subscribers: set[asyncio.Queue[str]] = set()
+        self._relay_task: asyncio.Task | None = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def publish(self, kind: str, payload: dict[str, Any]) -> None:
+        message = json.dumps({"type": kind, "data": payload}, ensure_ascii=False)
+        self._fan_out(message)
+        if self.redis:
+            try:
+                envelope = json.dumps({"origin": self.node_id, "message": message}, ensure_ascii=False)
+                await self.redis.publish(STREAM_CHANNEL, envelope)
+            except RedisError as e:
+                logger.warning("Redis publish failed: %s", e)
+
+    def _fan_out(self, message: str) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # Slow viewers lose the oldest delta instead of stalling ingest.
+                with suppress(asyncio.QueueEmpty):
+                    queue.get_nowait()
+            queue.put_nowait(message)
+
+    @asynccontextmanager
+    async def subscribe(self) -> AsyncIterator[asyncio.Queue[str]]:
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    async def start_relay(self) -> None:
+        if not self.redis or self._relay_task is not None:
+            return
+        self._relay_task = asyncio.create_task(self._relay())
+
+    async def stop_relay(self) -> None:
+        if self._relay_task is None:
+            return
+        self._relay_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._relay_task
+        self._relay_task = None
+
+    def _handle_relay_message(self, raw: str | bytes) -> None:
+        try:
+            envelope = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(envelope, dict) or envelope.get("origin") == self.node_id:
+            return
+        message = envelope.get("message")
+        if isinstance(message, str):
+            self._fan_out(message)
+
+    async def _relay(self) -> None:
+        # Any failure restarts the subscription with exponential backoff; the
+        # relay must not die silently and leave this node's viewers stale.
+        delay = RELAY_RETRY_SECONDS
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(STREAM_CHANNEL)
+                delay = RELAY_RETRY_SECONDS
+                async for item in pubsub.listen():
+                    if item.get("type") == "message":
+                        self._handle_relay_message(item["data"])
+            except RedisError as e:
+                logger.warning("Redis relay disconnected: %s. Retrying in %.0fs.", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RELAY_RETRY_MAX_SECONDS)
+            except Exception:
+                logger.exception("Redis relay failed. Retrying in %.0fs.", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RELAY_RETRY_MAX_SECONDS)
+            finally:
+                with suppress(Exception):
+                    await pubsub.aclose()
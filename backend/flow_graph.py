@@ -0,0 +1,486 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+from redis.exceptions import RedisError
+
+from backend.keys import KeySchema
+from backend.models import AccountState, GameEventLog
+from backend.redis_client import scan_keys
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BUCKET_SECONDS = 60
+DEFAULT_GRAPH_HORIZON_SECONDS = 3600
+MAX_GRAPH_LINKS = 500
+# Rank scores are amounts scaled by exp(decay * (t - landmark)); the roll
+# moves the landmark forward before they grow past this many half-lives.
+REBASE_HALF_LIVES = 16
+# Edges folded per script call when the totals are rebuilt from the buckets.
+REBUILD_PAGE = 500
+_EDGE_SEP = "\t"
+
+# Adds one transfer to its bucket, the rolling totals and the rank.
+# KEYS: bucket amount, bucket count, total amount, total count, rank, clock.
+# ARGV: edge, amount, now, decay rate, ttl.
+GRAPH_ADD = """
+local edge, amount, now = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local landmark = tonumber(redis.call('HGET', KEYS[6], 'landmark'))
+if not landmark then
+    landmark = now
+    redis.call('HSET', KEYS[6], 'landmark', ARGV[3])
+end
+redis.call('HINCRBY', KEYS[1], edge, amount)
+redis.call('HINCRBY', KEYS[2], edge, 1)
+redis.call('HINCRBY', KEYS[3], edge, amount)
+redis.call('HINCRBY', KEYS[4], edge, 1)
+redis.call('ZINCRBY', KEYS[5], amount * math.exp(tonumber(ARGV[4]) * (now - landmark)), edge)
+for i = 1, 6 do
+    redis.call('EXPIRE', KEYS[i], ARGV[5])
+end
+"""
+
+# Subtracts the buckets that left the horizon from the rolling totals,
+# dropping edges whose count reaches zero, and rebases the rank, unless
+# another node already did (clock.rolled no longer equals ARGV[1]). Only
+# the few buckets that expired since the last roll are read.
+# KEYS: total amount, total count, rank, clock, then each expired bucket's
+# amount and count hash. ARGV: expected rolled, new rolled, now, decay
+# rate, rebase after (seconds), ttl.
+GRAPH_ROLL = """
+local total_amount, total_count, rank, clock = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local now, rate = tonumber(ARGV[3]), tonumber(ARGV[4])
+if (redis.call('HGET', clock, 'rolled') or '') ~= ARGV[1] then
+    return 0
+end
+for i = 5, #KEYS, 2 do
+    local amounts = redis.call('HGETALL', KEYS[i])
+    for j = 1, #amounts, 2 do
+        local edge = amounts[j]
+        redis.call('HINCRBY', total_amount, edge, -tonumber(amounts[j + 1]))
+        local count = tonumber(redis.call('HGET', KEYS[i + 1], edge) or 0)
+        if redis.call('HINCRBY', total_count, edge, -count) <= 0 then
+            redis.call('HDEL', total_amount, edge)
+            redis.call('HDEL', total_count, edge)
+            redis.call('ZREM', rank, edge)
+        end
+    end
+    redis.call('DEL', KEYS[i], KEYS[i + 1])
+end
+local landmark = tonumber(redis.call('HGET', clock, 'landmark')) or now
+if now - landmark > tonumber(ARGV[5]) then
+    redis.call('ZUNIONSTORE', rank, 1, rank, 'WEIGHTS', math.exp(rate * (landmark - now)))
+    redis.call('HSET', clock, 'landmark', ARGV[3])
+end
+redis.call('HSET', clock, 'rolled', ARGV[2])
+for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ARGV[6])
+end
+return 1
+"""
+
+# Starts a rebuild of the totals, unless another node already did: clears
+# them, moves the landmark to now and sets the current bucket aside, so
+# adds arriving during the fold (which also reach the totals) start a
+# fresh bucket and are not folded twice.
+# KEYS: total amount, total count, rank, clock, current bucket amount and
+# count, the set-aside pair. ARGV: expected rolled, new rolled, now, ttl.
+GRAPH_REBUILD = """
+if (redis.call('HGET', KEYS[4], 'rolled') or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[7], KEYS[8])
+redis.call('HSET', KEYS[4], 'landmark', ARGV[3], 'rolled', ARGV[2])
+for i = 5, 6 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 2])
+    end
+end
+return 1
+"""
+
+# Folds one page of a bucket into the totals, and for the set-aside
+# current bucket back into that bucket.
+# KEYS: total amount, total count, rank[, bucket amount, bucket count].
+# ARGV: rank weight, ttl, then (edge, amount, count) for each edge.
+GRAPH_FOLD = """
+local weight = tonumber(ARGV[1])
+for i = 3, #ARGV, 3 do
+    local edge, amount, count = ARGV[i], tonumber(ARGV[i + 1]), ARGV[i + 2]
+    redis.call('HINCRBY', KEYS[1], edge, amount)
+    redis.call('HINCRBY', KEYS[2], edge, count)
+    redis.call('ZINCRBY', KEYS[3], amount * weight, edge)
+    if #KEYS == 5 then
+        redis.call('HINCRBY', KEYS[4], edge, amount)
+        redis.call('HINCRBY', KEYS[5], edge, count)
+    end
+end
+for i = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+"""
+
+
+def _horizon_from_env() -> int:
+    raw = os.environ.get("SUSANOH_GRAPH_HORIZON_SECONDS", "").strip()
+    try:
+        return max(GRAPH_BUCKET_SECONDS, int(raw)) if raw else DEFAULT_GRAPH_HORIZON_SECONDS
+    except ValueError:
+        return DEFAULT_GRAPH_HORIZON_SECONDS
+
+
+@dataclass
+class EdgeAggregate:
+    amount: int = 0
+    count: int = 0
+    weight: float = 0.0
+    updated_at: float = 0.0
+
+    def decayed_weight(self, now: float, decay_rate: float) -> float:
+        return self.weight * math.exp(-decay_rate * max(0.0, now - self.updated_at))
+
+
+class FlowGraph:
+    """
+    Actor->target transfer aggregates maintained incrementally per event.
+
+    Edges are accumulated into fixed-size time buckets; buckets older than the
+    horizon are subtracted from the running totals as they expire, so a
+    snapshot costs O(distinct edges) rather than O(events). Each edge also
+    carries an exponentially decayed weight (half-life = horizon / 4) that is
+    used to keep only the most relevant links in a snapshot.
+
+    With Redis, every API node adds to the same bucket hashes (amount /
+    count) and to rolling per-edge totals plus a sorted set ranking the
+    edges by decayed weight, all in one script per event. Once per bucket
+    each writer, and every snapshot, folds the buckets that left the horizon
+    out of the totals and rebases the rank (whichever node gets there first
+    does it, once), so the totals stay bounded without anyone polling. A
+    snapshot then reads only the top `max_links` edges, so its cost no
+    longer depends on the horizon. Rebuilding the totals after a long gap
+    folds the live buckets a page at a time. Deltas
+    still merge the few buckets they cover. In the cluster key layout all of
+    this is kept per aggregate shard of the sender; snapshots roll and read
+    every shard and merge their top edges.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        horizon_seconds: int | None = None,
+        clock: Callable[[], float] = time.time,
+        keys: Optional[KeySchema] = None,
+    ) -> None:
+        self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
+        self.horizon_seconds = horizon_seconds or _horizon_from_env()
+        self._clock = clock
+        self._decay_rate = math.log(2) / (self.horizon_seconds / 4)
+        self._buckets: deque[tuple[int, dict[tuple[str, str], list[int]]]] = deque()
+        self._totals: dict[tuple[str, str], EdgeAggregate] = {}
+        self._rolled_bucket: int | None = None
+
+    @property
+    def bucket_count(self) -> int:
+        return math.ceil(self.horizon_seconds / GRAPH_BUCKET_SECONDS)
+
+    def _bucket_of(self, ts: float) -> int:
+        return int(ts // GRAPH_BUCKET_SECONDS)
+
+    @property
+    def _ttl(self) -> int:
+        # Buckets outlive the horizon so a late roll can still subtract them.
+        return 2 * (self.horizon_seconds + GRAPH_BUCKET_SECONDS)
+
+    def _bucket_keys(self, bucket: int, shard: int) -> tuple[str, str]:
+        return self.keys.graph(f"{bucket}:amount", shard), self.keys.graph(f"{bucket}:count", shard)
+
+    def _total_keys(self, shard: int) -> tuple[str, str, str, str]:
+        """(total amount hash, total count hash, weight rank, clock hash of landmark / rolled)."""
+        return tuple(self.keys.graph(name, shard) for name in ("amount", "count", "rank", "clock"))
+
+    async def reset(self) -> None:
+        self._buckets.clear()
+        self._totals.clear()
+        self._rolled_bucket = None
+        if self.redis:
+            try:
+                keys = []
+                for shard in self.keys.aggregate_shards:
+                    keys += await scan_keys(self.redis, self.keys.graph("*", shard))
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.delete(key)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis graph reset failed: %s", e)
+
+    def _expire(self, now: float) -> None:
+        oldest_live = self._bucket_of(now) - self.bucket_count + 1
+        while self._buckets and self._buckets[0][0] < oldest_live:
+            _, edges = self._buckets.popleft()
+            for edge, (amount, count) in edges.items():
+                total = self._totals.get(edge)
+                if total is None:
+                    continue
+                total.amount -= amount
+                total.count -= count
+                if total.count <= 0:
+                    del self._totals[edge]
+
+    def _record_local(self, edge: tuple[str, str], amount: int, now: float) -> None:
+        bucket = self._bucket_of(now)
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, {}))
+        slot = self._buckets[-1][1].setdefault(edge, [0, 0])
+        slot[0] += amount
+        slot[1] += 1
+
+        total = self._totals.setdefault(edge, EdgeAggregate(updated_at=now))
+        total.amount += amount
+        total.count += 1
+        total.weight = total.decayed_weight(now, self._decay_rate) + amount
+        total.updated_at = now
+        self._expire(now)
+
+    def stage(self, pipe: Pipeline, event: GameEventLog, now: float | None = None) -> None:
+        """Queue this event's Redis updates on a caller-owned pipeline."""
+        now = self._clock() if now is None else now
+        field = f"{event.actor_id}{_EDGE_SEP}{event.target_id}"
+        shard = self.keys.aggregate_shard(event.actor_id)
+        keys = (*self._bucket_keys(self._bucket_of(now), shard), *self._total_keys(shard))
+        pipe.eval(GRAPH_ADD, len(keys), *keys, field, event.action_details.currency_amount, now, self._decay_rate, self._ttl)
+
+    def record_local(self, event: GameEventLog, now: float | None = None) -> None:
+        now = self._clock() if now is None else now
+        self._record_local((event.actor_id, event.target_id), event.action_details.currency_amount, now)
+
+    async def record(self, event: GameEventLog) -> None:
+        now = self._clock()
+        self.record_local(event, now)
+        if self.redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    self.stage(pipe, event, now)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis graph update failed: %s", e)
+            await self.maybe_roll(now)
+
+    async def maybe_roll(self, now: float | None = None) -> None:
+        """Roll every shard's totals; a no-op until the bucket changed since this node's last roll."""
+        now = self._clock() if now is None else now
+        if not self.redis or self._rolled_bucket == self._bucket_of(now):
+            return
+        try:
+            for shard in self.keys.aggregate_shards:
+                await self._roll(now, shard)
+            self._rolled_bucket = self._bucket_of(now)
+        except RedisError as e:
+            logger.warning("Redis graph roll failed: %s", e)
+
+    async def _roll(self, now: float, shard: int) -> None:
+        """Fold the buckets that left the horizon out of a shard's totals, or rebuild them after a long gap."""
+        total_amount, total_count, rank, clock = self._total_keys(shard)
+        current = self._bucket_of(now)
+        expired = current - self.bucket_count
+        rolled = await self.redis.hget(clock, "rolled")
+        if rolled is not None and int(rolled) >= expired:
+            return
+        if rolled is None or expired - int(rolled) > self.bucket_count:
+            await self._rebuild(now, shard, rolled)
+            return
+        bucket_keys = [key for b in range(int(rolled) + 1, expired + 1) for key in self._bucket_keys(b, shard)]
+        rebase_after = REBASE_HALF_LIVES * math.log(2) / self._decay_rate
+        await self.redis.eval(
+            GRAPH_ROLL, 4 + len(bucket_keys), total_amount, total_count, rank, clock, *bucket_keys,
+            rolled, expired, now, self._decay_rate, rebase_after, self._ttl,
+        )
+
+    async def _rebuild(self, now: float, shard: int, rolled: str | None) -> None:
+        """
+        Recompute a shard's totals from its live buckets, REBUILD_PAGE edges
+        per script call so Redis is never blocked for the whole horizon.
+        Snapshots taken meanwhile see partial totals.
+        """
+        totals = self._total_keys(shard)
+        current = self._bucket_of(now)
+        expired = current - self.bucket_count
+        current_keys = self._bucket_keys(current, shard)
+        aside = self.keys.graph("rebuild:amount", shard), self.keys.graph("rebuild:count", shard)
+        started = await self.redis.eval(
+            GRAPH_REBUILD, 8, *totals, *current_keys, *aside, rolled or "", expired, now, self._ttl,
+        )
+        if not started:
+            return
+        sources = [(b, self._bucket_keys(b, shard), ()) for b in range(expired + 1, current)]
+        for bucket, (amount_key, count_key), restore in [*sources, (current, aside, current_keys)]:
+            weight = math.exp(self._decay_rate * ((bucket + 1) * GRAPH_BUCKET_SECONDS - now))
+            page: list[tuple[str, str]] = []
+            seen: set[str] = set()
+            async for edge, amount in self.redis.hscan_iter(amount_key, count=REBUILD_PAGE):
+                if edge in seen:
+                    continue  # HSCAN may return a field twice
+                seen.add(edge)
+                page.append((edge, amount))
+                if len(page) >= REBUILD_PAGE:
+                    await self._fold((*totals[:3], *restore), count_key, page, weight)
+                    page = []
+            if page:
+                await self._fold((*totals[:3], *restore), count_key, page, weight)
+        await self.redis.delete(*aside)
+
+    async def _fold(self, keys: tuple[str, ...], count_key: str, page: list[tuple[str, str]], weight: float) -> None:
+        counts = await self.redis.hmget(count_key, [edge for edge, _ in page])
+        args = [arg for (edge, amount), count in zip(page, counts) for arg in (edge, amount, count or 0)]
+        await self.redis.eval(GRAPH_FOLD, len(keys), *keys, weight, self._ttl, *args)
+
+    async def _redis_top_links(self, now: float, max_links: int) -> dict[tuple[str, str], EdgeAggregate]:
+        shards = list(self.keys.aggregate_shards)
+        for shard in shards:
+            await self._roll(now, shard)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for shard in shards:
+                _, _, rank, clock = self._total_keys(shard)
+                pipe.zrevrange(rank, 0, max_links - 1, withscores=True)
+                pipe.hget(clock, "landmark")
+            raw = await pipe.execute()
+
+        # Scores are relative to their shard's landmark; scale them to `now`
+        # so edges of different shards rank by decayed weight.
+        candidates: list[tuple[float, int, str]] = []
+        for i, shard in enumerate(shards):
+            top, landmark = raw[2 * i], raw[2 * i + 1]
+            scale = math.exp(self._decay_rate * (float(landmark) - now)) if landmark is not None else 1.0
+            candidates += [(score * scale, shard, field) for field, score in top]
+        top = sorted(candidates, reverse=True)[:max_links]
+        if not top:
+            return {}
+        by_shard: dict[int, list[str]] = {}
+        for _, shard, field in top:
+            by_shard.setdefault(shard, []).append(field)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for shard, fields in by_shard.items():
+                total_amount, total_count, _, _ = self._total_keys(shard)
+                pipe.hmget(total_amount, fields)
+                pipe.hmget(total_count, fields)
+            raw = await pipe.execute()
+        totals: dict[str, tuple[str | None, str | None]] = {}
+        for i, fields in enumerate(by_shard.values()):
+            totals.update(zip(fields, zip(raw[2 * i], raw[2 * i + 1])))
+
+        links: dict[tuple[str, str], EdgeAggregate] = {}
+        for weight, _, field in top:
+            amount, count = totals[field]
+            if amount is None or count is None:
+                continue
+            src, _, dst = field.partition(_EDGE_SEP)
+            links[(src, dst)] = EdgeAggregate(int(amount), int(count), weight, now)
+        return links
+
+    async def _redis_links(self, now: float, first_bucket: int) -> dict[tuple[str, str], EdgeAggregate]:
+        current = self._bucket_of(now)
+        buckets = [
+            (bucket, shard) for bucket in range(first_bucket, current + 1) for shard in self.keys.aggregate_shards
+        ]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for bucket, shard in buckets:
+                amount_key, count_key = self._bucket_keys(bucket, shard)
+                pipe.hgetall(amount_key)
+                pipe.hgetall(count_key)
+            raw = await pipe.execute()
+
+        merged: dict[tuple[str, str], EdgeAggregate] = {}
+        for i, (bucket, _) in enumerate(buckets):
+            amounts, counts = raw[2 * i], raw[2 * i + 1]
+            bucket_end = (bucket + 1) * GRAPH_BUCKET_SECONDS
+            decay = math.exp(-self._decay_rate * max(0.0, now - bucket_end))
+            for field, amount in amounts.items():
+                src, _, dst = field.partition(_EDGE_SEP)
+                agg = merged.setdefault((src, dst), EdgeAggregate(updated_at=now))
+                agg.amount += int(amount)
+                agg.count += int(counts.get(field, 0))
+                agg.weight += int(amount) * decay
+        return merged
+
+    def _local_links(self, now: float, first_bucket: int) -> dict[tuple[str, str], EdgeAggregate]:
+        self._expire(now)
+        if first_bucket <= self._bucket_of(now) - self.bucket_count + 1:
+            return {
+                edge: EdgeAggregate(agg.amount, agg.count, agg.decayed_weight(now, self._decay_rate), now)
+                for edge, agg in self._totals.items()
+            }
+        merged: dict[tuple[str, str], EdgeAggregate] = {}
+        for bucket, edges in self._buckets:
+            if bucket < first_bucket:
+                continue
+            for edge, (amount, count) in edges.items():
+                agg = merged.setdefault(edge, EdgeAggregate(updated_at=now))
+                agg.amount += amount
+                agg.count += count
+                agg.weight = self._totals[edge].decayed_weight(now, self._decay_rate)
+        return merged
+
+    async def snapshot(self, since: float | None = None, max_links: int = MAX_GRAPH_LINKS) -> dict[str, Any]:
+        """
+        Return the aggregated links within the horizon, or only the increments
+        recorded since `since` (epoch seconds) when a delta is requested.
+        `version` is the start of the current bucket and can be passed back
+        as `since` to fetch the next delta.
+        """
+        now = self._clock()
+        oldest_live = self._bucket_of(now) - self.bucket_count + 1
+        first_bucket = oldest_live if since is None else max(oldest_live, self._bucket_of(since))
+
+        edges: dict[tuple[str, str], EdgeAggregate] | None = None
+        if self.redis:
+            try:
+                if first_bucket == oldest_live:
+                    edges = await self._redis_top_links(now, max_links)
+                else:
+                    edges = await self._redis_links(now, first_bucket)
+            except RedisError as e:
+                logger.warning("Redis graph snapshot failed: %s. Using in-memory.", e)
+        if edges is None:
+            edges = self._local_links(now, first_bucket)
+
+        ranked = sorted(edges.items(), key=lambda item: item[1].weight, reverse=True)[:max_links]
+        return {
+            "links": [
+                {"source": src, "target": dst, "amount": agg.amount, "count": agg.count}
+                for (src, dst), agg in ranked
+            ],
+            "version": self._bucket_of(now) * GRAPH_BUCKET_SECONDS,
+        }
+
+    @staticmethod
+    def build_graph(snapshot: dict[str, Any], accounts: dict[str, AccountState]) -> dict[str, Any]:
+        nodes = []
+        seen: set[str] = set()
+        for link in snapshot["links"]:
+            for nid in (link["source"], link["target"]):
+                if nid in seen:
+                    continue
+                seen.add(nid)
+                state = accounts.get(nid, AccountState.NORMAL)
+                nodes.append({"id": nid, "state": state.value, "label": nid})
+        return {"nodes": nodes, "links": snapshot["links"], "version": snapshot["version"]}
+
+    @staticmethod
+    def node_ids(snapshot: dict[str, Any]) -> list[str]:
+        ids: dict[str, None] = {}
+        for link in snapshot["links"]:
+            ids[link["source"]] = None
+            ids[link["target"]] = None
+        return list(ids)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from backend.models import GameEventLog
+
+RING_WINDOW_SECONDS = 1800
+MAX_TRACKED_EDGES = 50_000
+
+FAN_IN_MIN_SENDERS = 5
+CHAIN_MIN_HOPS = 3
+CHAIN_MAX_HOPS = 8
+CHAIN_MIN_RATIO = 0.8  # each hop forwards at least 80% of the previous amount
+CYCLE_MAX_DEPTH = 4
+CYCLE_MAX_EXPANSIONS = 200
+
+
+@dataclass(frozen=True)
+class RingDetection:
+    pattern: str
+    members: tuple[str, ...]
+
+
+@dataclass
+class _Transfer:
+    amount: int
+    ts: float
+
+
+@dataclass
+class _Adjacency:
+    outgoing: dict[str, _Transfer] = field(default_factory=dict)
+    incoming: dict[str, _Transfer] = field(default_factory=dict)
+
+
+class RingDetector:
+    """
+    Streaming detector for mule-ring structures on the transfer graph.
+
+    Keeps a bounded, time-windowed adjacency index (latest transfer per
+    actor->target pair) and, for every new edge, inspects only that edge's
+    neighbourhood:
+
+    - FAN_IN: the receiver has at least FAN_IN_MIN_SENDERS distinct senders.
+    - CHAIN: walking back from the edge finds CHAIN_MIN_HOPS time-ordered
+      hops whose amounts shrink by no more than CHAIN_MIN_RATIO per hop
+      (layering).
+    - CYCLE: the new edge closes a directed cycle of length <= CYCLE_MAX_DEPTH.
+
+    Work per edge is bounded by the fan-in of the walked nodes and
+    CYCLE_MAX_EXPANSIONS, independent of the total graph size.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = RING_WINDOW_SECONDS,
+        max_edges: int = MAX_TRACKED_EDGES,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.max_edges = max_edges
+        self._clock = clock
+        self._nodes: dict[str, _Adjacency] = {}
+        self._edge_log: deque[tuple[float, str, str]] = deque()
+        self._edge_count = 0
+
+    @property
+    def edge_count(self) -> int:
+        return self._edge_count
+
+    def reset(self) -> None:
+        self._nodes.clear()
+        self._edge_log.clear()
+        self._edge_count = 0
+
+    def _node(self, user_id: str) -> _Adjacency:
+        node = self._nodes.get(user_id)
+        if node is None:
+            node = self._nodes[user_id] = _Adjacency()
+        return node
+
+    def _drop_edge(self, src: str, dst: str, ts: float) -> None:
+        src_node = self._nodes.get(src)
+        if src_node is None:
+            return
+        transfer = src_node.outgoing.get(dst)
+        # The log holds every write; only drop the edge if this entry is its latest.
+        if transfer is None or transfer.ts != ts:
+            return
+        del src_node.outgoing[dst]
+        dst_node = self._nodes[dst]
+        dst_node.incoming.pop(src, None)
+        self._edge_count -= 1
+        for uid, node in ((src, src_node), (dst, dst_node)):
+            if not node.outgoing and not node.incoming:
+                del self._nodes[uid]
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._edge_log and (self._edge_log[0][0] < cutoff or self._edge_count > self.max_edges):
+            ts, src, dst = self._edge_log.popleft()
+            self._drop_edge(src, dst, ts)
+
+    def _add_edge(self, src: str, dst: str, amount: int, now: float) -> None:
+        src_node = self._node(src)
+        if dst not in src_node.outgoing:
+            self._edge_count += 1
+        transfer = _Transfer(amount=amount, ts=now)
+        src_node.outgoing[dst] = transfer
+        self._node(dst).incoming[src] = transfer
+        self._edge_log.append((now, src, dst))
+
+    def observe(self, event: GameEventLog) -> list[RingDetection]:
+        src, dst = event.actor_id, event.target_id
+        if src == dst:
+            return []
+        now = self._clock()
+        self._add_edge(src, dst, event.action_details.currency_amount, now)
+        self._expire(now)
+
+        detections = []
+        for check in (self._check_fan_in, self._check_chain, self._check_cycle):
+            found = check(src, dst)
+            if found:
+                detections.append(found)
+        return detections
+
+    def _check_fan_in(self, src: str, dst: str) -> RingDetection | None:
+        senders = self._nodes[dst].incoming
+        if len(senders) < FAN_IN_MIN_SENDERS:
+            return None
+        return RingDetection("FAN_IN", tuple(sorted(senders)) + (dst,))
+
+    def _check_chain(self, src: str, dst: str) -> RingDetection | None:
+        path = [dst, src]
+        current = src
+        downstream = self._nodes[src].outgoing[dst]
+        while len(path) - 1 < CHAIN_MAX_HOPS:
+            best: tuple[float, str, _Transfer] | None = None
+            for pred, transfer in self._nodes[current].incoming.items():
+                if pred in path or transfer.ts > downstream.ts or transfer.amount <= 0:
+                    continue
+                ratio = downstream.amount / transfer.amount
+                if CHAIN_MIN_RATIO <= ratio <= 1.0 and (best is None or ratio > best[0]):
+                    best = (ratio, pred, transfer)
+            if best is None:
+                break
+            _, current, downstream = best
+            path.append(current)
+        if len(path) - 1 < CHAIN_MIN_HOPS:
+            return None
+        return RingDetection("CHAIN", tuple(reversed(path)))
+
+    def _check_cycle(self, src: str, dst: str) -> RingDetection | None:
+        # Depth-limited DFS from dst looking for a path back to src.
+        stack: list[tuple[str, tuple[str, ...]]] = [(dst, (src, dst))]
+        expansions = 0
+        while stack and expansions < CYCLE_MAX_EXPANSIONS:
+            node, path = stack.pop()
+            expansions += 1
+            for nxt in self._nodes[node].outgoing:
+                if nxt == src:
+                    return RingDetection("CYCLE", path)
+                if nxt not in path and len(path) < CYCLE_MAX_DEPTH:
+                    stack.append((nxt, path + (nxt,)))
+        return None
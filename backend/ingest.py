@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Any, Optional
+
+from pydantic import ValidationError
+from redis.exceptions import RedisError, ResponseError
+
+from backend.autoscaling import worker_id
+from backend.models import GameEventLog
+from backend.redis_client import is_degraded
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+    from backend.redis_client import CircuitBreaker
+    from backend.wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+INGEST_MODES = ("sync", "queued")
+INGEST_STREAM = "susanoh:ingest"
+INGEST_GROUP = "screening"
+SEEN_KEY_PREFIX = "susanoh:ingest:seen:"
+SEEN_TTL_SECONDS = 86400
+SEEN_LOCAL_MAX = 100_000
+DEFAULT_CONSUMERS = 4
+DEFAULT_STREAM_MAXLEN = 1_000_000
+DEFAULT_LOCAL_MAX = 100_000
+READ_BATCH = 16
+READ_BLOCK_MS = 500  # below the client's socket timeout
+CLAIM_IDLE_MS = 30_000
+MAX_ATTEMPTS = 5
+
+EventHandler = Callable[[GameEventLog], Awaitable[Any]]
+
+
+def ingest_mode_from_env() -> str:
+    mode = os.environ.get("SUSANOH_INGEST_MODE", "sync").strip().lower()
+    return mode if mode in INGEST_MODES else "sync"
+
+
+def _int_env(name: str, default: int) -> int:
+    raw = os.environ.get(name, "").strip()
+    try:
+        return max(1, int(raw)) if raw else default
+    except ValueError:
+        return default
+
+
+def ingest_stream_key(node: Optional[str] = None) -> str:
+    """One stream per shard node, so events are screened by the node that owns them."""
+    return f"{INGEST_STREAM}:{node}" if node else INGEST_STREAM
+
+
+class IngestBacklogFull(Exception):
+    """The queue an event would go to is at capacity; the caller should retry later."""
+
+
+class EventIngestor:
+    """
+    Queued intake for `POST /api/v1/events`.
+
+    `submit` de-duplicates the already validated event on its event_id and
+    appends it to a Redis stream (or, without Redis, to a bounded in-process
+    queue), so the game server gets its 202 after two Redis round trips
+    however slow screening is. A pool of `consumers` tasks drains both
+    queues through `handler`, which sets screening throughput independently
+    of intake.
+
+    While Redis is degraded an event is only accepted once it is durable:
+    it is committed to the write-ahead log and parked, and
+    `replay_degraded_writes` moves parked events into the stream when Redis
+    is back, through the same seen key, so an event submitted on both paths
+    is screened once. Without a WAL, submit raises IngestBacklogFull (503).
+
+    Both queues are bounded without ever dropping an accepted event: the
+    stream is not trimmed (a trimmed, unread entry would leave its event_id
+    marked queued, so a resubmit would be skipped as a duplicate). Once
+    `maxlen` unfinished entries are queued, `submit` raises
+    IngestBacklogFull instead. Finished entries are deleted, so XLEN is the
+    backlog; concurrent submitters can overshoot the cap by their number.
+
+    Delivery is at least once. A stream entry is acknowledged and deleted
+    only after the handler returned, together with marking its event_id
+    done. Entries of a consumer that died are claimed again after
+    `claim_idle_ms`, and re-deliveries of an event already marked done are
+    skipped. An event whose handler keeps failing is dropped with an error
+    after MAX_ATTEMPTS deliveries, counted by the stream's pending entry
+    list, so the count survives a consumer that died.
+    """
+
+    def __init__(
+        self,
+        handler: EventHandler,
+        redis_client: Optional[Redis] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        stream: str = INGEST_STREAM,
+        consumers: Optional[int] = None,
+        maxlen: Optional[int] = None,
+        local_max: Optional[int] = None,
+        consumer_prefix: Optional[str] = None,
+        claim_idle_ms: int = CLAIM_IDLE_MS,
+        block_ms: Optional[int] = READ_BLOCK_MS,
+        wal: Optional[WriteAheadLog] = None,
+    ) -> None:
+        self.handler = handler
+        self.redis = redis_client
+        self.breaker = breaker
+        self.wal = wal
+        self.stream = stream
+        self.consumers = consumers or _int_env("SUSANOH_INGEST_CONSUMERS", DEFAULT_CONSUMERS)
+        self.maxlen = maxlen or _int_env("SUSANOH_INGEST_STREAM_MAXLEN", DEFAULT_STREAM_MAXLEN)
+        self.consumer_prefix = consumer_prefix or worker_id()
+        self.claim_idle_ms = claim_idle_ms
+        self.block_ms = block_ms
+        self._local: asyncio.Queue[tuple[GameEventLog, int]] = asyncio.Queue(
+            maxsize=local_max or _int_env("SUSANOH_INGEST_LOCAL_MAX", DEFAULT_LOCAL_MAX)
+        )
+        self._seen_local: OrderedDict[str, None] = OrderedDict()
+        # Events accepted into the WAL while Redis was degraded, oldest first.
+        self._parked: deque[GameEventLog] = deque()
+        self._local_max = self._local.maxsize
+        self._group_ready = False
+        self._tasks: list[asyncio.Task] = []
+        self.processed = 0
+        self.duplicates = 0
+
+    @property
+    def degraded(self) -> bool:
+        return is_degraded(self.breaker)
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._parked)
+
+    # --- intake ---
+
+    async def submit(self, event: GameEventLog) -> dict[str, Any]:
+        if not self.redis:
+            return self._submit_local(event)
+        if not self.degraded:
+            try:
+                return await self._submit_redis(event)
+            except RedisError as e:
+                logger.warning("Queueing event %s in Redis failed: %s. Parking it in the WAL.", event.event_id, e)
+        return await self._park(event)
+
+    async def _submit_redis(self, event: GameEventLog) -> dict[str, Any]:
+        seen_key = f"{SEEN_KEY_PREFIX}{event.event_id}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(seen_key, "queued", nx=True, ex=SEEN_TTL_SECONDS)
+            pipe.xlen(self.stream)
+            fresh, backlog = await pipe.execute()
+        if not fresh:
+            self.duplicates += 1
+            return {"event_id": event.event_id, "queue": "redis", "duplicate": True}
+        if backlog >= self.maxlen:
+            await self._forget_seen(seen_key)
+            raise IngestBacklogFull(f"ingest stream holds {backlog} unscreened events")
+        try:
+            await self.redis.xadd(self.stream, {"event": event.model_dump_json()})
+        except RedisError:
+            await self._forget_seen(seen_key)
+            raise
+        return {"event_id": event.event_id, "queue": "redis", "duplicate": False}
+
+    async def _forget_seen(self, seen_key: str) -> None:
+        try:
+            await self.redis.delete(seen_key)
+        except RedisError:
+            pass
+
+    def _remember_local(self, event_id: str) -> None:
+        self._seen_local[event_id] = None
+        while len(self._seen_local) > SEEN_LOCAL_MAX:
+            self._seen_local.popitem(last=False)
+
+    def _submit_local(self, event: GameEventLog) -> dict[str, Any]:
+        if event.event_id in self._seen_local:
+            self.duplicates += 1
+            return {"event_id": event.event_id, "queue": "local", "duplicate": True}
+        if self._local.full():
+            raise IngestBacklogFull(f"local ingest queue holds {self._local.qsize()} events")
+        self._local.put_nowait((event, 0))
+        self._remember_local(event.event_id)
+        return {"event_id": event.event_id, "queue": "local", "duplicate": False}
+
+    async def _park(self, event: GameEventLog) -> dict[str, Any]:
+        if self.wal is None:
+            raise IngestBacklogFull("Redis is unavailable and no write-ahead log is configured")
+        if event.event_id in self._seen_local:
+            self.duplicates += 1
+            return {"event_id": event.event_id, "queue": "wal", "duplicate": True}
+        if len(self._parked) >= self._local_max:
+            raise IngestBacklogFull(f"{len(self._parked)} events are parked until Redis is back")
+        self.wal.append("ingest", {"event": event.model_dump(mode="json")})
+        # Only a committed record makes the 202 safe to give.
+        await self.wal.commit()
+        self._parked.append(event)
+        self._remember_local(event.event_id)
+        return {"event_id": event.event_id, "queue": "wal", "duplicate": False}
+
+    def restore_from_wal(self, kind: str, data: dict, lsn: int = 0) -> bool:
+        """
+        Park an event a previous process accepted while Redis was degraded.
+        Needs no LSN watermark: the stream's seen-keys drop an event queued twice.
+        """
+        if kind != "ingest":
+            return False
+        event = GameEventLog.model_validate(data["event"])
+        self._parked.append(event)
+        self._remember_local(event.event_id)
+        return True
+
+    async def replay_degraded_writes(self) -> int:
+        """Queue parked events in the stream, oldest first; returns how many left the parking."""
+        if not self.redis or self.degraded:
+            return 0
+        moved = 0
+        while self._parked:
+            try:
+                await self._submit_redis(self._parked[0])
+            except (RedisError, IngestBacklogFull) as e:
+                logger.warning("Queueing parked events failed after %d: %s", moved, e)
+                break
+            self._parked.popleft()
+            moved += 1
+        return moved
+
+    # --- consumers ---
+
+    async def _ensure_group(self) -> None:
+        if self._group_ready:
+            return
+        try:
+            await self.redis.xgroup_create(self.stream, INGEST_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def drain_local(self, limit: int = READ_BATCH) -> int:
+        handled = 0
+        for _ in range(limit):
+            if self._local.empty():
+                break
+            event, attempts = self._local.get_nowait()
+            try:
+                await self.handler(event)
+            except Exception as e:
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    logger.error("Dropping event %s after %d failed attempts: %s", event.event_id, attempts + 1, e)
+                else:
+                    logger.warning("Screening queued event %s failed: %s", event.event_id, e)
+                    self._local.put_nowait((event, attempts + 1))
+                continue
+            self.processed += 1
+            handled += 1
+        return handled
+
+    async def poll_once(self, consumer: str, block_ms: Optional[int] = None) -> int:
+        """Screen one batch from the Redis stream as `consumer`; returns the number handled."""
+        if not self.redis or self.degraded:
+            return 0
+        await self._ensure_group()
+        _, entries, *_ = await self.redis.xautoclaim(
+            self.stream, INGEST_GROUP, consumer, min_idle_time=self.claim_idle_ms, count=READ_BATCH
+        )
+        if not entries:
+            reply = await self.redis.xreadgroup(
+                INGEST_GROUP, consumer, {self.stream: ">"}, count=READ_BATCH, block=block_ms
+            )
+            entries = reply[0][1] if reply else []
+        handled = 0
+        for entry_id, fields in entries:
+            if await self._handle_entry(entry_id, fields or {}):
+                handled += 1
+        return handled
+
+    async def _handle_entry(self, entry_id: str, fields: dict[str, str]) -> bool:
+        try:
+            event = GameEventLog.model_validate_json(fields.get("event", ""))
+        except ValidationError:
+            logger.error("Dropping malformed ingest entry %s", entry_id)
+            await self._finish(entry_id, None)
+            return False
+        seen_key = f"{SEEN_KEY_PREFIX}{event.event_id}"
+        if await self.redis.get(seen_key) == "done":
+            await self._finish(entry_id, None)
+            return False
+        try:
+            await self.handler(event)
+        except Exception as e:
+            attempts = await self._deliveries(entry_id)
+            if attempts < MAX_ATTEMPTS:
+                logger.warning("Screening queued event %s failed; it will be re-delivered: %s", event.event_id, e)
+                return False
+            logger.error("Dropping event %s after %d failed attempts: %s", event.event_id, attempts, e)
+        await self._finish(entry_id, seen_key)
+        self.processed += 1
+        return True
+
+    async def _deliveries(self, entry_id: str) -> int:
+        """How often the group delivered this entry, to any consumer."""
+        pending = await self.redis.xpending_range(self.stream, INGEST_GROUP, min=entry_id, max=entry_id, count=1)
+        return int(pending[0]["times_delivered"]) if pending else 1
+
+    async def _finish(self, entry_id: str, seen_key: Optional[str]) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if seen_key:
+                pipe.set(seen_key, "done", ex=SEEN_TTL_SECONDS)
+            pipe.xack(self.stream, INGEST_GROUP, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def _run(self, consumer: str) -> None:
+        while True:
+            handled = await self.drain_local()
+            try:
+                # Only block on Redis when there is no local backlog to get back to.
+                handled += await self.poll_once(consumer, None if handled else self.block_ms)
+            except RedisError as e:
+                logger.warning("Ingest stream read failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if not handled and (not self.redis or self.degraded):
+                await asyncio.sleep(0.05)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run(f"{self.consumer_prefix}:{i}")) for i in range(self.consumers)
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def status(self) -> dict[str, Any]:
+        backlog: Optional[int] = None
+        if self.redis and not self.degraded:
+            try:
+                backlog = await self.redis.xlen(self.stream)
+            except RedisError:
+                pass
+        return {
+            "mode": "queued",
+            "consumers": self.consumers,
+            "stream": self.stream if self.redis else None,
+            "stream_backlog": backlog,
+            "local_backlog": self._local.qsize(),
+            "parked": len(self._parked),
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+        }
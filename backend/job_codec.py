@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field
+
+# Bump when the positional layout changes; workers reject versions they do not know.
+# v2 appends the priority lane; v1 payloads decode into the default lane.
+# v3 appends the window side the job's rules were raised on; older payloads
+# were always receiver-side.
+JOB_FORMAT_VERSION = 3
+DEFAULT_LANE = "normal"
+DEFAULT_SIDE = "target"
+
+
+@dataclass(frozen=True)
+class L2JobRef:
+    """
+    By-reference L2 job: enough to rebuild the AnalysisRequest from the live
+    Redis window when the worker picks the job up, instead of pickling the
+    whole request (and every related event) into the queue.
+    """
+
+    target_id: str
+    trigger_event_id: str
+    triggered_rules: list[str]
+    enqueue_ts: float = field(default_factory=time.time)
+    lane: str = DEFAULT_LANE
+    # WindowSide value: "actor" for outflow rules (R6/R7) that incriminate the sender.
+    side: str = DEFAULT_SIDE
+
+
+def encode_job(ref: L2JobRef) -> str:
+    """Versioned positional JSON: [version, target_id, trigger_event_id, rules, enqueue_ts, lane, side]."""
+    return json.dumps(
+        [
+            JOB_FORMAT_VERSION,
+            ref.target_id,
+            ref.trigger_event_id,
+            ref.triggered_rules,
+            round(ref.enqueue_ts, 3),
+            ref.lane,
+            ref.side,
+        ],
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def decode_job(payload: str | bytes) -> L2JobRef:
+    try:
+        data = json.loads(payload)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"malformed L2 job payload: {e}") from e
+    if not isinstance(data, list) or not data:
+        raise ValueError("malformed L2 job payload")
+    version = data[0]
+    if version == 1 and len(data) == 5:
+        data = [*data, DEFAULT_LANE, DEFAULT_SIDE]
+    elif version == 2 and len(data) == 6:
+        data = [*data, DEFAULT_SIDE]
+    elif version != JOB_FORMAT_VERSION or len(data) != 7:
+        raise ValueError(f"unsupported L2 job format version: {version!r}")
+    _, target_id, trigger_event_id, rules, enqueue_ts, lane, side = data
+    return L2JobRef(
+        str(target_id), str(trigger_event_id), [str(r) for r in rules], float(enqueue_ts), str(lane), str(side)
+    )
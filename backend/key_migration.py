@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import logging
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from redis.exceptions import ResponseError
+
+from backend.flow_graph import _EDGE_SEP
+from backend.keys import LEGACY_KEYS, KeySchema
+from backend.models import AccountState
+from backend.state_machine import StateMachine
+from backend.transition_stream import stream_maxlen_from_env
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH = 1000
+SCREENING_KEYS = ("recent_events", "total_events", "l1_flag_count")
+# RPUSH list that held transitions before the capped transition stream.
+LEGACY_TRANSITION_LIST = "susanoh:transitions"
+
+
+async def _move_transitions(redis: Redis, target: KeySchema, apply: bool) -> int:
+    """
+    Move the old transition list, and in the cluster layout the single legacy
+    stream, into `target`'s per-shard streams in their original order. Each
+    batch is removed from its source and counted in the same transaction, so
+    a re-run never moves or counts an entry twice. Consumer groups start over
+    on the new streams; sinks skip the transitions they already hold.
+    """
+    sources = [LEGACY_TRANSITION_LIST]
+    if target.cluster:
+        sources.append(LEGACY_KEYS.transitions())
+    if not apply:
+        total = await redis.llen(LEGACY_TRANSITION_LIST)
+        return total + (await redis.xlen(LEGACY_KEYS.transitions()) if target.cluster else 0)
+
+    maxlen = stream_maxlen_from_env()
+    moved = 0
+    for source in sources:
+        is_list = source == LEGACY_TRANSITION_LIST
+        while True:
+            if is_list:
+                batch = [(None, json.loads(raw)) for raw in await redis.lrange(source, 0, MIGRATION_BATCH - 1)]
+            else:
+                batch = await redis.xrange(source, count=MIGRATION_BATCH)
+            if not batch:
+                break
+            counts: dict[int, int] = {}
+            async with redis.pipeline(transaction=True) as pipe:
+                for _, fields in batch:
+                    shard = target.aggregate_shard(fields.get("user_id", ""))
+                    pipe.xadd(target.transitions(shard), fields, maxlen=maxlen, approximate=True)
+                    counts[shard] = counts.get(shard, 0) + 1
+                for shard, count in counts.items():
+                    pipe.incrby(target.transition_count(shard), count)
+                if is_list:
+                    pipe.ltrim(source, len(batch), -1)
+                else:
+                    pipe.xdel(source, *(entry_id for entry_id, _ in batch))
+                    pipe.decrby(LEGACY_KEYS.transition_count(), len(batch))
+                await pipe.execute()
+            moved += len(batch)
+
+    if target.cluster:
+        # Transitions already trimmed from the legacy stream still count towards the total.
+        trimmed = int(await redis.get(LEGACY_KEYS.transition_count()) or 0)
+        async with redis.pipeline(transaction=True) as pipe:
+            if trimmed > 0:
+                pipe.incrby(target.transition_count(0), trimmed)
+            pipe.delete(LEGACY_KEYS.transition_count(), LEGACY_KEYS.transitions())
+            await pipe.execute()
+    return moved
+
+
+async def _split_by_shard(
+    redis: Redis, key: str, target_key: Callable[[int], str], shard_of: Callable[[str], int] | None, target: KeySchema
+) -> None:
+    """
+    Move one legacy hash or sorted set into per-shard copies, keeping its TTL.
+    Members go to the shard `shard_of(member)` picks; without `shard_of`
+    the whole key is copied to every shard.
+    """
+    kind = await redis.type(key)
+    ttl = await redis.pttl(key)
+    if kind == "hash":
+        entries = list((await redis.hgetall(key)).items())
+    elif kind == "zset":
+        entries = await redis.zrange(key, 0, -1, withscores=True)
+    else:
+        return
+    groups: dict[int, dict] = {}
+    for member, value in entries:
+        shards = target.aggregate_shards if shard_of is None else (shard_of(member),)
+        for shard in shards:
+            groups.setdefault(shard, {})[member] = value
+    async with redis.pipeline(transaction=True) as pipe:
+        for shard, mapping in groups.items():
+            if kind == "hash":
+                pipe.hset(target_key(shard), mapping=mapping)
+            else:
+                pipe.zadd(target_key(shard), mapping)
+            if ttl > 0:
+                pipe.pexpire(target_key(shard), ttl)
+        pipe.delete(key)
+        await pipe.execute()
+
+
+async def _move_economy_views(redis: Redis, target: KeySchema, apply: bool) -> int:
+    """
+    Move the flow graph, leaderboards and price sums into the cluster layout.
+    Graph buckets are split by the sender's aggregate shard and leaderboard
+    summaries by the ranked user's; the Count-Min rows are copied to every
+    shard, where they stay upper bounds. The graph's rolling totals are
+    dropped: the next snapshot rebuilds them from the buckets.
+    """
+    moved = 0
+    async for key in redis.scan_iter(match="susanoh:graph:*", count=MIGRATION_BATCH):
+        moved += 1
+        if not apply:
+            continue
+        parts = key.split(":")
+        if len(parts) == 4 and parts[2].lstrip("-").isdigit():
+            await _split_by_shard(
+                redis, key,
+                lambda shard, name=f"{parts[2]}:{parts[3]}": target.graph(name, shard),
+                lambda field: target.aggregate_shard(field.partition(_EDGE_SEP)[0]),
+                target,
+            )
+        else:
+            await redis.delete(key)
+
+    async for key in redis.scan_iter(match="susanoh:leaderboard:*", count=MIGRATION_BATCH):
+        parts = key.split(":")
+        if len(parts) not in (4, 5):
+            continue
+        moved += 1
+        if not apply:
+            continue
+        board, bucket, suffix = parts[2], parts[3], parts[4:]
+        await _split_by_shard(
+            redis, key,
+            lambda shard: ":".join([target.leaderboard(board, bucket, shard), *suffix]),
+            None if suffix == ["cms"] else target.aggregate_shard,
+            target,
+        )
+
+    async for key in redis.scan_iter(match="susanoh:price:*", count=MIGRATION_BATCH):
+        parts = key.split(":")
+        if len(parts) < 4:
+            continue
+        moved += 1
+        if apply:
+            try:
+                await redis.rename(key, target.price(":".join(parts[2:-1]), parts[-1]))
+            except ResponseError:
+                pass  # SCAN may return a key twice; it has already been moved
+    if await redis.exists(LEGACY_KEYS.price_lru):
+        moved += 1
+        if apply:
+            await redis.rename(LEGACY_KEYS.price_lru, target.price_lru)
+    return moved
+
+
+def _legacy_user_key(key: str, target: KeySchema) -> str | None:
+    """The cluster-layout name for one legacy per-user key, or None if it is not one."""
+    parts = key.split(":")
+    if len(parts) < 3 or parts[0] != "susanoh":
+        return None
+    kind = parts[1]
+    if kind in ("window", "actor_window"):
+        side = "target" if kind == "window" else "actor"
+        return target.window(side, ":".join(parts[2:]))
+    if kind == "rollup" and len(parts) >= 5:
+        return target.rollup(parts[2], parts[3], ":".join(parts[4:]))
+    if kind == "hll" and len(parts) >= 5 and parts[-1].isdigit():
+        return target.distinct(parts[2], ":".join(parts[3:-1]), int(parts[-1]))
+    return None
+
+
+async def migrate_key_layout(
+    redis: Redis, target: KeySchema, *, apply: bool = False
+) -> dict[str, int]:
+    """
+    Rewrite a legacy-layout Redis in place into `target`.
+
+    For the legacy layout this only moves the old transition list into the
+    transition stream. For the cluster layout everything below applies.
+
+    Run it against the standalone node with traffic stopped, before importing
+    the data into a cluster (`redis-cli --cluster import`). Windows, rollups,
+    HyperLogLogs, price sums and the L1 counters (into aggregate shard 0)
+    are RENAMEd, which keeps their values and TTLs; flow-graph buckets and
+    leaderboard summaries are split over the aggregate shards. The accounts hash becomes one state key per user plus the
+    sharded user registry, transitions are split per aggregate shard in
+    their original order, and the sharded counters and index sets are
+    rebuilt from the new state keys. Per-user locks are short-lived and are
+    not moved.
+
+    Without `apply` nothing is written and the counts of what would move are
+    returned. Running it again after a partial run only moves what is left.
+    """
+    moved = {"accounts": 0, "transitions": 0, "renamed": 0}
+    if not target.cluster:
+        moved["transitions"] = await _move_transitions(redis, target, apply)
+        return moved
+
+    for name in SCREENING_KEYS:
+        if await redis.exists(LEGACY_KEYS.screening(name)):
+            moved["renamed"] += 1
+            if apply:
+                await redis.rename(LEGACY_KEYS.screening(name), target.screening(name))
+
+    cursor = 0
+    while True:
+        cursor, chunk = await redis.hscan(LEGACY_KEYS.accounts, cursor, count=MIGRATION_BATCH)
+        moved["accounts"] += len(chunk)
+        if apply and chunk:
+            async with redis.pipeline(transaction=False) as pipe:
+                for uid, state in chunk.items():
+                    pipe.set(target.state(uid), state)
+                    pipe.sadd(target.users(target.aggregate_shard(uid)), uid)
+                await pipe.execute()
+        if cursor == 0:
+            break
+
+    moved["transitions"] = await _move_transitions(redis, target, apply)
+
+    for pattern in LEGACY_KEYS.user_patterns():
+        async for key in redis.scan_iter(match=pattern, count=MIGRATION_BATCH):
+            new_key = _legacy_user_key(key, target)
+            if new_key is None:
+                continue
+            moved["renamed"] += 1
+            if apply:
+                try:
+                    await redis.rename(key, new_key)
+                except ResponseError:
+                    pass  # SCAN may return a key twice; it has already been moved
+
+    moved["renamed"] += await _move_economy_views(redis, target, apply)
+
+    if apply:
+        await redis.delete(
+            LEGACY_KEYS.accounts,
+            LEGACY_KEYS.state_counts(),
+            *(LEGACY_KEYS.state_index(s.value) for s in AccountState),
+        )
+        # Blocked withdrawals and L2 idempotency claims are single keys in both layouts.
+        await StateMachine(redis, keys=target).reconcile_state_aggregates()
+        logger.info("Migrated to the cluster key layout: %s", moved)
+    return moved
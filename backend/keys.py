@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import os
+import zlib
+from dataclasses import dataclass
+
+KEY_LAYOUTS = ("legacy", "cluster")
+DEFAULT_AGGREGATE_SHARDS = 16
+
+
+def _layout_from_env() -> str:
+    layout = os.environ.get("SUSANOH_REDIS_KEY_LAYOUT", "legacy").strip().lower()
+    return layout if layout in KEY_LAYOUTS else "legacy"
+
+
+def _shards_from_env() -> int:
+    raw = os.environ.get("SUSANOH_REDIS_AGGREGATE_SHARDS", "").strip()
+    try:
+        return max(1, int(raw)) if raw else DEFAULT_AGGREGATE_SHARDS
+    except ValueError:
+        return DEFAULT_AGGREGATE_SHARDS
+
+
+@dataclass(frozen=True)
+class KeySchema:
+    """
+    Redis key names for per-user and aggregate state.
+
+    `legacy` is the original single-node layout: one global accounts hash,
+    one state-counts hash, one index set per state and one transition stream,
+    with per-user keys such as `susanoh:window:<uid>`.
+
+    `cluster` is Redis Cluster compatible. Every per-user key carries the
+    user id as hash tag (`susanoh:{<uid>}:window`, `...:state`, `...:lock`,
+    rollups and HyperLogLogs), so a user's multi-key commands and pipelines
+    stay in one slot. Account states are one string per user instead of
+    fields of a global hash. The aggregates that used to be single hot keys
+    (state counts, state index sets, the account registry and the
+    transition stream) are split into `shards` slot groups tagged `{s<n>}`,
+    each user counting towards the group `aggregate_shard(uid)`. Every
+    event also writes economy-wide views (L1 counters and recent events,
+    flow graph, leaderboards); they are split over the same groups, by the
+    receiver, the sender and the ranked user respectively, and readers merge
+    the shards. Price sums are tagged per item (`{price:<item>}`).
+    """
+
+    layout: str = "legacy"
+    shards: int = DEFAULT_AGGREGATE_SHARDS
+
+    def __post_init__(self) -> None:
+        if self.layout not in KEY_LAYOUTS:
+            raise ValueError(f"key layout must be one of {KEY_LAYOUTS}")
+
+    @classmethod
+    def from_env(cls) -> KeySchema:
+        return cls(_layout_from_env(), _shards_from_env())
+
+    @property
+    def cluster(self) -> bool:
+        return self.layout == "cluster"
+
+    @property
+    def aggregate_shards(self) -> range:
+        return range(self.shards) if self.cluster else range(1)
+
+    def aggregate_shard(self, user_id: str) -> int:
+        return zlib.crc32(user_id.encode()) % self.shards if self.cluster else 0
+
+    # --- per user ---
+
+    def window(self, side: str, user_id: str) -> str:
+        name = "window" if side == "target" else "actor_window"
+        return f"susanoh:{{{user_id}}}:{name}" if self.cluster else f"susanoh:{name}:{user_id}"
+
+    def rollup(self, side: str, tier: str, user_id: str) -> str:
+        if self.cluster:
+            return f"susanoh:{{{user_id}}}:rollup:{side}:{tier}"
+        return f"susanoh:rollup:{side}:{tier}:{user_id}"
+
+    def distinct(self, side: str, user_id: str, bucket: int) -> str:
+        if self.cluster:
+            return f"susanoh:{{{user_id}}}:hll:{side}:{bucket}"
+        return f"susanoh:hll:{side}:{user_id}:{bucket}"
+
+    def lock(self, user_id: str) -> str:
+        return f"susanoh:{{{user_id}}}:lock" if self.cluster else f"susanoh:lock:{user_id}"
+
+    def state(self, user_id: str) -> str:
+        """Per-user account state (cluster layout; legacy keeps states in `accounts`)."""
+        return f"susanoh:{{{user_id}}}:state"
+
+    def user_patterns(self) -> list[str]:
+        """KEYS/SCAN patterns covering every per-user window, rollup and HLL key."""
+        if self.cluster:
+            return [f"susanoh:{{*}}:{name}" for name in ("window", "actor_window", "rollup:*", "hll:*")]
+        return ["susanoh:window:*", "susanoh:actor_window:*", "susanoh:rollup:*", "susanoh:hll:*"]
+
+    # --- aggregates ---
+
+    accounts = "susanoh:accounts"
+
+    def _aggregate(self, shard: int, name: str) -> str:
+        return f"susanoh:{{s{shard}}}:{name}" if self.cluster else f"susanoh:{name}"
+
+    def state_counts(self, shard: int = 0) -> str:
+        return self._aggregate(shard, "state_counts")
+
+    def state_index(self, state: str, shard: int = 0) -> str:
+        return self._aggregate(shard, f"state_index:{state}")
+
+    def users(self, shard: int) -> str:
+        """Registry of every account in one aggregate shard (cluster layout)."""
+        return self._aggregate(shard, "users")
+
+    def transitions(self, shard: int = 0) -> str:
+        """Capped audit stream of state transitions (see backend.transition_stream)."""
+        return self._aggregate(shard, "transition_stream")
+
+    def transition_count(self, shard: int = 0) -> str:
+        """Lifetime transitions, which the capped stream's length no longer gives."""
+        return self._aggregate(shard, "transition_count")
+
+    # --- economy-wide views, split over the aggregate shards ---
+
+    def screening(self, name: str, shard: int = 0) -> str:
+        """L1 counters and recent-events buffer of one shard; one MGET covers a shard's counters."""
+        return self._aggregate(shard, name)
+
+    def graph(self, name: str, shard: int = 0) -> str:
+        """Flow-graph buckets and edge totals of one shard, so its scripts stay in one slot."""
+        return f"susanoh:{{s{shard}}}:graph:{name}" if self.cluster else f"susanoh:graph:{name}"
+
+    def leaderboard(self, board: str, bucket: int | str, shard: int = 0) -> str:
+        """One board's top-k bucket of one shard, so a window's ZUNION stays in one slot."""
+        if self.cluster:
+            return f"susanoh:{{s{shard}}}:lb:{board}:{bucket}"
+        return f"susanoh:leaderboard:{board}:{bucket}"
+
+    def price(self, item_id: str, epoch: int | str) -> str:
+        """Price sums of one item and epoch, tagged by item."""
+        if self.cluster:
+            return f"susanoh:{{price:{item_id}}}:{epoch}"
+        return f"susanoh:price:{item_id}:{epoch}"
+
+    @property
+    def price_lru(self) -> str:
+        return "susanoh:{price}:lru" if self.cluster else "susanoh:price_lru"
+
+    def applied(self, idempotency_key: str) -> str:
+        """Claim of one L2 verdict; claims are single keys in both layouts."""
+        return f"susanoh:l2:applied:{idempotency_key}"
+
+    def wal_applied(self, wal_id: str, journal: str) -> str:
+        """Highest WAL LSN of one engine journal replayed to Redis (see backend.wal)."""
+        return f"susanoh:wal:{wal_id}:{journal}"
+
+
+LEGACY_KEYS = KeySchema()
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
+import os
 import re
+import heapq
 import json
 import logging
-from collections import defaultdict, deque
-from dataclasses import dataclass, field
-from datetime import UTC, datetime, timedelta
-from typing import TYPE_CHECKING, Optional
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Optional, TypeAlias
 
 from redis.exceptions import RedisError
 
+from backend.flow_graph import FlowGraph
+from backend.graph_analytics import RingDetector
+from backend.keys import KeySchema
+from backend.leaderboards import Leaderboards
+from backend.market_price import MIN_SAMPLES, MarketPriceEstimator
 from backend.models import (
     AnalysisRequest,
     GameEventLog,
@@ -17,13 +23,26 @@ from backend.models import (
     AccountState,
     UserProfile,
 )
+from backend.prompt_budget import compact_analysis_request
+from backend.redis_client import is_degraded
+from backend.windowing import (
+    PENDING_EVENTS_MAX,
+    SlidingWindowStore,
+    UserWindow,
+    WindowSide,
+    event_timestamp,
+)
 
 if TYPE_CHECKING:
     from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+    from backend.redis_client import CircuitBreaker
+    from backend.wal import WriteAheadLog
 
 logger = logging.getLogger(__name__)
 
-WINDOW_SECONDS = 300  # 5 min
+ScreeningListener: TypeAlias = Callable[[GameEventLog, ScreeningResult], Awaitable[None]]
 
 SLANG_PATTERN = re.compile(
     r"振[り込]?込|D[でにて]確認|[0-9]+[kK千万]|りょ[。.]|PayPa[ly]|銀行|口座|送金|入金確認"
@@ -32,46 +51,72 @@ SLANG_PATTERN = re.compile(
 AMOUNT_THRESHOLD = 1_000_000
 TX_COUNT_THRESHOLD = 10
 MARKET_AVG_MULTIPLIER = 100
+OUTFLOW_AMOUNT_THRESHOLD = 1_000_000
+FAN_OUT_THRESHOLD = 5
+DAILY_AMOUNT_THRESHOLD = 5_000_000
 
+# R1-R4 are always evaluated. Newer rules are opt-in via SUSANOH_L1_OPTIONAL_RULES
+# (comma separated) so the pinned testbench fixtures keep their expected rule sets.
+OPTIONAL_RULES = frozenset({"R5", "R6", "R7", "R8"})
+# Rules that incriminate the sender of the event rather than the receiver.
+ACTOR_RULES = frozenset({"R6", "R7"})
 
-@dataclass
-class UserWindow:
-    events: deque = field(default_factory=deque)
-
-    def add_event(self, event: GameEventLog) -> None:
-        self.events.append(event)
-        self._purge()
-
-    def _purge(self, cutoff: Optional[datetime] = None) -> None:
-        if cutoff is None:
-            cutoff = datetime.now(UTC)
-        window_limit = cutoff - timedelta(seconds=WINDOW_SECONDS)
-        while self.events:
-            try:
-                ts = datetime.fromisoformat(self.events[0].timestamp.replace("Z", "+00:00"))
-            except Exception:
-                ts = cutoff
-            if ts < window_limit:
-                self.events.popleft()
-            else:
-                break
-
-    def total_amount(self) -> int:
-        return sum(e.action_details.currency_amount for e in self.events)
 
-    def transaction_count(self) -> int:
-        return len(self.events)
-
-    def unique_senders(self) -> int:
-        return len({e.actor_id for e in self.events})
+def _optional_rules_from_env() -> frozenset[str]:
+    raw = os.environ.get("SUSANOH_L1_OPTIONAL_RULES", "")
+    return frozenset(rule.strip().upper() for rule in raw.split(",") if rule.strip()) & OPTIONAL_RULES
 
 
 class L1Engine:
-    def __init__(self, redis_client: Optional[Redis] = None) -> None:
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        optional_rules: frozenset[str] | set[str] | None = None,
+        breaker: Optional[CircuitBreaker] = None,
+        keys: Optional[KeySchema] = None,
+        wal: Optional[WriteAheadLog] = None,
+    ) -> None:
         self.redis = redis_client
-        self.user_windows: dict[str, UserWindow] = defaultdict(UserWindow)
+        self.breaker = breaker
+        self.wal = wal
+        self.optional_rules = (
+            frozenset(optional_rules) if optional_rules is not None else _optional_rules_from_env()
+        )
+        self.keys = keys or KeySchema.from_env()
+        self.windows = SlidingWindowStore(redis_client, breaker=breaker, keys=self.keys, wal=wal)
+        self.user_windows: dict[str, UserWindow] = self.windows.local[WindowSide.TARGET]
+        self.actor_windows: dict[str, UserWindow] = self.windows.local[WindowSide.ACTOR]
         self._recent_events: deque[tuple[GameEventLog, ScreeningResult]] = deque(maxlen=200)
         self._l1_flag_count: int = 0
+        self._total_events: int = 0
+        self._screening_listeners: list[ScreeningListener] = []
+        # (WAL LSN or 0, event, result) of screened events whose Redis writes
+        # were skipped or failed while degraded.
+        self._pending_events: deque[tuple[int, GameEventLog, ScreeningResult]] = deque(maxlen=PENDING_EVENTS_MAX)
+        self.flow_graph = FlowGraph(redis_client, keys=self.keys)
+        self.ring_detector = RingDetector()
+        self.leaderboards = Leaderboards(redis_client, keys=self.keys)
+        self.market_prices = MarketPriceEstimator(redis_client, keys=self.keys)
+
+    def add_screening_listener(self, listener: ScreeningListener) -> None:
+        self._screening_listeners.append(listener)
+
+    @staticmethod
+    def event_row(event: GameEventLog, result: ScreeningResult) -> dict:
+        """Dashboard row shape shared by /events/recent and the live stream."""
+        return {
+            **event.model_dump(),
+            "screened": result.screened,
+            "triggered_rules": result.triggered_rules,
+        }
+
+    @property
+    def degraded(self) -> bool:
+        return is_degraded(self.breaker)
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending_events) + self.windows.pending_writes
 
     @property
     def recent_events(self) -> list[tuple[GameEventLog, ScreeningResult]]:
@@ -81,60 +126,54 @@ class L1Engine:
     def l1_flag_count(self) -> int:
         return self._l1_flag_count
 
+    @property
+    def total_events(self) -> int:
+        return self._total_events
+
+    async def get_counters(self) -> dict[str, int]:
+        """Lifetime screening counters (not bounded by the recent-events buffer)."""
+        if self.redis and not self.degraded:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard in self.keys.aggregate_shards:
+                        pipe.mget(self.keys.screening("total_events", shard), self.keys.screening("l1_flag_count", shard))
+                    rows = await pipe.execute()
+                return {
+                    "total_events": sum(int(total or 0) for total, _ in rows),
+                    "l1_flags": sum(int(flags or 0) for _, flags in rows),
+                }
+            except RedisError as e:
+                logger.warning("Redis get_counters failed: %s. Using in-memory.", e)
+        return {"total_events": self._total_events, "l1_flags": self._l1_flag_count}
+
     async def reset(self) -> None:
-        self.user_windows.clear()
+        await self.windows.reset()
         self._recent_events.clear()
+        self._pending_events.clear()
         self._l1_flag_count = 0
+        self._total_events = 0
+        await self.flow_graph.reset()
+        self.ring_detector.reset()
+        await self.leaderboards.reset()
+        await self.market_prices.reset()
         if self.redis:
             try:
-                keys = await self.redis.keys("susanoh:window:*")
-                if keys:
-                    await self.redis.delete(*keys)
-                await self.redis.delete("susanoh:recent_events", "susanoh:l1_flag_count")
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard in self.keys.aggregate_shards:
+                        for name in ("recent_events", "l1_flag_count", "total_events"):
+                            pipe.delete(self.keys.screening(name, shard))
+                    await pipe.execute()
             except RedisError as e:
                 logger.warning("Redis reset failed: %s. Using in-memory fallback.", e)
 
     async def screen(self, event: GameEventLog) -> ScreeningResult:
-        target_id = event.target_id
-        
-        total_amount = 0
-        tx_count = 0
-        
-        # In-memory always tracks for fallback/snapshot
-        window = self.user_windows[target_id]
-        window.add_event(event)
-
-        if self.redis:
-            try:
-                key = f"susanoh:window:{target_id}"
-                # Use event timestamp as score for consistency (Finding 3)
-                try:
-                    event_ts = datetime.fromisoformat(event.timestamp.replace("Z", "+00:00")).timestamp()
-                except Exception:
-                    event_ts = datetime.now(UTC).timestamp()
-                
-                cutoff_ts = event_ts - WINDOW_SECONDS
-                
-                # Add current event
-                await self.redis.zadd(key, {event.model_dump_json(): event_ts})
-                # Purge old events
-                await self.redis.zremrangebyscore(key, "-inf", cutoff_ts)
-                # Set TTL
-                await self.redis.expire(key, WINDOW_SECONDS + 60)
-                
-                # Get window stats
-                raw_events = await self.redis.zrange(key, 0, -1)
-                events_in_window = [GameEventLog.model_validate_json(e) for e in raw_events]
-                total_amount = sum(e.action_details.currency_amount for e in events_in_window)
-                tx_count = len(events_in_window)
-            except RedisError as e:
-                logger.error("Redis screening failed: %s. Degraded to in-memory.", e)
-                # Fail open to in-memory mode
-                total_amount = window.total_amount()
-                tx_count = window.transaction_count()
-        else:
-            total_amount = window.total_amount()
-            tx_count = window.transaction_count()
+        # Receiver and sender windows are updated together in one round trip.
+        event_ts = event_timestamp(event)
+        windows = await self.windows.add(event)
+        received = windows[WindowSide.TARGET]
+        sent = windows[WindowSide.ACTOR]
+        total_amount = received.total_amount
+        tx_count = received.count
 
         triggered: list[str] = []
 
@@ -142,12 +181,8 @@ class L1Engine:
             triggered.append("R1")
         if tx_count >= TX_COUNT_THRESHOLD:
             triggered.append("R2")
-        if (
-            event.action_details.market_avg_price
-            and event.action_details.market_avg_price > 0
-            and event.action_details.currency_amount
-            >= event.action_details.market_avg_price * MARKET_AVG_MULTIPLIER
-        ):
+        reference_price, estimated_price = await self._reference_price(event, event_ts)
+        if reference_price and event.action_details.currency_amount >= reference_price * MARKET_AVG_MULTIPLIER:
             triggered.append("R3")
 
         needs_l2 = False
@@ -156,93 +191,217 @@ class L1Engine:
             triggered.append("R4")
             needs_l2 = True
 
-        if triggered:
-            self._l1_flag_count += 1
-            if self.redis:
-                try:
-                    await self.redis.incr("susanoh:l1_flag_count")
-                except RedisError:
-                    pass
+        ring_patterns: list[str] = []
+        ring_members: list[str] = []
+        if "R5" in self.optional_rules:
+            for detection in self.ring_detector.observe(event):
+                ring_patterns.append(detection.pattern)
+                ring_members.extend(m for m in detection.members if m not in ring_members)
+            if ring_patterns:
+                triggered.append("R5")
+                needs_l2 = True
+
+        if "R8" in self.optional_rules and received.horizons["24h"].amount >= DAILY_AMOUNT_THRESHOLD:
+            triggered.append("R8")
+        if "R6" in self.optional_rules and sent.total_amount >= OUTFLOW_AMOUNT_THRESHOLD:
+            triggered.append("R6")
+        if "R7" in self.optional_rules and sent.counterparties >= FAN_OUT_THRESHOLD:
+            triggered.append("R7")
 
         result = ScreeningResult(
             screened=bool(triggered),
             triggered_rules=triggered,
             recommended_action=AccountState.RESTRICTED_WITHDRAWAL if triggered else None,
             needs_l2=needs_l2,
+            ring_patterns=ring_patterns,
+            ring_members=ring_members,
+            estimated_market_price=estimated_price,
         )
         
-        self._recent_events.append((event, result))
-        if self.redis:
+        self._record_local(event, result, event_ts)
+        if self.redis and not self.degraded:
             try:
-                data = json.dumps({
-                    "event": event.model_dump(),
-                    "result": result.model_dump()
-                })
-                await self.redis.lpush("susanoh:recent_events", data)
-                await self.redis.ltrim("susanoh:recent_events", 0, 199)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    self._stage_screened(pipe, event, result, event_ts)
+                    await pipe.execute()
             except RedisError:
-                pass
+                self._journal(event, result)
+            await self.flow_graph.maybe_roll()
+            await self.market_prices.maybe_evict()
+        elif self.redis:
+            self._journal(event, result)
+
+        for listener in self._screening_listeners:
+            try:
+                await listener(event, result)
+            except Exception as e:
+                logger.warning("Screening listener failed for %s: %s", event.event_id, e)
 
         return result
 
+    def _record_local(self, event: GameEventLog, result: ScreeningResult, event_ts: float) -> None:
+        self._recent_events.append((event, result))
+        self._total_events += 1
+        if result.screened:
+            self._l1_flag_count += 1
+        self.flow_graph.record_local(event)
+        self.leaderboards.record_local(event)
+        self.market_prices.record_local(event, event_ts)
+
+    def _journal(self, event: GameEventLog, result: ScreeningResult) -> None:
+        lsn = 0
+        if self.wal:
+            lsn = self.wal.append(
+                "screened", {"event": event.model_dump(mode="json"), "result": result.model_dump(mode="json")}
+            )
+        self._pending_events.append((lsn, event, result))
+
+    def restore_from_wal(self, kind: str, data: dict, lsn: int = 0) -> bool:
+        """
+        Re-apply one WAL record written while degraded: screened events go back
+        into the recent events, counters and local aggregates and are journaled
+        for replay again; window records rebuild the sliding windows.
+        """
+        if kind != "screened":
+            return self.windows.restore_from_wal(kind, data, lsn)
+        event = GameEventLog.model_validate(data["event"])
+        result = ScreeningResult.model_validate(data["result"])
+        self._record_local(event, result, event_timestamp(event))
+        self._pending_events.append((lsn, event, result))
+        return True
+
+    def _stage_screened(self, pipe: Pipeline, event: GameEventLog, result: ScreeningResult, event_ts: float) -> None:
+        data = json.dumps({
+            "event": event.model_dump(),
+            "result": result.model_dump(),
+            "ts": event_ts,
+        })
+        shard = self.keys.aggregate_shard(event.target_id)
+        pipe.lpush(self.keys.screening("recent_events", shard), data)
+        pipe.ltrim(self.keys.screening("recent_events", shard), 0, 199)
+        pipe.incr(self.keys.screening("total_events", shard))
+        if result.screened:
+            pipe.incr(self.keys.screening("l1_flag_count", shard))
+        self.flow_graph.stage(pipe, event)
+        self.leaderboards.stage(pipe, event)
+        self.market_prices.stage(pipe, event, event_ts)
+
+    async def replay_degraded_writes(self) -> int:
+        """
+        Write screening results that only reached memory while Redis was
+        degraded (recent events, counters, flow graph, leaderboards, price
+        samples, and the sliding windows) back to Redis, oldest first.
+        Events at or below the WAL watermark reached Redis before a crash
+        and are skipped. Returns the number of events replayed.
+        """
+        if not self.redis or self.degraded:
+            return 0
+        await self.windows.replay_pending()
+        if not self._pending_events:
+            return 0
+        pending = list(self._pending_events)
+        try:
+            applied = await self.wal.applied_lsn(self.redis, self.keys, "screened") if self.wal else 0
+            async with self.redis.pipeline(transaction=not self.keys.cluster) as pipe:
+                for lsn, event, result in pending:
+                    if not lsn or lsn > applied:
+                        self._stage_screened(pipe, event, result, event_timestamp(event))
+                last = max(lsn for lsn, _, _ in pending)
+                if self.wal and last > applied:
+                    self.wal.stage_applied(pipe, self.keys, "screened", last)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Replaying degraded screening writes failed: %s", e)
+            return 0
+        for _ in range(min(len(pending), len(self._pending_events))):
+            self._pending_events.popleft()
+        await self.flow_graph.maybe_roll()
+        await self.market_prices.maybe_evict()
+        logger.info("Replayed %d screened events written while degraded", len(pending))
+        return len(pending)
+
+    async def _reference_price(self, event: GameEventLog, event_ts: float) -> tuple[float | None, float | None]:
+        """R3's reference price: the client's market_avg_price, else the learned per-item median."""
+        client_price = event.action_details.market_avg_price
+        if client_price and client_price > 0:
+            return client_price, None
+        if not self.market_prices.observes(event):
+            return None, None
+        estimate = await self.market_prices.estimate(event.action_details.item_id, event_ts)
+        if estimate is None or estimate.samples < MIN_SAMPLES:
+            return None, None
+        return estimate.median, estimate.median
+
     @staticmethod
     def _check_slang(chat_log: str) -> bool:
         return bool(SLANG_PATTERN.search(chat_log))
 
     async def build_analysis_request(self, user_id: str, event: GameEventLog, triggered_rules: list[str], current_state: AccountState) -> AnalysisRequest:
-        total_amount = 0
-        tx_count = 0
-        unique_senders = 0
-        related_events = []
+        windows = await self.windows.read(user_id, event)
+        received = windows[WindowSide.TARGET]
+        sent = windows[WindowSide.ACTOR]
+        related: dict[str, GameEventLog] = {e.event_id: e for e in received.events}
+        related.update((e.event_id, e) for e in sent.events)
 
-        if self.redis:
-            try:
-                key = f"susanoh:window:{user_id}"
-                try:
-                    event_ts = datetime.fromisoformat(event.timestamp.replace("Z", "+00:00")).timestamp()
-                except Exception:
-                    event_ts = datetime.now(UTC).timestamp()
-                cutoff_ts = event_ts - WINDOW_SECONDS
-                await self.redis.zremrangebyscore(key, "-inf", cutoff_ts)
-                raw_events = await self.redis.zrange(key, 0, -1)
-                related_events = [GameEventLog.model_validate_json(e) for e in raw_events]
-                total_amount = sum(e.action_details.currency_amount for e in related_events)
-                tx_count = len(related_events)
-                unique_senders = len({e.actor_id for e in related_events})
-            except RedisError:
-                # Fallback to in-memory
-                window = self.user_windows.get(user_id, UserWindow())
-                related_events = list(window.events)
-                total_amount = window.total_amount()
-                tx_count = window.transaction_count()
-                unique_senders = window.unique_senders()
-        else:
-            window = self.user_windows.get(user_id, UserWindow())
-            related_events = list(window.events)
-            total_amount = window.total_amount()
-            tx_count = window.transaction_count()
-            unique_senders = window.unique_senders()
-
-        return AnalysisRequest(
+        request = AnalysisRequest(
             trigger_event=event,
-            related_events=related_events,
+            related_events=sorted(related.values(), key=lambda e: e.timestamp),
             triggered_rules=triggered_rules,
             user_profile=UserProfile(
                 user_id=user_id,
                 current_state=current_state,
-                total_received_5min=total_amount,
-                transaction_count_5min=tx_count,
-                unique_senders_5min=unique_senders,
+                total_received_5min=received.total_amount,
+                transaction_count_5min=received.count,
+                unique_senders_5min=received.counterparties,
+                total_received_1h=received.horizons["1h"].amount,
+                total_received_24h=received.horizons["24h"].amount,
+                transaction_count_24h=received.horizons["24h"].count,
+                total_sent_5min=sent.total_amount,
+                unique_receivers_5min=sent.counterparties,
             ),
         )
+        return compact_analysis_request(request, slang_pattern=SLANG_PATTERN)
+
+    async def rebuild_analysis_request(
+        self,
+        user_id: str,
+        trigger_event_id: str,
+        triggered_rules: list[str],
+        current_state: AccountState,
+        side: WindowSide = WindowSide.TARGET,
+    ) -> Optional[AnalysisRequest]:
+        """
+        Rebuild an analysis request from the live windows for a by-reference L2 job.
+
+        `side` is the window the job's rules were raised on: ACTOR for outflow
+        rules against the sender. The trigger is looked up in both windows; if it
+        has already aged out, the most recent event of `side` stands in for it.
+        None when that window is empty too.
+        """
+        sides = [side, *(s for s in WindowSide if s is not side)]
+        windows = {s: await self.windows.events(s, user_id) for s in sides}
+        trigger = next((e for s in sides for e in windows[s] if e.event_id == trigger_event_id), None)
+        if trigger is None:
+            if not windows[side]:
+                return None
+            trigger = windows[side][-1]
+        return await self.build_analysis_request(user_id, trigger, triggered_rules, current_state)
 
     async def get_recent_events(self, limit: int = 20) -> list[dict]:
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
-                raw = await self.redis.lrange("susanoh:recent_events", 0, limit - 1)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard in self.keys.aggregate_shards:
+                        pipe.lrange(self.keys.screening("recent_events", shard), 0, limit - 1)
+                    shards = await pipe.execute()
+                # Each shard is newest first; merge them by event time.
+                newest = heapq.merge(
+                    *([json.loads(item) for item in raw] for raw in shards),
+                    key=lambda data: data.get("ts", 0.0),
+                    reverse=True,
+                )
                 results = []
-                for item in raw:
-                    data = json.loads(item)
+                for data in list(newest)[:limit]:
                     results.append({
                         **data["event"],
                         "screened": data["result"]["screened"],
@@ -253,43 +412,4 @@ class L1Engine:
                 pass
 
         events = list(self._recent_events)
-        return [
-            {
-                **event.model_dump(),
-                "screened": result.screened,
-                "triggered_rules": result.triggered_rules,
-            }
-            for event, result in reversed(events[-limit:])
-        ]
-
-    async def get_graph_data(self, accounts: dict[str, AccountState]) -> dict:
-        node_ids: set[str] = set()
-        link_map: dict[tuple[str, str], dict] = {}
-
-        events_to_process = []
-        if self.redis:
-            try:
-                raw = await self.redis.lrange("susanoh:recent_events", 0, -1)
-                for item in raw:
-                    data = json.loads(item)
-                    events_to_process.append(GameEventLog.model_validate(data["event"]))
-            except RedisError:
-                events_to_process = [e for e, _ in self._recent_events]
-        else:
-            events_to_process = [e for e, _ in self._recent_events]
-
-        for event in events_to_process:
-            node_ids.add(event.actor_id)
-            node_ids.add(event.target_id)
-            key = (event.actor_id, event.target_id)
-            if key not in link_map:
-                link_map[key] = {"source": event.actor_id, "target": event.target_id, "amount": 0, "count": 0}
-            link_map[key]["amount"] += event.action_details.currency_amount
-            link_map[key]["count"] += 1
-
-        nodes = []
-        for nid in node_ids:
-            state = accounts.get(nid, AccountState.NORMAL)
-            nodes.append({"id": nid, "state": state.value, "label": nid})
-
-        return {"nodes": nodes, "links": list(link_map.values())}
+        return [self.event_row(event, result) for event, result in reversed(events[-limit:])]
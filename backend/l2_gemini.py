@@ -3,18 +3,26 @@ from __future__ import annotations
 import json
 import os
 import logging
+from collections import deque
 from collections.abc import Awaitable, Callable
 from typing import TYPE_CHECKING, Optional, TypeAlias
 
+import httpx
+
 from backend.models import (
     AccountState,
     AnalysisRequest,
     ArbitrationResult,
     FraudType,
 )
+from backend.prompt_budget import compact_analysis_request, estimate_tokens, format_event_line
+from backend.redis_client import is_degraded
 
 logger = logging.getLogger(__name__)
 
+# HTTP statuses after which the same Gemini request may well succeed later.
+RETRYABLE_STATUS_CODES = frozenset({408, 429})
+
 SYSTEM_PROMPT = """You are an anti-fraud analysis AI for an online game economy.
 Analyze the provided data and return an arbitration result in the following JSON format.
 
@@ -22,6 +30,9 @@ Analysis dimensions:
 1. Transaction patterns: bursty high-volume activity, aggregation patterns, chain transfers
 2. Chat logs: RMT slang (e.g., transfer/confirmation/3k)
 3. Account profile: level, account age, transaction frequency
+4. Graph structure: rule R5 means the account sits in a fan-in hub, a layering chain or a transfer cycle
+5. Long horizon: rule R8 means the account received a large total over 24 hours in smaller, spread-out transfers
+6. Outflow: rules R6/R7 mean the account itself sent a large total or paid many distinct receivers (distribution)
 
 Decision criteria:
 - risk_score 0-30: NORMAL (legitimate)
@@ -43,6 +54,25 @@ Output must strictly follow this JSON schema:
 }"""
 
 
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+
+Several cases are provided, each starting with a "# Case i/N" header.
+Return a JSON array with exactly one object per case in the format above,
+and set "target_id" to that case's User ID."""
+
+
+class GeminiUnavailable(Exception):
+    """A transient Gemini failure (rate limit, 5xx, timeout) raised instead of falling back."""
+
+
+def is_retryable_gemini_error(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    # google.genai's APIError carries `code`, HTTP client errors `status_code`.
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return isinstance(code, int) and (code in RETRYABLE_STATUS_CODES or code >= 500)
+
+
 def _score_to_action(score: int) -> AccountState:
     if score <= 30:
         return AccountState.NORMAL
@@ -65,6 +95,14 @@ def _local_fallback(request: AnalysisRequest, reason: str) -> ArbitrationResult:
         score += 25
     if "R4" in rules:
         score += 30
+    if "R5" in rules:
+        score += 25
+    if "R6" in rules:
+        score += 25
+    if "R7" in rules:
+        score += 20
+    if "R8" in rules:
+        score += 20
     if profile.unique_senders_5min >= 5:
         score += 15
 
@@ -107,45 +145,142 @@ def build_deterministic_local_result(
 if TYPE_CHECKING:
     from redis.asyncio import Redis
 
+    from backend.l2_triage import L2Triage
+    from backend.redis_client import CircuitBreaker
+
 GeminiCall: TypeAlias = Callable[[AnalysisRequest, str], Awaitable[ArbitrationResult]]
+GeminiBatchCall: TypeAlias = Callable[[list[AnalysisRequest], str], Awaitable[str]]
+ResultListener: TypeAlias = Callable[[ArbitrationResult], Awaitable[None]]
 
 class L2Engine:
     REDIS_KEY = "susanoh:analyses"
+    COUNT_KEY = "susanoh:l2_analysis_count"
+    RESULTS_MAX = 200
 
-    def __init__(self, redis_client: Optional[Redis] = None) -> None:
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        triage: Optional[L2Triage] = None,
+        max_results: Optional[int] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        raise_transient_errors: bool = False,
+    ) -> None:
         self.redis = redis_client
+        self.breaker = breaker
+        self.triage = triage
+        # Queued jobs (the worker) re-raise transient Gemini failures as
+        # GeminiUnavailable so the job is retried; in-process callers fall back.
+        self.raise_transient_errors = raise_transient_errors
+        # Oldest in-memory results are evicted beyond max_results (None keeps all).
+        self.max_results = max_results
         self.analysis_results: list[ArbitrationResult] = []
+        # Estimated prompt tokens sent to Gemini by this process (autoscaling headroom signal).
+        self.prompt_tokens: int = 0
+        self._analysis_count: int = 0
+        self._result_listeners: list[ResultListener] = []
+        # Results stored only in memory while Redis was degraded, oldest first.
+        self._pending_results: deque[ArbitrationResult] = deque(maxlen=self.RESULTS_MAX)
+        self._pending_count: int = 0
+
+    def add_result_listener(self, listener: ResultListener) -> None:
+        self._result_listeners.append(listener)
+
+    @property
+    def degraded(self) -> bool:
+        return is_degraded(self.breaker)
+
+    @property
+    def pending_writes(self) -> int:
+        return self._pending_count
 
     async def reset(self) -> None:
         self.analysis_results.clear()
+        self._pending_results.clear()
+        self._pending_count = 0
+        self._analysis_count = 0
         if self.redis:
             try:
-                await self.redis.delete(self.REDIS_KEY)
+                await self.redis.delete(self.REDIS_KEY, self.COUNT_KEY)
             except Exception as e:
                 logger.warning("Redis L2 reset failed: %s", e)
 
     async def _store_result(self, result: ArbitrationResult) -> None:
         """Store result in both in-memory list and Redis (if available)."""
         self.analysis_results.append(result)
-        if self.redis:
+        if self.max_results is not None and len(self.analysis_results) > self.max_results:
+            del self.analysis_results[: len(self.analysis_results) - self.max_results]
+        self._analysis_count += 1
+        if self.redis and not self.degraded:
             try:
-                await self.redis.lpush(self.REDIS_KEY, result.model_dump_json())
-                await self.redis.ltrim(self.REDIS_KEY, 0, 199)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.lpush(self.REDIS_KEY, result.model_dump_json())
+                    pipe.ltrim(self.REDIS_KEY, 0, self.RESULTS_MAX - 1)
+                    pipe.incr(self.COUNT_KEY)
+                    await pipe.execute()
             except Exception as e:
                 logger.warning("Redis L2 store failed: %s", e)
+                self._journal(result)
+        elif self.redis:
+            self._journal(result)
+        for listener in self._result_listeners:
+            try:
+                await listener(result)
+            except Exception as e:
+                logger.warning("L2 result listener failed: %s", e)
+
+    def _journal(self, result: ArbitrationResult) -> None:
+        self._pending_results.append(result)
+        self._pending_count += 1
+
+    async def replay_degraded_writes(self) -> int:
+        """Push results stored only in memory while degraded to Redis and add them to the shared count."""
+        if not self.redis or self.degraded or not self._pending_count:
+            return 0
+        results = list(self._pending_results)
+        count = self._pending_count
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if results:
+                    pipe.lpush(self.REDIS_KEY, *(r.model_dump_json() for r in results))
+                    pipe.ltrim(self.REDIS_KEY, 0, self.RESULTS_MAX - 1)
+                pipe.incrby(self.COUNT_KEY, count)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Replaying degraded L2 results failed: %s", e)
+            return 0
+        for _ in range(min(len(results), len(self._pending_results))):
+            self._pending_results.popleft()
+        self._pending_count -= count
+        return count
 
     async def analyze_deterministically(
         self,
         request: AnalysisRequest,
         *,
         reason: str = "deterministic local analyzer",
+        store: bool = True,
     ) -> ArbitrationResult:
         result = build_deterministic_local_result(request, reason=reason)
-        await self._store_result(result)
+        if store:
+            await self._store_result(result)
         return result
 
-    async def analyze(self, request: AnalysisRequest) -> ArbitrationResult:
-        return await self.analyze_with_overrides(request)
+    async def try_triage(self, request: AnalysisRequest) -> Optional[ArbitrationResult]:
+        """Settle a clear-cut request locally; None means it should go to the LLM."""
+        if self.triage is None:
+            return None
+        result = self.triage.resolve(request)
+        if result is not None:
+            await self._store_result(result)
+        return result
+
+    async def analyze(self, request: AnalysisRequest, *, store: bool = True) -> ArbitrationResult:
+        return await self.analyze_with_overrides(request, store=store)
+
+    async def store_results(self, results: list[ArbitrationResult]) -> None:
+        """Store and broadcast results analyzed with `store=False`."""
+        for result in results:
+            await self._store_result(result)
 
     async def analyze_with_overrides(
         self,
@@ -154,7 +289,13 @@ class L2Engine:
         api_key: str | None = None,
         gemini_call: GeminiCall | None = None,
         gemini_response_text: str | None = None,
+        store: bool = True,
     ) -> ArbitrationResult:
+        """
+        Analyze one request and store the result. With `store=False` the
+        caller stores it later through `store_results`, e.g. once a whole
+        batch has been applied.
+        """
         resolved_api_key = (
             os.environ.get("GEMINI_API_KEY", "")
             if api_key is None
@@ -173,6 +314,7 @@ class L2Engine:
             request,
             api_key=resolved_api_key,
             gemini_call=resolved_gemini_call,
+            store=store,
         )
 
     async def _analyze_with_gemini_call(
@@ -181,23 +323,126 @@ class L2Engine:
         *,
         api_key: str,
         gemini_call: GeminiCall,
+        store: bool = True,
     ) -> ArbitrationResult:
         if not api_key:
             return await self.analyze_deterministically(
                 request,
                 reason="GEMINI_API_KEY is not set",
+                store=store,
             )
 
+        self.prompt_tokens += estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(self._build_prompt(request))
         try:
             result = await gemini_call(request, api_key)
-            await self._store_result(result)
-            return result
         except Exception as e:
+            self._raise_if_transient(e)
             logger.warning("Gemini API error: %s — falling back", e)
             return await self.analyze_deterministically(
                 request,
                 reason=f"API error: {e}",
+                store=store,
             )
+        if store:
+            await self._store_result(result)
+        return result
+
+    def _raise_if_transient(self, error: Exception) -> None:
+        if self.raise_transient_errors and is_retryable_gemini_error(error):
+            raise GeminiUnavailable(f"Gemini API error: {error}") from error
+
+    async def analyze_batch(
+        self,
+        requests: list[AnalysisRequest],
+        *,
+        api_key: str | None = None,
+        gemini_batch_call: GeminiBatchCall | None = None,
+        gemini_call: GeminiCall | None = None,
+        store: bool = True,
+    ) -> list[ArbitrationResult]:
+        """
+        Analyze several requests with one LLM call, returning results in request order.
+
+        The system prompt is paid once per batch. Requests missing from (or
+        malformed in) the response, and repeated targets, which one prompt
+        cannot tell apart, fall back to individual calls. Results are stored
+        only once every request has one, so a transient error raised halfway
+        leaves nothing stored for the retry to repeat; `store=False` leaves
+        storing to the caller.
+        """
+        if len(requests) <= 1:
+            results = [
+                await self.analyze_with_overrides(request, api_key=api_key, gemini_call=gemini_call, store=False)
+                for request in requests
+            ]
+        else:
+            results = await self._analyze_batch(requests, api_key, gemini_batch_call, gemini_call)
+        if store:
+            await self.store_results(results)
+        return results
+
+    async def _analyze_batch(
+        self,
+        requests: list[AnalysisRequest],
+        api_key: str | None,
+        gemini_batch_call: GeminiBatchCall | None,
+        gemini_call: GeminiCall | None,
+    ) -> list[ArbitrationResult]:
+        resolved_api_key = os.environ.get("GEMINI_API_KEY", "") if api_key is None else api_key
+        if not resolved_api_key:
+            return [
+                build_deterministic_local_result(request, reason="GEMINI_API_KEY is not set")
+                for request in requests
+            ]
+
+        batched: list[AnalysisRequest] = []
+        seen: set[str] = set()
+        for request in requests:
+            if request.user_profile.user_id not in seen:
+                seen.add(request.user_profile.user_id)
+                batched.append(request)
+
+        self.prompt_tokens += estimate_tokens(BATCH_SYSTEM_PROMPT) + estimate_tokens(self._build_batch_prompt(batched))
+        try:
+            text = await (gemini_batch_call or self._call_gemini_batch)(batched, resolved_api_key)
+            by_target = self._parse_batch_response_text(batched, text)
+        except Exception as e:
+            self._raise_if_transient(e)
+            logger.warning("Gemini batch API error: %s — falling back", e)
+            return [build_deterministic_local_result(request, reason=f"API error: {e}") for request in requests]
+
+        results = []
+        for request in requests:
+            result = by_target.pop(request.user_profile.user_id, None)
+            if result is None:
+                result = await self._analyze_with_gemini_call(
+                    request,
+                    api_key=resolved_api_key,
+                    gemini_call=gemini_call or self._call_gemini,
+                    store=False,
+                )
+            results.append(result)
+        return results
+
+    async def _call_gemini_batch(self, requests: list[AnalysisRequest], api_key: str) -> str:
+        import asyncio
+        from google import genai
+
+        model_name = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+        client = genai.Client(api_key=api_key)
+
+        response = await asyncio.to_thread(
+            client.models.generate_content,
+            model=model_name,
+            contents=self._build_batch_prompt(requests),
+            config=genai.types.GenerateContentConfig(
+                system_instruction=BATCH_SYSTEM_PROMPT,
+                response_mime_type="application/json",
+                response_schema=list[ArbitrationResult],
+                temperature=0.1,
+            ),
+        )
+        return response.text
 
     async def _call_gemini(self, request: AnalysisRequest, api_key: str) -> ArbitrationResult:
         import asyncio
@@ -232,6 +477,10 @@ class L2Engine:
         except json.JSONDecodeError:
             return _local_fallback(request, "JSON parse failed")
 
+        return self._result_from_data(request, data)
+
+    @staticmethod
+    def _result_from_data(request: AnalysisRequest, data: dict) -> ArbitrationResult:
         action_str = data.get("recommended_action", "UNDER_SURVEILLANCE")
         try:
             action = AccountState(action_str)
@@ -255,6 +504,39 @@ class L2Engine:
             confidence=max(0.0, min(1.0, data.get("confidence", 0.8))),
         )
 
+    def _parse_batch_response_text(
+        self,
+        requests: list[AnalysisRequest],
+        text: str,
+    ) -> dict[str, ArbitrationResult]:
+        """Map a list-valued batch response back to its requests by target_id; unusable items are dropped."""
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, list):
+            return {}
+        by_target = {request.user_profile.user_id: request for request in requests}
+        results: dict[str, ArbitrationResult] = {}
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            request = by_target.get(item.get("target_id"))
+            if request is None or request.user_profile.user_id in results:
+                continue
+            try:
+                results[request.user_profile.user_id] = self._result_from_data(request, item)
+            except (TypeError, ValueError):
+                continue
+        return results
+
+    @classmethod
+    def _build_batch_prompt(cls, requests: list[AnalysisRequest]) -> str:
+        return "\n\n".join(
+            f"# Case {i}/{len(requests)}\n{cls._build_prompt(request)}"
+            for i, request in enumerate(requests, start=1)
+        )
+
     @staticmethod
     def _build_prompt(request: AnalysisRequest) -> str:
         profile = request.user_profile
@@ -267,6 +549,10 @@ class L2Engine:
             f"- 5-minute total received: {profile.total_received_5min}G",
             f"- 5-minute transaction count: {profile.transaction_count_5min}",
             f"- 5-minute unique senders: {profile.unique_senders_5min}",
+            f"- 1-hour / 24-hour total received: {profile.total_received_1h}G / {profile.total_received_24h}G",
+            f"- 24-hour transaction count: {profile.transaction_count_24h}",
+            f"- 5-minute total sent: {profile.total_sent_5min}G",
+            f"- 5-minute unique receivers: {profile.unique_receivers_5min}",
             "",
             "## Trigger Event",
             f"- Event ID: {trigger.event_id}",
@@ -276,19 +562,34 @@ class L2Engine:
             "",
             f"## Triggered Rules: {', '.join(request.triggered_rules) or 'none'}",
             "",
-            "## Related Events",
         ]
-        for evt in request.related_events[-10:]:
-            lines.append(
-                f"- {evt.event_id}: {evt.actor_id}→{evt.target_id} "
-                f"{evt.action_details.currency_amount}G "
-                f"chat=\"{evt.context_metadata.recent_chat_log or ''}\""
-            )
+        request = compact_analysis_request(request)
+        summary = request.window_summary
+        if summary is not None:
+            lines += [
+                f"## Window Summary ({summary.event_count} events, {summary.shown_events} most informative shown below)",
+                f"- Total / max amount: {summary.total_amount}G / {summary.max_amount}G",
+                f"- Distinct senders / receivers: {summary.distinct_senders} / {summary.distinct_receivers}",
+                f"- Chats with slang: {summary.slang_hits}",
+                f"- Span: {summary.first_timestamp} .. {summary.last_timestamp}",
+                "",
+            ]
+        lines.append("## Related Events")
+        lines += [format_event_line(evt) for evt in request.related_events]
 
         return "\n".join(lines)
 
+    async def get_analysis_count(self) -> int:
+        """Lifetime number of stored verdicts, shared across processes via Redis."""
+        if self.redis and not self.degraded:
+            try:
+                return int(await self.redis.get(self.COUNT_KEY) or 0)
+            except Exception as e:
+                logger.warning("Redis L2 get_analysis_count failed: %s. Using in-memory.", e)
+        return self._analysis_count
+
     async def get_analyses(self, limit: int = 20) -> list[ArbitrationResult]:
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
                 raw_analyses = await self.redis.lrange(self.REDIS_KEY, 0, limit - 1)
                 results = []
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from backend.l2_gemini import _score_to_action
+from backend.models import AnalysisRequest, ArbitrationResult, FraudType
+
+logger = logging.getLogger(__name__)
+
+# Log-odds weights per feature. The defaults are hand-set to mirror the point
+# weights of the local fallback, not fitted, so on their own they never clear
+# an account nor ban one. A fitted model (scripts/fit_triage_model.py) is supplied as JSON
+# ({"bias": ..., "weights": {...}}) via SUSANOH_L2_TRIAGE_MODEL.
+DEFAULT_BIAS = -4.5
+DEFAULT_WEIGHTS: dict[str, float] = {
+    "R1": 1.6,
+    "R2": 1.1,
+    "R3": 1.3,
+    "R4": 1.6,
+    "R5": 1.3,
+    "R6": 1.3,
+    "R7": 1.1,
+    "R8": 1.1,
+    "unique_senders": 0.35,
+    "unique_receivers": 0.25,
+    "log_received": 0.15,
+    "new_account": 0.6,
+    "low_level": 0.4,
+}
+# Probabilities outside [low, high] are settled locally; the middle band goes to the LLM.
+DEFAULT_BAND = (0.1, 0.9)
+# Highest risk score an uncalibrated local verdict may carry: UNDER_SURVEILLANCE.
+UNCALIBRATED_MAX_SCORE = 70
+
+
+def triage_features(request: AnalysisRequest) -> dict[str, float]:
+    profile = request.user_profile
+    context = request.trigger_event.context_metadata
+    features = {rule: 1.0 for rule in request.triggered_rules}
+    features.update(
+        unique_senders=float(min(profile.unique_senders_5min, 10)),
+        unique_receivers=float(min(profile.unique_receivers_5min, 10)),
+        log_received=math.log10(1 + profile.total_received_5min),
+        new_account=1.0 if context.account_age_days <= 7 else 0.0,
+        low_level=1.0 if context.actor_level <= 5 else 0.0,
+    )
+    return features
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+@dataclass
+class TriageModel:
+    bias: float = DEFAULT_BIAS
+    weights: dict[str, float] = field(default_factory=lambda: dict(DEFAULT_WEIGHTS))
+
+    @classmethod
+    def from_file(cls, path: str) -> "TriageModel":
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(bias=float(data["bias"]), weights={k: float(v) for k, v in data["weights"].items()})
+
+    def to_file(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(asdict(self), fh, indent=2, sort_keys=True)
+
+    def probability(self, request: AnalysisRequest) -> float:
+        z = self.bias + sum(self.weights.get(name, 0.0) * value for name, value in triage_features(request).items())
+        return _sigmoid(z)
+
+
+def fit_triage_model(
+    samples: Iterable[tuple[AnalysisRequest, bool]],
+    epochs: int = 2000,
+    learning_rate: float = 0.1,
+    l2: float = 1e-3,
+) -> TriageModel:
+    """
+    Fit the logistic model to labelled requests (request, is_fraud) by batch
+    gradient descent with a small L2 penalty on the weights.
+    """
+    rows = [(triage_features(request), 1.0 if is_fraud else 0.0) for request, is_fraud in samples]
+    if len({label for _, label in rows}) < 2:
+        raise ValueError("fitting needs both fraud and legitimate samples")
+    names = sorted({name for features, _ in rows for name in features})
+    bias, weights = 0.0, dict.fromkeys(names, 0.0)
+    for _ in range(epochs):
+        grad_bias, grad = 0.0, dict.fromkeys(names, 0.0)
+        for features, label in rows:
+            error = _sigmoid(bias + sum(weights[name] * value for name, value in features.items())) - label
+            grad_bias += error
+            for name, value in features.items():
+                grad[name] += error * value
+        bias -= learning_rate * grad_bias / len(rows)
+        for name in names:
+            weights[name] -= learning_rate * (grad[name] / len(rows) + l2 * weights[name])
+    return TriageModel(bias=round(bias, 4), weights={name: round(w, 4) for name, w in weights.items()})
+
+
+class L2Triage:
+    """
+    Local scoring stage between L1 and the LLM.
+
+    A logistic model over the triggered rules and window profile settles the
+    clear-cut cases (p <= low: legitimate, p >= high: fraud) without an LLM
+    call; only the ambiguous middle band is escalated to Gemini.
+
+    Final verdicts need calibrated probabilities, i.e. a fitted model. With
+    the hand-set default weights (no `model` given, unless `calibrated` says
+    otherwise) the low side escalates too, and a local fraud verdict is
+    capped at UNCALIBRATED_MAX_SCORE, so only Gemini can ban the account.
+    """
+
+    def __init__(
+        self,
+        model: TriageModel | None = None,
+        band: tuple[float, float] = DEFAULT_BAND,
+        calibrated: bool | None = None,
+    ) -> None:
+        low, high = band
+        if not 0.0 <= low < high <= 1.0:
+            raise ValueError("triage band must satisfy 0 <= low < high <= 1")
+        self.model = model or TriageModel()
+        self.low, self.high = low, high
+        self.calibrated = model is not None if calibrated is None else calibrated
+        self.counts = {"local_fraud": 0, "local_clear": 0, "escalated": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["L2Triage"]:
+        """Enabled by SUSANOH_L2_TRIAGE=1; SUSANOH_L2_TRIAGE_BAND="low,high" tunes the escalation band."""
+        if os.environ.get("SUSANOH_L2_TRIAGE", "").strip().lower() not in {"1", "true", "yes", "on"}:
+            return None
+        band = DEFAULT_BAND
+        raw_band = os.environ.get("SUSANOH_L2_TRIAGE_BAND", "").strip()
+        if raw_band:
+            try:
+                low, high = (float(part) for part in raw_band.split(","))
+                band = (low, high)
+            except ValueError:
+                logger.warning("Invalid SUSANOH_L2_TRIAGE_BAND=%r; using %s", raw_band, DEFAULT_BAND)
+        model = None
+        model_path = os.environ.get("SUSANOH_L2_TRIAGE_MODEL", "").strip()
+        if model_path:
+            try:
+                model = TriageModel.from_file(model_path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Failed to load triage model %s: %s. Using defaults (escalate-only).", model_path, e)
+        return cls(model, band)
+
+    def resolve(self, request: AnalysisRequest) -> Optional[ArbitrationResult]:
+        """Return a local verdict for clear-cut requests, or None to escalate."""
+        p = self.model.probability(request)
+        if self.low < p < self.high or (p <= self.low and not self.calibrated):
+            self.counts["escalated"] += 1
+            return None
+
+        profile = request.user_profile
+        is_fraud = p >= self.high
+        self.counts["local_fraud" if is_fraud else "local_clear"] += 1
+        score = round(p * 100)
+        if not self.calibrated:
+            score = min(score, UNCALIBRATED_MAX_SCORE)
+        fraud_type = FraudType.LEGITIMATE
+        if is_fraud:
+            if profile.unique_senders_5min >= 3:
+                fraud_type = FraudType.RMT_SMURFING
+            elif "R4" in request.triggered_rules:
+                fraud_type = FraudType.RMT_DIRECT
+            else:
+                fraud_type = FraudType.MONEY_LAUNDERING
+        return ArbitrationResult(
+            target_id=profile.user_id,
+            is_fraud=is_fraud,
+            risk_score=score,
+            fraud_type=fraud_type,
+            recommended_action=_score_to_action(score),
+            reasoning=(
+                f"[Local triage p={p:.2f}] Rules {request.triggered_rules} were triggered. "
+                f"5-minute total={profile.total_received_5min}G, "
+                f"unique_senders={profile.unique_senders_5min}."
+            ),
+            evidence_event_ids=[request.trigger_event.event_id],
+            confidence=round(max(p, 1 - p), 2),
+        )
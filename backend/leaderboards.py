@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional
+
+from redis.exceptions import RedisError
+
+from backend.keys import KeySchema
+from backend.models import GameEventLog
+from backend.redis_client import scan_keys
+from backend.sketches import CountMinSketch, SpaceSaving
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_BUCKET_SECONDS = 300
+LEADERBOARD_HORIZON_SECONDS = 86400
+LEADERBOARD_CAPACITY = 200
+CMS_WIDTH = 512
+CMS_DEPTH = 4
+BOARDS = ("receivers", "senders")
+
+# Space-Saving insert on a bucket's sorted set (KEYS[1]) and its error hash
+# (KEYS[2]): a new member replaces the minimum once the set is full and
+# inherits its score as error. ARGV: member, amount, capacity, ttl.
+SPACE_SAVING_INSERT = """
+local top, err = KEYS[1], KEYS[2]
+local member, amount, capacity = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+if redis.call('ZSCORE', top, member) or redis.call('ZCARD', top) < capacity then
+    redis.call('ZINCRBY', top, amount, member)
+else
+    local victim = redis.call('ZRANGE', top, 0, 0, 'WITHSCORES')
+    redis.call('ZREM', top, victim[1])
+    redis.call('HDEL', err, victim[1])
+    redis.call('ZADD', top, tonumber(victim[2]) + amount, member)
+    redis.call('HSET', err, member, victim[2])
+end
+redis.call('EXPIRE', top, ARGV[4])
+redis.call('EXPIRE', err, ARGV[4])
+"""
+
+
+class _BucketSketch:
+    __slots__ = ("top", "cms")
+
+    def __init__(self, capacity: int) -> None:
+        self.top = SpaceSaving(capacity)
+        self.cms = CountMinSketch(CMS_WIDTH, CMS_DEPTH)
+
+
+class Leaderboards:
+    """
+    Economy-wide top receivers / senders by transferred amount.
+
+    Every LEADERBOARD_BUCKET_SECONDS bucket holds, per board, a Space-Saving
+    top-k summary (candidates) and a Count-Min sketch (amount upper bound).
+    A query merges the buckets inside the requested window, so cost depends
+    on buckets x capacity, never on the number of users or events.
+
+    With Redis each bucket is a Space-Saving summary kept by a Lua script (a
+    sorted set of at most `capacity` counters plus a hash of their errors,
+    merged with ZUNION) and a hash holding the Count-Min rows, shared by all
+    API nodes and expired by TTL. Reported `amount` is an upper bound and
+    `min_amount` a lower bound on the true total. In the cluster key layout
+    each aggregate shard keeps its own summaries for the users it owns;
+    queries take each shard's candidates and merge them.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        capacity: int = LEADERBOARD_CAPACITY,
+        horizon_seconds: int = LEADERBOARD_HORIZON_SECONDS,
+        clock: Callable[[], float] = time.time,
+        keys: Optional[KeySchema] = None,
+    ) -> None:
+        self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
+        self.capacity = capacity
+        self.horizon_seconds = horizon_seconds
+        self._clock = clock
+        self._buckets: deque[tuple[int, dict[str, _BucketSketch]]] = deque()
+        self._cells = CountMinSketch(CMS_WIDTH, CMS_DEPTH).cells
+
+    @staticmethod
+    def _bucket_of(ts: float) -> int:
+        return int(ts // LEADERBOARD_BUCKET_SECONDS)
+
+    def _keys(self, board: str, bucket: int, shard: int) -> tuple[str, str, str]:
+        """(top-k sorted set, its error hash, Count-Min hash) of one bucket, all in the shard's slot."""
+        top_key = self.keys.leaderboard(board, bucket, shard)
+        return top_key, f"{top_key}:err", f"{top_key}:cms"
+
+    @staticmethod
+    def _members(event: GameEventLog) -> tuple[tuple[str, str], ...]:
+        return (("receivers", event.target_id), ("senders", event.actor_id))
+
+    def _window_buckets(self, now: float, window_seconds: int) -> list[int]:
+        window_seconds = min(window_seconds, self.horizon_seconds)
+        last = self._bucket_of(now)
+        count = max(1, math.ceil(window_seconds / LEADERBOARD_BUCKET_SECONDS))
+        return list(range(last - count + 1, last + 1))
+
+    async def reset(self) -> None:
+        self._buckets.clear()
+        if self.redis:
+            try:
+                keys = []
+                for shard in self.keys.aggregate_shards:
+                    keys += await scan_keys(self.redis, self.keys.leaderboard("*", "*", shard))
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.delete(key)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis leaderboard reset failed: %s", e)
+
+    def record_local(self, event: GameEventLog, now: float | None = None) -> None:
+        now = self._clock() if now is None else now
+        bucket = self._bucket_of(now)
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, {board: _BucketSketch(self.capacity) for board in BOARDS}))
+        oldest_live = bucket - math.ceil(self.horizon_seconds / LEADERBOARD_BUCKET_SECONDS) + 1
+        while self._buckets and self._buckets[0][0] < oldest_live:
+            self._buckets.popleft()
+
+        amount = event.action_details.currency_amount
+        sketches = self._buckets[-1][1]
+        for board, user_id in self._members(event):
+            sketches[board].top.add(user_id, amount)
+            sketches[board].cms.add(user_id, amount)
+
+    def stage(self, pipe: Pipeline, event: GameEventLog, now: float | None = None) -> None:
+        """Queue this event's Redis updates on a caller-owned pipeline."""
+        now = self._clock() if now is None else now
+        bucket = self._bucket_of(now)
+        amount = event.action_details.currency_amount
+        ttl = self.horizon_seconds + LEADERBOARD_BUCKET_SECONDS
+        for board, user_id in self._members(event):
+            top_key, err_key, cms_key = self._keys(board, bucket, self.keys.aggregate_shard(user_id))
+            # EVAL rather than EVALSHA: Redis caches the compiled script, and a
+            # restarted Redis never fails the caller's pipeline with NOSCRIPT.
+            pipe.eval(SPACE_SAVING_INSERT, 2, top_key, err_key, user_id, amount, self.capacity, ttl)
+            for row, col in enumerate(self._cells(user_id)):
+                pipe.hincrby(cms_key, f"{row}:{col}", amount)
+            pipe.expire(cms_key, ttl)
+
+    def _local_board(self, board: str, buckets: list[int], limit: int) -> list[dict[str, Any]]:
+        live = [sketches[board] for b, sketches in self._buckets if buckets[0] <= b <= buckets[-1]]
+        if not live:
+            return []
+        merged = SpaceSaving.union((s.top for s in live), self.capacity)
+        entries = []
+        for user_id, count, error in merged.top(2 * limit):
+            # Summing per-bucket point estimates avoids materialising a merged sketch.
+            estimate = sum(s.cms.estimate(user_id) for s in live)
+            entries.append({"user_id": user_id, "amount": min(count, estimate), "min_amount": count - error})
+        entries.sort(key=lambda e: e["amount"], reverse=True)
+        return entries[:limit]
+
+    async def _redis_board(self, board: str, buckets: list[int], limit: int) -> list[dict[str, Any]]:
+        shards = list(self.keys.aggregate_shards)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for shard in shards:
+                pipe.zunion([self._keys(board, b, shard)[0] for b in buckets], withscores=True)
+            # A user only ever lands in its own shard, so the unions are disjoint.
+            candidates = [(uid, score, shard) for shard, top in zip(shards, await pipe.execute()) for uid, score in top]
+        candidates.sort(key=lambda c: c[1], reverse=True)
+        candidates = candidates[: 2 * limit]
+        if not candidates:
+            return []
+
+        by_shard: dict[int, list[str]] = {}
+        for uid, _, shard in candidates:
+            by_shard.setdefault(shard, []).append(uid)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for shard, user_ids in by_shard.items():
+                flat_fields = [f"{row}:{col}" for uid in user_ids for row, col in enumerate(self._cells(uid))]
+                for b in buckets:
+                    top_key, err_key, cms_key = self._keys(board, b, shard)
+                    pipe.zmscore(top_key, user_ids)
+                    pipe.hmget(err_key, user_ids)
+                    pipe.hmget(cms_key, flat_fields)
+            replies = await pipe.execute()
+
+        entries = []
+        at = 0
+        for user_ids in by_shard.values():
+            shard_replies = replies[at:at + 3 * len(buckets)]
+            at += 3 * len(buckets)
+            for i, user_id in enumerate(user_ids):
+                estimate = 0
+                guaranteed = 0
+                for step in range(0, len(shard_replies), 3):
+                    counts, errors, cms_values = shard_replies[step:step + 3]
+                    if counts[i] is not None:
+                        guaranteed += int(counts[i]) - int(errors[i] or 0)
+                    cells = cms_values[i * CMS_DEPTH:(i + 1) * CMS_DEPTH]
+                    estimate += min(int(v or 0) for v in cells)
+                # Count-Min never underestimates, so it bounds the total across buckets.
+                entries.append({"user_id": user_id, "amount": max(estimate, guaranteed), "min_amount": guaranteed})
+        entries.sort(key=lambda e: e["amount"], reverse=True)
+        return entries[:limit]
+
+    async def top(self, window_seconds: int = 3600, limit: int = 50) -> dict[str, Any]:
+        now = self._clock()
+        buckets = self._window_buckets(now, window_seconds)
+        boards: dict[str, list[dict[str, Any]]] | None = None
+        if self.redis:
+            try:
+                boards = {board: await self._redis_board(board, buckets, limit) for board in BOARDS}
+            except RedisError as e:
+                logger.warning("Redis leaderboard query failed: %s. Using in-memory.", e)
+        if boards is None:
+            boards = {board: self._local_board(board, buckets, limit) for board in BOARDS}
+        return {"window_seconds": len(buckets) * LEADERBOARD_BUCKET_SECONDS, **boards}
+
+    @staticmethod
+    def user_ids(result: dict[str, Any]) -> list[str]:
+        ids: dict[str, None] = {}
+        for board in BOARDS:
+            for entry in result[board]:
+                ids[entry["user_id"]] = None
+        return list(ids)
@@ -4,6 +4,8 @@ import asyncio
 from contextlib import asynccontextmanager
 from typing import TYPE_CHECKING, AsyncGenerator, Optional
 
+from backend.keys import KeySchema
+
 if TYPE_CHECKING:
     from redis.asyncio import Redis
 
@@ -15,8 +17,9 @@ class LockManager:
     Falls back to asyncio.Lock for in-memory, single-process execution.
     """
 
-    def __init__(self, redis_client: Optional[Redis] = None) -> None:
+    def __init__(self, redis_client: Optional[Redis] = None, keys: Optional[KeySchema] = None) -> None:
         self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
         self._local_locks: dict[str, asyncio.Lock] = {}
 
     @asynccontextmanager
@@ -27,7 +30,7 @@ class LockManager:
         """
         if self.redis:
             # redis.lock returns an async context manager in redis-py asyncio
-            lock = self.redis.lock(f"susanoh:lock:{user_id}", timeout=timeout)
+            lock = self.redis.lock(self.keys.lock(user_id), timeout=timeout)
             async with lock:
                 yield
         else:
@@ -5,34 +5,48 @@ import logging
 import os
 from typing import Optional
 
-from arq import create_pool
-from arq.connections import RedisSettings
-from fastapi import FastAPI, HTTPException, Query, Depends, status
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+import httpx
+from redis.exceptions import RedisError
 from datetime import timedelta
 
 from backend.models import (
     AccountState,
+    ArbitrationResult,
     GameEventLog,
+    ScreeningResult,
     ShowcaseResult,
+    TransitionLog,
     WithdrawRequest,
 )
 from backend.state_machine import StateMachine
-from backend.l1_screening import L1Engine
+from backend.l1_screening import ACTOR_RULES, L1Engine
+from backend.leaderboards import BOARDS, Leaderboards
 from backend.l2_gemini import L2Engine
+from backend.l2_scheduling import LaneMetrics, dispatch_at, lane_for
+from backend.l2_triage import L2Triage
+from backend.job_codec import L2JobRef, encode_job
 from backend.mock_server import MockGameServer, DemoStreamer
 from backend.persistence import PersistenceStore
 from backend.lock_manager import LockManager
 from backend.redis_client import RedisClient
+from backend.sharding import ShardRouter
+from backend.transition_stream import PersistenceSink, TransitionStreamConsumer, WebhookSink
+from backend.wal import WriteAheadLog
+from backend.event_bus import EventBroadcaster
+from backend.ingest import EventIngestor, IngestBacklogFull, ingest_mode_from_env, ingest_stream_key
+from backend.flow_graph import FlowGraph
+from backend.windowing import WindowSide
+from backend.autoscaling import AutoscalingSignal, ThroughputRecorder
+from backend.worker import WorkerSettings
 from backend.auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     MOCK_USERS_DB,
     Role,
-    User,
     create_access_token,
-    get_current_user,
     get_user,
     require_roles,
     verify_password,
@@ -42,21 +56,41 @@ from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Setup arq pool
-    redis_url = os.environ.get("REDIS_URL", "").strip()
+    # The arq pool shares the Redis subsystem (pool limits, keepalive, breaker)
     app.state.arq_pool = None
-    if redis_url:
+    pool = redis_client.get_arq_pool()
+    if pool is not None:
         try:
-            app.state.arq_pool = await create_pool(RedisSettings.from_dsn(redis_url))
-        except Exception as e:
-            logger.warning(f"Failed to create arq pool (continuing without async worker): {e}")
-            app.state.arq_pool = None
-    
+            await pool.ping()
+            app.state.arq_pool = pool
+        except RedisError as e:
+            logger.warning(f"Redis unavailable for arq (continuing without async worker): {e}")
+    await broadcaster.start_relay()
+    if wal:
+        restored = restore_from_wal()
+        if restored:
+            logger.info("Restored %d degraded writes from the WAL in %s", restored, wal.directory)
+        wal.start()
+    replay_task = asyncio.create_task(_replay_degraded_writes_loop()) if redis_client.enabled else None
+    consumer_tasks = [asyncio.create_task(consumer.run()) for consumer in transition_consumers]
+    if ingestor:
+        ingestor.start()
+
     yield
     # Shutdown logic
-    if app.state.arq_pool:
-        await app.state.arq_pool.close()
-        app.state.arq_pool = None
+    if replay_task:
+        replay_task.cancel()
+    for task in consumer_tasks:
+        task.cancel()
+    if ingestor:
+        await ingestor.stop()
+    if webhook_sink:
+        await webhook_sink.close()
+    if wal:
+        await wal.close()
+    await broadcaster.stop_relay()
+    await shard_router.close()
+    app.state.arq_pool = None
     await redis_client.close()
 
 app = FastAPI(title="Susanoh", version="0.1.0", lifespan=lifespan)
@@ -69,18 +103,57 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 redis_client = RedisClient()
-sm = StateMachine(redis_client.get_client())
-l1 = L1Engine(redis_client.get_client())
-l2 = L2Engine(redis_client=redis_client.get_client())
+# SUSANOH_WAL_DIR: writes journaled while Redis is degraded also go to a local
+# write-ahead log, so they survive a restart before Redis comes back.
+wal = WriteAheadLog.from_env() if redis_client.enabled else None
+sm = StateMachine(redis_client.get_client(), breaker=redis_client.breaker, wal=wal)
+l1 = L1Engine(redis_client.get_client(), breaker=redis_client.breaker, wal=wal)
+l2 = L2Engine(redis_client=redis_client.get_client(), triage=L2Triage.from_env(), breaker=redis_client.breaker)
 lock_manager = LockManager(redis_client.get_client())
+broadcaster = EventBroadcaster(redis_client.get_client())
+lane_metrics = LaneMetrics(redis_client.get_client())
+throughput = ThroughputRecorder(redis_client.get_client())
+autoscaling = AutoscalingSignal(throughput, slots_per_worker=WorkerSettings.max_jobs)
+shard_router = ShardRouter.from_env()
 mock = MockGameServer()
 streamer: DemoStreamer | None = None
 persistence_store = PersistenceStore.from_env()
 persistence_store.init_schema()
 
+# With Redis, audit transitions are read back from the transition stream,
+# one consumer group per sink.
+webhook_sink = WebhookSink.from_env() if redis_client.enabled else None
+transition_sinks = [webhook_sink] if webhook_sink else []
+if redis_client.enabled and persistence_store.enabled:
+    transition_sinks.append(PersistenceSink(persistence_store))
+transition_consumers = [
+    TransitionStreamConsumer(redis_client.get_client(), sink, keys=sm.keys) for sink in transition_sinks
+]
+
+STREAM_HEARTBEAT_SECONDS = 15.0
+REPLAY_INTERVAL_SECONDS = float(os.environ.get("SUSANOH_REDIS_REPLAY_INTERVAL", "5"))
+
+
+async def _publish_screening(event: GameEventLog, result: ScreeningResult) -> None:
+    await broadcaster.publish("screening", L1Engine.event_row(event, result))
+
+
+async def _publish_transition(log: TransitionLog) -> None:
+    await broadcaster.publish("transition", log.model_dump(mode="json"))
+
+
+async def _publish_analysis(result: ArbitrationResult) -> None:
+    await broadcaster.publish("analysis", result.model_dump(mode="json"))
+
+
+l1.add_screening_listener(_publish_screening)
+sm.add_transition_listener(_publish_transition)
+l2.add_result_listener(_publish_analysis)
+
 
 def _configured_api_keys() -> set[str]:
     raw = os.environ.get("SUSANOH_API_KEYS", "")
@@ -107,7 +180,61 @@ async def reset_runtime_state() -> None:
     await sm.reset()
     await l1.reset()
     await l2.reset()
+    await lane_metrics.reset()
     persistence_store.clear_all()
+    if wal:
+        await wal.checkpoint()
+
+
+async def replay_degraded_writes() -> dict[str, int]:
+    """Converge Redis with the writes the engines kept in memory while it was degraded."""
+    return {
+        "accounts": await sm.replay_degraded_writes(),
+        "events": await l1.replay_degraded_writes(),
+        "analyses": await l2.replay_degraded_writes(),
+        "ingest": await ingestor.replay_degraded_writes() if ingestor else 0,
+    }
+
+
+def restore_from_wal() -> int:
+    """Rebuild the journals (and in-memory state) of writes a previous process left in the WAL."""
+    restored = 0
+    for lsn, kind, data in wal.records():
+        try:
+            if (
+                sm.restore_from_wal(kind, data, lsn)
+                or l1.restore_from_wal(kind, data, lsn)
+                or (ingestor is not None and ingestor.restore_from_wal(kind, data, lsn))
+            ):
+                restored += 1
+            else:
+                logger.warning("Skipping unknown WAL record kind %r", kind)
+        except (KeyError, ValueError) as exc:
+            logger.warning("Skipping malformed WAL record %r: %s", kind, exc)
+    return restored
+
+
+async def _checkpoint_wal() -> None:
+    # Nothing may await between the journal check and the checkpoint, or a
+    # write journaled in between would be dropped from the WAL; checkpoint
+    # cuts the log off before its first await.
+    parked = ingestor.pending_writes if ingestor else 0
+    if wal and not sm.pending_writes and not l1.pending_writes and not parked and (wal.buffered or wal.segments()):
+        removed = await wal.checkpoint()
+        if removed:
+            logger.info("Degraded writes reached Redis; removed %d WAL segments", removed)
+
+
+async def _replay_degraded_writes_loop() -> None:
+    while True:
+        await asyncio.sleep(REPLAY_INTERVAL_SECONDS)
+        try:
+            replayed = await replay_degraded_writes()
+            if any(replayed.values()):
+                logger.info("Replayed degraded writes to Redis: %s", replayed)
+            await _checkpoint_wal()
+        except Exception as exc:
+            logger.warning("Degraded write replay failed: %s", exc)
 
 
 async def _persist_runtime_snapshot() -> None:
@@ -118,7 +245,9 @@ async def _persist_runtime_snapshot() -> None:
     try:
         # get_analyses is now async, so we must await it
         analyses = await l2.get_analyses(limit=50)
-        persistence_store.persist_runtime_snapshot(sm=sm, l1=l1, l2_results=analyses)
+        persistence_store.persist_runtime_snapshot(
+            sm=sm, l1=l1, l2_results=analyses, include_transitions=sm.redis is None
+        )
     except Exception as exc:
         logger.warning("Failed to persist runtime snapshot: %s", exc)
 
@@ -127,6 +256,20 @@ async def _process_event(event: GameEventLog) -> dict:
     return await _process_event_with_options(event, schedule_l2=True)
 
 
+# SUSANOH_INGEST_MODE=queued: POST /events only queues (202) and a consumer pool screens.
+ingestor = (
+    EventIngestor(
+        _process_event,
+        redis_client.get_client(),
+        breaker=redis_client.breaker,
+        stream=ingest_stream_key(shard_router.self_node if shard_router.enabled else None),
+        wal=wal,
+    )
+    if ingest_mode_from_env() == "queued"
+    else None
+)
+
+
 async def _process_event_with_options(event: GameEventLog, schedule_l2: bool) -> dict:
     """Process one event and optionally schedule background L2.
 
@@ -141,33 +284,71 @@ async def _process_event_with_options(event: GameEventLog, schedule_l2: bool) ->
         await sm.get_or_create(event.target_id)
 
         result = await l1.screen(event)
-    
-        if result.screened and result.recommended_action:
-            current = await sm.get_or_create(event.target_id)
-            if current == AccountState.NORMAL:
-                await sm.transition(
-                    event.target_id,
-                    AccountState.RESTRICTED_WITHDRAWAL,
-                    "L1_SCREENING",
-                    ",".join(result.triggered_rules),
-                    f"L1 rule triggered: {result.triggered_rules}",
-                )
+        target_rules = [r for r in result.triggered_rules if r not in ACTOR_RULES]
+        actor_rules = [r for r in result.triggered_rules if r in ACTOR_RULES]
+
+        await _apply_l1_result(event.target_id, event, target_rules, result.needs_l2, schedule_l2)
 
-        if schedule_l2 and (result.needs_l2 or (
-            result.screened
-            and await sm.get_or_create(event.target_id) != AccountState.NORMAL
-        )):
-            current_state = await sm.get_or_create(event.target_id)
-            analysis_req = await l1.build_analysis_request(
-                event.target_id, event, result.triggered_rules, current_state
+    # Outflow rules incriminate the sender. Its lock is taken only after the
+    # target's is released, so no two user locks are ever held at once.
+    if actor_rules:
+        async with lock_manager.acquire_user_lock(event.actor_id):
+            await _apply_l1_result(event.actor_id, event, actor_rules, False, schedule_l2)
+
+    await _persist_runtime_snapshot()
+    return {
+        "screened": result.screened,
+        "triggered_rules": result.triggered_rules,
+        "ring_members": result.ring_members,
+    }
+
+
+async def _apply_l1_result(
+    user_id: str,
+    event: GameEventLog,
+    rules: list[str],
+    needs_l2: bool,
+    schedule_l2: bool,
+) -> None:
+    """Restrict `user_id` for the rules it triggered and queue its L2 review. Caller holds its lock."""
+    if rules:
+        current = await sm.get_or_create(user_id)
+        if current == AccountState.NORMAL:
+            await sm.transition(
+                user_id,
+                AccountState.RESTRICTED_WITHDRAWAL,
+                "L1_SCREENING",
+                ",".join(rules),
+                f"L1 rule triggered: {rules}",
             )
-            if hasattr(app.state, "arq_pool") and app.state.arq_pool:
-                await app.state.arq_pool.enqueue_job("analyze_l2_task", analysis_req)
-            else:
-                asyncio.create_task(_run_l2(analysis_req))
 
-        await _persist_runtime_snapshot()
-        return {"screened": result.screened, "triggered_rules": result.triggered_rules}
+    if schedule_l2 and (needs_l2 or (
+        rules
+        and await sm.get_or_create(user_id) != AccountState.NORMAL
+    )):
+        current_state = await sm.get_or_create(user_id)
+        analysis_req = await l1.build_analysis_request(user_id, event, rules, current_state)
+        verdict = await l2.try_triage(analysis_req)
+        if verdict is not None:
+            await sm.apply_l2_verdict(verdict.target_id, verdict.recommended_action, verdict.risk_score)
+        elif hasattr(app.state, "arq_pool") and app.state.arq_pool:
+            lane = lane_for(analysis_req)
+            side = WindowSide.TARGET if user_id == event.target_id else WindowSide.ACTOR
+            job = L2JobRef(user_id, event.event_id, analysis_req.triggered_rules, lane=lane.name, side=side.value)
+            try:
+                await app.state.arq_pool.enqueue_job(
+                    "analyze_l2_ref_task",
+                    encode_job(job),
+                    _defer_until=dispatch_at(lane, job.enqueue_ts),
+                )
+            except RedisError as e:
+                logger.warning("L2 enqueue failed, analyzing in-process: %s", e)
+                asyncio.create_task(_run_l2(analysis_req))
+                return
+            await lane_metrics.record_enqueue(lane)
+            await throughput.record_enqueued()
+        else:
+            asyncio.create_task(_run_l2(analysis_req))
 
 
 async def _run_l2(analysis_req) -> None:
@@ -219,12 +400,79 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer", "role": user_dict["role"].value}
 
 
+async def _forward_to_owner(request: Request, user_id: str) -> Optional[Response]:
+    """Proxy the request to the shard that owns `user_id`; None when it is owned here."""
+    if shard_router.is_local(user_id):
+        return None
+    path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    body = await request.body()
+    if shard_router.is_forwarded(request.method, path, body, request.headers):
+        return None
+    owner = shard_router.owner(user_id)
+    try:
+        forwarded = await shard_router.forward(owner, request.method, path, body, request.headers)
+    except httpx.HTTPError as exc:
+        logger.warning("Forwarding %s for %s to %s failed: %s", path, user_id, owner, exc)
+        raise HTTPException(503, f"Shard owner for {user_id} is unavailable")
+    return Response(
+        content=forwarded.content,
+        status_code=forwarded.status_code,
+        media_type=forwarded.headers.get("content-type"),
+    )
+
+
+# --- Shards ---
+@app.get("/api/v1/shards")
+async def get_shards(user_id: Optional[str] = None):
+    shard_map = shard_router.shard_map()
+    if user_id is not None:
+        shard_map["owner"] = shard_router.owner(user_id) or shard_router.self_node
+    return shard_map
+
+
 # --- Events ---
 @app.post("/api/v1/events")
-async def post_event(event: GameEventLog):
+async def post_event(event: GameEventLog, request: Request):
+    if forwarded := await _forward_to_owner(request, event.target_id):
+        return forwarded
+    if ingestor:
+        try:
+            accepted = await ingestor.submit(event)
+        except IngestBacklogFull as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content={"status": "accepted", **accepted})
     return await _process_event(event)
 
 
+@app.get("/api/v1/ingest", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def get_ingest_status():
+    if not ingestor:
+        return {"mode": "sync"}
+    return await ingestor.status()
+
+
+@app.get("/api/v1/stream", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def stream_updates(request: Request):
+    """Server-sent events carrying screening results, transitions and L2 verdicts as deltas."""
+
+    async def _messages():
+        async with broadcaster.subscribe() as queue:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+
+    return StreamingResponse(
+        _messages(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/v1/events/recent")
 async def get_recent_events(limit: int = Query(default=20, le=200)):
     return await l1.get_recent_events(limit)
@@ -232,25 +480,36 @@ async def get_recent_events(limit: int = Query(default=20, le=200)):
 
 # --- Users ---
 @app.get("/api/v1/users", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
-async def get_users(state: Optional[str] = None):
+async def get_users(
+    response: Response,
+    state: Optional[str] = None,
+    cursor: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
     state_filter = None
     if state:
         try:
             state_filter = AccountState(state)
         except ValueError:
             raise HTTPException(400, f"Invalid state: {state}")
-    return await sm.get_all_users(state_filter)
+    users, next_cursor = await sm.get_users_page(state_filter, cursor=cursor, limit=limit)
+    response.headers["X-Next-Cursor"] = str(next_cursor)
+    return users
 
 
 @app.get("/api/v1/users/{user_id}", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
-async def get_user_by_id(user_id: str):
+async def get_user_by_id(user_id: str, request: Request):
+    if forwarded := await _forward_to_owner(request, user_id):
+        return forwarded
     st = await sm.get_or_create(user_id)
     return {"user_id": user_id, "state": st.value}
 
 
 # --- Withdraw ---
 @app.post("/api/v1/withdraw")
-async def withdraw(req: WithdrawRequest):
+async def withdraw(req: WithdrawRequest, request: Request):
+    if forwarded := await _forward_to_owner(request, req.user_id):
+        return forwarded
     status_code, message = await _withdraw_status(req.user_id)
     await _record_blocked_withdrawal(status_code)
     if status_code == 200:
@@ -260,7 +519,9 @@ async def withdraw(req: WithdrawRequest):
 
 # --- Release ---
 @app.post("/api/v1/users/{user_id}/release", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR]))])
-async def release_user(user_id: str):
+async def release_user(user_id: str, request: Request):
+    if forwarded := await _forward_to_owner(request, user_id):
+        return forwarded
     current = await sm.get_or_create(user_id)
     releasable_states = {AccountState.RESTRICTED_WITHDRAWAL, AccountState.UNDER_SURVEILLANCE}
     if current not in releasable_states:
@@ -280,12 +541,40 @@ async def release_user(user_id: str):
 @app.get("/api/v1/stats", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
 async def get_stats():
     stats = await sm.get_stats()
-    stats["l1_flags"] = l1.l1_flag_count
-    stats["l2_analyses"] = len(l2.analysis_results)
-    stats["total_events"] = len(l1.recent_events)
+    stats.update(await l1.get_counters())
+    stats["l2_analyses"] = await l2.get_analysis_count()
     return stats
 
 
+@app.get("/api/v1/redis/health", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def get_redis_health():
+    return {
+        "enabled": redis_client.enabled,
+        "breaker": redis_client.breaker.state(),
+        "pending_writes": {
+            "accounts": sm.pending_writes,
+            "events": l1.pending_writes,
+            "analyses": l2.pending_writes,
+            "ingest": ingestor.pending_writes if ingestor else 0,
+        },
+        "transition_consumers": [await consumer.status() for consumer in transition_consumers],
+        "wal": wal.status() if wal else None,
+    }
+
+
+@app.get("/api/v1/l2/lanes", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def get_l2_lanes():
+    return await lane_metrics.snapshot()
+
+
+@app.get("/api/v1/l2/autoscaling", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def get_l2_autoscaling(format: str = Query(default="json", pattern="^(json|prometheus)$")):
+    snapshot = await autoscaling.snapshot(getattr(app.state, "arq_pool", None))
+    if format == "prometheus":
+        return PlainTextResponse(AutoscalingSignal.prometheus(snapshot), media_type="text/plain; version=0.0.4")
+    return snapshot
+
+
 # --- Transitions ---
 @app.get("/api/v1/transitions", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
 async def get_transitions(limit: int = Query(default=50, le=200)):
@@ -294,15 +583,26 @@ async def get_transitions(limit: int = Query(default=50, le=200)):
 
 # --- Graph ---
 @app.get("/api/v1/graph", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
-async def get_graph():
-    # Resolve node states from Redis if available (Finding 4)
-    recent = await l1.get_recent_events(limit=200)
-    user_ids = set()
-    for e in recent:
-        user_ids.add(e["actor_id"])
-        user_ids.add(e["target_id"])
-    resolved = await sm.resolve_accounts(list(user_ids))
-    return await l1.get_graph_data(resolved)
+async def get_graph(since: Optional[float] = Query(default=None, ge=0)):
+    """Transfer graph over the configured horizon, or a delta when `since` is given."""
+    snapshot = await l1.flow_graph.snapshot(since=since)
+    resolved = await sm.resolve_accounts(FlowGraph.node_ids(snapshot))
+    return FlowGraph.build_graph(snapshot, resolved)
+
+
+# --- Leaderboards ---
+@app.get("/api/v1/leaderboards", dependencies=[Depends(require_roles([Role.ADMIN, Role.OPERATOR, Role.VIEWER]))])
+async def get_leaderboards(
+    window: int = Query(default=3600, ge=300, le=86400),
+    limit: int = Query(default=50, ge=1, le=200),
+):
+    """Top receivers and senders by amount over the last `window` seconds (sketch-based)."""
+    boards = await l1.leaderboards.top(window_seconds=window, limit=limit)
+    states = await sm.resolve_accounts(Leaderboards.user_ids(boards))
+    for board in BOARDS:
+        for entry in boards[board]:
+            entry["state"] = states.get(entry["user_id"], AccountState.NORMAL).value
+    return boards
 
 
 # --- L2 Analyze ---
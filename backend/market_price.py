@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from redis.exceptions import RedisError
+
+from backend.keys import KeySchema
+from backend.models import GameEventLog
+from backend.redis_client import scan_keys
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HALF_LIFE_SECONDS = 6 * 3600
+DEFAULT_MAX_ITEMS = 10_000
+MIN_SAMPLES = 20  # below this the estimate is not trusted by R3
+BIN_GROWTH = 1.1  # histogram bins are 10% wide, so quantiles are within ~5%
+EVICT_EVERY = 256  # Redis LRU trims are amortised over this many updates
+_EPOCHS_PER_KEY_LIFETIME = 2
+
+
+def _max_items_from_env() -> int:
+    raw = os.environ.get("SUSANOH_PRICE_MAX_ITEMS", "").strip()
+    try:
+        return max(1, int(raw)) if raw else DEFAULT_MAX_ITEMS
+    except ValueError:
+        return DEFAULT_MAX_ITEMS
+
+
+@dataclass
+class PriceEstimate:
+    mean: float
+    median: float
+    samples: int
+
+
+def _bin_of(price: float) -> int:
+    return int(math.floor(math.log(max(price, 1.0), BIN_GROWTH)))
+
+
+def _bin_mid(index: int) -> float:
+    return BIN_GROWTH ** (index + 0.5)
+
+
+class _EpochSums:
+    """Decay-weighted sums for one epoch; weights are 2**((t - epoch_start) / half_life)."""
+
+    __slots__ = ("weight", "total", "count", "bins")
+
+    def __init__(self) -> None:
+        self.weight = 0.0
+        self.total = 0.0
+        self.count = 0
+        self.bins: dict[int, float] = {}
+
+    def add(self, price: float, weight: float) -> None:
+        self.weight += weight
+        self.total += weight * price
+        self.count += 1
+        b = _bin_of(price)
+        self.bins[b] = self.bins.get(b, 0.0) + weight
+
+    @classmethod
+    def from_hash(cls, raw: dict[str, str]) -> "_EpochSums":
+        sums = cls()
+        for name, value in raw.items():
+            if name == "w":
+                sums.weight = float(value)
+            elif name == "s":
+                sums.total = float(value)
+            elif name == "n":
+                sums.count = int(value)
+            elif name.startswith("b"):
+                sums.bins[int(name[1:])] = float(value)
+        return sums
+
+
+class MarketPriceEstimator:
+    """
+    Online per-item price reference learned from TRADE events.
+
+    Each item keeps an exponentially decayed mean and a decayed log-binned
+    histogram (median within ~5%). Time is cut into epochs of four half-lives;
+    within an epoch every sample is weighted 2**((t - epoch_start) / half_life),
+    so all state is additive: Redis updates are plain HINCRBYFLOAT calls with
+    no read-modify-write, safe across API nodes. A read merges the current and
+    previous epoch, scaling the previous one down by 2**-4.
+
+    Item cardinality is bounded by an LRU (OrderedDict in memory, a sorted set
+    of last-seen times in Redis) trimmed to `max_items`.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        half_life_seconds: int = DEFAULT_HALF_LIFE_SECONDS,
+        max_items: int | None = None,
+        keys: Optional[KeySchema] = None,
+    ) -> None:
+        self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
+        self.half_life = half_life_seconds
+        self.epoch_seconds = 4 * half_life_seconds
+        self.max_items = max_items or _max_items_from_env()
+        self._local: OrderedDict[str, dict[int, _EpochSums]] = OrderedDict()
+        self._updates_since_evict = 0
+
+    def _epoch_of(self, ts: float) -> int:
+        return int(ts // self.epoch_seconds)
+
+    def _weight(self, ts: float, epoch: int) -> float:
+        return 2.0 ** ((ts - epoch * self.epoch_seconds) / self.half_life)
+
+    def _key(self, item_id: str, epoch: int) -> str:
+        return self.keys.price(item_id, epoch)
+
+    async def _delete(self, keys: list[str]) -> None:
+        # One DEL per key: in the cluster layout every item hashes to its own slot.
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.delete(key)
+            await pipe.execute()
+
+    @staticmethod
+    def observes(event: GameEventLog) -> bool:
+        details = event.action_details
+        return event.event_type == "TRADE" and bool(details.item_id) and details.currency_amount > 0
+
+    async def reset(self) -> None:
+        self._local.clear()
+        self._updates_since_evict = 0
+        if self.redis:
+            try:
+                keys = await scan_keys(self.redis, self.keys.price("*", "*"))
+                keys.append(self.keys.price_lru)
+                await self._delete(keys)
+            except RedisError as e:
+                logger.warning("Redis price reset failed: %s", e)
+
+    def record_local(self, event: GameEventLog, ts: float) -> None:
+        if not self.observes(event):
+            return
+        item_id = event.action_details.item_id
+        epochs = self._local.get(item_id)
+        if epochs is None:
+            epochs = self._local[item_id] = {}
+            while len(self._local) > self.max_items:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(item_id)
+        epoch = self._epoch_of(ts)
+        for stale in [e for e in epochs if e < epoch - 1]:
+            del epochs[stale]
+        epochs.setdefault(epoch, _EpochSums()).add(event.action_details.currency_amount, self._weight(ts, epoch))
+
+    def stage(self, pipe: Pipeline, event: GameEventLog, ts: float) -> None:
+        """Queue this event's Redis updates on a caller-owned pipeline."""
+        if not self.observes(event):
+            return
+        item_id = event.action_details.item_id
+        price = event.action_details.currency_amount
+        epoch = self._epoch_of(ts)
+        weight = self._weight(ts, epoch)
+        key = self._key(item_id, epoch)
+        pipe.hincrbyfloat(key, "w", weight)
+        pipe.hincrbyfloat(key, "s", weight * price)
+        pipe.hincrby(key, "n", 1)
+        pipe.hincrbyfloat(key, f"b{_bin_of(price)}", weight)
+        pipe.expire(key, _EPOCHS_PER_KEY_LIFETIME * self.epoch_seconds)
+        pipe.zadd(self.keys.price_lru, {item_id: ts})
+        self._updates_since_evict += 1
+
+    def _combine(self, epochs: dict[int, _EpochSums], ts: float) -> Optional[PriceEstimate]:
+        current = self._epoch_of(ts)
+        weight = total = 0.0
+        count = 0
+        bins: dict[int, float] = {}
+        for epoch in (current - 1, current):
+            sums = epochs.get(epoch)
+            if sums is None:
+                continue
+            scale = 2.0 ** ((epoch - current) * self.epoch_seconds / self.half_life)
+            weight += sums.weight * scale
+            total += sums.total * scale
+            count += sums.count
+            for b, w in sums.bins.items():
+                bins[b] = bins.get(b, 0.0) + w * scale
+        if count == 0 or weight <= 0:
+            return None
+
+        half, running, median = weight / 2, 0.0, 0.0
+        for b in sorted(bins):
+            running += bins[b]
+            if running >= half:
+                median = _bin_mid(b)
+                break
+        return PriceEstimate(mean=total / weight, median=median, samples=count)
+
+    async def estimate(self, item_id: str, ts: float) -> Optional[PriceEstimate]:
+        if self.redis:
+            try:
+                current = self._epoch_of(ts)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(self._key(item_id, current - 1))
+                    pipe.hgetall(self._key(item_id, current))
+                    previous, latest = await pipe.execute()
+                epochs = {
+                    current - 1: _EpochSums.from_hash(previous),
+                    current: _EpochSums.from_hash(latest),
+                }
+                return self._combine(epochs, ts)
+            except RedisError as e:
+                logger.warning("Redis price estimate failed: %s. Using in-memory.", e)
+        epochs = self._local.get(item_id)
+        return self._combine(epochs, ts) if epochs else None
+
+    async def maybe_evict(self) -> None:
+        """Trim the Redis item LRU to `max_items`; a no-op until EVICT_EVERY updates were staged."""
+        if not self.redis or self._updates_since_evict < EVICT_EVERY:
+            return
+        self._updates_since_evict = 0
+        try:
+            excess = await self.redis.zcard(self.keys.price_lru) - self.max_items
+            if excess <= 0:
+                return
+            keys = []
+            for item_id, last_seen in await self.redis.zpopmin(self.keys.price_lru, excess):
+                # Only the last-seen epoch and its predecessor can still exist; older ones expired.
+                epoch = self._epoch_of(last_seen)
+                keys += [self._key(item_id, epoch - 1), self._key(item_id, epoch)]
+            await self._delete(keys)
+        except RedisError as e:
+            logger.warning("Redis price eviction failed: %s", e)
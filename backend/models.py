@@ -49,6 +49,24 @@ class UserProfile(BaseModel):
     total_received_5min: int = 0
     transaction_count_5min: int = 0
     unique_senders_5min: int = 0
+    total_received_1h: int = 0
+    total_received_24h: int = 0
+    transaction_count_24h: int = 0
+    total_sent_5min: int = 0
+    unique_receivers_5min: int = 0
+
+
+class WindowSummary(BaseModel):
+    """Aggregate view of a related-events window whose events were compacted away."""
+    event_count: int = 0
+    shown_events: int = 0
+    total_amount: int = 0
+    max_amount: int = 0
+    distinct_senders: int = 0
+    distinct_receivers: int = 0
+    slang_hits: int = 0
+    first_timestamp: Optional[str] = None
+    last_timestamp: Optional[str] = None
 
 
 class AnalysisRequest(BaseModel):
@@ -56,6 +74,7 @@ class AnalysisRequest(BaseModel):
     related_events: list[GameEventLog] = Field(default_factory=list)
     triggered_rules: list[str] = Field(default_factory=list)
     user_profile: UserProfile
+    window_summary: Optional[WindowSummary] = None
 
 
 class ArbitrationResult(BaseModel):
@@ -84,6 +103,9 @@ class ScreeningResult(BaseModel):
     triggered_rules: list[str] = Field(default_factory=list)
     recommended_action: Optional[AccountState] = None
     needs_l2: bool = False
+    ring_patterns: list[str] = Field(default_factory=list)
+    ring_members: list[str] = Field(default_factory=list)
+    estimated_market_price: Optional[float] = None
 
 
 class WithdrawRequest(BaseModel):
@@ -117,3 +139,4 @@ class GraphLink(BaseModel):
 class GraphData(BaseModel):
     nodes: list[GraphNode] = Field(default_factory=list)
     links: list[GraphLink] = Field(default_factory=list)
+    version: Optional[int] = None
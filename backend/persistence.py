@@ -5,14 +5,14 @@ from contextlib import contextmanager
 from datetime import UTC, datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Boolean, Float, Integer, String, Text, create_engine
+from sqlalchemy import Boolean, Float, Integer, String, Text, create_engine, insert
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, sessionmaker
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
 
     from backend.l1_screening import L1Engine
-    from backend.models import ArbitrationResult
+    from backend.models import AccountState, ArbitrationResult, TransitionLog
     from backend.state_machine import StateMachine
 
 
@@ -120,7 +120,13 @@ class PersistenceStore:
         sm: "StateMachine",
         l1: "L1Engine" | None,
         l2_results: list["ArbitrationResult"],
+        include_transitions: bool = True,
     ) -> None:
+        """
+        Diff the in-memory runtime state into the database. With Redis,
+        transitions reach the database through the transition stream
+        (`PersistenceSink`) instead, so callers pass include_transitions=False.
+        """
         if not self.enabled:
             return
 
@@ -183,25 +189,98 @@ class PersistenceStore:
                     )
                 )
 
-            # Append only new transitions
-            existing_transitions = {
-                (r.user_id, r.timestamp, r.to_state) for r in session.query(AuditLogRecord).all()
-            }
-            for log in sm.transition_logs:
-                if (log.user_id, log.timestamp, log.to_state.value) in existing_transitions:
-                    continue
-                session.add(
-                    AuditLogRecord(
-                        user_id=log.user_id,
-                        from_state=log.from_state.value,
-                        to_state=log.to_state.value,
-                        trigger=log.trigger,
-                        triggered_by_rule=log.triggered_by_rule,
-                        timestamp=log.timestamp,
-                        evidence_summary=log.evidence_summary,
-                    )
-                )
+            if include_transitions:
+                self._add_new_transitions(session, sm.transition_logs)
 
             session.commit()
 
+    def persist_transitions(self, transitions: list["TransitionLog"]) -> None:
+        """Append audit transitions, skipping ones already stored, so re-deliveries are harmless."""
+        if not self.enabled or not transitions:
+            return
+        with self.session() as session:
+            self._add_new_transitions(session, transitions)
+            session.commit()
 
+    @staticmethod
+    def _add_new_transitions(session: Session, transitions: list["TransitionLog"]) -> None:
+        if not transitions:
+            return
+        existing_transitions = {
+            (r.user_id, r.timestamp, r.to_state)
+            for r in session.query(AuditLogRecord.user_id, AuditLogRecord.timestamp, AuditLogRecord.to_state)
+            .filter(AuditLogRecord.user_id.in_({log.user_id for log in transitions}))
+            .filter(AuditLogRecord.timestamp.in_({log.timestamp for log in transitions}))
+        }
+        for log in transitions:
+            key = (log.user_id, log.timestamp, log.to_state.value)
+            if key in existing_transitions:
+                continue
+            existing_transitions.add(key)
+            session.add(
+                AuditLogRecord(
+                    user_id=log.user_id,
+                    from_state=log.from_state.value,
+                    to_state=log.to_state.value,
+                    trigger=log.trigger,
+                    triggered_by_rule=log.triggered_by_rule,
+                    timestamp=log.timestamp,
+                    evidence_summary=log.evidence_summary,
+                )
+            )
+
+    def persist_verdict_batch(
+        self,
+        accounts: dict[str, "AccountState"],
+        analyses: list["ArbitrationResult"],
+        transitions: list["TransitionLog"],
+    ) -> None:
+        """
+        Persist one batch of L2 verdicts in a single transaction.
+
+        Unlike `persist_runtime_snapshot`, nothing is diffed against existing
+        rows: only the touched users are upserted and the batch's analyses and
+        transitions are bulk-inserted, so the cost is independent of history.
+        """
+        if not self.enabled:
+            return
+
+        now = datetime.now(UTC)
+        with self.session() as session:
+            for user_id, state in accounts.items():
+                session.merge(UserRecord(user_id=user_id, state=state.value, updated_at=now))
+            if analyses:
+                session.execute(
+                    insert(AnalysisResultRecord),
+                    [
+                        {
+                            "target_id": analysis.target_id,
+                            "is_fraud": analysis.is_fraud,
+                            "risk_score": analysis.risk_score,
+                            "fraud_type": analysis.fraud_type.value,
+                            "recommended_action": analysis.recommended_action.value,
+                            "reasoning": analysis.reasoning,
+                            "evidence_event_ids": ",".join(analysis.evidence_event_ids),
+                            "confidence": analysis.confidence,
+                            "created_at": now,
+                        }
+                        for analysis in analyses
+                    ],
+                )
+            if transitions:
+                session.execute(
+                    insert(AuditLogRecord),
+                    [
+                        {
+                            "user_id": log.user_id,
+                            "from_state": log.from_state.value,
+                            "to_state": log.to_state.value,
+                            "trigger": log.trigger,
+                            "triggered_by_rule": log.triggered_by_rule,
+                            "timestamp": log.timestamp,
+                            "evidence_summary": log.evidence_summary,
+                        }
+                        for log in transitions
+                    ],
+                )
+            session.commit()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+from typing import Optional
+
+from backend.models import AnalysisRequest, GameEventLog, WindowSummary
+
+DEFAULT_EVENT_TOKEN_BUDGET = 600
+DEFAULT_MAX_EVENTS = 10
+MAX_CHAT_CHARS = 120
+
+
+def _budget_from_env() -> int:
+    raw = os.environ.get("SUSANOH_L2_PROMPT_BUDGET", "").strip()
+    try:
+        return max(1, int(raw)) if raw else DEFAULT_EVENT_TOKEN_BUDGET
+    except ValueError:
+        return DEFAULT_EVENT_TOKEN_BUDGET
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate: ~4 ASCII characters per token, and one token
+    per non-ASCII character (Japanese chat is mostly one token per character).
+    Errs on the high side for both, so budgets hold against the real tokenizer.
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + math.ceil((len(text) - non_ascii) / 4)
+
+
+def format_event_line(event: GameEventLog) -> str:
+    chat = event.context_metadata.recent_chat_log or ""
+    if len(chat) > MAX_CHAT_CHARS:
+        chat = chat[:MAX_CHAT_CHARS] + "…"
+    return (
+        f"- {event.event_id}: {event.actor_id}→{event.target_id} "
+        f"{event.action_details.currency_amount}G "
+        f"chat=\"{chat}\""
+    )
+
+
+def summarize_window(
+    events: list[GameEventLog],
+    slang_pattern: Optional[re.Pattern[str]] = None,
+) -> WindowSummary:
+    amounts = [e.action_details.currency_amount for e in events]
+    timestamps = sorted(e.timestamp for e in events)
+    return WindowSummary(
+        event_count=len(events),
+        total_amount=sum(amounts),
+        max_amount=max(amounts, default=0),
+        distinct_senders=len({e.actor_id for e in events}),
+        distinct_receivers=len({e.target_id for e in events}),
+        slang_hits=sum(1 for e in events if _has_slang(e, slang_pattern)),
+        first_timestamp=timestamps[0] if timestamps else None,
+        last_timestamp=timestamps[-1] if timestamps else None,
+    )
+
+
+def _has_slang(event: GameEventLog, slang_pattern: Optional[re.Pattern[str]]) -> bool:
+    chat = event.context_metadata.recent_chat_log
+    return bool(slang_pattern and chat and slang_pattern.search(chat))
+
+
+def _by_informativeness(
+    user_id: str,
+    events: list[GameEventLog],
+    slang_pattern: Optional[re.Pattern[str]],
+) -> list[GameEventLog]:
+    """Slang hits first, then the largest event per counterparty, then everything else; larger amounts first."""
+    by_amount = sorted(events, key=lambda e: e.action_details.currency_amount, reverse=True)
+    slang = [e for e in by_amount if _has_slang(e, slang_pattern)]
+    per_counterparty: dict[str, GameEventLog] = {}
+    for event in by_amount:
+        counterparty = event.actor_id if event.target_id == user_id else event.target_id
+        per_counterparty.setdefault(counterparty, event)
+    ordered: dict[str, GameEventLog] = {}
+    for event in (*slang, *per_counterparty.values(), *by_amount):
+        ordered.setdefault(event.event_id, event)
+    return list(ordered.values())
+
+
+def compact_analysis_request(
+    request: AnalysisRequest,
+    *,
+    token_budget: int | None = None,
+    max_events: int = DEFAULT_MAX_EVENTS,
+    slang_pattern: Optional[re.Pattern[str]] = None,
+) -> AnalysisRequest:
+    """
+    Bound the related-events payload of an analysis request.
+
+    Requests whose window already fits `max_events` and `token_budget` (estimated
+    over the rendered prompt lines) are returned unchanged. Larger windows are
+    replaced by a `WindowSummary` over the whole window plus the most
+    informative events that fit the budget, kept in chronological order, so
+    job payloads and prompts stay bounded however large the window grows.
+    Already compacted requests are returned as is.
+    """
+    if request.window_summary is not None:
+        return request
+    budget = _budget_from_env() if token_budget is None else token_budget
+    events = request.related_events
+    if len(events) <= max_events and sum(estimate_tokens(format_event_line(e)) for e in events) <= budget:
+        return request
+
+    candidates = [e for e in events if e.event_id != request.trigger_event.event_id]
+    selected: list[GameEventLog] = []
+    used = 0
+    for event in _by_informativeness(request.user_profile.user_id, candidates, slang_pattern):
+        if len(selected) >= max_events:
+            break
+        cost = estimate_tokens(format_event_line(event))
+        if used + cost > budget:
+            continue
+        selected.append(event)
+        used += cost
+    selected.sort(key=lambda e: e.timestamp)
+
+    summary = summarize_window(events, slang_pattern)
+    summary.shown_events = len(selected)
+    return request.model_copy(update={"related_events": selected, "window_summary": summary})
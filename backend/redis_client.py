@@ -1,29 +1,284 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
-from typing import Optional
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional
 
 import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster
+from redis.asyncio.connection import AbstractConnection, BlockingConnectionPool
+from redis.exceptions import ConnectionError as RedisConnectionError
 from redis.exceptions import RedisError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+if TYPE_CHECKING:
+    from arq.connections import ArqRedis
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_POOL_TIMEOUT_SECONDS = 2.0
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_BREAKER_THRESHOLD = 2
+DEFAULT_BREAKER_COOLDOWN_SECONDS = 5.0
+SOCKET_TIMEOUT_SECONDS = 2
+SCAN_COUNT = 1000
+
+
+def _int_env(name: str, default: int) -> int:
+    raw = os.environ.get(name, "").strip()
+    try:
+        return max(1, int(raw)) if raw else default
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    raw = os.environ.get(name, "").strip()
+    try:
+        return max(0.0, float(raw)) if raw else default
+    except ValueError:
+        return default
+
+
+class CircuitOpenError(RedisConnectionError):
+    """Raised instead of connecting while the breaker is open.
+
+    It is a `ConnectionError`, so every existing `except RedisError` fallback
+    handles it, only without waiting for a socket timeout first.
+    """
+
+
+class CircuitBreaker:
+    """
+    Shared Redis health for one process.
+
+    After `threshold` consecutive connection or command failures the breaker
+    opens, and Redis is skipped until `cooldown` seconds have passed since
+    `_last_failure`. The breaker is then half-open: the first task to ask
+    probes Redis while every other caller still sees it open. Success closes
+    the breaker, failure re-opens it for another cool-down, and a probe that
+    never reports back is replaced after another `cooldown`. Engines consult
+    it (see `is_degraded`) to go straight to their in-memory paths instead of
+    building pipelines that cannot be sent.
+    """
+
+    def __init__(
+        self,
+        threshold: int | None = None,
+        cooldown: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.threshold = threshold or _int_env("SUSANOH_REDIS_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD)
+        self.cooldown = (
+            cooldown
+            if cooldown is not None
+            else _float_env("SUSANOH_REDIS_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN_SECONDS)
+        )
+        self._clock = clock
+        self._last_failure: Optional[float] = None
+        self._failures = 0
+        # (task, started at) of the half-open probe in flight.
+        self._probe: Optional[tuple[Optional[asyncio.Task], float]] = None
+
+    def _cooling_down(self, now: float) -> bool:
+        if self._failures < self.threshold or self._last_failure is None:
+            return False
+        return now - self._last_failure < self.cooldown
+
+    def _probing(self, now: float) -> bool:
+        return self._probe is not None and now - self._probe[1] < self.cooldown
+
+    def is_open(self) -> bool:
+        if self._failures < self.threshold or self._last_failure is None:
+            return False
+        now = self._clock()
+        if self._cooling_down(now):
+            return True
+        task = _current_task()
+        if self._probing(now):
+            return self._probe[0] is not task
+        self._probe = (task, now)
+        return False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._last_failure = self._clock()
+        self._probe = None
+        if self._failures == self.threshold:
+            logger.warning("Redis unreachable; skipping it for %.1fs", self.cooldown)
+
+    def record_success(self) -> None:
+        if self._failures >= self.threshold:
+            logger.info("Redis reachable again; circuit breaker closed")
+        self._failures = 0
+        self._probe = None
+
+    def state(self) -> dict[str, Any]:
+        now = self._clock()
+        return {
+            # Reported without claiming the half-open probe.
+            "open": self._cooling_down(now) or (self._failures >= self.threshold and self._probing(now)),
+            "consecutive_failures": self._failures,
+            "seconds_since_failure": (
+                round(self._clock() - self._last_failure, 3) if self._last_failure is not None else None
+            ),
+            "cooldown_seconds": self.cooldown,
+        }
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+def is_degraded(breaker: Optional[CircuitBreaker]) -> bool:
+    return breaker is not None and breaker.is_open()
+
+
+async def scan_keys(client: Any, pattern: str) -> list[str]:
+    """
+    Keys matching `pattern`, found with SCAN rather than KEYS, which blocks
+    the server for the whole keyspace walk. A RedisCluster client scans
+    every primary.
+    """
+    options: dict[str, Any] = {}
+    if isinstance(client, RedisCluster):
+        options["target_nodes"] = RedisCluster.PRIMARIES
+    # SCAN may return a key more than once.
+    return list(dict.fromkeys([key async for key in client.scan_iter(match=pattern, count=SCAN_COUNT, **options)]))
+
+
+class _BreakerConnection(AbstractConnection):
+    """
+    Reports every command's outcome on the connection to the pool's breaker.
+    Handshake replies do not count as a success, so a server that accepts
+    connections but times out every command still opens the breaker.
+    """
+
+    breaker: CircuitBreaker
+    _handshaking = False
+
+    async def on_connect(self) -> None:
+        self._handshaking = True
+        try:
+            await super().on_connect()
+        finally:
+            self._handshaking = False
+
+    async def send_packed_command(self, *args: Any, **kwargs: Any) -> None:
+        try:
+            await super().send_packed_command(*args, **kwargs)
+        except (RedisConnectionError, RedisTimeoutError, OSError):
+            self.breaker.record_failure()
+            raise
+
+    async def read_response(self, *args: Any, **kwargs: Any) -> Any:
+        try:
+            response = await super().read_response(*args, **kwargs)
+        except (RedisConnectionError, RedisTimeoutError, OSError):
+            self.breaker.record_failure()
+            raise
+        except RedisError:
+            if not self._handshaking:
+                self.breaker.record_success()  # an error reply still means Redis answered
+            raise
+        if not self._handshaking:
+            self.breaker.record_success()
+        return response
+
+
+class BreakerConnectionPool(BlockingConnectionPool):
+    """
+    Blocking pool that reports connection and command failures to a
+    `CircuitBreaker` and refuses to hand out connections while it is open.
+    Waiting for a free slot is not a failure; connecting, sending and
+    reading replies are.
+    """
+
+    def __init__(self, *, breaker: CircuitBreaker, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.breaker = breaker
+        # Subclass whichever connection class the URL picked (TCP, TLS, unix socket).
+        self.connection_class = type(
+            f"Breaker{self.connection_class.__name__}",
+            (_BreakerConnection, self.connection_class),
+            {"breaker": breaker},
+        )
+
+    async def get_connection(self, *args: Any, **kwargs: Any):
+        if self.breaker.is_open():
+            raise CircuitOpenError("Redis circuit breaker is open")
+        return await super().get_connection(*args, **kwargs)
+
+    async def ensure_connection(self, connection: AbstractConnection) -> None:
+        try:
+            await super().ensure_connection(connection)
+        except (RedisConnectionError, RedisTimeoutError, OSError):
+            self.breaker.record_failure()
+            raise
+
 
 class RedisClient:
-    def __init__(self, url: Optional[str] = None) -> None:
+    """
+    The process-wide Redis subsystem: one bounded connection pool for the
+    decoded client the engines share, one for the arq queue, and a
+    `CircuitBreaker` over both.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        *,
+        max_connections: int | None = None,
+        health_check_interval: int | None = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         self.url = url or os.environ.get("REDIS_URL")
         self.enabled = bool(self.url)
+        self.max_connections = max_connections or _int_env("SUSANOH_REDIS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+        self.health_check_interval = health_check_interval or _int_env(
+            "SUSANOH_REDIS_HEALTH_CHECK_INTERVAL", DEFAULT_HEALTH_CHECK_INTERVAL
+        )
+        self.breaker = breaker or CircuitBreaker()
         self._client: Optional[redis.Redis] = None
-        self._last_failure: Optional[float] = None
+        self._arq_pool: Optional[ArqRedis] = None
+
+    def _pool(self, **kwargs: Any) -> BreakerConnectionPool:
+        return BreakerConnectionPool.from_url(
+            self.url,
+            breaker=self.breaker,
+            max_connections=self.max_connections,
+            timeout=DEFAULT_POOL_TIMEOUT_SECONDS,
+            socket_timeout=SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=SOCKET_TIMEOUT_SECONDS,
+            socket_keepalive=True,
+            health_check_interval=self.health_check_interval,
+            **kwargs,
+        )
 
     def get_client(self) -> Optional[redis.Redis]:
         if not self.enabled:
             return None
         if self._client is None:
-            self._client = redis.from_url(self.url, decode_responses=True, socket_timeout=2, socket_connect_timeout=2)
+            self._client = redis.Redis.from_pool(self._pool(decode_responses=True))
         return self._client
 
+    def get_arq_pool(self) -> Optional[ArqRedis]:
+        """arq needs raw bytes, so the queue gets its own pool behind the same breaker."""
+        if not self.enabled:
+            return None
+        if self._arq_pool is None:
+            from arq.connections import ArqRedis
+
+            self._arq_pool = ArqRedis(self._pool())
+        return self._arq_pool
+
     async def ping(self) -> bool:
         client = self.get_client()
         if not client:
@@ -35,5 +290,9 @@ class RedisClient:
 
     async def close(self) -> None:
         if self._client:
-            await self._client.close()
+            await self._client.aclose()
             self._client = None
+        if self._arq_pool:
+            await self._arq_pool.aclose()
+            await self._arq_pool.connection_pool.disconnect()
+            self._arq_pool = None
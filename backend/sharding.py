@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+from collections.abc import Mapping
+from typing import Any, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VNODES = 64
+DEFAULT_FORWARD_TIMEOUT_SECONDS = 5.0
+# Set on forwarded requests so the receiving node never forwards them again;
+# only honoured with a valid FORWARD_SIGNATURE_HEADER from a node in the ring.
+FORWARDED_HEADER = "X-Susanoh-Forwarded-By"
+FORWARD_SIGNATURE_HEADER = "X-Susanoh-Forward-Signature"
+# Only these are passed on to the owner; hop-by-hop and host headers are not.
+FORWARDED_REQUEST_HEADERS = ("content-type", "x-api-key", "authorization")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with `vnodes` points per node.
+
+    Every node (and every game server holding the same node list) computes
+    the same owner for a key, and adding or removing one of n nodes only
+    moves about 1/n of the keys.
+    """
+
+    def __init__(self, nodes: list[str], vnodes: int = DEFAULT_VNODES) -> None:
+        if not nodes:
+            raise ValueError("a hash ring needs at least one node")
+        self.nodes = sorted(set(nodes))
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        i = bisect.bisect(self._hashes, _hash(key))
+        return self._owners[i % len(self._owners)]
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the node set or vnode count does, so clients can tell a stale map."""
+        return hashlib.blake2b(f"{self.vnodes}|{','.join(self.nodes)}".encode(), digest_size=6).hexdigest()
+
+
+class ShardRouter:
+    """
+    Routes per-user requests to the node that owns the user, so that node's
+    in-memory windows, caches and locks are authoritative for it.
+
+    Nodes are the base URLs in SUSANOH_SHARD_NODES and this process is
+    SUSANOH_SHARD_SELF. Run one process per core on its own port and list
+    each one. Game servers can route by themselves from `shard_map()`, and
+    anything that reaches the wrong node takes one forwarding hop. The hop is
+    signed with an HMAC-SHA256 over the sending node, method, path and body
+    keyed by SUSANOH_SHARD_SECRET, which every node shares; a forwarded
+    header without a valid signature from a ring node is ignored, so clients
+    cannot use it to skip the ownership check.
+    """
+
+    def __init__(
+        self,
+        nodes: Optional[list[str]] = None,
+        self_node: Optional[str] = None,
+        vnodes: int = DEFAULT_VNODES,
+        timeout: float = DEFAULT_FORWARD_TIMEOUT_SECONDS,
+        client: Optional[httpx.AsyncClient] = None,
+        secret: Optional[str] = None,
+    ) -> None:
+        nodes = [n.rstrip("/") for n in nodes or []]
+        self.self_node = self_node.rstrip("/") if self_node else None
+        self.ring = HashRing(nodes, vnodes) if nodes else None
+        if self.ring and self.self_node not in self.ring.nodes:
+            raise ValueError(f"SUSANOH_SHARD_SELF {self_node!r} is not one of the shard nodes")
+        self._secret = secret.encode() if secret else None
+        if self.enabled and self._secret is None:
+            raise ValueError("SUSANOH_SHARD_SECRET is required when sharding across several nodes")
+        self.timeout = timeout
+        self._client = client
+
+    @classmethod
+    def from_env(cls) -> ShardRouter:
+        nodes = [n.strip() for n in os.environ.get("SUSANOH_SHARD_NODES", "").split(",") if n.strip()]
+        raw_vnodes = os.environ.get("SUSANOH_SHARD_VNODES", "").strip()
+        try:
+            vnodes = max(1, int(raw_vnodes)) if raw_vnodes else DEFAULT_VNODES
+        except ValueError:
+            vnodes = DEFAULT_VNODES
+        return cls(
+            nodes,
+            os.environ.get("SUSANOH_SHARD_SELF", "").strip() or None,
+            vnodes,
+            secret=os.environ.get("SUSANOH_SHARD_SECRET", "").strip() or None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ring is not None and len(self.ring.nodes) > 1
+
+    def owner(self, key: str) -> Optional[str]:
+        return self.ring.owner(key) if self.ring else None
+
+    def is_local(self, key: str) -> bool:
+        return not self.enabled or self.owner(key) == self.self_node
+
+    def shard_map(self) -> dict[str, Any]:
+        if not self.ring:
+            return {"enabled": False, "self": self.self_node, "nodes": [], "vnodes": 0, "version": None}
+        return {
+            "enabled": self.enabled,
+            "self": self.self_node,
+            "nodes": self.ring.nodes,
+            "vnodes": self.ring.vnodes,
+            "hash": "blake2b-64",
+            "version": self.ring.version,
+        }
+
+    def sign(self, node: str, method: str, path: str, body: bytes) -> str:
+        """Signature of one hop from `node`; `path` includes the query string."""
+        message = b"\n".join([node.encode(), method.upper().encode(), path.encode(), body])
+        return hmac.new(self._secret or b"", message, hashlib.sha256).hexdigest()
+
+    def is_forwarded(self, method: str, path: str, body: bytes, headers: Mapping[str, str]) -> bool:
+        """True only for a hop signed by a node of this ring."""
+        node = headers.get(FORWARDED_HEADER)
+        signature = headers.get(FORWARD_SIGNATURE_HEADER)
+        if not self.enabled or node is None or signature is None or node not in self.ring.nodes:
+            return False
+        return hmac.compare_digest(signature, self.sign(node, method, path, body))
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def forward(
+        self,
+        owner: str,
+        method: str,
+        path: str,
+        body: bytes,
+        headers: Mapping[str, str],
+    ) -> httpx.Response:
+        """Replay one request on `owner`. Raises httpx.HTTPError if it is unreachable."""
+        forwarded = {name: headers[name] for name in FORWARDED_REQUEST_HEADERS if name in headers}
+        forwarded[FORWARDED_HEADER] = self.self_node or ""
+        forwarded[FORWARD_SIGNATURE_HEADER] = self.sign(forwarded[FORWARDED_HEADER], method, path, body)
+        return await self._get_client().request(method, f"{owner}{path}", content=body, headers=forwarded)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import hashlib
+import math
+from collections.abc import Iterable
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+def _hash64(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch with 2**precision one-byte registers.
+
+    The standard error is about 1.04 / sqrt(2**precision); `for_error` picks
+    the smallest precision meeting a requested relative error. Sketches of
+    the same precision merge by register-wise max, so per-bucket sketches can
+    be combined into any window.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = 12) -> None:
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @staticmethod
+    def precision_for_error(relative_error: float) -> int:
+        if relative_error <= 0:
+            raise ValueError("relative_error must be positive")
+        precision = math.ceil(2 * math.log2(1.04 / relative_error))
+        return max(MIN_PRECISION, min(MAX_PRECISION, precision))
+
+    @classmethod
+    def for_error(cls, relative_error: float) -> "HyperLogLog":
+        return cls(cls.precision_for_error(relative_error))
+
+    def add(self, item: str) -> None:
+        h = _hash64(item)
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    @classmethod
+    def union(cls, sketches: Iterable["HyperLogLog"], precision: int) -> "HyperLogLog":
+        merged = cls(precision)
+        for sketch in sketches:
+            merged.merge(sketch)
+        return merged
+
+    def count(self) -> int:
+        m = len(self.registers)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """
+    Point-frequency sketch: `depth` rows of `width` counters.
+
+    Estimates never undercount and overcount by at most e/width of the total
+    weight with probability 1 - exp(-depth). Sketches of equal shape merge by
+    element-wise sum.
+    """
+
+    __slots__ = ("width", "depth", "rows")
+
+    def __init__(self, width: int = 1024, depth: int = 4) -> None:
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def cells(self, item: str) -> list[int]:
+        """Column index of `item` in each row (shared with the Redis layout)."""
+        h = _hash64(item)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item: str, weight: int = 1) -> None:
+        for row, col in zip(self.rows, self.cells(item)):
+            row[col] += weight
+
+    def estimate(self, item: str) -> int:
+        return min(row[col] for row, col in zip(self.rows, self.cells(item)))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge sketches of different shape")
+        for row, other_row in zip(self.rows, other.rows):
+            for col, value in enumerate(other_row):
+                row[col] += value
+
+
+class SpaceSaving:
+    """
+    Top-k summary holding at most `capacity` counters.
+
+    An unseen item evicts the smallest counter and inherits its count as its
+    error, so `count` overestimates the true weight by at most `error`. Any
+    item with weight above total/capacity is guaranteed to be present.
+    """
+
+    __slots__ = ("capacity", "counts", "errors")
+
+    def __init__(self, capacity: int = 200) -> None:
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, item: str, weight: int = 1) -> None:
+        if item in self.counts:
+            self.counts[item] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+            return
+        victim = min(self.counts, key=self.counts.__getitem__)
+        floor = self.counts.pop(victim)
+        del self.errors[victim]
+        self.counts[item] = floor + weight
+        self.errors[item] = floor
+
+    def floor(self) -> int:
+        """Upper bound on the weight of any item not in the summary."""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def top(self, k: int) -> list[tuple[str, int, int]]:
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [(item, count, self.errors[item]) for item, count in ranked]
+
+    @classmethod
+    def union(cls, summaries: Iterable["SpaceSaving"], capacity: int) -> "SpaceSaving":
+        """Mergeable-summaries union: absent items are charged each summary's floor as error."""
+        merged = cls(capacity)
+        total_floor = 0
+        for summary in summaries:
+            floor = summary.floor()
+            total_floor += floor
+            # Credit back the floor pre-charged below for summaries holding the item.
+            for item, count in summary.counts.items():
+                merged.counts[item] = merged.counts.get(item, 0) + count - floor
+                merged.errors[item] = merged.errors.get(item, 0) + summary.errors[item] - floor
+        for item in merged.counts:
+            merged.counts[item] += total_floor
+            merged.errors[item] += total_floor
+        if len(merged.counts) > capacity:
+            keep = sorted(merged.counts, key=merged.counts.__getitem__, reverse=True)[:capacity]
+            merged.counts = {item: merged.counts[item] for item in keep}
+            merged.errors = {item: merged.errors[item] for item in keep}
+        return merged
@@ -1,19 +1,36 @@
 from __future__ import annotations
 
-import json
 import logging
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable
 from datetime import UTC, datetime
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Optional, TypeAlias
 
 from redis.exceptions import RedisError
 
+from backend.keys import KeySchema
 from backend.models import AccountState, TransitionLog
+from backend.redis_client import is_degraded, scan_keys
+from backend.transition_stream import stream_maxlen_from_env, transition_fields
 
 if TYPE_CHECKING:
     from redis.asyncio import Redis
 
+    from backend.redis_client import CircuitBreaker
+    from backend.wal import WriteAheadLog
+
 logger = logging.getLogger(__name__)
 
+BLOCKED_WITHDRAWALS_KEY = "susanoh:blocked_withdrawals"
+RECONCILE_SCAN_COUNT = 1000
+APPLIED_KEY_TTL_SECONDS = 86400
+APPLIED_KEYS_LOCAL_MAX = 10_000
+PENDING_LOGS_MAX = 10_000
+# In-memory transition history; Redis keeps the capped audit stream.
+RECENT_TRANSITIONS_MAX = 1000
+
+TransitionListener: TypeAlias = Callable[[TransitionLog], Awaitable[None]]
+
 ALLOWED_TRANSITIONS: dict[AccountState, set[AccountState]] = {
     AccountState.NORMAL: {AccountState.RESTRICTED_WITHDRAWAL},
     AccountState.RESTRICTED_WITHDRAWAL: {AccountState.UNDER_SURVEILLANCE, AccountState.NORMAL},
@@ -21,13 +38,175 @@ ALLOWED_TRANSITIONS: dict[AccountState, set[AccountState]] = {
     AccountState.BANNED: set(),
 }
 
+# When a replayed account conflicts with a change made elsewhere, the more restrictive state wins.
+STATE_SEVERITY = {state: rank for rank, state in enumerate(AccountState)}
+
+# Compare-and-set of one account state. KEYS[1] is the accounts hash (ARGV[1]
+# the user id) or, in the cluster layout, the user's state key (ARGV[1] empty).
+# Sets ARGV[3] only if the state is still ARGV[2]; returns 1 then, otherwise
+# the state found (nil if the account does not exist).
+STATE_CAS = """
+local current
+if ARGV[1] ~= '' then current = redis.call('HGET', KEYS[1], ARGV[1]) else current = redis.call('GET', KEYS[1]) end
+if current ~= ARGV[2] then return current end
+if ARGV[1] ~= '' then redis.call('HSET', KEYS[1], ARGV[1], ARGV[3]) else redis.call('SET', KEYS[1], ARGV[3]) end
+return 1
+"""
+# Attempts at a transition whose state another writer changed between the read and the CAS.
+CAS_ATTEMPTS = 3
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
 
 class StateMachine:
-    def __init__(self, redis_client: Optional[Redis] = None) -> None:
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        keys: Optional[KeySchema] = None,
+        stream_maxlen: Optional[int] = None,
+        wal: Optional[WriteAheadLog] = None,
+    ) -> None:
         self.redis = redis_client
+        self.breaker = breaker
+        self.wal = wal
+        self.keys = keys or KeySchema.from_env()
+        self.stream_maxlen = stream_maxlen or stream_maxlen_from_env()
         self._accounts: dict[str, AccountState] = {}
-        self._transition_logs: list[TransitionLog] = []
+        # Kept on every path, but only read when Redis is absent or degraded
+        # (get_transitions, and the in-memory mode's database snapshot), so an
+        # outage still serves the transitions made just before it.
+        self._recent_transitions: deque[TransitionLog] = deque(maxlen=RECENT_TRANSITIONS_MAX)
+        self._transition_count: int = 0
         self._blocked_withdrawals: int = 0
+        self._transition_listeners: list[TransitionListener] = []
+        self._applied_keys: OrderedDict[str, None] = OrderedDict()
+        # Writes that only reached memory while Redis was degraded, replayed by
+        # replay_degraded_writes: account -> its state before the first such write
+        # (None if it was created then), plus transition logs and withdrawal
+        # blocks, each with the LSN of its WAL record (0 without a WAL).
+        self._pending_accounts: OrderedDict[str, Optional[AccountState]] = OrderedDict()
+        self._pending_logs: deque[tuple[int, TransitionLog]] = deque(maxlen=PENDING_LOGS_MAX)
+        self._pending_blocked: deque[int] = deque()
+
+    @property
+    def degraded(self) -> bool:
+        """True while the shared breaker says Redis is down; reads and writes go to memory only."""
+        return is_degraded(self.breaker)
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending_accounts) + len(self._pending_logs) + len(self._pending_blocked)
+
+    def _journal(self, user_id: str, before: Optional[AccountState], logs: list[TransitionLog]) -> None:
+        if self.redis:
+            lsn = 0
+            if self.wal:
+                lsn = self.wal.append("state", {
+                    "user_id": user_id,
+                    "before": before.value if before else None,
+                    "logs": [transition_fields(log) for log in logs],
+                })
+            self._pending_accounts.setdefault(user_id, before)
+            self._pending_logs.extend((lsn, log) for log in logs)
+
+    def restore_from_wal(self, kind: str, data: dict, lsn: int = 0) -> bool:
+        """Re-apply one WAL record written by `_journal`; False if the record is not ours."""
+        if kind == "blocked":
+            self._blocked_withdrawals += 1
+            self._pending_blocked.append(lsn)
+            return True
+        if kind != "state":
+            return False
+        user_id = data["user_id"]
+        logs = [TransitionLog.model_validate(log) for log in data["logs"]]
+        before = AccountState(data["before"]) if data["before"] else None
+        self._accounts[user_id] = logs[-1].to_state if logs else self._accounts.get(user_id, AccountState.NORMAL)
+        self._record_local(logs)
+        self._pending_accounts.setdefault(user_id, before)
+        self._pending_logs.extend((lsn, log) for log in logs)
+        return True
+
+    # --- key layout helpers (see backend.keys) ---
+
+    def _pipeline(self, atomic: bool = True):
+        """MULTI/EXEC only where every key can share a slot, i.e. never in the cluster layout."""
+        return self.redis.pipeline(transaction=atomic and not self.keys.cluster)
+
+    async def _read_states(self, user_ids: list[str]) -> list[Optional[str]]:
+        if not self.keys.cluster:
+            return await self.redis.hmget(self.keys.accounts, user_ids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for uid in user_ids:
+                pipe.get(self.keys.state(uid))
+            return await pipe.execute()
+
+    async def _get_state(self, user_id: str) -> Optional[str]:
+        if self.keys.cluster:
+            return await self.redis.get(self.keys.state(user_id))
+        return await self.redis.hget(self.keys.accounts, user_id)
+
+    async def _create_state(self, user_id: str) -> bool:
+        if self.keys.cluster:
+            return bool(await self.redis.set(self.keys.state(user_id), AccountState.NORMAL.value, nx=True))
+        return bool(await self.redis.hsetnx(self.keys.accounts, user_id, AccountState.NORMAL.value))
+
+    def _stage_state(self, pipe, user_id: str, state: AccountState) -> None:
+        if self.keys.cluster:
+            pipe.set(self.keys.state(user_id), state.value)
+            pipe.sadd(self.keys.users(self.keys.aggregate_shard(user_id)), user_id)
+        else:
+            pipe.hset(self.keys.accounts, user_id, state.value)
+
+    def _stage_compare_and_set(self, pipe, user_id: str, expected: AccountState, state: AccountState) -> None:
+        if self.keys.cluster:
+            pipe.eval(STATE_CAS, 1, self.keys.state(user_id), "", expected.value, state.value)
+        else:
+            pipe.eval(STATE_CAS, 1, self.keys.accounts, user_id, expected.value, state.value)
+
+    def _stage_moves(self, pipe, log: TransitionLog) -> None:
+        """Move the account between the per-state counters and index sets."""
+        shard = self.keys.aggregate_shard(log.user_id)
+        pipe.hincrby(self.keys.state_counts(shard), log.from_state.value, -1)
+        pipe.hincrby(self.keys.state_counts(shard), log.to_state.value, 1)
+        pipe.srem(self.keys.state_index(log.from_state.value, shard), log.user_id)
+        pipe.sadd(self.keys.state_index(log.to_state.value, shard), log.user_id)
+
+    def _stage_logs(self, pipe, logs: list[TransitionLog]) -> None:
+        counts: dict[int, int] = {}
+        for log in logs:
+            shard = self.keys.aggregate_shard(log.user_id)
+            pipe.xadd(
+                self.keys.transitions(shard), transition_fields(log), maxlen=self.stream_maxlen, approximate=True
+            )
+            counts[shard] = counts.get(shard, 0) + 1
+        for shard, count in counts.items():
+            pipe.incrby(self.keys.transition_count(shard), count)
+
+    def _record_local(self, logs: list[TransitionLog]) -> None:
+        self._recent_transitions.extend(logs)
+        self._transition_count += len(logs)
+
+    async def _scan_states(self, shard: int):
+        """Yield {user_id: state} chunks for every account in one aggregate shard."""
+        cursor = 0
+        while True:
+            if self.keys.cluster:
+                cursor, uids = await self.redis.sscan(self.keys.users(shard), cursor, count=RECONCILE_SCAN_COUNT)
+                uids = list(uids)
+                chunk = {uid: val for uid, val in zip(uids, await self._read_states(uids)) if val} if uids else {}
+            else:
+                cursor, chunk = await self.redis.hscan(self.keys.accounts, cursor, count=RECONCILE_SCAN_COUNT)
+            # Tolerate clients without decode_responses: bytes would match no state
+            # and the rebuild would zero every counter.
+            yield {_text(uid): _text(val) for uid, val in chunk.items()}
+            if cursor == 0:
+                break
+
+    def add_transition_listener(self, listener: TransitionListener) -> None:
+        self._transition_listeners.append(listener)
 
     @property
     def accounts(self) -> dict[str, AccountState]:
@@ -36,7 +215,8 @@ class StateMachine:
 
     @property
     def transition_logs(self) -> list[TransitionLog]:
-        return self._transition_logs
+        """The most recent transitions made by this process, oldest first."""
+        return list(self._recent_transitions)
 
     @property
     def blocked_withdrawals(self) -> int:
@@ -48,34 +228,67 @@ class StateMachine:
 
     async def reset(self) -> None:
         self._accounts.clear()
-        self._transition_logs.clear()
+        self._recent_transitions.clear()
+        self._transition_count = 0
         self._blocked_withdrawals = 0
+        self._applied_keys.clear()
+        self._pending_accounts.clear()
+        self._pending_logs.clear()
+        self._pending_blocked.clear()
         if self.redis:
             try:
-                await self.redis.delete("susanoh:accounts", "susanoh:transitions", "susanoh:blocked_withdrawals")
+                keys = [self.keys.accounts, BLOCKED_WITHDRAWALS_KEY]
+                for shard in self.keys.aggregate_shards:
+                    keys += [
+                        self.keys.state_counts(shard),
+                        self.keys.transitions(shard),
+                        self.keys.transition_count(shard),
+                    ]
+                    keys += [self.keys.state_index(s.value, shard) for s in AccountState]
+                    if self.keys.cluster:
+                        keys.append(self.keys.users(shard))
+                keys += await scan_keys(self.redis, self.keys.applied("*"))
+                if self.keys.cluster:
+                    keys += await scan_keys(self.redis, self.keys.state("*"))
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for key in keys:
+                            pipe.delete(key)
+                        await pipe.execute()
+                else:
+                    await self.redis.delete(*keys)
             except RedisError as e:
                 logger.warning("Redis reset failed: %s", e)
 
     async def get_or_create(self, user_id: str) -> AccountState:
         # Always check in-memory first as a cache/fallback
         in_mem = self._accounts.get(user_id)
-        
-        if self.redis:
+
+        if self.redis and not self.degraded:
             try:
-                val = await self.redis.hget("susanoh:accounts", user_id)
-                if val:
-                    st = AccountState(val)
-                    self._accounts[user_id] = st
-                    return st
-                
-                await self.redis.hset("susanoh:accounts", user_id, AccountState.NORMAL.value)
-                self._accounts[user_id] = AccountState.NORMAL
-                return AccountState.NORMAL
+                val = await self._get_state(user_id)
+                if not val:
+                    # HSETNX / SET NX makes creation race-free, so the NORMAL
+                    # counter and index are updated exactly once per account.
+                    if await self._create_state(user_id):
+                        shard = self.keys.aggregate_shard(user_id)
+                        async with self._pipeline() as pipe:
+                            pipe.hincrby(self.keys.state_counts(shard), AccountState.NORMAL.value, 1)
+                            pipe.sadd(self.keys.state_index(AccountState.NORMAL.value, shard), user_id)
+                            if self.keys.cluster:
+                                pipe.sadd(self.keys.users(shard), user_id)
+                            await pipe.execute()
+                        val = AccountState.NORMAL.value
+                    else:
+                        val = await self._get_state(user_id)
+                st = AccountState(val)
+                self._accounts[user_id] = st
+                return st
             except RedisError as e:
                 logger.error("Redis get_or_create failed for %s: %s. Using in-memory.", user_id, e)
 
         if user_id not in self._accounts:
             self._accounts[user_id] = AccountState.NORMAL
+            self._journal(user_id, None, [])
         return self._accounts[user_id]
 
     async def transition(
@@ -87,45 +300,67 @@ class StateMachine:
         evidence_summary: str = "",
     ) -> bool:
         current = await self.get_or_create(user_id)
-        if new_state not in ALLOWED_TRANSITIONS.get(current, set()):
+        for _ in range(CAS_ATTEMPTS):
+            if new_state not in ALLOWED_TRANSITIONS.get(current, set()):
+                return False
+            log = TransitionLog(
+                user_id=user_id,
+                from_state=current,
+                to_state=new_state,
+                trigger=trigger,
+                triggered_by_rule=rule,
+                timestamp=datetime.now(UTC).isoformat() + "Z",
+                evidence_summary=evidence_summary,
+            )
+            if not self.redis or self.degraded:
+                self._journal(user_id, current, [log])
+                break
+            try:
+                lost = await self._commit_transitions({user_id: [log]})
+            except RedisError as e:
+                logger.error("Redis transition failed for %s: %s", user_id, e)
+                self._journal(user_id, current, [log])
+                break
+            if user_id not in lost:
+                break
+            # Another writer moved the account first; re-check against its state.
+            current = await self.get_or_create(user_id)
+        else:
+            logger.warning("Transition of %s to %s lost %d state races; giving up", user_id, new_state.value, CAS_ATTEMPTS)
             return False
 
-        log = TransitionLog(
-            user_id=user_id,
-            from_state=current,
-            to_state=new_state,
-            trigger=trigger,
-            triggered_by_rule=rule,
-            timestamp=datetime.now(UTC).isoformat() + "Z",
-            evidence_summary=evidence_summary,
-        )
-
-        # Update in-memory
         self._accounts[user_id] = new_state
-        self._transition_logs.append(log)
+        self._record_local([log])
 
-        if self.redis:
+        for listener in self._transition_listeners:
             try:
-                await self.redis.hset("susanoh:accounts", user_id, new_state.value)
-                await self.redis.rpush("susanoh:transitions", log.model_dump_json())
-            except RedisError as e:
-                logger.error("Redis transition failed for %s: %s", user_id, e)
-        
+                await listener(log)
+            except Exception as e:
+                logger.warning("Transition listener failed for %s: %s", user_id, e)
+
         return True
 
     async def can_withdraw(self, user_id: str) -> bool:
         return await self.get_or_create(user_id) == AccountState.NORMAL
 
     async def get_stats(self) -> dict:
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
-                all_accounts = await self.redis.hgetall("susanoh:accounts")
-                stats = {s.value: 0 for s in AccountState}
-                for state_val in all_accounts.values():
-                    stats[state_val] += 1
-                stats["total_accounts"] = len(all_accounts)
-                stats["total_transitions"] = await self.redis.llen("susanoh:transitions")
-                stats["blocked_withdrawals"] = int(await self.redis.get("susanoh:blocked_withdrawals") or 0)
+                shards = self.keys.aggregate_shards
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard in shards:
+                        pipe.hgetall(self.keys.state_counts(shard))
+                    for shard in shards:
+                        pipe.get(self.keys.transition_count(shard))
+                    pipe.get(BLOCKED_WITHDRAWALS_KEY)
+                    *results, blocked = await pipe.execute()
+                counts, transitions = results[:len(shards)], results[len(shards):]
+                stats = {
+                    s.value: sum(max(0, int(c.get(s.value, 0))) for c in counts) for s in AccountState
+                }
+                stats["total_accounts"] = sum(stats[s.value] for s in AccountState)
+                stats["total_transitions"] = sum(int(n or 0) for n in transitions)
+                stats["blocked_withdrawals"] = int(blocked or 0)
                 return stats
             except RedisError as e:
                 logger.warning("Redis get_stats failed: %s. Using in-memory.", e)
@@ -134,25 +369,144 @@ class StateMachine:
         for state in self._accounts.values():
             stats[state.value] += 1
         stats["total_accounts"] = len(self._accounts)
-        stats["total_transitions"] = len(self._transition_logs)
+        stats["total_transitions"] = self._transition_count
         stats["blocked_withdrawals"] = self._blocked_withdrawals
         return stats
 
+    async def reconcile_state_aggregates(self) -> dict[str, int]:
+        """Rebuild the per-state counters and index sets from the account states.
+
+        Both are maintained incrementally on every write; this full pass
+        exists to repair drift (e.g. writes lost while Redis was degraded).
+        Index sets are rebuilt under temporary keys and swapped in with RENAME
+        so readers never observe a half-built index. In the cluster layout
+        each aggregate shard is rebuilt on its own; the staging keys carry the
+        shard's hash tag so the RENAME stays within one slot.
+        """
+        totals = {s.value: 0 for s in AccountState}
+        if not self.redis:
+            for state in self._accounts.values():
+                totals[state.value] += 1
+            return totals
+
+        for shard in self.keys.aggregate_shards:
+            counts = {s.value: 0 for s in AccountState}
+            index = {s: self.keys.state_index(s.value, shard) for s in AccountState}
+            staging = {s: f"{key}:rebuild" for s, key in index.items()}
+            await self.redis.delete(*staging.values())
+            async for chunk in self._scan_states(shard):
+                members: dict[AccountState, list[str]] = {}
+                for uid, state_val in chunk.items():
+                    if state_val in counts:
+                        counts[state_val] += 1
+                        members.setdefault(AccountState(state_val), []).append(uid)
+                if members:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for state, uids in members.items():
+                            pipe.sadd(staging[state], *uids)
+                        await pipe.execute()
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self.keys.state_counts(shard))
+                pipe.hset(self.keys.state_counts(shard), mapping=counts)
+                for state in AccountState:
+                    if counts[state.value]:
+                        pipe.rename(staging[state], index[state])
+                    else:
+                        pipe.delete(index[state])
+                await pipe.execute()
+            for name, count in counts.items():
+                totals[name] += count
+        return totals
+
+    async def replay_degraded_writes(self) -> int:
+        """Write changes that only reached memory while Redis was degraded back to Redis.
+
+        An account is overwritten only if Redis still holds the state it had
+        before the first degraded write (or nothing). If another node changed
+        it in the meantime, the more restrictive of the two states wins on
+        both sides. Journaled transition logs and withdrawal blocks are
+        appended, then the state counters and indexes are rebuilt, since the
+        incremental updates for these writes never happened. Logs and blocks
+        at or below the WAL watermark reached Redis before a crash and are
+        skipped. Returns the number of accounts replayed; entries stay
+        journaled if Redis fails.
+        """
+        if not self.redis or self.degraded or not self.pending_writes:
+            return 0
+        user_ids = list(self._pending_accounts)
+        logs = list(self._pending_logs)
+        blocked = list(self._pending_blocked)
+        try:
+            applied = await self.wal.applied_lsn(self.redis, self.keys, "state") if self.wal else 0
+            stored = await self._read_states(user_ids) if user_ids else []
+            updates: dict[str, AccountState] = {}
+            for uid, val in zip(user_ids, stored):
+                local = self._accounts.get(uid, AccountState.NORMAL)
+                before = self._pending_accounts[uid]
+                if val is None or (before is not None and val == before.value):
+                    updates[uid] = local
+                elif val != local.value:
+                    remote = AccountState(val)
+                    winner = max(local, remote, key=STATE_SEVERITY.__getitem__)
+                    logger.warning("Replay conflict for %s: local %s, Redis %s; keeping %s", uid, local.value, val, winner.value)
+                    self._accounts[uid] = winner
+                    if winner != remote:
+                        updates[uid] = winner
+            async with self._pipeline() as pipe:
+                for uid, state in updates.items():
+                    self._stage_state(pipe, uid, state)
+                fresh_logs = [log for lsn, log in logs if not lsn or lsn > applied]
+                if fresh_logs:
+                    self._stage_logs(pipe, fresh_logs)
+                fresh_blocked = sum(1 for lsn in blocked if not lsn or lsn > applied)
+                if fresh_blocked:
+                    pipe.incrby(BLOCKED_WITHDRAWALS_KEY, fresh_blocked)
+                last = max([lsn for lsn, _ in logs] + blocked, default=0)
+                if self.wal and last > applied:
+                    self.wal.stage_applied(pipe, self.keys, "state", last)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Replaying degraded writes failed: %s", e)
+            return 0
+
+        for uid in user_ids:
+            self._pending_accounts.pop(uid, None)
+        for _ in range(min(len(logs), len(self._pending_logs))):
+            self._pending_logs.popleft()
+        for _ in range(min(len(blocked), len(self._pending_blocked))):
+            self._pending_blocked.popleft()
+        try:
+            await self.reconcile_state_aggregates()
+        except RedisError as e:
+            logger.warning("State aggregate rebuild after replay failed: %s", e)
+        logger.info("Replayed %d accounts and %d transitions written while degraded", len(user_ids), len(logs))
+        return len(user_ids)
+
     async def get_transitions(self, limit: int = 50) -> list[TransitionLog]:
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
-                raw_logs = await self.redis.lrange("susanoh:transitions", -limit, -1)
-                logs = [TransitionLog.model_validate_json(l) for l in raw_logs]
-                return list(reversed(logs))
+                shards = self.keys.aggregate_shards
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard in shards:
+                        pipe.xrevrange(self.keys.transitions(shard), count=limit)
+                    parts = await pipe.execute()
+                logs = [TransitionLog.model_validate(fields) for part in parts for _, fields in part]
+                if len(shards) > 1:
+                    # Each shard is newest first; merge them into the newest `limit` overall.
+                    logs = sorted(logs, key=lambda log: log.timestamp, reverse=True)[:limit]
+                return logs
             except RedisError as e:
                 logger.warning("Redis get_transitions failed: %s. Using in-memory.", e)
 
-        return list(reversed(self._transition_logs[-limit:]))
+        return list(reversed(self._recent_transitions))[:limit]
 
     async def get_all_users(self, state_filter: AccountState | None = None) -> list[dict]:
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
-                all_accounts = await self.redis.hgetall("susanoh:accounts")
+                all_accounts: dict[str, str] = {}
+                for shard in self.keys.aggregate_shards:
+                    async for chunk in self._scan_states(shard):
+                        all_accounts.update(chunk)
                 users = []
                 for uid, st_val in all_accounts.items():
                     if state_filter and st_val != state_filter.value:
@@ -169,13 +523,75 @@ class StateMachine:
             users.append({"user_id": uid, "state": st.value})
         return users
 
+    async def get_users_page(
+        self,
+        state_filter: AccountState | None = None,
+        cursor: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[dict], int]:
+        """Return one page of users and the cursor for the next page (0 when done).
+
+        With Redis, unfiltered pages come from HSCAN over the accounts hash and
+        filtered pages from SSCAN over the per-state index set, so each call
+        touches O(limit) entries regardless of population size. As with SCAN,
+        `limit` is a hint and a page may hold slightly more or fewer rows.
+        In the cluster layout the shards are scanned one after another and
+        the cursor packs (scan cursor, shard) as `inner * shards + shard`.
+        """
+        if self.redis and not self.degraded:
+            try:
+                if self.keys.cluster:
+                    return await self._cluster_users_page(state_filter, cursor, limit)
+                if state_filter:
+                    next_cursor, members = await self.redis.sscan(
+                        self.keys.state_index(state_filter.value), cursor, count=limit
+                    )
+                    users = [{"user_id": uid, "state": state_filter.value} for uid in members]
+                else:
+                    next_cursor, chunk = await self.redis.hscan(self.keys.accounts, cursor, count=limit)
+                    users = [{"user_id": uid, "state": st_val} for uid, st_val in chunk.items()]
+                return users, int(next_cursor)
+            except RedisError as e:
+                logger.warning("Redis get_users_page failed: %s. Using in-memory.", e)
+
+        rows = [
+            {"user_id": uid, "state": st.value}
+            for uid, st in self._accounts.items()
+            if not state_filter or st == state_filter
+        ]
+        page = rows[cursor:cursor + limit]
+        next_cursor = cursor + limit if cursor + limit < len(rows) else 0
+        return page, next_cursor
+
+    async def _cluster_users_page(
+        self, state_filter: AccountState | None, cursor: int, limit: int
+    ) -> tuple[list[dict], int]:
+        shards = self.keys.shards
+        inner, shard = divmod(cursor, shards)
+        if state_filter:
+            key = self.keys.state_index(state_filter.value, shard)
+        else:
+            key = self.keys.users(shard)
+        next_inner, members = await self.redis.sscan(key, inner, count=limit)
+        members = list(members)
+        if state_filter:
+            users = [{"user_id": uid, "state": state_filter.value} for uid in members]
+        else:
+            states = await self._read_states(members) if members else []
+            users = [{"user_id": uid, "state": val} for uid, val in zip(members, states) if val]
+        if int(next_inner):
+            return users, int(next_inner) * shards + shard
+        return users, shard + 1 if shard + 1 < shards else 0
+
     async def resolve_accounts(self, user_ids: list[str]) -> dict[str, AccountState]:
         """Resolves states for a list of users, fetching from Redis if available."""
         results = {}
-        if self.redis:
+        if not user_ids:
+            return results
+        if self.redis and not self.degraded:
             try:
                 # Batch fetch from Redis
-                vals = await self.redis.hmget("susanoh:accounts", user_ids)
+                vals = await self._read_states(user_ids)
                 for uid, val in zip(user_ids, vals):
                     if val:
                         st = AccountState(val)
@@ -193,47 +609,225 @@ class StateMachine:
 
     async def increment_blocked_withdrawals(self) -> None:
         self._blocked_withdrawals += 1
-        if self.redis:
+        if self.redis and not self.degraded:
             try:
-                await self.redis.incr("susanoh:blocked_withdrawals")
+                await self.redis.incr(BLOCKED_WITHDRAWALS_KEY)
+                return
             except RedisError:
                 pass
+        if self.redis:
+            self._pending_blocked.append(self.wal.append("blocked", {}) if self.wal else 0)
 
     async def apply_l2_verdict(self, target_id: str, target_state: AccountState, risk_score: int) -> None:
         current = await self.get_or_create(target_id)
-        if target_state == AccountState.BANNED:
-            if current == AccountState.RESTRICTED_WITHDRAWAL:
-                await self.transition(
-                    target_id,
-                    AccountState.UNDER_SURVEILLANCE,
-                    "L2_ANALYSIS",
-                    "GEMINI_VERDICT",
-                    f"L2 intermediate transition (risk_score: {risk_score})",
-                )
-            current = await self.get_or_create(target_id)
-            if current == AccountState.UNDER_SURVEILLANCE:
-                await self.transition(
-                    target_id,
-                    AccountState.BANNED,
-                    "L2_ANALYSIS",
-                    "GEMINI_VERDICT",
-                    f"RMT confirmed (risk_score: {risk_score})",
-                )
-        elif target_state == AccountState.UNDER_SURVEILLANCE:
-            if current == AccountState.RESTRICTED_WITHDRAWAL:
-                await self.transition(
-                    target_id,
-                    AccountState.UNDER_SURVEILLANCE,
-                    "L2_ANALYSIS",
-                    "GEMINI_VERDICT",
-                    f"Requires surveillance (risk_score: {risk_score})",
-                )
-        elif target_state == AccountState.NORMAL:
-            if current in (AccountState.RESTRICTED_WITHDRAWAL, AccountState.UNDER_SURVEILLANCE):
-                await self.transition(
-                    target_id,
-                    AccountState.NORMAL,
-                    "L2_ANALYSIS",
-                    "GEMINI_VERDICT",
-                    f"Low-risk auto recovery (risk_score: {risk_score})",
-                )
+        for new_state, summary in _verdict_steps(current, target_state, risk_score):
+            if not await self.transition(target_id, new_state, "L2_ANALYSIS", "GEMINI_VERDICT", summary):
+                break
+
+    async def applied_keys(self, idempotency_keys: list[str]) -> set[str]:
+        """The keys among `idempotency_keys` whose verdict was already claimed."""
+        if not idempotency_keys:
+            return set()
+        if self.redis:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in idempotency_keys:
+                    pipe.exists(self.keys.applied(key))
+                replies = await pipe.execute()
+            return {key for key, found in zip(idempotency_keys, replies) if found}
+        return {key for key in idempotency_keys if key in self._applied_keys}
+
+    async def apply_l2_verdicts(
+        self,
+        verdicts: list[tuple[str, AccountState, int]],
+        idempotency_keys: Optional[list[str]] = None,
+    ) -> list[TransitionLog]:
+        """
+        Apply several (target_id, recommended_state, risk_score) verdicts at once.
+
+        Current states are read with one HMGET and every resulting transition
+        is written in two pipelined round trips (the compare-and-set of each
+        account, then the counters and audit stream), instead of a
+        get/transition round trip per step. Verdicts for the same target apply
+        in order; those of an account changed concurrently are re-planned from
+        its new state. Returns the transitions made.
+
+        With `idempotency_keys` (one per verdict) each key is claimed with
+        SET NX first and verdicts whose key was already claimed are skipped,
+        so a retried job never transitions twice. In that mode Redis errors
+        release the claims and propagate for the caller to retry, instead of
+        degrading to memory.
+        """
+        strict = idempotency_keys is not None
+        claimed: list[str] = []
+        if idempotency_keys is not None:
+            verdicts, claimed = await self._claim_verdicts(verdicts, idempotency_keys)
+        if not verdicts:
+            return []
+        try:
+            return await self._apply_verdicts(verdicts, strict)
+        except RedisError:
+            await self._release_claims(claimed)
+            raise
+
+    async def _claim_verdicts(
+        self, verdicts: list[tuple[str, AccountState, int]], keys: list[str]
+    ) -> tuple[list[tuple[str, AccountState, int]], list[str]]:
+        if len(keys) != len(verdicts):
+            raise ValueError("one idempotency key per verdict is required")
+        if self.redis:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(self.keys.applied(key), "1", nx=True, ex=APPLIED_KEY_TTL_SECONDS)
+                won = [bool(ok) for ok in await pipe.execute()]
+        else:
+            won = []
+            for key in keys:
+                won.append(key not in self._applied_keys)
+                self._applied_keys[key] = None
+            while len(self._applied_keys) > APPLIED_KEYS_LOCAL_MAX:
+                self._applied_keys.popitem(last=False)
+        fresh = [verdict for verdict, ok in zip(verdicts, won) if ok]
+        return fresh, [key for key, ok in zip(keys, won) if ok]
+
+    async def _release_claims(self, keys: list[str]) -> None:
+        for key in keys:
+            self._applied_keys.pop(key, None)
+        if self.redis and keys:
+            try:
+                # One DEL per claim: claims of different users live in different slots.
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.delete(self.keys.applied(key))
+                    await pipe.execute()
+            except RedisError as e:
+                logger.error("Failed to release %d verdict claims: %s", len(keys), e)
+
+    async def _commit_transitions(self, logs_by_user: dict[str, list[TransitionLog]]) -> set[str]:
+        """
+        Write each user's chain of transitions to Redis; returns the users whose
+        state no longer matched the chain's first from_state, which are left as is.
+
+        The state itself moves with an atomic compare-and-set (STATE_CAS), so of
+        two writers racing on one account only one gets to decrement its old
+        state's counter. The counters, index sets and audit stream of the
+        winners follow in one pipeline. Should that fail, those logs are
+        journaled: replay appends them and rebuilds the counters.
+        """
+        users = list(logs_by_user)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for uid in users:
+                chain = logs_by_user[uid]
+                self._stage_compare_and_set(pipe, uid, chain[0].from_state, chain[-1].to_state)
+            replies = await pipe.execute()
+        won = [uid for uid, reply in zip(users, replies) if reply == 1]
+        if won:
+            logs = [log for uid in won for log in logs_by_user[uid]]
+            try:
+                async with self._pipeline() as pipe:
+                    for log in logs:
+                        self._stage_moves(pipe, log)
+                    self._stage_logs(pipe, logs)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.error("Counter update after %d state changes failed: %s", len(won), e)
+                for uid in won:
+                    self._journal(uid, logs_by_user[uid][0].from_state, logs_by_user[uid])
+        return set(users) - set(won)
+
+    async def _plan_verdicts(
+        self, verdicts: list[tuple[str, AccountState, int]], strict: bool
+    ) -> dict[str, list[TransitionLog]]:
+        """Per user, the transitions that move its current state through its verdicts in order."""
+        user_ids = list(dict.fromkeys(v[0] for v in verdicts))
+        if strict and self.redis:
+            values = await self._read_states(user_ids)
+            states = {
+                uid: AccountState(val) if val else self._accounts.get(uid, AccountState.NORMAL)
+                for uid, val in zip(user_ids, values)
+            }
+        else:
+            states = await self.resolve_accounts(user_ids)
+        chains: dict[str, list[TransitionLog]] = {}
+        for target_id, target_state, risk_score in verdicts:
+            for new_state, summary in _verdict_steps(states[target_id], target_state, risk_score):
+                chains.setdefault(target_id, []).append(TransitionLog(
+                    user_id=target_id,
+                    from_state=states[target_id],
+                    to_state=new_state,
+                    trigger="L2_ANALYSIS",
+                    triggered_by_rule="GEMINI_VERDICT",
+                    timestamp=datetime.now(UTC).isoformat() + "Z",
+                    evidence_summary=summary,
+                ))
+                states[target_id] = new_state
+        return chains
+
+    async def _apply_verdicts(
+        self, verdicts: list[tuple[str, AccountState, int]], strict: bool
+    ) -> list[TransitionLog]:
+        logs: list[TransitionLog] = []
+        remaining = verdicts
+        for _ in range(CAS_ATTEMPTS):
+            chains = await self._plan_verdicts(remaining, strict)
+            if not chains:
+                break
+            if not (self.redis and (strict or not self.degraded)):
+                for uid, chain in chains.items():
+                    self._journal(uid, chain[0].from_state, chain)
+                logs += [log for chain in chains.values() for log in chain]
+                break
+            try:
+                lost = await self._commit_transitions(chains)
+            except RedisError as e:
+                if strict:
+                    raise
+                logger.error("Redis batched transition failed for %d verdicts: %s", len(verdicts), e)
+                for uid, chain in chains.items():
+                    self._journal(uid, chain[0].from_state, chain)
+                logs += [log for chain in chains.values() for log in chain]
+                break
+            logs += [log for uid, chain in chains.items() if uid not in lost for log in chain]
+            # Verdicts of accounts another writer changed meanwhile are re-planned from their new state.
+            remaining = [v for v in remaining if v[0] in lost]
+            if not remaining:
+                break
+            for uid in {v[0] for v in remaining}:
+                await self.get_or_create(uid)
+        else:
+            logger.warning("Dropping %d verdicts that lost %d state races", len(remaining), CAS_ATTEMPTS)
+        if not logs:
+            return []
+
+        for log in logs:
+            self._accounts[log.user_id] = log.to_state
+        self._record_local(logs)
+
+        for log in logs:
+            for listener in self._transition_listeners:
+                try:
+                    await listener(log)
+                except Exception as e:
+                    logger.warning("Transition listener failed for %s: %s", log.user_id, e)
+        return logs
+
+
+def _verdict_steps(
+    current: AccountState, target_state: AccountState, risk_score: int
+) -> list[tuple[AccountState, str]]:
+    """Transitions (new_state, evidence_summary) that move `current` toward an L2 verdict."""
+    if target_state == AccountState.BANNED:
+        steps = []
+        if current == AccountState.RESTRICTED_WITHDRAWAL:
+            steps.append((AccountState.UNDER_SURVEILLANCE, f"L2 intermediate transition (risk_score: {risk_score})"))
+            current = AccountState.UNDER_SURVEILLANCE
+        if current == AccountState.UNDER_SURVEILLANCE:
+            steps.append((AccountState.BANNED, f"RMT confirmed (risk_score: {risk_score})"))
+        return steps
+    if target_state == AccountState.UNDER_SURVEILLANCE and current == AccountState.RESTRICTED_WITHDRAWAL:
+        return [(AccountState.UNDER_SURVEILLANCE, f"Requires surveillance (risk_score: {risk_score})")]
+    if target_state == AccountState.NORMAL and current in (
+        AccountState.RESTRICTED_WITHDRAWAL,
+        AccountState.UNDER_SURVEILLANCE,
+    ):
+        return [(AccountState.NORMAL, f"Low-risk auto recovery (risk_score: {risk_score})")]
+    return []
@@ -1145,7 +1145,33 @@ def _activated_local_fault_injection(
     from redis.exceptions import TimeoutError as RedisTimeoutError
 
     if fault_injection.type is FaultInjectionType.REDIS_TIMEOUT:
+        class _TimeoutRedisPipeline:
+            def __getattr__(self, name: str):
+                def _queue(*args, **kwargs):
+                    del args, kwargs
+                    return self
+
+                return _queue
+
+            def __len__(self) -> int:
+                return 0
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info) -> None:
+                return None
+
+            async def execute(self, *args, **kwargs):
+                del args, kwargs
+                observation.record("pipeline.execute")
+                raise RedisTimeoutError("Connection timed out")
+
         class _TimeoutRedisClient:
+            def pipeline(self, *args, **kwargs) -> _TimeoutRedisPipeline:
+                del args, kwargs
+                return _TimeoutRedisPipeline()
+
             def __getattr__(self, name: str):
                 async def _raise(*args, **kwargs):
                     del args, kwargs
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Optional, Protocol
+
+import httpx
+from pydantic import ValidationError
+from redis.exceptions import RedisError, ResponseError
+
+from backend.autoscaling import worker_id
+from backend.keys import KeySchema
+from backend.models import TransitionLog
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+    from backend.persistence import PersistenceStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM_MAXLEN = 100_000
+CONSUMER_BATCH = 100
+CONSUMER_POLL_SECONDS = 0.5
+# Entries a consumer took but never acknowledged (it crashed, or its sink failed)
+# are re-delivered once they have been pending this long.
+CLAIM_IDLE_MS = 30_000
+WEBHOOK_TIMEOUT_SECONDS = 5.0
+
+
+def stream_maxlen_from_env() -> int:
+    raw = os.environ.get("SUSANOH_TRANSITION_STREAM_MAXLEN", "").strip()
+    try:
+        return max(1, int(raw)) if raw else DEFAULT_STREAM_MAXLEN
+    except ValueError:
+        return DEFAULT_STREAM_MAXLEN
+
+
+def transition_fields(log: TransitionLog) -> dict[str, str]:
+    return log.model_dump(mode="json")
+
+
+class TransitionSink(Protocol):
+    """A destination for audit transitions; `name` is its consumer group."""
+
+    name: str
+
+    async def handle(self, entries: list[tuple[str, TransitionLog]]) -> None:
+        """Deliver (stream id, log) pairs. Raising leaves them pending for re-delivery."""
+
+
+class PersistenceSink:
+    """Writes transitions to the audit_logs table; rows already present are skipped."""
+
+    name = "persistence"
+
+    def __init__(self, store: PersistenceStore) -> None:
+        self.store = store
+
+    async def handle(self, entries: list[tuple[str, TransitionLog]]) -> None:
+        self.store.persist_transitions([log for _, log in entries])
+
+
+class WebhookSink:
+    """
+    POSTs `{"transitions": [...]}` to a URL. Each item carries its stream
+    `id`, which receivers use to drop re-deliveries.
+    """
+
+    name = "webhook"
+
+    def __init__(self, url: str, client: Optional[httpx.AsyncClient] = None) -> None:
+        self.url = url
+        self._client = client or httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS)
+
+    @classmethod
+    def from_env(cls) -> Optional[WebhookSink]:
+        url = os.environ.get("SUSANOH_TRANSITION_WEBHOOK_URL", "").strip()
+        return cls(url) if url else None
+
+    async def handle(self, entries: list[tuple[str, TransitionLog]]) -> None:
+        body = {"transitions": [{"id": entry_id, **transition_fields(log)} for entry_id, log in entries]}
+        response = await self._client.post(self.url, json=body)
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class TransitionStreamConsumer:
+    """
+    Feeds the transition streams (one per aggregate shard, see
+    `KeySchema.transitions`) to one sink through the consumer group named
+    after it. Every sink has its own group, so each acknowledges
+    independently and a slow or failing sink never holds back another.
+
+    Delivery is at least once: a batch is acknowledged only after the sink
+    accepted it, and entries left pending by a failure or a dead consumer
+    are claimed again after `claim_idle_ms`. Sinks make that exactly-once
+    by skipping what they already have. Streams are capped with MAXLEN ~,
+    so a sink that falls further behind than the cap loses the oldest
+    entries instead of letting Redis grow without bound.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        sink: TransitionSink,
+        keys: Optional[KeySchema] = None,
+        consumer: Optional[str] = None,
+        batch: int = CONSUMER_BATCH,
+        claim_idle_ms: int = CLAIM_IDLE_MS,
+        poll_seconds: float = CONSUMER_POLL_SECONDS,
+    ) -> None:
+        self.redis = redis_client
+        self.sink = sink
+        self.keys = keys or KeySchema.from_env()
+        self.consumer = consumer or worker_id()
+        self.batch = batch
+        self.claim_idle_ms = claim_idle_ms
+        self.poll_seconds = poll_seconds
+        self._groups_ready = False
+
+    @property
+    def group(self) -> str:
+        return self.sink.name
+
+    async def ensure_groups(self) -> None:
+        if self._groups_ready:
+            return
+        for shard in self.keys.aggregate_shards:
+            try:
+                await self.redis.xgroup_create(self.keys.transitions(shard), self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._groups_ready = True
+
+    async def poll_once(self) -> int:
+        """Deliver one batch per shard stream; returns the number of transitions handled."""
+        await self.ensure_groups()
+        handled = 0
+        for shard in self.keys.aggregate_shards:
+            stream = self.keys.transitions(shard)
+            _, entries, *_ = await self.redis.xautoclaim(
+                stream, self.group, self.consumer, min_idle_time=self.claim_idle_ms, count=self.batch
+            )
+            reply = await self.redis.xreadgroup(self.group, self.consumer, {stream: ">"}, count=self.batch)
+            if reply:
+                entries += reply[0][1]
+            if not entries:
+                continue
+            parsed: list[tuple[str, TransitionLog]] = []
+            for entry_id, fields in entries:
+                try:
+                    parsed.append((entry_id, TransitionLog.model_validate(fields or {})))
+                except ValidationError:
+                    logger.error("Dropping malformed transition entry %s from %s", entry_id, stream)
+            if parsed:
+                await self.sink.handle(parsed)
+            await self.redis.xack(stream, self.group, *(entry_id for entry_id, _ in entries))
+            handled += len(parsed)
+        return handled
+
+    async def pending(self) -> int:
+        total = 0
+        for shard in self.keys.aggregate_shards:
+            try:
+                total += (await self.redis.xpending(self.keys.transitions(shard), self.group))["pending"]
+            except ResponseError:
+                pass  # no group yet
+        return total
+
+    async def status(self) -> dict[str, Any]:
+        try:
+            pending: Optional[int] = await self.pending()
+        except RedisError:
+            pending = None
+        return {"group": self.group, "consumer": self.consumer, "pending": pending}
+
+    async def run(self) -> None:
+        while True:
+            handled = 0
+            try:
+                handled = await self.poll_once()
+            except RedisError as e:
+                logger.warning("Transition stream read for %s failed: %s", self.group, e)
+            except Exception as e:
+                logger.warning("Transition sink %s failed; entries stay pending: %s", self.group, e)
+            if handled < self.batch:
+                await asyncio.sleep(self.poll_seconds)
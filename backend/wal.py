@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from backend.keys import KeySchema
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_COMMIT_MS = 50
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+ID_FILE = "wal.id"
+# Replay watermarks only matter until the next checkpoint; orphaned ones expire.
+WATERMARK_TTL_SECONDS = 7 * 24 * 3600
+
+
+def _int_env(name: str, default: int) -> int:
+    raw = os.environ.get(name, "").strip()
+    try:
+        return max(1, int(raw)) if raw else default
+    except ValueError:
+        return default
+
+
+def encode_record(kind: str, data: dict[str, Any], lsn: int = 0) -> bytes:
+    """`<crc32 hex> <json>\\n`; the checksum lets replay tell a torn tail from a record."""
+    body = json.dumps({"lsn": lsn, "kind": kind, "data": data}, separators=(",", ":"), ensure_ascii=False).encode()
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+
+def decode_record(line: bytes) -> Optional[tuple[int, str, dict[str, Any]]]:
+    """(lsn, kind, data); records written before LSNs existed have LSN 0."""
+    crc, _, body = line.rstrip(b"\n").partition(b" ")
+    try:
+        if int(crc, 16) != zlib.crc32(body):
+            return None
+        record = json.loads(body)
+        return int(record.get("lsn", 0)), record["kind"], record["data"]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+class WriteAheadLog:
+    """
+    Local append-only log of the writes StateMachine and L1Engine journal
+    while Redis is degraded, so a crash before Redis comes back does not
+    lose them.
+
+    `append` only buffers the encoded record and never touches the disk.
+    A flusher task writes whatever accumulated and fsyncs once per
+    `commit_ms` (group commit), in a worker thread, so the event loop never
+    waits on the disk; a crash loses at most one commit interval. Segments
+    rotate once they exceed `segment_bytes`. `checkpoint` deletes them after
+    the engines replayed their journals to Redis. `records` reads every
+    segment back in order, stopping at the first torn or corrupt record of
+    a segment.
+
+    Every record gets a log sequence number, increasing within one log
+    (`wal_id`, which changes whenever a process starts on an empty
+    directory). Engines keep the LSN with each journaled write and record
+    the highest one they replayed in Redis, in the same MULTI as the
+    writes (`stage_applied`); records restored again after a crash between
+    replay and checkpoint are then skipped instead of applied twice.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        commit_ms: int = DEFAULT_COMMIT_MS,
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.commit_ms = commit_ms
+        self._buffer: list[bytes] = []
+        # Serializes file access between the flusher thread and checkpoint.
+        self._lock = threading.Lock()
+        self._file: Optional[IO[bytes]] = None
+        self._file_bytes = 0
+        segments = self.segments()
+        self._next_seq = max((self._seq(p) for p in segments), default=0) + 1
+        self.wal_id = self._load_id() if segments else None
+        if self.wal_id is None:
+            self.wal_id = uuid.uuid4().hex
+            (self.directory / ID_FILE).write_text(self.wal_id)
+        self._next_lsn = self._last_lsn(segments) + 1
+        # Bumped by each checkpoint; a segment written before the bump may be
+        # deleted by it, so a flush after the bump starts a new segment.
+        self._generation = 0
+        self._file_generation = 0
+        self._generation_first_seq: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.appended = 0
+        self.commits = 0
+
+    @classmethod
+    def from_env(cls) -> Optional[WriteAheadLog]:
+        """Enabled by SUSANOH_WAL_DIR."""
+        directory = os.environ.get("SUSANOH_WAL_DIR", "").strip()
+        if not directory:
+            return None
+        return cls(
+            directory,
+            segment_bytes=_int_env("SUSANOH_WAL_SEGMENT_BYTES", DEFAULT_SEGMENT_BYTES),
+            commit_ms=_int_env("SUSANOH_WAL_COMMIT_MS", DEFAULT_COMMIT_MS),
+        )
+
+    @staticmethod
+    def _seq(path: Path) -> int:
+        return int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _load_id(self) -> Optional[str]:
+        try:
+            return (self.directory / ID_FILE).read_text().strip() or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def _last_lsn(segments: list[Path]) -> int:
+        for path in reversed(segments):
+            last = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    record = decode_record(line)
+                    if record is None:
+                        break
+                    last = record[0]
+            if last:
+                return last
+        return 0
+
+    def segments(self) -> list[Path]:
+        return sorted(self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"), key=self._seq)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def append(self, kind: str, data: dict[str, Any]) -> int:
+        """Buffer one record; returns its LSN."""
+        lsn = self._next_lsn
+        self._next_lsn += 1
+        self._buffer.append(encode_record(kind, data, lsn))
+        self.appended += 1
+        return lsn
+
+    def applied_key(self, keys: KeySchema, journal: str) -> str:
+        return keys.wal_applied(self.wal_id, journal)
+
+    async def applied_lsn(self, redis: Any, keys: KeySchema, journal: str) -> int:
+        """Highest LSN of `journal` already replayed to Redis."""
+        return int(await redis.get(self.applied_key(keys, journal)) or 0)
+
+    def stage_applied(self, pipe: Any, keys: KeySchema, journal: str, lsn: int) -> None:
+        """Queue the watermark update; stage it in the replay's own MULTI."""
+        pipe.set(self.applied_key(keys, journal), lsn, ex=WATERMARK_TTL_SECONDS)
+
+    def flush(self) -> int:
+        """Write and fsync the buffered records; returns how many were committed."""
+        with self._lock:
+            # Take the records before reading the generation: a checkpoint
+            # in between then leaves them in a segment it does not delete.
+            records, self._buffer = self._buffer, []
+            if not records:
+                return 0
+            generation = self._generation
+            if self._file is not None and self._file_generation != generation:
+                self._close_segment()
+            if self._file is None:
+                self._open_segment(generation)
+            data = b"".join(records)
+            try:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                # Keep the records for the next commit, in a fresh segment.
+                self._buffer[:0] = records
+                self._close_segment()
+                raise
+            self._file_bytes += len(data)
+            if self._file_bytes >= self.segment_bytes:
+                self._close_segment()
+            self.commits += 1
+            return len(records)
+
+    async def commit(self) -> int:
+        return await asyncio.to_thread(self.flush)
+
+    def _open_segment(self, generation: int) -> None:
+        seq = self._next_seq
+        path = self.directory / f"{SEGMENT_PREFIX}{seq:016d}{SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._file = open(path, "ab")
+        self._file_bytes = 0
+        if generation != self._file_generation or self._generation_first_seq is None:
+            self._generation_first_seq = seq
+        self._file_generation = generation
+
+    def _close_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def records(self) -> Iterator[tuple[int, str, dict[str, Any]]]:
+        """Every committed (lsn, kind, data) record, oldest first."""
+        for path in self.segments():
+            with open(path, "rb") as f:
+                for number, line in enumerate(f, 1):
+                    record = decode_record(line)
+                    if record is None:
+                        logger.warning("Stopping WAL replay of %s at torn record %d", path.name, number)
+                        break
+                    yield record
+
+    async def checkpoint(self) -> int:
+        """
+        Forget everything logged so far; returns the number of segments removed.
+
+        Callers check that the engine journals are empty and await this
+        without yielding in between. What was logged up to that point is cut
+        off before the first await; the files are deleted in a worker thread,
+        since the lock may be held by the flusher's fsync, and records
+        appended meanwhile go to a segment that is kept.
+        """
+        self._buffer.clear()
+        self._generation += 1
+        return await asyncio.to_thread(self._remove_segments, self._generation)
+
+    def _remove_segments(self, generation: int) -> int:
+        with self._lock:
+            if self._file is not None and self._file_generation < generation:
+                self._close_segment()
+            keep_from = self._generation_first_seq if self._file_generation >= generation else None
+            removed = [p for p in self.segments() if keep_from is None or self._seq(p) < keep_from]
+            for path in removed:
+                path.unlink(missing_ok=True)
+            return len(removed)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.commit_ms / 1000)
+            if not self._buffer:
+                continue
+            try:
+                await self.commit()
+            except OSError as e:
+                logger.error("WAL commit to %s failed: %s", self.directory, e)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.commit()
+        finally:
+            self._close_segment()
+
+    def status(self) -> dict[str, Any]:
+        segments = self.segments()
+        return {
+            "directory": str(self.directory),
+            "segments": len(segments),
+            "bytes": sum(p.stat().st_size for p in segments if p.exists()),
+            "buffered": self.buffered,
+            "lsn": self._next_lsn - 1,
+            "appended": self.appended,
+            "commits": self.commits,
+        }
@@ -0,0 +1,612 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Optional
+
+from redis.exceptions import RedisError
+
+from backend.keys import LEGACY_KEYS, KeySchema
+from backend.models import GameEventLog
+from backend.redis_client import is_degraded, scan_keys
+from backend.sketches import HyperLogLog
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+    from backend.redis_client import CircuitBreaker
+    from backend.wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 300  # 5 min
+PENDING_EVENTS_MAX = 10_000
+# Users whose rollup rings are kept in memory for degraded mode, least recently active evicted first.
+LOCAL_ROLLUP_USERS_MAX = 10_000
+
+
+class WindowSide(str, Enum):
+    TARGET = "target"  # events received by the user
+    ACTOR = "actor"  # events sent by the user
+
+
+def window_key(side: WindowSide, user_id: str, keys: KeySchema = LEGACY_KEYS) -> str:
+    return keys.window(side.value, user_id)
+
+
+@dataclass(frozen=True)
+class BucketTier:
+    name: str
+    bucket_seconds: int
+    retention_seconds: int
+
+    @property
+    def slots(self) -> int:
+        return self.retention_seconds // self.bucket_seconds
+
+
+# Each horizon is served by the finest tier that retains it, so a rollup reads
+# at most 30 / 60 / 96 buckets regardless of how many events the user had.
+BUCKET_TIERS = (
+    BucketTier("10s", 10, 300),
+    BucketTier("1m", 60, 3600),
+    BucketTier("15m", 900, 86400),
+)
+HORIZONS = {"1m": 60, "5m": 300, "1h": 3600, "24h": 86400}
+
+
+# Distinct counterparties: "exact" builds a set over the raw window; "approx"
+# merges per-bucket HyperLogLogs so the cost no longer grows with fan-in.
+DISTINCT_BUCKET_SECONDS = 60
+DEFAULT_DISTINCT_ERROR = 0.05
+DISTINCT_MODES = ("exact", "approx")
+# Extra rollup horizon the approx mode reads the sliding window's totals from.
+WINDOW_HORIZON = "window"
+
+
+def _distinct_mode_from_env() -> str:
+    mode = os.environ.get("SUSANOH_DISTINCT_MODE", "exact").strip().lower()
+    return mode if mode in DISTINCT_MODES else "exact"
+
+
+def _distinct_error_from_env() -> float:
+    raw = os.environ.get("SUSANOH_DISTINCT_ERROR", "").strip()
+    try:
+        value = float(raw) if raw else DEFAULT_DISTINCT_ERROR
+    except ValueError:
+        return DEFAULT_DISTINCT_ERROR
+    return value if value > 0 else DEFAULT_DISTINCT_ERROR
+
+
+def _tier_for(horizon_seconds: int) -> BucketTier:
+    return next(t for t in BUCKET_TIERS if t.retention_seconds >= horizon_seconds)
+
+
+def rollup_key(side: WindowSide, tier: BucketTier, user_id: str, keys: KeySchema = LEGACY_KEYS) -> str:
+    return keys.rollup(side.value, tier.name, user_id)
+
+
+def event_timestamp(event: GameEventLog) -> float:
+    try:
+        return datetime.fromisoformat(event.timestamp.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return datetime.now(UTC).timestamp()
+
+
+@dataclass
+class UserWindow:
+    events: deque = field(default_factory=deque)
+
+    def add_event(self, event: GameEventLog) -> None:
+        self.events.append(event)
+        self._purge()
+
+    def _purge(self, cutoff: Optional[datetime] = None) -> None:
+        if cutoff is None:
+            cutoff = datetime.now(UTC)
+        window_limit = cutoff - timedelta(seconds=WINDOW_SECONDS)
+        while self.events:
+            try:
+                ts = datetime.fromisoformat(self.events[0].timestamp.replace("Z", "+00:00"))
+            except Exception:
+                ts = cutoff
+            if ts < window_limit:
+                self.events.popleft()
+            else:
+                break
+
+    def total_amount(self) -> int:
+        return sum(e.action_details.currency_amount for e in self.events)
+
+    def transaction_count(self) -> int:
+        return len(self.events)
+
+    def unique_senders(self) -> int:
+        return len({e.actor_id for e in self.events})
+
+    def unique_receivers(self) -> int:
+        return len({e.target_id for e in self.events})
+
+
+@dataclass
+class HorizonTotals:
+    amount: int = 0
+    count: int = 0
+
+
+class BucketRing:
+    """Fixed-size ring of (amount, count) buckets; a slot is reused once its bucket ages out."""
+
+    __slots__ = ("ids", "amounts", "counts")
+
+    def __init__(self, slots: int) -> None:
+        self.ids = [-1] * slots
+        self.amounts = [0] * slots
+        self.counts = [0] * slots
+
+    def add(self, bucket: int, amount: int) -> None:
+        slot = bucket % len(self.ids)
+        if self.ids[slot] != bucket:
+            if self.ids[slot] > bucket:
+                return  # older than the ring's retention
+            self.ids[slot] = bucket
+            self.amounts[slot] = 0
+            self.counts[slot] = 0
+        self.amounts[slot] += amount
+        self.counts[slot] += 1
+
+    def totals(self, first_bucket: int, last_bucket: int) -> HorizonTotals:
+        totals = HorizonTotals()
+        for bucket, amount, count in zip(self.ids, self.amounts, self.counts):
+            if first_bucket <= bucket <= last_bucket:
+                totals.amount += amount
+                totals.count += count
+        return totals
+
+
+class MultiResolutionCounters:
+    """
+    Per-user amount/count rollups over the HORIZONS, built from BUCKET_TIERS.
+
+    In memory every (side, tier, user) owns a BucketRing; they only serve
+    degraded mode, so at most `max_users` (side, user) pairs are kept, least
+    recently active evicted first. In Redis each
+    (side, tier, user) is one hash whose fields are `<bucket>:a` / `<bucket>:n`
+    (absolute bucket index) incremented with HINCRBY; reads filter by bucket
+    range, and stale fields are deleted once they outnumber the live slots.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        keys: Optional[KeySchema] = None,
+        max_users: int = LOCAL_ROLLUP_USERS_MAX,
+    ) -> None:
+        self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
+        self.max_users = max_users
+        self.local: OrderedDict[tuple[WindowSide, str], dict[str, BucketRing]] = OrderedDict()
+
+    def reset_local(self) -> None:
+        self.local.clear()
+
+    def record_local(self, side: WindowSide, user_id: str, ts: float, amount: int) -> None:
+        rings = self.local.get((side, user_id))
+        if rings is None:
+            rings = self.local[(side, user_id)] = {t.name: BucketRing(t.slots) for t in BUCKET_TIERS}
+            while len(self.local) > self.max_users:
+                self.local.popitem(last=False)
+        else:
+            self.local.move_to_end((side, user_id))
+        for tier in BUCKET_TIERS:
+            rings[tier.name].add(int(ts // tier.bucket_seconds), amount)
+
+    def local_totals(
+        self, side: WindowSide, user_id: str, ts: float, horizons: dict[str, int] = HORIZONS
+    ) -> dict[str, HorizonTotals]:
+        rings = self.local.get((side, user_id))
+        result = {}
+        for horizon, seconds in horizons.items():
+            tier = _tier_for(seconds)
+            last = int(ts // tier.bucket_seconds)
+            first = last - seconds // tier.bucket_seconds + 1
+            result[horizon] = rings[tier.name].totals(first, last) if rings else HorizonTotals()
+        return result
+
+    def stage_write(self, pipe: Pipeline, side: WindowSide, user_id: str, ts: float, amount: int) -> None:
+        for tier in BUCKET_TIERS:
+            key = rollup_key(side, tier, user_id, self.keys)
+            bucket = int(ts // tier.bucket_seconds)
+            pipe.hincrby(key, f"{bucket}:a", amount)
+            pipe.hincrby(key, f"{bucket}:n", 1)
+            pipe.expire(key, tier.retention_seconds + tier.bucket_seconds)
+
+    def stage_read(self, pipe: Pipeline, side: WindowSide, user_id: str) -> int:
+        """Queue one HGETALL per tier; returns the number of queued replies."""
+        for tier in BUCKET_TIERS:
+            pipe.hgetall(rollup_key(side, tier, user_id, self.keys))
+        return len(BUCKET_TIERS)
+
+    def parse(
+        self, side: WindowSide, user_id: str, replies: list[dict[str, Any]], ts: float,
+        horizons: dict[str, int] = HORIZONS,
+    ) -> tuple[dict[str, HorizonTotals], dict[str, list[str]]]:
+        """Fold HGETALL replies into horizon totals; also returns stale fields per key."""
+        per_tier: dict[str, dict[int, HorizonTotals]] = {}
+        stale: dict[str, list[str]] = {}
+        for tier, raw in zip(BUCKET_TIERS, replies):
+            oldest_live = int(ts // tier.bucket_seconds) - tier.slots + 1
+            buckets: dict[int, HorizonTotals] = {}
+            dead: list[str] = []
+            for name, value in raw.items():
+                bucket_str, _, kind = name.rpartition(":")
+                bucket = int(bucket_str)
+                if bucket < oldest_live:
+                    dead.append(name)
+                    continue
+                totals = buckets.setdefault(bucket, HorizonTotals())
+                if kind == "a":
+                    totals.amount += int(value)
+                else:
+                    totals.count += int(value)
+            per_tier[tier.name] = buckets
+            if len(dead) > 2 * tier.slots:
+                stale[rollup_key(side, tier, user_id, self.keys)] = dead
+
+        result = {}
+        for horizon, seconds in horizons.items():
+            tier = _tier_for(seconds)
+            last = int(ts // tier.bucket_seconds)
+            first = last - seconds // tier.bucket_seconds + 1
+            totals = HorizonTotals()
+            for bucket, part in per_tier[tier.name].items():
+                if first <= bucket <= last:
+                    totals.amount += part.amount
+                    totals.count += part.count
+            result[horizon] = totals
+        return result, stale
+
+    async def collect_garbage(self, stale: dict[str, list[str]]) -> None:
+        if not stale or not self.redis:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, fields in stale.items():
+                    pipe.hdel(key, *fields)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Redis rollup cleanup failed: %s", e)
+
+
+class DistinctCounters:
+    """
+    Approximate distinct counterparties per user over the sliding window.
+
+    Each DISTINCT_BUCKET_SECONDS bucket holds one HyperLogLog; the window's
+    count is the union of its live buckets. In memory the sketch precision is
+    derived from `relative_error`. Redis HLLs (PFADD / multi-key PFCOUNT) use
+    Redis's fixed ~0.81% standard error, which is always within that bound.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        window_seconds: int = WINDOW_SECONDS,
+        relative_error: float = DEFAULT_DISTINCT_ERROR,
+        keys: Optional[KeySchema] = None,
+    ) -> None:
+        self.redis = redis_client
+        self.keys = keys or KeySchema.from_env()
+        self.slots = math.ceil(window_seconds / DISTINCT_BUCKET_SECONDS)
+        self.precision = HyperLogLog.precision_for_error(relative_error)
+        self.local: dict[tuple[WindowSide, str], dict[int, HyperLogLog]] = {}
+
+    def reset_local(self) -> None:
+        self.local.clear()
+
+    def _live_buckets(self, ts: float) -> range:
+        last = int(ts // DISTINCT_BUCKET_SECONDS)
+        return range(last - self.slots + 1, last + 1)
+
+    def _key(self, side: WindowSide, user_id: str, bucket: int) -> str:
+        return self.keys.distinct(side.value, user_id, bucket)
+
+    def record_local(self, side: WindowSide, user_id: str, ts: float, counterparty: str) -> None:
+        ring = self.local.setdefault((side, user_id), {})
+        bucket = int(ts // DISTINCT_BUCKET_SECONDS)
+        # Buckets are keyed by index, so a late event can neither evict a live bucket nor revive a dead one.
+        oldest_live = max(bucket, *ring) - self.slots + 1 if ring else bucket
+        if bucket < oldest_live:
+            return
+        sketch = ring.get(bucket)
+        if sketch is None:
+            sketch = ring[bucket] = HyperLogLog(self.precision)
+            for stale in [b for b in ring if b < oldest_live]:
+                del ring[stale]
+        sketch.add(counterparty)
+
+    def local_count(self, side: WindowSide, user_id: str, ts: float) -> int:
+        live = self._live_buckets(ts)
+        sketches = [hll for b, hll in self.local.get((side, user_id), {}).items() if b in live]
+        return HyperLogLog.union(sketches, self.precision).count() if sketches else 0
+
+    def stage_write(self, pipe: Pipeline, side: WindowSide, user_id: str, ts: float, counterparty: str) -> None:
+        key = self._key(side, user_id, int(ts // DISTINCT_BUCKET_SECONDS))
+        pipe.pfadd(key, counterparty)
+        pipe.expire(key, (self.slots + 1) * DISTINCT_BUCKET_SECONDS)
+
+    def stage_read(self, pipe: Pipeline, side: WindowSide, user_id: str, ts: float) -> None:
+        pipe.pfcount(*(self._key(side, user_id, b) for b in self._live_buckets(ts)))
+
+
+@dataclass
+class WindowStats:
+    total_amount: int = 0
+    count: int = 0
+    counterparties: int = 0  # distinct senders (TARGET) or receivers (ACTOR)
+    events: list[GameEventLog] = field(default_factory=list)
+    horizons: dict[str, HorizonTotals] = field(default_factory=dict)
+
+    @classmethod
+    def from_events(
+        cls, side: WindowSide, events: list[GameEventLog], count_distinct: bool = True
+    ) -> "WindowStats":
+        if not count_distinct:
+            counterparties = 0
+        elif side is WindowSide.TARGET:
+            counterparties = len({e.actor_id for e in events})
+        else:
+            counterparties = len({e.target_id for e in events})
+        return cls(
+            total_amount=sum(e.action_details.currency_amount for e in events),
+            count=len(events),
+            counterparties=counterparties,
+            events=events,
+        )
+
+
+class SlidingWindowStore:
+    """
+    Sliding event windows for both sides of every transfer.
+
+    A single event updates the receiver's TARGET window and the sender's
+    ACTOR window. With Redis, both sorted sets are written, purged, expired
+    and read back in one pipelined round trip. In-memory windows are always
+    maintained as the degraded-mode fallback.
+
+    With `distinct_mode="approx"` (SUSANOH_DISTINCT_MODE) counterparties come
+    from DistinctCounters instead of a set over the window's events, and
+    screening no longer reads the window back: its amount and count come from
+    the rollups (to a 10 s bucket) and its counterparties from one PFCOUNT
+    over the per-minute HyperLogLogs, so the cost of `add` no longer grows
+    with the window. `read` still returns the events for L2 requests.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        window_seconds: int = WINDOW_SECONDS,
+        distinct_mode: str | None = None,
+        distinct_error: float | None = None,
+        breaker: Optional[CircuitBreaker] = None,
+        keys: Optional[KeySchema] = None,
+        wal: Optional[WriteAheadLog] = None,
+    ) -> None:
+        self.redis = redis_client
+        self.breaker = breaker
+        self.keys = keys or KeySchema.from_env()
+        self.wal = wal
+        self.window_seconds = window_seconds
+        # Events whose window writes only reached memory while Redis was degraded.
+        # (WAL LSN or 0, event) of window writes made while degraded.
+        self._pending: deque[tuple[int, GameEventLog]] = deque(maxlen=PENDING_EVENTS_MAX)
+        self.local: dict[WindowSide, defaultdict[str, UserWindow]] = {
+            side: defaultdict(UserWindow) for side in WindowSide
+        }
+        self.rollups = MultiResolutionCounters(redis_client, self.keys)
+        mode = distinct_mode or _distinct_mode_from_env()
+        if mode not in DISTINCT_MODES:
+            raise ValueError(f"distinct_mode must be one of {DISTINCT_MODES}")
+        self.distinct: DistinctCounters | None = None
+        self._horizons = HORIZONS
+        if mode == "approx":
+            self.distinct = DistinctCounters(
+                redis_client, window_seconds, distinct_error or _distinct_error_from_env(), self.keys
+            )
+            self._horizons = {**HORIZONS, WINDOW_HORIZON: window_seconds}
+
+    def _sides_for(self, event: GameEventLog) -> list[tuple[WindowSide, str]]:
+        return [(WindowSide.TARGET, event.target_id), (WindowSide.ACTOR, event.actor_id)]
+
+    @staticmethod
+    def _counterparty(side: WindowSide, event: GameEventLog) -> str:
+        return event.actor_id if side is WindowSide.TARGET else event.target_id
+
+    async def reset(self) -> None:
+        for windows in self.local.values():
+            windows.clear()
+        self._pending.clear()
+        self.rollups.reset_local()
+        if self.distinct:
+            self.distinct.reset_local()
+        if self.redis:
+            try:
+                keys = []
+                for pattern in self.keys.user_patterns():
+                    keys += await scan_keys(self.redis, pattern)
+                # One DEL per key: in the cluster layout they live in different slots.
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.delete(key)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning("Redis window reset failed: %s", e)
+
+    def _local_stats(self, side: WindowSide, user_id: str, ts: float) -> WindowStats:
+        window = self.local[side].get(user_id) or UserWindow()
+        stats = WindowStats.from_events(side, list(window.events), count_distinct=self.distinct is None)
+        stats.horizons = self.rollups.local_totals(side, user_id, ts, self._horizons)
+        stats.horizons.pop(WINDOW_HORIZON, None)
+        if self.distinct:
+            stats.counterparties = self.distinct.local_count(side, user_id, ts)
+        return stats
+
+    def _record_local(self, event: GameEventLog, event_ts: float) -> None:
+        amount = event.action_details.currency_amount
+        for side, user_id in self._sides_for(event):
+            self.local[side][user_id].add_event(event)
+            self.rollups.record_local(side, user_id, event_ts, amount)
+            if self.distinct:
+                self.distinct.record_local(side, user_id, event_ts, self._counterparty(side, event))
+
+    async def add(self, event: GameEventLog) -> dict[WindowSide, WindowStats]:
+        sides = self._sides_for(event)
+        event_ts = event_timestamp(event)
+        self._record_local(event, event_ts)
+
+        if self.redis and not is_degraded(self.breaker):
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    offsets = []
+                    with_events = self.distinct is None
+                    for side, user_id in sides:
+                        self._stage_writes(pipe, side, user_id, event, event_ts)
+                        key = window_key(side, user_id, self.keys)
+                        offsets.append(self._stage_reads(pipe, key, side, user_id, event_ts, with_events))
+                    replies = await pipe.execute()
+                return await self._stats_from_replies(sides, replies, offsets, event_ts, with_events)
+            except RedisError as e:
+                logger.error("Redis window update failed: %s. Degraded to in-memory.", e)
+        if self.redis:
+            lsn = self.wal.append("window", {"event": event.model_dump(mode="json")}) if self.wal else 0
+            self._pending.append((lsn, event))
+
+        return {side: self._local_stats(side, user_id, event_ts) for side, user_id in sides}
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending)
+
+    def restore_from_wal(self, kind: str, data: dict, lsn: int = 0) -> bool:
+        """Rebuild the in-memory windows from a WAL record written by `add`; False if it is not ours."""
+        if kind != "window":
+            return False
+        event = GameEventLog.model_validate(data["event"])
+        self._record_local(event, event_timestamp(event))
+        self._pending.append((lsn, event))
+        return True
+
+    def _stage_writes(self, pipe: Pipeline, side: WindowSide, user_id: str, event: GameEventLog, event_ts: float) -> None:
+        key = window_key(side, user_id, self.keys)
+        pipe.zadd(key, {event.model_dump_json(): event_ts})
+        pipe.zremrangebyscore(key, "-inf", event_ts - self.window_seconds)
+        pipe.expire(key, self.window_seconds + 60)
+        self.rollups.stage_write(pipe, side, user_id, event_ts, event.action_details.currency_amount)
+        if self.distinct:
+            self.distinct.stage_write(pipe, side, user_id, event_ts, self._counterparty(side, event))
+
+    async def replay_pending(self) -> int:
+        """
+        Write window updates made while degraded to Redis. Returns the number of events replayed.
+
+        Updates a previous process already replayed before it crashed (at or
+        below the WAL watermark) are skipped, since the rollups are counters.
+        """
+        if not self.redis or is_degraded(self.breaker) or not self._pending:
+            return 0
+        events = list(self._pending)
+        try:
+            applied = await self.wal.applied_lsn(self.redis, self.keys, "window") if self.wal else 0
+            async with self.redis.pipeline(transaction=not self.keys.cluster) as pipe:
+                for lsn, event in events:
+                    if lsn and lsn <= applied:
+                        continue
+                    event_ts = event_timestamp(event)
+                    for side, user_id in self._sides_for(event):
+                        self._stage_writes(pipe, side, user_id, event, event_ts)
+                last = max(lsn for lsn, _ in events)
+                if self.wal and last > applied:
+                    self.wal.stage_applied(pipe, self.keys, "window", last)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Replaying degraded window writes failed: %s", e)
+            return 0
+        for _ in range(min(len(events), len(self._pending))):
+            self._pending.popleft()
+        return len(events)
+
+    async def read(self, user_id: str, as_of: GameEventLog) -> dict[WindowSide, WindowStats]:
+        """Both windows of one user, purged relative to `as_of`'s timestamp."""
+        event_ts = event_timestamp(as_of)
+        sides = [(side, user_id) for side in WindowSide]
+        if self.redis and not is_degraded(self.breaker):
+            try:
+                cutoff_ts = event_ts - self.window_seconds
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    offsets = []
+                    for side, _ in sides:
+                        key = window_key(side, user_id, self.keys)
+                        pipe.zremrangebyscore(key, "-inf", cutoff_ts)
+                        offsets.append(self._stage_reads(pipe, key, side, user_id, event_ts))
+                    replies = await pipe.execute()
+                return await self._stats_from_replies(sides, replies, offsets, event_ts)
+            except RedisError:
+                pass
+        return {side: self._local_stats(side, user_id, event_ts) for side, _ in sides}
+
+    async def events(self, side: WindowSide, user_id: str) -> list[GameEventLog]:
+        """Events currently held in one window, oldest first, without purging."""
+        if self.redis and not is_degraded(self.breaker):
+            try:
+                raw = await self.redis.zrange(window_key(side, user_id, self.keys), 0, -1)
+                return [GameEventLog.model_validate_json(e) for e in raw]
+            except RedisError as e:
+                logger.warning("Redis window scan failed: %s. Using in-memory.", e)
+        window = self.local[side].get(user_id)
+        return list(window.events) if window else []
+
+    def _stage_reads(
+        self, pipe: Pipeline, key: str, side: WindowSide, user_id: str, ts: float, with_events: bool = True
+    ) -> int:
+        """Queue [(ZRANGE), rollup HGETALLs..., (PFCOUNT)]; returns the index of the first reply."""
+        start = len(pipe)
+        if with_events:
+            pipe.zrange(key, 0, -1)
+        self.rollups.stage_read(pipe, side, user_id)
+        if self.distinct:
+            self.distinct.stage_read(pipe, side, user_id, ts)
+        return start
+
+    async def _stats_from_replies(
+        self,
+        sides: list[tuple[WindowSide, str]],
+        replies: list[Any],
+        offsets: list[int],
+        event_ts: float,
+        with_events: bool = True,
+    ) -> dict[WindowSide, WindowStats]:
+        stats = {}
+        stale: dict[str, list[str]] = {}
+        for (side, user_id), at in zip(sides, offsets):
+            events = []
+            if with_events:
+                events = [GameEventLog.model_validate_json(e) for e in replies[at]]
+                at += 1
+            stats[side] = WindowStats.from_events(side, events, count_distinct=self.distinct is None)
+            rollup_replies = replies[at:at + len(BUCKET_TIERS)]
+            horizons, side_stale = self.rollups.parse(side, user_id, rollup_replies, event_ts, self._horizons)
+            window = horizons.pop(WINDOW_HORIZON, None)
+            if window is not None and not with_events:
+                stats[side].total_amount, stats[side].count = window.amount, window.count
+            stats[side].horizons = horizons
+            if self.distinct:
+                stats[side].counterparties = int(replies[at + len(BUCKET_TIERS)])
+            stale.update(side_stale)
+        await self.rollups.collect_garbage(stale)
+        return stats
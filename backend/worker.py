@@ -1,56 +1,215 @@
 from __future__ import annotations
 
-import asyncio
 import logging
 import os
-from typing import Any
+import time
+from collections.abc import Awaitable, Callable
+from functools import partial
+from typing import Any, Optional
 
-from arq import create_pool
+from arq import Retry, cron
 from arq.connections import RedisSettings
 
-from backend.models import AccountState, AnalysisRequest, ArbitrationResult
+from backend.models import AnalysisRequest, ArbitrationResult
 from backend.state_machine import StateMachine
 from backend.l2_gemini import L2Engine
 from backend.persistence import PersistenceStore
+from backend.event_bus import EventBroadcaster
+from backend.autoscaling import ThroughputRecorder
+from backend.batching import MicroBatcher
+from backend.dead_letter import DeadLetterQueue, retry_delay
+from backend.job_codec import decode_job
+from backend.l1_screening import L1Engine
+from backend.l2_scheduling import DEFAULT_LANE, LANES_BY_NAME, LaneMetrics
+from backend.redis_client import RedisClient
+from backend.windowing import WindowSide
 
 logger = logging.getLogger(__name__)
 
-# Re-use apply_l2_verdict logic from main.py, but need to be careful with sm
-# We'll create a standalone version or import it.
-# To avoid circular imports, let's define it here for now or move it to a shared place.
+# Concurrent analyze_l2_task jobs in one worker are coalesced into batched
+# Gemini prompts; SUSANOH_L2_BATCH_SIZE=1 disables batching.
+L2_BATCH_SIZE = max(1, int(os.environ.get("SUSANOH_L2_BATCH_SIZE", "8")))
+L2_BATCH_WAIT_SECONDS = float(os.environ.get("SUSANOH_L2_BATCH_WAIT_MS", "50")) / 1000
+# Verdicts are persisted per batch, so the worker only keeps a short in-memory history.
+WORKER_MAX_RESULTS = 200
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Failed L2 jobs are retried with backoff up to this many tries, then dead-lettered.
+L2_MAX_TRIES = max(1, int(os.environ.get("SUSANOH_L2_MAX_TRIES", "5")))
 
 async def analyze_l2_task(ctx: dict[Any, Any], analysis_req: AnalysisRequest) -> None:
-    # ctx['redis'] is the arq redis pool
+    """Legacy by-value job; kept so jobs enqueued before the by-reference format still drain."""
+    key = verdict_key(analysis_req.user_profile.user_id, analysis_req.trigger_event.event_id)
+    await _with_retries(
+        ctx,
+        "analyze_l2_task",
+        lambda: analysis_req.model_dump_json(),
+        lambda: _analyze_and_apply(ctx, analysis_req, key),
+    )
+
+async def analyze_l2_ref_task(ctx: dict[Any, Any], payload: str) -> None:
+    """By-reference job: rebuild the request from the live window, then analyze it."""
+    try:
+        job = decode_job(payload)
+    except ValueError as e:
+        await _dead_letters(ctx).push("analyze_l2_ref_task", str(payload), f"undecodable: {e}", ctx.get('job_try', 1))
+        return
+    lane_metrics = ctx.get('lane_metrics')
+    if lane_metrics is not None and ctx.get('job_try', 1) == 1:
+        await lane_metrics.record_start(LANES_BY_NAME.get(job.lane, DEFAULT_LANE), time.time() - job.enqueue_ts)
+
+    async def _run() -> None:
+        current_state = await ctx['sm'].get_or_create(job.target_id)
+        analysis_req = await ctx['l1'].rebuild_analysis_request(
+            job.target_id, job.trigger_event_id, job.triggered_rules, current_state, WindowSide(job.side)
+        )
+        if analysis_req is None:
+            logger.warning(
+                "L2 job for %s dropped: window is empty (queued %.1fs ago)",
+                job.target_id,
+                time.time() - job.enqueue_ts,
+            )
+            return
+        await _analyze_and_apply(ctx, analysis_req, verdict_key(job.target_id, job.trigger_event_id))
+
+    await _with_retries(ctx, "analyze_l2_ref_task", lambda: payload, _run)
+
+def verdict_key(target_id: str, trigger_event_id: str) -> str:
+    """Idempotency key of the verdict an L2 job applies; retries of the same job share it."""
+    return f"{target_id}:{trigger_event_id}"
+
+def _dead_letters(ctx: dict[Any, Any]) -> DeadLetterQueue:
+    return ctx.get('dead_letters') or DeadLetterQueue()
+
+async def _with_retries(
+    ctx: dict[Any, Any],
+    function: str,
+    payload: Callable[[], str],
+    work: Callable[[], Awaitable[None]],
+) -> None:
+    """Run `work`; failures retry with jittered backoff, then go to the dead-letter stream."""
+    try:
+        await work()
+    except Exception as e:
+        job_try = ctx.get('job_try', 1)
+        if job_try < L2_MAX_TRIES:
+            delay = retry_delay(job_try)
+            logger.warning("%s failed (try %d/%d), retrying in %.1fs: %s", function, job_try, L2_MAX_TRIES, delay, e)
+            raise Retry(defer=delay) from e
+        logger.error("%s failed after %d tries", function, job_try, exc_info=True)
+        await _dead_letters(ctx).push(function, payload(), repr(e), job_try)
+
+async def _analyze_and_apply(ctx: dict[Any, Any], analysis_req: AnalysisRequest, key: str) -> None:
+    batcher = ctx.get('l2_batcher')
+    if batcher is not None:
+        await batcher.submit((key, analysis_req))
+    else:
+        await _process_batch(ctx, [(key, analysis_req)])
+
+async def _process_batch(
+    ctx: dict[Any, Any], items: list[tuple[str, AnalysisRequest]]
+) -> list[Optional[ArbitrationResult]]:
+    """
+    Analyze a micro-batch, apply its verdicts in one pipelined write and persist them in one insert.
+
+    Results are stored, broadcast and persisted only after the verdicts are
+    applied, so a transient error halfway through leaves nothing for the
+    retry to repeat. Items whose verdict an earlier try already applied are
+    skipped and get None.
+    """
     sm = ctx['sm']
     l2 = ctx['l2']
-    persistence = ctx['persistence']
-    
+    done = await sm.applied_keys([key for key, _ in items])
+    # A job delivered twice in one batch is analyzed once.
+    pending = list({key: request for key, request in items if key not in done}.items())
+    if not pending:
+        return [None] * len(items)
+    requests = [request for _, request in pending]
+    started = time.monotonic()
+    if len(requests) == 1:
+        verdicts = [await l2.analyze(requests[0], store=False)]
+    else:
+        verdicts = await l2.analyze_batch(requests, store=False)
+    logs = await sm.apply_l2_verdicts(
+        [(v.target_id, v.recommended_action, v.risk_score) for v in verdicts],
+        idempotency_keys=[key for key, _ in pending],
+    )
+    await l2.store_results(verdicts)
+    throughput = ctx.get('throughput')
+    if throughput is not None:
+        tokens = l2.prompt_tokens - ctx.get('prompt_tokens_reported', 0)
+        ctx['prompt_tokens_reported'] = l2.prompt_tokens
+        await throughput.record_completed(len(pending), (time.monotonic() - started) * len(pending), tokens)
+    # With Redis the transitions reach the database through the transition stream's persistence consumer.
+    state_redis = ctx.get('state_redis')
+    streamed = state_redis is not None and state_redis.enabled
     try:
-        verdict: ArbitrationResult = await l2.analyze(analysis_req)
-        await sm.apply_l2_verdict(verdict.target_id, verdict.recommended_action, verdict.risk_score)
-        
-        # Persist snapshot (L1 is None in worker)
-        try:
-            persistence.persist_runtime_snapshot(sm=sm, l1=None, l2_results=l2.analysis_results)
-        except Exception as exc:
-            logger.warning("Worker failed to persist snapshot: %s", exc)
-            
-    except Exception as e:
-        logger.error(f"Error in analyze_l2_task: {e}", exc_info=True)
+        ctx['persistence'].persist_verdict_batch(
+            accounts={log.user_id: log.to_state for log in logs},
+            analyses=verdicts,
+            transitions=[] if streamed else logs,
+        )
+    except Exception as exc:
+        logger.warning("Worker failed to persist verdict batch: %s", exc)
+    by_key = {key: verdict for (key, _), verdict in zip(pending, verdicts)}
+    return [by_key.get(key) for key, _ in items]
+
+async def reconcile_state_aggregates_task(ctx: dict[Any, Any]) -> dict[str, int]:
+    """Periodically rebuild the per-state counters and user index sets."""
+    counts = await ctx['sm'].reconcile_state_aggregates()
+    logger.info("Reconciled state counters and indexes: %s", counts)
+    return counts
+
+async def replay_degraded_writes_task(ctx: dict[Any, Any]) -> int:
+    """Push results and state changes kept in memory during a Redis outage back to Redis."""
+    return await ctx['sm'].replay_degraded_writes() + await ctx['l2'].replay_degraded_writes()
 
 async def startup(ctx: dict[Any, Any]) -> None:
     redis_pool = ctx['redis']
-    ctx['sm'] = StateMachine(redis_pool)
-    ctx['l2'] = L2Engine(redis_client=redis_pool)
+    # The arq pool returns bytes; state and window reads need the decoded client the API uses.
+    ctx['state_redis'] = RedisClient(REDIS_URL)
+    state_redis = ctx['state_redis'].get_client()
+    breaker = ctx['state_redis'].breaker
+    ctx['sm'] = StateMachine(state_redis, breaker=breaker)
+    ctx['l2'] = L2Engine(redis_client=redis_pool, max_results=WORKER_MAX_RESULTS, raise_transient_errors=True)
+    ctx['l1'] = L1Engine(state_redis, breaker=breaker)
+    ctx['lane_metrics'] = LaneMetrics(state_redis)
+    ctx['dead_letters'] = DeadLetterQueue(state_redis)
+    ctx['throughput'] = ThroughputRecorder(state_redis)
+    if L2_BATCH_SIZE > 1:
+        ctx['l2_batcher'] = MicroBatcher(partial(_process_batch, ctx), L2_BATCH_SIZE, L2_BATCH_WAIT_SECONDS)
     ctx['persistence'] = PersistenceStore.from_env()
     ctx['persistence'].init_schema()
+
+    # Verdicts applied here reach dashboards through the API nodes' pub/sub relay.
+    broadcaster = EventBroadcaster(redis_pool)
+    ctx['broadcaster'] = broadcaster
+
+    async def _publish_transition(log) -> None:
+        await broadcaster.publish("transition", log.model_dump(mode="json"))
+
+    async def _publish_analysis(result: ArbitrationResult) -> None:
+        await broadcaster.publish("analysis", result.model_dump(mode="json"))
+
+    ctx['sm'].add_transition_listener(_publish_transition)
+    ctx['l2'].add_result_listener(_publish_analysis)
     logger.info("Worker started up")
 
 async def shutdown(ctx: dict[Any, Any]) -> None:
+    if ctx.get('l2_batcher') is not None:
+        await ctx['l2_batcher'].close()
+    if ctx.get('state_redis') is not None:
+        await ctx['state_redis'].close()
     logger.info("Worker shutting down")
 
 class WorkerSettings:
-    functions = [analyze_l2_task]
+    functions = [analyze_l2_task, analyze_l2_ref_task]
+    cron_jobs = [
+        cron(reconcile_state_aggregates_task, minute={0, 15, 30, 45}, run_at_startup=True),
+        cron(replay_degraded_writes_task, second=0),
+    ]
     on_startup = startup
     on_shutdown = shutdown
-    redis_settings = RedisSettings.from_dsn(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    # Enough concurrent jobs for micro-batches to fill up.
+    max_jobs = max(10, 2 * L2_BATCH_SIZE)
+    max_tries = L2_MAX_TRIES
+    redis_settings = RedisSettings.from_dsn(REDIS_URL)
@@ -1,10 +1,16 @@
 import { useState, useEffect, useCallback } from 'react';
+import type { Dispatch, SetStateAction } from 'react';
 import {
-  fetchStats, fetchRecentEvents, fetchAnalyses, fetchGraph, fetchUsers,
+  fetchStats, fetchRecentEvents, fetchAnalyses, fetchGraph, fetchUsers, fetchLeaderboards,
   triggerScenario, runShowcaseSmurfing, startDemo, stopDemo,
-  getToken, removeToken,
-  type ShowcaseResult,
+  getToken, removeToken, subscribeLiveUpdates,
+  type LiveUpdate, type ShowcaseResult,
 } from './api';
+import {
+  applyAnalysis, applyAnalysisToStats,
+  applyScreeningToEvents, applyScreeningToGraph, applyScreeningToStats,
+  applyTransitionToGraph, applyTransitionToStats, applyTransitionToUsers,
+} from './liveUpdatesModel';
 import StatsCards from './components/StatsCards';
 import EventStream from './components/EventStream';
 import NetworkGraph from './components/NetworkGraph';
@@ -13,17 +19,44 @@ import AccountTable from './components/AccountTable';
 import IncidentTimeline from './components/IncidentTimeline';
 import { Login } from './components/Login';
 
-function usePolling<T>(fn: () => Promise<T>, interval: number, active: boolean = true): [T | null, () => void] {
+// Snapshots are only re-read occasionally to heal drift; live deltas keep them current in between.
+const RESYNC_INTERVAL_MS = 30_000;
+const STREAM_RETRY_MS = 3_000;
+
+function useSnapshot<T>(
+  fn: () => Promise<T>,
+  active: boolean = true,
+): [T | null, Dispatch<SetStateAction<T | null>>, () => void] {
   const [data, setData] = useState<T | null>(null);
   const refresh = useCallback(() => {
     if (active) fn().then(setData).catch(() => { });
   }, [fn, active]);
   useEffect(() => {
     refresh();
-    const id = setInterval(refresh, interval);
+    const id = setInterval(refresh, RESYNC_INTERVAL_MS);
     return () => clearInterval(id);
-  }, [refresh, interval]);
-  return [data, refresh];
+  }, [refresh]);
+  return [data, setData, refresh];
+}
+
+function useLiveUpdates(onUpdate: (update: LiveUpdate) => void, active: boolean) {
+  useEffect(() => {
+    if (!active) return;
+    const controller = new AbortController();
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+    const connect = () => {
+      subscribeLiveUpdates(onUpdate, controller.signal)
+        .catch(() => { })
+        .finally(() => {
+          if (!controller.signal.aborted) retryTimer = setTimeout(connect, STREAM_RETRY_MS);
+        });
+    };
+    connect();
+    return () => {
+      controller.abort();
+      if (retryTimer) clearTimeout(retryTimer);
+    };
+  }, [onUpdate, active]);
 }
 
 export default function App() {
@@ -40,11 +73,32 @@ export default function App() {
     setIsAuthenticated(false);
   };
 
-  const [stats, refreshStats] = usePolling(fetchStats, 3000, isAuthenticated);
-  const [events, refreshEvents] = usePolling(fetchRecentEvents, 3000, isAuthenticated);
-  const [analyses, refreshAnalyses] = usePolling(fetchAnalyses, 3000, isAuthenticated);
-  const [graph, refreshGraph] = usePolling(fetchGraph, 5000, isAuthenticated);
-  const [users, refreshUsers] = usePolling(fetchUsers, 5000, isAuthenticated);
+  const [stats, setStats, refreshStats] = useSnapshot(fetchStats, isAuthenticated);
+  const [events, setEvents, refreshEvents] = useSnapshot(fetchRecentEvents, isAuthenticated);
+  const [analyses, setAnalyses, refreshAnalyses] = useSnapshot(fetchAnalyses, isAuthenticated);
+  const [graph, setGraph, refreshGraph] = useSnapshot(fetchGraph, isAuthenticated);
+  const [users, setUsers, refreshUsers] = useSnapshot(fetchUsers, isAuthenticated);
+  const [leaderboards] = useSnapshot(fetchLeaderboards, isAuthenticated);
+
+  const handleLiveUpdate = useCallback((update: LiveUpdate) => {
+    switch (update.type) {
+      case 'screening':
+        setEvents((prev) => applyScreeningToEvents(prev, update.data));
+        setStats((prev) => applyScreeningToStats(prev, update.data));
+        setGraph((prev) => applyScreeningToGraph(prev, update.data));
+        break;
+      case 'transition':
+        setStats((prev) => applyTransitionToStats(prev, update.data));
+        setUsers((prev) => applyTransitionToUsers(prev, update.data));
+        setGraph((prev) => applyTransitionToGraph(prev, update.data));
+        break;
+      case 'analysis':
+        setAnalyses((prev) => applyAnalysis(prev, update.data));
+        setStats((prev) => applyAnalysisToStats(prev));
+        break;
+    }
+  }, [setEvents, setStats, setGraph, setUsers, setAnalyses]);
+  useLiveUpdates(handleLiveUpdate, isAuthenticated);
   const [streaming, setStreaming] = useState(false);
   const [loading, setLoading] = useState('');
   const [showcaseLoading, setShowcaseLoading] = useState(false);
@@ -221,7 +275,11 @@ export default function App() {
           <EventStream events={events ?? []} />
           <AuditReport analyses={analyses ?? []} />
         </div>
-        <AccountTable users={users ?? []} onRefresh={refreshUsers} />
+        <AccountTable
+          users={users ?? []}
+          topReceivers={leaderboards?.receivers ?? []}
+          onRefresh={refreshUsers}
+        />
       </main>
     </div>
   );
@@ -125,6 +125,7 @@ export interface GraphLink {
 export interface GraphData {
   nodes: GraphNode[];
   links: GraphLink[];
+  version?: number;
 }
 
 export interface UserInfo {
@@ -132,6 +133,19 @@ export interface UserInfo {
   state: string;
 }
 
+export interface LeaderboardEntry {
+  user_id: string;
+  amount: number;
+  min_amount: number;
+  state: string;
+}
+
+export interface Leaderboards {
+  window_seconds: number;
+  receivers: LeaderboardEntry[];
+  senders: LeaderboardEntry[];
+}
+
 export interface ShowcaseResult {
   target_user: string;
   triggered_rules: string[];
@@ -142,6 +156,50 @@ export interface ShowcaseResult {
   analysis_error?: string | null;
 }
 
+export type LiveUpdate =
+  | { type: 'screening'; data: GameEvent }
+  | { type: 'transition'; data: TransitionLog }
+  | { type: 'analysis'; data: ArbitrationResult };
+
+/**
+ * Subscribe to the server-sent delta stream. Uses fetch instead of EventSource
+ * so the bearer token can be sent as a header. Resolves when the stream ends.
+ */
+export async function subscribeLiveUpdates(
+  onUpdate: (update: LiveUpdate) => void,
+  signal: AbortSignal,
+): Promise<void> {
+  const res = await fetch(`${BASE}/stream`, {
+    headers: { ...getAuthHeaders(), Accept: 'text/event-stream' },
+    signal,
+  });
+  if (res.status === 401) {
+    removeToken();
+    window.dispatchEvent(new Event('auth-failed'));
+  }
+  if (!res.ok || !res.body) throw new Error(`${res.status} ${res.statusText}`);
+
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const data = frame
+        .split('\n')
+        .filter((line) => line.startsWith('data: '))
+        .map((line) => line.slice('data: '.length))
+        .join('\n');
+      if (data) onUpdate(JSON.parse(data) as LiveUpdate);
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+}
+
 export const login = async (username: string, password: string): Promise<{ access_token: string, token_type: string, role: string }> => {
   const params = new URLSearchParams();
   params.append('username', username);
@@ -155,6 +213,8 @@ export const fetchAnalyses = (limit = 20) => get<ArbitrationResult[]>(`/analyses
 export const fetchRecentEvents = (limit = 20) => get<GameEvent[]>(`/events/recent?limit=${limit}`);
 export const fetchUsers = () => get<UserInfo[]>('/users');
 export const fetchGraph = () => get<GraphData>('/graph');
+export const fetchLeaderboards = (window = 3600, limit = 20) =>
+  get<Leaderboards>(`/leaderboards?window=${window}&limit=${limit}`);
 export const triggerScenario = (name: string) => post<unknown>(`/demo/scenario/${name}`);
 export const runShowcaseSmurfing = () => post<ShowcaseResult>('/demo/showcase/smurfing');
 export const startDemo = () => post<unknown>('/demo/start');
@@ -1,5 +1,5 @@
 import { useState } from 'react';
-import type { UserInfo } from '../api';
+import type { LeaderboardEntry, UserInfo } from '../api';
 import { tryWithdraw, releaseUser } from '../api';
 
 const STATE_BADGE: Record<string, string> = {
@@ -9,8 +9,27 @@ const STATE_BADGE: Record<string, string> = {
   BANNED: 'bg-red-100 text-red-800',
 };
 
-export default function AccountTable({ users, onRefresh }: { users: UserInfo[]; onRefresh: () => void }) {
+// Top receivers (by 1h amount) come first, followed by the remaining known users.
+function rankRows(users: UserInfo[], topReceivers: LeaderboardEntry[]) {
+  const ranked = topReceivers.map((e) => ({ user_id: e.user_id, state: e.state, received: e.amount }));
+  const seen = new Set(ranked.map((r) => r.user_id));
+  const rest = users.filter((u) => !seen.has(u.user_id)).map((u) => ({ ...u, received: undefined }));
+  // Prefer the live state from the users snapshot, which SSE transitions keep current.
+  const stateById = new Map(users.map((u) => [u.user_id, u.state]));
+  return [...ranked.map((r) => ({ ...r, state: stateById.get(r.user_id) ?? r.state })), ...rest];
+}
+
+export default function AccountTable({
+  users,
+  topReceivers = [],
+  onRefresh,
+}: {
+  users: UserInfo[];
+  topReceivers?: LeaderboardEntry[];
+  onRefresh: () => void;
+}) {
   const [msg, setMsg] = useState('');
+  const rows = rankRows(users, topReceivers);
 
   const handleWithdraw = async (uid: string) => {
     try {
@@ -46,14 +65,15 @@ export default function AccountTable({ users, onRefresh }: { users: UserInfo[];
             <tr className="border-b border-gray-100 text-left text-gray-500 uppercase">
               <th className="py-2 px-2">User ID</th>
               <th className="py-2 px-2">Status</th>
+              <th className="py-2 px-2 text-right">Received (1h)</th>
               <th className="py-2 px-2 text-right">Actions</th>
             </tr>
           </thead>
           <tbody>
-            {users.length === 0 && (
-              <tr><td colSpan={3} className="text-center text-gray-400 py-6">No users</td></tr>
+            {rows.length === 0 && (
+              <tr><td colSpan={4} className="text-center text-gray-400 py-6">No users</td></tr>
             )}
-            {users.map((u) => (
+            {rows.map((u) => (
               <tr key={u.user_id} className="border-b border-gray-50 hover:bg-gray-50">
                 <td className="py-1.5 px-2 font-mono">{u.user_id}</td>
                 <td className="py-1.5 px-2">
@@ -61,6 +81,9 @@ export default function AccountTable({ users, onRefresh }: { users: UserInfo[];
                     {u.state}
                   </span>
                 </td>
+                <td className="py-1.5 px-2 text-right font-mono text-gray-600">
+                  {u.received !== undefined ? `${u.received.toLocaleString()}G` : '-'}
+                </td>
                 <td className="py-1.5 px-2 text-right space-x-1">
                   <button
                     onClick={() => handleWithdraw(u.user_id)}
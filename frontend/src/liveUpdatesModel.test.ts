@@ -0,0 +1,99 @@
+import { describe, expect, it } from 'vitest';
+
+import type { GameEvent, GraphData, Stats, TransitionLog } from './api';
+import {
+  EVENT_LIMIT,
+  applyScreeningToEvents,
+  applyScreeningToGraph,
+  applyScreeningToStats,
+  applyTransitionToGraph,
+  applyTransitionToStats,
+  applyTransitionToUsers,
+} from './liveUpdatesModel';
+
+function makeEvent(overrides: Partial<GameEvent> = {}): GameEvent {
+  return {
+    event_id: 'evt_1',
+    timestamp: '2026-02-21T12:00:00Z',
+    event_type: 'TRADE',
+    actor_id: 'user_mule_01',
+    target_id: 'user_boss_01',
+    screened: true,
+    triggered_rules: ['R1'],
+    action_details: { currency_amount: 250_000 },
+    context_metadata: { actor_level: 2, account_age_days: 1 },
+    ...overrides,
+  };
+}
+
+function makeStats(overrides: Partial<Stats> = {}): Stats {
+  return {
+    NORMAL: 2,
+    RESTRICTED_WITHDRAWAL: 0,
+    UNDER_SURVEILLANCE: 0,
+    BANNED: 0,
+    total_accounts: 2,
+    total_transitions: 0,
+    blocked_withdrawals: 0,
+    l1_flags: 0,
+    l2_analyses: 0,
+    total_events: 0,
+    ...overrides,
+  };
+}
+
+const transition: TransitionLog = {
+  user_id: 'user_boss_01',
+  from_state: 'NORMAL',
+  to_state: 'RESTRICTED_WITHDRAWAL',
+  trigger: 'L1_SCREENING',
+  triggered_by_rule: 'R1',
+  timestamp: '2026-02-21T12:00:01Z',
+  evidence_summary: '',
+};
+
+describe('liveUpdatesModel', () => {
+  it('prepends screening rows, dedupes by event id and caps the list', () => {
+    const existing = Array.from({ length: EVENT_LIMIT }, (_, i) => makeEvent({ event_id: `evt_old_${i}` }));
+    const next = applyScreeningToEvents([makeEvent(), ...existing], makeEvent());
+    expect(next[0].event_id).toBe('evt_1');
+    expect(next.filter((e) => e.event_id === 'evt_1')).toHaveLength(1);
+    expect(next).toHaveLength(EVENT_LIMIT);
+  });
+
+  it('counts events and flags from screening deltas', () => {
+    const stats = applyScreeningToStats(makeStats(), makeEvent());
+    expect(stats?.total_events).toBe(1);
+    expect(stats?.l1_flags).toBe(1);
+    expect(applyScreeningToStats(null, makeEvent())).toBeNull();
+  });
+
+  it('moves state counts on transitions', () => {
+    const stats = applyTransitionToStats(makeStats(), transition);
+    expect(stats?.NORMAL).toBe(1);
+    expect(stats?.RESTRICTED_WITHDRAWAL).toBe(1);
+    expect(stats?.total_transitions).toBe(1);
+  });
+
+  it('updates or appends users on transitions', () => {
+    expect(applyTransitionToUsers([{ user_id: 'user_boss_01', state: 'NORMAL' }], transition)).toEqual([
+      { user_id: 'user_boss_01', state: 'RESTRICTED_WITHDRAWAL' },
+    ]);
+    expect(applyTransitionToUsers(null, transition)).toEqual([
+      { user_id: 'user_boss_01', state: 'RESTRICTED_WITHDRAWAL' },
+    ]);
+  });
+
+  it('aggregates graph links and node states incrementally', () => {
+    const graph: GraphData = { nodes: [], links: [] };
+    const once = applyScreeningToGraph(graph, makeEvent());
+    const twice = applyScreeningToGraph(once, makeEvent({ event_id: 'evt_2' }));
+    expect(twice?.nodes.map((n) => n.id).sort()).toEqual(['user_boss_01', 'user_mule_01']);
+    expect(twice?.links).toEqual([
+      { source: 'user_mule_01', target: 'user_boss_01', amount: 500_000, count: 2 },
+    ]);
+
+    const updated = applyTransitionToGraph(twice, transition);
+    expect(updated?.nodes.find((n) => n.id === 'user_boss_01')?.state).toBe('RESTRICTED_WITHDRAWAL');
+  });
+});
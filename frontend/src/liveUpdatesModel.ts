@@ -0,0 +1,81 @@
+import type { ArbitrationResult, GameEvent, GraphData, Stats, TransitionLog, UserInfo } from './api';
+
+export const EVENT_LIMIT = 20;
+export const ANALYSIS_LIMIT = 20;
+
+export function applyScreeningToEvents(events: GameEvent[] | null, event: GameEvent): GameEvent[] {
+  const rest = (events ?? []).filter((e) => e.event_id !== event.event_id);
+  return [event, ...rest].slice(0, EVENT_LIMIT);
+}
+
+export function applyScreeningToStats(stats: Stats | null, event: GameEvent): Stats | null {
+  if (!stats) return stats;
+  return {
+    ...stats,
+    total_events: stats.total_events + 1,
+    l1_flags: stats.l1_flags + (event.screened ? 1 : 0),
+  };
+}
+
+export function applyScreeningToGraph(graph: GraphData | null, event: GameEvent): GraphData | null {
+  if (!graph) return graph;
+  const nodes = [...graph.nodes];
+  for (const id of [event.actor_id, event.target_id]) {
+    if (!nodes.some((n) => n.id === id)) nodes.push({ id, state: 'NORMAL', label: id });
+  }
+  let found = false;
+  const links = graph.links.map((link) => {
+    if (link.source !== event.actor_id || link.target !== event.target_id) return link;
+    found = true;
+    return {
+      ...link,
+      amount: link.amount + event.action_details.currency_amount,
+      count: link.count + 1,
+    };
+  });
+  if (!found) {
+    links.push({
+      source: event.actor_id,
+      target: event.target_id,
+      amount: event.action_details.currency_amount,
+      count: 1,
+    });
+  }
+  return { nodes, links };
+}
+
+export function applyTransitionToStats(stats: Stats | null, log: TransitionLog): Stats | null {
+  if (!stats) return stats;
+  const counts = stats as unknown as Record<string, number>;
+  return {
+    ...stats,
+    [log.from_state]: Math.max(0, (counts[log.from_state] ?? 0) - 1),
+    [log.to_state]: (counts[log.to_state] ?? 0) + 1,
+    total_transitions: stats.total_transitions + 1,
+  };
+}
+
+export function applyTransitionToUsers(users: UserInfo[] | null, log: TransitionLog): UserInfo[] {
+  const current = users ?? [];
+  if (!current.some((u) => u.user_id === log.user_id)) {
+    return [...current, { user_id: log.user_id, state: log.to_state }];
+  }
+  return current.map((u) => (u.user_id === log.user_id ? { ...u, state: log.to_state } : u));
+}
+
+export function applyTransitionToGraph(graph: GraphData | null, log: TransitionLog): GraphData | null {
+  if (!graph) return graph;
+  return {
+    ...graph,
+    nodes: graph.nodes.map((n) => (n.id === log.user_id ? { ...n, state: log.to_state } : n)),
+  };
+}
+
+export function applyAnalysis(analyses: ArbitrationResult[] | null, result: ArbitrationResult): ArbitrationResult[] {
+  return [result, ...(analyses ?? [])].slice(0, ANALYSIS_LIMIT);
+}
+
+export function applyAnalysisToStats(stats: Stats | null): Stats | null {
+  if (!stats) return stats;
+  return { ...stats, l2_analyses: stats.l2_analyses + 1 };
+}
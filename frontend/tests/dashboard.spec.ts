@@ -62,6 +62,22 @@ test.describe('Dashboard E2E', () => {
                 json: [],
             });
         });
+
+        await page.route('**/api/v1/leaderboards*', async (route) => {
+            await route.fulfill({
+                status: 200,
+                contentType: 'application/json',
+                json: { window_seconds: 3600, receivers: [], senders: [] },
+            });
+        });
+
+        await page.route('**/api/v1/stream', async (route) => {
+            await route.fulfill({
+                status: 200,
+                contentType: 'text/event-stream',
+                body: ': connected\n\n',
+            });
+        });
     });
 
     test('should login and display main dashboard elements', async ({ page }) => {
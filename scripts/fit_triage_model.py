@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Fit the L2 triage model (SUSANOH_L2_TRIAGE_MODEL) to labelled analysis requests."""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from backend.l2_triage import fit_triage_model
+from backend.models import AnalysisRequest
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "samples",
+        help='JSONL, one {"request": <AnalysisRequest>, "is_fraud": <bool>} per line (e.g. reviewed L2 verdicts)',
+    )
+    parser.add_argument("output", help="where to write the model JSON")
+    parser.add_argument("--epochs", type=int, default=2000)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--l2", type=float, default=1e-3, help="L2 penalty on the weights")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    samples = []
+    with open(args.samples, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                row = json.loads(line)
+                samples.append((AnalysisRequest.model_validate(row["request"]), bool(row["is_fraud"])))
+    model = fit_triage_model(samples, epochs=args.epochs, learning_rate=args.learning_rate, l2=args.l2)
+    model.to_file(args.output)
+    print(json.dumps({"samples": len(samples), "bias": model.bias, "weights": model.weights}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
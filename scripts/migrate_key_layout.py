@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Move a legacy-layout Redis to the current transition stream and, optionally, the cluster key layout."""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from backend.key_migration import migrate_key_layout
+from backend.keys import DEFAULT_AGGREGATE_SHARDS, KEY_LAYOUTS, KeySchema
+from backend.redis_client import RedisClient
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument(
+        "--layout",
+        choices=KEY_LAYOUTS,
+        default=os.environ.get("SUSANOH_REDIS_KEY_LAYOUT", "cluster"),
+        help="target key layout (legacy only moves the old transition list into the stream)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.environ.get("SUSANOH_REDIS_AGGREGATE_SHARDS", DEFAULT_AGGREGATE_SHARDS)),
+        help="aggregate shards of the target layout (must match SUSANOH_REDIS_AGGREGATE_SHARDS)",
+    )
+    parser.add_argument("--apply", action="store_true", help="rewrite the keys (default: only count them)")
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    client = RedisClient(args.redis_url)
+    try:
+        moved = await migrate_key_layout(
+            client.get_client(), KeySchema(args.layout, max(1, args.shards)), apply=args.apply
+        )
+    finally:
+        await client.close()
+    print(json.dumps({"applied": args.apply, **moved}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""List or replay L2 jobs parked in the dead-letter stream."""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from arq import create_pool
+from arq.connections import RedisSettings
+
+from backend.dead_letter import DeadLetterQueue
+from backend.redis_client import RedisClient
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--count", type=int, default=100, help="maximum number of entries to list or replay")
+    parser.add_argument("--replay", action="store_true", help="re-enqueue the entries (default: only list them)")
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    client = RedisClient(args.redis_url)
+    dead_letters = DeadLetterQueue(client.get_client())
+    try:
+        if not args.replay:
+            for entry in await dead_letters.entries(args.count):
+                print(json.dumps(entry, ensure_ascii=False))
+            return 0
+        pool = await create_pool(RedisSettings.from_dsn(args.redis_url))
+        try:
+            replayed = await dead_letters.replay(pool, args.count)
+        finally:
+            await pool.close()
+        print(f"Replayed {replayed} dead-lettered job(s)")
+        return 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
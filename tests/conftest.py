@@ -1,6 +1,7 @@
 import pytest
 from backend.main import app
 from backend.auth import get_current_user, User, Role
+from backend.models import ActionDetails, ContextMetadata, GameEventLog
 
 @pytest.fixture(autouse=True)
 def override_auth_for_tests():
@@ -8,3 +9,45 @@ def override_auth_for_tests():
     app.dependency_overrides[get_current_user] = lambda: User(username="test_admin", role=Role.ADMIN)
     yield
     app.dependency_overrides.clear()
+
+
+class FakeClock:
+    """Settable time source for engines that take a `clock`; with `tick`, every reading advances it."""
+
+    def __init__(self, now: float = 1_000_000.0, tick: float = 0.0) -> None:
+        self.now = now
+        self.tick = tick
+
+    def __call__(self) -> float:
+        self.now += self.tick
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def _make_event(
+    actor: str = "a1",
+    target: str = "t1",
+    amount: int = 1000,
+    event_id: str = "evt",
+    *,
+    item_id: str | None = None,
+    market_avg_price: int | None = None,
+    chat: str | None = None,
+) -> GameEventLog:
+    return GameEventLog(
+        event_id=event_id,
+        actor_id=actor,
+        target_id=target,
+        action_details=ActionDetails(currency_amount=amount, item_id=item_id, market_avg_price=market_avg_price),
+        context_metadata=ContextMetadata(recent_chat_log=chat),
+    )
+
+
+@pytest.fixture
+def make_event():
+    """Factory of a transfer event: make_event(actor, target, amount, event_id, item_id=..., ...)."""
+    return _make_event
@@ -1,23 +1,23 @@
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
 
 import backend.main as main_module
 
 
 @pytest.mark.asyncio
 async def test_lifespan_skips_arq_pool_without_redis_url(monkeypatch):
-    create_pool_mock = AsyncMock()
+    get_arq_pool_mock = MagicMock(return_value=None)
     redis_close_mock = AsyncMock()
 
-    monkeypatch.delenv("REDIS_URL", raising=False)
-    monkeypatch.setattr(main_module, "create_pool", create_pool_mock)
+    monkeypatch.setattr(main_module.redis_client, "get_arq_pool", get_arq_pool_mock)
     monkeypatch.setattr(main_module.redis_client, "close", redis_close_mock)
 
     async with main_module.lifespan(main_module.app):
         assert main_module.app.state.arq_pool is None
 
-    create_pool_mock.assert_not_awaited()
+    get_arq_pool_mock.assert_called_once_with()
     redis_close_mock.assert_awaited_once()
     assert main_module.app.state.arq_pool is None
 
@@ -25,21 +25,27 @@ async def test_lifespan_skips_arq_pool_without_redis_url(monkeypatch):
 @pytest.mark.asyncio
 async def test_lifespan_initializes_arq_pool_when_redis_url_is_configured(monkeypatch):
     pool = MagicMock()
-    pool.close = AsyncMock()
-    create_pool_mock = AsyncMock(return_value=pool)
-    redis_settings_mock = MagicMock(return_value="redis-settings")
+    pool.ping = AsyncMock(return_value=True)
     redis_close_mock = AsyncMock()
 
-    monkeypatch.setenv("REDIS_URL", "redis://redis:6379/0")
-    monkeypatch.setattr(main_module, "create_pool", create_pool_mock)
-    monkeypatch.setattr(main_module.RedisSettings, "from_dsn", redis_settings_mock)
+    monkeypatch.setattr(main_module.redis_client, "get_arq_pool", MagicMock(return_value=pool))
     monkeypatch.setattr(main_module.redis_client, "close", redis_close_mock)
 
     async with main_module.lifespan(main_module.app):
         assert main_module.app.state.arq_pool is pool
 
-    redis_settings_mock.assert_called_once_with("redis://redis:6379/0")
-    create_pool_mock.assert_awaited_once_with("redis-settings")
-    pool.close.assert_awaited_once()
+    pool.ping.assert_awaited_once()
     redis_close_mock.assert_awaited_once()
     assert main_module.app.state.arq_pool is None
+
+
+@pytest.mark.asyncio
+async def test_lifespan_runs_without_arq_pool_when_redis_is_unreachable(monkeypatch):
+    pool = MagicMock()
+    pool.ping = AsyncMock(side_effect=RedisConnectionError("refused"))
+
+    monkeypatch.setattr(main_module.redis_client, "get_arq_pool", MagicMock(return_value=pool))
+    monkeypatch.setattr(main_module.redis_client, "close", AsyncMock())
+
+    async with main_module.lifespan(main_module.app):
+        assert main_module.app.state.arq_pool is None
@@ -4,6 +4,7 @@ from unittest.mock import AsyncMock, MagicMock
 from fastapi.testclient import TestClient
 
 import backend.main as main_module
+from backend.job_codec import decode_job
 from backend.models import GameEventLog, AccountState, ScreeningResult, AnalysisRequest, UserProfile
 
 @pytest.fixture
@@ -52,8 +53,11 @@ def test_event_enqueues_l2_task_when_pool_exists(mock_arq_pool, monkeypatch):
     # Check if enqueue_job was called
     assert mock_arq_pool.enqueue_job.called
     args, kwargs = mock_arq_pool.enqueue_job.call_args
-    assert args[0] == "analyze_l2_task"
-    assert args[1] == mock_analysis_req
+    assert args[0] == "analyze_l2_ref_task"
+    job = decode_job(args[1])
+    assert (job.target_id, job.trigger_event_id, job.triggered_rules) == ("target_1", "e_test_async", [])
+    assert job.lane == "normal"
+    assert kwargs["_defer_until"].timestamp() == pytest.approx(job.enqueue_ts, abs=0.01)
 
 def test_event_falls_back_to_local_task_when_pool_is_missing(monkeypatch):
     # Ensure arq_pool is None
@@ -65,17 +65,20 @@ async def test_analyze_l2_task_success():
     )
     
     ctx['l2'].analyze = AsyncMock(return_value=verdict)
-    ctx['l2'].analysis_results = [verdict]
+    ctx['l2'].store_results = AsyncMock()
+    ctx['sm'].applied_keys = AsyncMock(return_value=set())
     ctx['sm'].get_or_create = AsyncMock(return_value=AccountState.RESTRICTED_WITHDRAWAL)
     ctx['sm'].transition = AsyncMock(return_value=True)
     
     await analyze_l2_task(ctx, analysis_req)
     
-    ctx['l2'].analyze.assert_called_once_with(analysis_req)
-    ctx['sm'].apply_l2_verdict.assert_called_once_with(
-        verdict.target_id, verdict.recommended_action, verdict.risk_score
+    ctx['l2'].analyze.assert_called_once_with(analysis_req, store=False)
+    ctx['sm'].apply_l2_verdicts.assert_called_once_with(
+        [(verdict.target_id, verdict.recommended_action, verdict.risk_score)],
+        idempotency_keys=["u1:e1"],
     )
-    ctx['persistence'].persist_runtime_snapshot.assert_called_once()
+    ctx['l2'].store_results.assert_called_once_with([verdict])
+    ctx['persistence'].persist_verdict_batch.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -92,3 +95,213 @@ async def test_worker_startup_shutdown():
     
     await shutdown(ctx)
     # Just checking it doesn't crash
+
+
+@pytest.mark.asyncio
+async def test_analyze_l2_ref_task_rebuilds_request_from_live_window():
+    from backend.job_codec import L2JobRef, encode_job
+    from backend.l1_screening import L1Engine
+    from backend.worker import analyze_l2_ref_task
+
+    l1 = L1Engine()
+    for i in range(3):
+        await l1.windows.add(GameEventLog(
+            event_id=f"e{i}",
+            actor_id=f"a{i}",
+            target_id="u1",
+            action_details=ActionDetails(currency_amount=100_000),
+        ))
+    verdict = ArbitrationResult(
+        target_id="u1",
+        is_fraud=False,
+        risk_score=10,
+        fraud_type=FraudType.LEGITIMATE,
+        recommended_action=AccountState.NORMAL,
+        reasoning="Test reasoning",
+        confidence=1.0
+    )
+    ctx = {'l1': l1, 'sm': MagicMock(spec=StateMachine), 'l2': MagicMock(), 'persistence': MagicMock()}
+    ctx['sm'].get_or_create = AsyncMock(return_value=AccountState.RESTRICTED_WITHDRAWAL)
+    ctx['sm'].applied_keys = AsyncMock(return_value=set())
+    ctx['l2'].analyze = AsyncMock(return_value=verdict)
+    ctx['l2'].store_results = AsyncMock()
+
+    await analyze_l2_ref_task(ctx, encode_job(L2JobRef("u1", "e1", ["R2"])))
+
+    request = ctx['l2'].analyze.call_args.args[0]
+    assert request.trigger_event.event_id == "e1"
+    assert request.triggered_rules == ["R2"]
+    assert request.user_profile.unique_senders_5min == 3
+    ctx['sm'].apply_l2_verdicts.assert_called_once_with(
+        [("u1", AccountState.NORMAL, 10)], idempotency_keys=["u1:e1"]
+    )
+
+    ctx['l2'].analyze.reset_mock()
+    await analyze_l2_ref_task(ctx, encode_job(L2JobRef("nobody", "e1", ["R2"])))
+    ctx['l2'].analyze.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_actor_rule_ref_job_rebuilds_from_the_senders_window():
+    from backend.job_codec import L2JobRef, encode_job
+    from backend.l1_screening import L1Engine
+    from backend.worker import analyze_l2_ref_task
+
+    l1 = L1Engine(optional_rules={"R6", "R7"})
+    for i in range(5):
+        result = await l1.screen(GameEventLog(
+            event_id=f"out{i}",
+            actor_id="payer",
+            target_id=f"mule{i}",
+            action_details=ActionDetails(currency_amount=300_000),
+        ))
+    assert result.triggered_rules == ["R6", "R7"]
+    # The sender also received once; that event must not stand in for the trigger.
+    await l1.screen(GameEventLog(
+        event_id="in0", actor_id="friend", target_id="payer", action_details=ActionDetails(currency_amount=10),
+    ))
+
+    sm = StateMachine()
+    await sm.transition("payer", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R6,R7")
+    l2 = MagicMock()
+    l2.analyze = AsyncMock(return_value=ArbitrationResult(
+        target_id="payer",
+        is_fraud=True,
+        risk_score=90,
+        fraud_type=FraudType.MONEY_LAUNDERING,
+        recommended_action=AccountState.BANNED,
+        reasoning="outflow fan-out",
+        confidence=0.9,
+    ))
+    l2.store_results = AsyncMock()
+    ctx = {'l1': l1, 'sm': sm, 'l2': l2, 'persistence': MagicMock()}
+
+    await analyze_l2_ref_task(ctx, encode_job(L2JobRef("payer", "out4", ["R6", "R7"], side="actor")))
+
+    request = l2.analyze.call_args.args[0]
+    assert request.trigger_event.event_id == "out4"
+    assert request.user_profile.total_sent_5min == 1_500_000
+    assert await sm.get_or_create("payer") == AccountState.BANNED
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_retry_with_backoff_then_dead_letter():
+    from arq import Retry
+    from fakeredis.aioredis import FakeRedis
+
+    from backend.dead_letter import DEAD_LETTER_STREAM, DeadLetterQueue
+    from backend.job_codec import L2JobRef, encode_job
+    from backend.worker import L2_MAX_TRIES, analyze_l2_ref_task
+
+    redis = FakeRedis(decode_responses=True)
+    ctx = {'sm': MagicMock(spec=StateMachine), 'dead_letters': DeadLetterQueue(redis), 'job_try': 1}
+    ctx['sm'].get_or_create = AsyncMock(side_effect=ConnectionError("redis blip"))
+    payload = encode_job(L2JobRef("u1", "e1", ["R1"]))
+
+    with pytest.raises(Retry) as retry:
+        await analyze_l2_ref_task(ctx, payload)
+    assert 1.0 <= retry.value.defer_score / 1000 <= 2.0
+
+    ctx['job_try'] = L2_MAX_TRIES
+    await analyze_l2_ref_task(ctx, payload)
+
+    [(_, entry)] = await redis.xrange(DEAD_LETTER_STREAM)
+    assert entry["function"] == "analyze_l2_ref_task"
+    assert entry["payload"] == payload
+    assert "redis blip" in entry["error"]
+
+    pool = MagicMock()
+    pool.enqueue_job = AsyncMock()
+    assert await ctx['dead_letters'].replay(pool) == 1
+    pool.enqueue_job.assert_called_once_with("analyze_l2_ref_task", payload)
+    assert await redis.xlen(DEAD_LETTER_STREAM) == 0
+
+
+class _RateLimited(Exception):
+    code = 429
+
+
+@pytest.mark.asyncio
+async def test_transient_gemini_errors_retry_the_job_instead_of_falling_back(monkeypatch):
+    from arq import Retry
+
+    from backend.l2_gemini import GeminiUnavailable, L2Engine
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    analysis_req = AnalysisRequest(
+        trigger_event=GameEventLog(event_id="e1", actor_id="a1", target_id="u1"),
+        user_profile=UserProfile(user_id="u1", current_state=AccountState.RESTRICTED_WITHDRAWAL)
+    )
+    l2 = L2Engine(raise_transient_errors=True)
+    l2._call_gemini = AsyncMock(side_effect=_RateLimited("429 Too Many Requests"))
+    ctx = {'sm': MagicMock(spec=StateMachine), 'l2': l2, 'persistence': MagicMock(), 'job_try': 1}
+    ctx['sm'].applied_keys = AsyncMock(return_value=set())
+
+    with pytest.raises(Retry) as retry:
+        await analyze_l2_task(ctx, analysis_req)
+    assert isinstance(retry.value.__cause__, GeminiUnavailable)
+    ctx['sm'].apply_l2_verdicts.assert_not_called()
+    assert l2.analysis_results == []
+
+    # Errors a retry cannot fix, and the in-process engine, still fall back.
+    l2._call_gemini = AsyncMock(side_effect=ValueError("context length exceeded"))
+    assert "API error" in (await l2.analyze(analysis_req)).reasoning
+    in_process = L2Engine()
+    in_process._call_gemini = AsyncMock(side_effect=TimeoutError("Gemini API took too long"))
+    assert "API error" in (await in_process.analyze(analysis_req)).reasoning
+
+
+@pytest.mark.asyncio
+async def test_a_retried_batch_stores_and_broadcasts_each_result_once(monkeypatch):
+    import json
+
+    from backend.l2_gemini import GeminiUnavailable, L2Engine
+    from backend.worker import _process_batch
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    items = [
+        (f"{uid}:e1", AnalysisRequest(
+            trigger_event=GameEventLog(event_id="e1", actor_id="a1", target_id=uid),
+            user_profile=UserProfile(user_id=uid, current_state=AccountState.RESTRICTED_WITHDRAWAL),
+        ))
+        for uid in ("u1", "u2")
+    ]
+    sm = StateMachine()
+    for uid in ("u1", "u2"):
+        await sm.transition(uid, AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1")
+    l2 = L2Engine(raise_transient_errors=True)
+    broadcast: list[str] = []
+
+    async def _listener(result):
+        broadcast.append(result.target_id)
+
+    l2.add_result_listener(_listener)
+
+    async def _batch_call(requests, api_key):
+        # u2 is missing from the response and falls back to a single call.
+        return json.dumps([{"target_id": "u1", "risk_score": 10, "recommended_action": "NORMAL"}])
+
+    l2._call_gemini_batch = _batch_call
+    l2._call_gemini = AsyncMock(side_effect=_RateLimited("429 Too Many Requests"))
+    persistence = MagicMock()
+    ctx = {'sm': sm, 'l2': l2, 'persistence': persistence}
+
+    with pytest.raises(GeminiUnavailable):
+        await _process_batch(ctx, items)
+    assert l2.analysis_results == [] and broadcast == []
+    assert await sm.get_or_create("u1") == AccountState.RESTRICTED_WITHDRAWAL
+
+    l2._call_gemini = AsyncMock(side_effect=lambda request, api_key: l2._result_from_data(
+        request, {"risk_score": 10, "recommended_action": "NORMAL"}
+    ))
+    ctx['throughput'] = MagicMock(record_completed=AsyncMock(side_effect=ConnectionError("redis blip")))
+    with pytest.raises(ConnectionError):
+        await _process_batch(ctx, items)
+    assert sorted(broadcast) == ["u1", "u2"]
+
+    # The verdicts were applied before the failure, so the next try skips them.
+    del ctx['throughput']
+    assert await _process_batch(ctx, items) == [None, None]
+    assert sorted(broadcast) == ["u1", "u2"]
+    assert len(l2.analysis_results) == 2
+    assert await sm.get_or_create("u1") == AccountState.NORMAL
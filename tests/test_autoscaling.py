@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from arq.connections import ArqRedis
+from fakeredis.aioredis import FakeRedis
+
+from backend.autoscaling import AutoscalingSignal, ThroughputRecorder, recommend_workers
+
+
+def test_recommendation_follows_littles_law():
+    # 2 jobs/s for 5s each keeps 10 jobs in flight: one 10-slot worker.
+    assert recommend_workers(2.0, 5.0, backlog=0, target_seconds=60, slots_per_worker=10) == 1
+    # Draining a 1200-job backlog within 60s adds 20 jobs/s of demand.
+    assert recommend_workers(2.0, 5.0, backlog=1200, target_seconds=60, slots_per_worker=10) == 11
+    assert recommend_workers(0.0, 5.0, backlog=0, target_seconds=60, slots_per_worker=10) == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshot_combines_queue_and_worker_throughput():
+    redis = FakeRedis(decode_responses=True)
+    now = [time.time()]
+    clock = lambda: now[0]
+    api = ThroughputRecorder(redis, clock=clock)
+    worker_a = ThroughputRecorder(redis, worker="host:1", clock=clock)
+    worker_b = ThroughputRecorder(redis, worker="host:2", clock=clock)
+    await api.record_enqueued(30)
+    await worker_a.record_completed(20, busy_seconds=40.0, tokens=6_000)
+    await worker_b.record_completed(10, busy_seconds=20.0, tokens=3_000)
+
+    pool = ArqRedis(connection_pool=FakeRedis().connection_pool)
+    for i in range(3):
+        await pool.enqueue_job("analyze_l2_ref_task", f"job-{i}")
+    now[0] += 12
+
+    signal = AutoscalingSignal(api, slots_per_worker=10, target_seconds=60, tokens_per_minute=100_000, clock=clock)
+    snapshot = await signal.snapshot(pool)
+
+    assert snapshot["queue"]["depth"] == 3
+    assert snapshot["queue"]["oldest_job_age_seconds"] == pytest.approx(12, abs=1)
+    assert snapshot["mean_service_seconds"] == 2.0
+    assert [w["worker_id"] for w in snapshot["workers"]] == ["host:1", "host:2"]
+    assert snapshot["workers"][0]["jobs_per_second"] == pytest.approx(2 * snapshot["workers"][1]["jobs_per_second"], rel=0.01)
+    assert 0 < snapshot["gemini_tokens"]["headroom_ratio"] < 1
+    assert snapshot["recommended_workers"] >= 1
+
+    text = AutoscalingSignal.prometheus(snapshot)
+    assert "susanoh_l2_queue_depth 3" in text
+    assert 'susanoh_l2_worker_jobs_per_second{worker="host:1"}' in text
+
+
+@pytest.mark.asyncio
+async def test_snapshots_are_cached_between_polls():
+    now = [1_000.0]
+    recorder = ThroughputRecorder(clock=lambda: now[0])
+    signal = AutoscalingSignal(recorder, slots_per_worker=10, cache_seconds=2, clock=lambda: now[0])
+
+    first = await signal.snapshot()
+    await recorder.record_enqueued(100)
+    assert await signal.snapshot() is first
+    now[0] += 3
+    assert (await signal.snapshot())["arrival_rate_per_second"] > 0
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from backend.batching import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_full_batches_flush_immediately_and_results_map_back():
+    seen: list[list[int]] = []
+
+    async def handler(items: list[int]) -> list[int]:
+        seen.append(items)
+        return [i * 10 for i in items]
+
+    batcher = MicroBatcher(handler, max_size=3, max_wait_seconds=60)
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert seen == [[0, 1, 2], [3, 4, 5]]
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_flushes_after_wait():
+    async def handler(items: list[str]) -> list[str]:
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(handler, max_size=10, max_wait_seconds=0.01)
+    assert await asyncio.gather(batcher.submit("a"), batcher.submit("b")) == ["A", "B"]
+    assert batcher.batches_flushed == 1
+
+
+@pytest.mark.asyncio
+async def test_handler_errors_reach_every_caller():
+    async def handler(items: list[int]) -> list[int]:
+        raise RuntimeError("quota exceeded")
+
+    batcher = MicroBatcher(handler, max_size=2, max_wait_seconds=0.01)
+    results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,8 @@
+from backend.dead_letter import RETRY_CAP_SECONDS, retry_delay
+
+
+def test_retry_delay_grows_exponentially_with_equal_jitter():
+    assert retry_delay(1, rng=lambda: 0.0) == 1.0
+    assert retry_delay(1, rng=lambda: 1.0) == 2.0
+    assert retry_delay(4, rng=lambda: 1.0) == 16.0
+    assert retry_delay(30, rng=lambda: 1.0) == RETRY_CAP_SECONDS
@@ -0,0 +1,88 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.l1_screening import L1Engine
+from backend.l2_gemini import L2Engine
+from backend.models import AccountState
+from backend.redis_client import CircuitBreaker
+from backend.state_machine import StateMachine
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def breaker(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=5, clock=clock)
+    breaker.record_failure()
+    return breaker
+
+
+@pytest.mark.asyncio
+async def test_engines_skip_redis_while_degraded_and_replay_after_recovery(fake_redis, breaker, clock, make_event):
+    sm = StateMachine(fake_redis, breaker=breaker)
+    l1 = L1Engine(fake_redis, breaker=breaker)
+    l2 = L2Engine(redis_client=fake_redis, breaker=breaker)
+
+    event = make_event("sender", "mule", 2_000_000, "evt_1")
+    assert await sm.get_or_create("mule") == AccountState.NORMAL
+    result = await l1.screen(event)
+    assert "R1" in result.triggered_rules
+    await sm.transition("mule", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1", "test")
+    await sm.increment_blocked_withdrawals()
+    request = await l1.build_analysis_request("mule", event, result.triggered_rules, AccountState.RESTRICTED_WITHDRAWAL)
+    await l2.analyze_deterministically(request)
+
+    # Nothing reached Redis, everything is served from memory and journaled.
+    assert await fake_redis.keys("*") == []
+    assert (await sm.get_stats())["RESTRICTED_WITHDRAWAL"] == 1
+    assert await l2.get_analysis_count() == 1
+    assert sm.pending_writes and l1.pending_writes and l2.pending_writes
+    assert await sm.replay_degraded_writes() == 0
+
+    clock.now += 6
+    assert await sm.replay_degraded_writes() == 1
+    assert await l1.replay_degraded_writes() == 1
+    assert await l2.replay_degraded_writes() == 1
+    assert sm.pending_writes == l1.pending_writes == l2.pending_writes == 0
+
+    assert await fake_redis.hget("susanoh:accounts", "mule") == AccountState.RESTRICTED_WITHDRAWAL.value
+    stats = await sm.get_stats()
+    assert stats["RESTRICTED_WITHDRAWAL"] == 1
+    assert stats["total_transitions"] == 1
+    assert stats["blocked_withdrawals"] == 1
+    assert await fake_redis.sismember("susanoh:state_index:RESTRICTED_WITHDRAWAL", "mule")
+    assert await l1.get_counters() == {"total_events": 1, "l1_flags": 1}
+    assert len(await fake_redis.zrange("susanoh:window:mule", 0, -1)) == 1
+    assert await l2.get_analysis_count() == 1
+    assert [a.target_id for a in await l2.get_analyses()] == ["mule"]
+
+
+@pytest.mark.asyncio
+async def test_replay_keeps_the_more_restrictive_state_on_conflict(fake_redis, breaker, clock):
+    await fake_redis.hset("susanoh:accounts", "u1", AccountState.UNDER_SURVEILLANCE.value)
+    sm = StateMachine(fake_redis, breaker=breaker)
+    await sm.transition("u1", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1", "degraded")
+
+    # Another node banned the account after this one lost Redis.
+    await fake_redis.hset("susanoh:accounts", "u1", AccountState.BANNED.value)
+    clock.now += 6
+    assert await sm.replay_degraded_writes() == 1
+    assert await fake_redis.hget("susanoh:accounts", "u1") == AccountState.BANNED.value
+    assert sm.accounts["u1"] == AccountState.BANNED
+
+
+@pytest.mark.asyncio
+async def test_replay_overwrites_accounts_unchanged_since_degrading(fake_redis, breaker, clock):
+    sm = StateMachine(fake_redis)
+    await sm.get_or_create("u1")
+    await sm.transition("u1", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1", "live")
+    sm.breaker = breaker
+
+    await sm.transition("u1", AccountState.NORMAL, "L2_ANALYSIS", "GEMINI_VERDICT", "degraded")
+    clock.now += 6
+    await sm.replay_degraded_writes()
+    assert await fake_redis.hget("susanoh:accounts", "u1") == AccountState.NORMAL.value
+    assert (await sm.get_stats())["NORMAL"] == 1
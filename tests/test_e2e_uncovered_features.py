@@ -104,6 +104,14 @@ def test_e2e_core_api_flow_covers_events_users_release_and_read_models():
     state_filtered_ids = {row["user_id"] for row in users_by_state.json()}
     assert target_id in state_filtered_ids
 
+    first_page = client.get("/api/v1/users", params={"limit": 1})
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 1
+    next_cursor = first_page.headers["X-Next-Cursor"]
+    assert next_cursor != "0"
+    second_page = client.get("/api/v1/users", params={"limit": 1, "cursor": next_cursor})
+    assert second_page.json()[0]["user_id"] != first_page.json()[0]["user_id"]
+
     stats = client.get("/api/v1/stats")
     assert stats.status_code == 200
     stats_payload = stats.json()
@@ -212,3 +220,25 @@ def test_e2e_api_key_auth_middleware_flow(monkeypatch):
 
     health = client.get("/")
     assert health.status_code == 200
+
+
+def test_e2e_leaderboards_rank_receivers_with_state():
+    for i in range(3):
+        client.post(
+            "/api/v1/events",
+            json=_event_payload(event_id=f"lb_{i}", actor_id=f"lb_sender_{i}", target_id="lb_hub", amount=400_000),
+        )
+    client.post(
+        "/api/v1/events",
+        json=_event_payload(event_id="lb_small", actor_id="lb_sender_0", target_id="lb_small", amount=10),
+    )
+
+    response = client.get("/api/v1/leaderboards", params={"window": 3600, "limit": 5})
+
+    assert response.status_code == 200
+    receivers = response.json()["receivers"]
+    assert receivers[0]["user_id"] == "lb_hub"
+    assert receivers[0]["amount"] == 1_200_000
+    assert receivers[0]["state"] in {"NORMAL", "RESTRICTED_WITHDRAWAL", "UNDER_SURVEILLANCE", "BANNED"}
+    assert response.json()["senders"][0]["user_id"] == "lb_sender_0"
+    assert client.get("/api/v1/leaderboards", params={"window": 10}).status_code == 422
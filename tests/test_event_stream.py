@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from httpx import ASGITransport, AsyncClient
+
+import backend.main as main_module
+from backend.event_bus import STREAM_CHANNEL, SUBSCRIBER_QUEUE_SIZE, EventBroadcaster
+from backend.models import AccountState
+
+
+class _FakeRequest:
+    def __init__(self, polls_before_disconnect: int) -> None:
+        self._remaining = polls_before_disconnect
+
+    async def is_disconnected(self) -> bool:
+        self._remaining -= 1
+        return self._remaining < 0
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_to_every_subscriber():
+    broadcaster = EventBroadcaster()
+    async with broadcaster.subscribe() as first, broadcaster.subscribe() as second:
+        assert broadcaster.subscriber_count == 2
+        await broadcaster.publish("transition", {"user_id": "u1"})
+        for queue in (first, second):
+            message = json.loads(queue.get_nowait())
+            assert message == {"type": "transition", "data": {"user_id": "u1"}}
+    assert broadcaster.subscriber_count == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest_delta():
+    broadcaster = EventBroadcaster()
+    async with broadcaster.subscribe() as queue:
+        for i in range(SUBSCRIBER_QUEUE_SIZE + 5):
+            await broadcaster.publish("screening", {"seq": i})
+        assert queue.qsize() == SUBSCRIBER_QUEUE_SIZE
+        assert json.loads(queue.get_nowait())["data"]["seq"] == 5
+
+
+@pytest.mark.asyncio
+async def test_relay_forwards_only_foreign_messages():
+    fake_redis = FakeRedis(decode_responses=True)
+    local = EventBroadcaster(fake_redis, node_id="node-a")
+    remote = EventBroadcaster(fake_redis, node_id="node-b")
+
+    pubsub = fake_redis.pubsub()
+    await pubsub.subscribe(STREAM_CHANNEL)
+    await remote.publish("analysis", {"target_id": "u1"})
+    received = None
+    for _ in range(10):
+        received = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.1)
+        if received:
+            break
+    await pubsub.aclose()
+    assert received is not None
+
+    async with local.subscribe() as queue:
+        local._handle_relay_message(received["data"])
+        assert json.loads(queue.get_nowait())["data"] == {"target_id": "u1"}
+
+        own = json.dumps({"origin": "node-a", "message": "{}"})
+        local._handle_relay_message(own)
+        assert queue.empty()
+
+
+class _BrokenPubSub:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+    async def subscribe(self, channel: str) -> None:
+        raise self.error
+
+    async def aclose(self) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_relay_survives_unexpected_errors_with_backoff(monkeypatch):
+    from redis.exceptions import ConnectionError as RedisConnectionError
+
+    import backend.event_bus as event_bus
+
+    fake_redis = FakeRedis(decode_responses=True)
+    failures = [RuntimeError("decoder bug"), RedisConnectionError("down"), KeyError("data")]
+    real_pubsub = fake_redis.pubsub
+    monkeypatch.setattr(fake_redis, "pubsub", lambda: _BrokenPubSub(failures.pop(0)) if failures else real_pubsub())
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def _sleep(seconds: float) -> None:
+        delays.append(seconds)
+        await real_sleep(0)
+
+    monkeypatch.setattr(event_bus.asyncio, "sleep", _sleep)
+    local = EventBroadcaster(fake_redis, node_id="node-a")
+    await local.start_relay()
+    try:
+        async with local.subscribe() as queue:
+            for _ in range(100):
+                if not failures and await fake_redis.pubsub_numsub(STREAM_CHANNEL) == [(STREAM_CHANNEL, 1)]:
+                    break
+                await real_sleep(0.01)
+            await EventBroadcaster(fake_redis, node_id="node-b").publish("analysis", {"target_id": "u1"})
+            message = await asyncio.wait_for(queue.get(), timeout=2)
+        assert json.loads(message)["data"] == {"target_id": "u1"}
+        assert delays[:3] == [1.0, 2.0, 4.0]
+    finally:
+        await local.stop_relay()
+
+
+@pytest.mark.asyncio
+async def test_event_ingest_pushes_screening_and_transition_deltas():
+    await main_module.reset_runtime_state()
+    payload = {
+        "event_id": "evt_stream_001",
+        "actor_id": "user_stream_actor",
+        "target_id": "user_stream_target",
+        "action_details": {"currency_amount": 2_000_000},
+    }
+    async with main_module.broadcaster.subscribe() as queue:
+        async with AsyncClient(transport=ASGITransport(app=main_module.app), base_url="http://test") as client:
+            resp = await client.post("/api/v1/events", json=payload)
+        assert resp.status_code == 200
+
+        messages = []
+        while not queue.empty():
+            messages.append(json.loads(queue.get_nowait()))
+
+    assert [m["type"] for m in messages[:2]] == ["screening", "transition"]
+    assert messages[0]["data"]["event_id"] == "evt_stream_001"
+    assert "R1" in messages[0]["data"]["triggered_rules"]
+    assert messages[1]["data"]["to_state"] == AccountState.RESTRICTED_WITHDRAWAL.value
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_emits_sse_frames():
+    response = await main_module.stream_updates(_FakeRequest(polls_before_disconnect=1))
+    assert response.media_type == "text/event-stream"
+
+    frames = response.body_iterator
+    assert await frames.__anext__() == ": connected\n\n"
+    await main_module.broadcaster.publish("analysis", {"target_id": "u_sse"})
+    frame = await asyncio.wait_for(frames.__anext__(), timeout=1)
+    assert frame.startswith("data: ")
+    assert json.loads(frame[len("data: "):])["data"]["target_id"] == "u_sse"
+    with pytest.raises(StopAsyncIteration):
+        await frames.__anext__()
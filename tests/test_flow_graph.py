@@ -0,0 +1,150 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend import flow_graph
+from backend.flow_graph import GRAPH_BUCKET_SECONDS, REBASE_HALF_LIVES, FlowGraph
+from backend.models import AccountState
+
+
+@pytest.mark.asyncio
+async def test_links_aggregate_incrementally_in_memory(clock, make_event):
+    graph = FlowGraph(horizon_seconds=600, clock=clock)
+    await graph.record(make_event("a", "b", 100))
+    await graph.record(make_event("a", "b", 50))
+    await graph.record(make_event("c", "b", 10))
+
+    snapshot = await graph.snapshot()
+    links = {(l["source"], l["target"]): (l["amount"], l["count"]) for l in snapshot["links"]}
+    assert links == {("a", "b"): (150, 2), ("c", "b"): (10, 1)}
+    assert FlowGraph.node_ids(snapshot) == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_links_expire_after_horizon(use_redis, clock, make_event):
+    graph = FlowGraph(FakeRedis(decode_responses=True) if use_redis else None, horizon_seconds=300, clock=clock)
+    await graph.record(make_event("a", "b", 100))
+    clock.now += 200
+    await graph.record(make_event("c", "d", 5))
+    clock.now += 200
+
+    snapshot = await graph.snapshot()
+    assert [(l["source"], l["target"]) for l in snapshot["links"]] == [("c", "d")]
+
+
+@pytest.mark.asyncio
+async def test_delta_since_version_returns_only_new_increments(clock, make_event):
+    graph = FlowGraph(horizon_seconds=600, clock=clock)
+    await graph.record(make_event("a", "b", 100))
+    version = (await graph.snapshot())["version"]
+    clock.now += GRAPH_BUCKET_SECONDS
+    await graph.record(make_event("a", "b", 7))
+
+    delta = await graph.snapshot(since=version + GRAPH_BUCKET_SECONDS)
+    assert delta["links"] == [{"source": "a", "target": "b", "amount": 7, "count": 1}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_snapshot_keeps_heaviest_decayed_links(use_redis, clock, make_event):
+    graph = FlowGraph(FakeRedis(decode_responses=True) if use_redis else None, horizon_seconds=3600, clock=clock)
+    await graph.record(make_event("old", "x", 1_000))
+    clock.now += 3000
+    await graph.record(make_event("new", "x", 400))
+
+    snapshot = await graph.snapshot(max_links=1)
+    assert [l["source"] for l in snapshot["links"]] == ["new"]
+
+
+@pytest.mark.asyncio
+async def test_redis_buckets_are_shared_across_nodes(clock, make_event):
+    fake_redis = FakeRedis(decode_responses=True)
+    node_a = FlowGraph(fake_redis, horizon_seconds=600, clock=clock)
+    node_b = FlowGraph(fake_redis, horizon_seconds=600, clock=clock)
+    await node_a.record(make_event("a", "b", 100))
+    await node_b.record(make_event("a", "b", 20))
+
+    snapshot = await node_a.snapshot()
+    assert snapshot["links"] == [{"source": "a", "target": "b", "amount": 120, "count": 2}]
+
+    graph = FlowGraph.build_graph(snapshot, {"b": AccountState.BANNED})
+    assert {n["id"]: n["state"] for n in graph["nodes"]} == {"a": "NORMAL", "b": "BANNED"}
+
+
+@pytest.mark.asyncio
+async def test_redis_rolling_totals_match_the_in_memory_graph(clock, make_event):
+    fake_redis = FakeRedis(decode_responses=True)
+    nodes = [FlowGraph(fake_redis, horizon_seconds=300, clock=clock) for _ in range(2)]
+    local = FlowGraph(horizon_seconds=300, clock=clock)
+    # Two horizons of traffic with a snapshot every bucket, then a gap long
+    # enough that the totals are rebuilt, then more traffic (landmark rebases).
+    for step in range(50):
+        if step == 20:
+            clock.now += 3 * 300
+        for i in range(3):
+            event = make_event(f"a{(step + i) % 4}", f"b{i}", 10 * step + i + 1)
+            await nodes[i % 2].record(event)
+            local.record_local(event, clock.now)
+        clock.now += GRAPH_BUCKET_SECONDS
+        expected = {(l["source"], l["target"]): (l["amount"], l["count"]) for l in (await local.snapshot())["links"]}
+        snapshot = await nodes[step % 2].snapshot()
+        assert {(l["source"], l["target"]): (l["amount"], l["count"]) for l in snapshot["links"]} == expected
+
+    amount_key, count_key, rank_key, _ = nodes[0]._total_keys(0)
+    assert await fake_redis.hlen(count_key) == await fake_redis.zcard(rank_key) == len(expected)
+    oldest_live = nodes[0]._bucket_of(clock.now) - nodes[0].bucket_count + 1
+    assert not await fake_redis.exists(*nodes[0]._bucket_keys(oldest_live - 1, 0))
+
+
+def _links(snapshot: dict) -> dict:
+    return {(l["source"], l["target"]): (l["amount"], l["count"]) for l in snapshot["links"]}
+
+
+@pytest.mark.asyncio
+async def test_writers_roll_the_totals_without_snapshots(clock, make_event):
+    fake_redis = FakeRedis(decode_responses=True)
+    graph = FlowGraph(fake_redis, horizon_seconds=300, clock=clock)
+    # Twenty horizons of writes, far past the rank rebase, and nobody polls /graph.
+    for step in range(100):
+        await graph.record(make_event(f"a{step}", "b", step + 1))
+        clock.now += GRAPH_BUCKET_SECONDS
+
+    amount_key, count_key, rank_key, clock_key = graph._total_keys(0)
+    assert await fake_redis.hlen(amount_key) == await fake_redis.zcard(rank_key) <= graph.bucket_count
+    rebase_after = REBASE_HALF_LIVES * 300 / 4
+    assert clock.now - float(await fake_redis.hget(clock_key, "landmark")) <= rebase_after + GRAPH_BUCKET_SECONDS
+    assert max(score for _, score in await fake_redis.zrange(rank_key, 0, -1, withscores=True)) < 2 ** 20
+
+
+@pytest.mark.asyncio
+async def test_rebuild_folds_the_buckets_a_page_at_a_time(monkeypatch, clock, make_event):
+    monkeypatch.setattr(flow_graph, "REBUILD_PAGE", 3)
+    fake_redis = FakeRedis(decode_responses=True)
+    graph = FlowGraph(fake_redis, horizon_seconds=300, clock=clock)
+    local = FlowGraph(horizon_seconds=300, clock=clock)
+    for step in range(40):
+        event = make_event(f"a{step % 13}", f"b{step % 3}", step + 1)
+        await graph.record(event)
+        local.record_local(event, clock.now)
+        clock.now += GRAPH_BUCKET_SECONDS / 4
+    # Lose the totals (as after a key migration): the next snapshot rebuilds them.
+    await fake_redis.delete(*graph._total_keys(0))
+
+    folds = []
+    eval_ = fake_redis.eval
+    other = FlowGraph(fake_redis, horizon_seconds=300, clock=clock)
+
+    async def _eval(script, numkeys, *args):
+        if script == flow_graph.GRAPH_FOLD:
+            if not folds:
+                # Another node keeps writing while the rebuild is under way.
+                event = make_event("a1", "b1", 1000)
+                await other.record(event)
+                local.record_local(event, clock.now)
+            folds.append(len(args[numkeys + 2:]) // 3)
+        return await eval_(script, numkeys, *args)
+
+    monkeypatch.setattr(fake_redis, "eval", _eval)
+    assert _links(await graph.snapshot()) == _links(await local.snapshot())
+    assert len(folds) > 1 and max(folds) <= 3
+    assert not await fake_redis.exists(graph.keys.graph("rebuild:amount"))
@@ -0,0 +1,75 @@
+import pytest
+
+from backend.graph_analytics import FAN_IN_MIN_SENDERS, RingDetector
+from backend.l1_screening import L1Engine
+
+
+@pytest.fixture
+def clock(clock):
+    # Every reading moves the detector's clock on by a second.
+    clock.tick = 1
+    return clock
+
+
+def test_fan_in_hub_detected_with_all_senders(clock, make_event):
+    detector = RingDetector(clock=clock)
+    detections = []
+    for i in range(FAN_IN_MIN_SENDERS):
+        detections = detector.observe(make_event(f"mule_{i}", "boss"))
+    assert [d.pattern for d in detections] == ["FAN_IN"]
+    assert detections[0].members == tuple(f"mule_{i}" for i in range(FAN_IN_MIN_SENDERS)) + ("boss",)
+
+
+def test_layering_chain_of_decaying_amounts(clock, make_event):
+    detector = RingDetector(clock=clock)
+    amount = 400_000
+    chain = ["A", "B", "C", "D"]
+    detections = []
+    for src, dst in zip(chain, chain[1:]):
+        detections = detector.observe(make_event(src, dst, amount))
+        amount = int(amount * 0.95)
+    assert [d.pattern for d in detections] == ["CHAIN"]
+    assert detections[0].members == ("A", "B", "C", "D")
+
+
+def test_chain_ignores_amount_jumps(clock, make_event):
+    detector = RingDetector(clock=clock)
+    detector.observe(make_event("A", "B", 100))
+    detector.observe(make_event("B", "C", 100_000))
+    assert detector.observe(make_event("C", "D", 99_000)) == []
+
+
+def test_cycle_closed_by_new_edge(clock, make_event):
+    detector = RingDetector(clock=clock)
+    detector.observe(make_event("A", "B", 10))
+    detector.observe(make_event("B", "C", 5_000))
+    detections = detector.observe(make_event("C", "A", 10))
+    assert [d.pattern for d in detections] == ["CYCLE"]
+    assert set(detections[0].members) == {"A", "B", "C"}
+
+
+def test_edges_expire_outside_window_and_capacity(clock, make_event):
+    detector = RingDetector(window_seconds=10, max_edges=3, clock=clock)
+    for i in range(5):
+        detector.observe(make_event(f"s{i}", "hub"))
+    assert detector.edge_count == 3
+
+    clock.now += 100
+    detector.observe(make_event("late", "hub"))
+    assert detector.edge_count == 1
+
+
+@pytest.mark.asyncio
+async def test_r5_is_opt_in_and_attaches_ring_members(make_event):
+    default_engine = L1Engine()
+    ring_engine = L1Engine(optional_rules={"R5"})
+    result = None
+    for i in range(FAN_IN_MIN_SENDERS):
+        event = make_event(f"mule_{i}", "boss", amount=100, event_id=f"evt_{i}")
+        assert "R5" not in (await default_engine.screen(event)).triggered_rules
+        result = await ring_engine.screen(event)
+
+    assert "R5" in result.triggered_rules
+    assert result.needs_l2 is True
+    assert result.ring_patterns == ["FAN_IN"]
+    assert "boss" in result.ring_members
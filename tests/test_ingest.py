@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from fastapi.testclient import TestClient
+
+import backend.main as main_module
+from backend.ingest import MAX_ATTEMPTS, SEEN_KEY_PREFIX, EventIngestor, IngestBacklogFull
+from backend.main import app
+from backend.models import GameEventLog
+from backend.redis_client import CircuitBreaker
+from backend.wal import WriteAheadLog
+
+
+class Handler:
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.seen: list[str] = []
+
+    async def __call__(self, event: GameEventLog) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("screening failed")
+        self.seen.append(event.event_id)
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis(decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_redis_ingest_dedups_and_drains(fake_redis, make_event):
+    handler = Handler()
+    ingestor = EventIngestor(handler, fake_redis, consumers=1, consumer_prefix="n1")
+
+    first = await ingestor.submit(make_event(event_id="e1"))
+    again = await ingestor.submit(make_event(event_id="e1"))
+    await ingestor.submit(make_event(event_id="e2"))
+    assert (first["queue"], first["duplicate"], again["duplicate"]) == ("redis", False, True)
+    assert handler.seen == []
+
+    assert await ingestor.poll_once("n1:0") == 2
+    assert handler.seen == ["e1", "e2"]
+    assert await fake_redis.xlen(ingestor.stream) == 0
+    assert await fake_redis.get(f"{SEEN_KEY_PREFIX}e1") == "done"
+    assert (await ingestor.submit(make_event(event_id="e1")))["duplicate"] is True
+
+
+@pytest.mark.asyncio
+async def test_failed_events_are_redelivered_once_done(fake_redis, make_event):
+    handler = Handler(failures=1)
+    ingestor = EventIngestor(handler, fake_redis, consumer_prefix="n1", claim_idle_ms=0)
+    await ingestor.submit(make_event(event_id="e1"))
+
+    assert await ingestor.poll_once("n1:0") == 0
+    assert await ingestor.poll_once("n1:1") == 1  # claimed from the first consumer
+    assert handler.seen == ["e1"]
+
+    # A re-delivery of an event that was already screened is skipped.
+    await fake_redis.xadd(ingestor.stream, {"event": make_event(event_id="e1").model_dump_json()})
+    assert await ingestor.poll_once("n1:0") == 0
+    assert handler.seen == ["e1"]
+
+
+@pytest.mark.asyncio
+async def test_local_queue_without_redis(make_event):
+    handler = Handler()
+    ingestor = EventIngestor(handler, local_max=2)
+    assert (await ingestor.submit(make_event(event_id="e1")))["queue"] == "local"
+    assert (await ingestor.submit(make_event(event_id="e1")))["duplicate"] is True
+    await ingestor.submit(make_event(event_id="e2"))
+    with pytest.raises(IngestBacklogFull):
+        await ingestor.submit(make_event(event_id="e3"))
+
+    assert await ingestor.drain_local() == 2
+    assert handler.seen == ["e1", "e2"]
+    assert (await ingestor.status())["local_backlog"] == 0
+
+
+def test_queued_mode_accepts_with_202(monkeypatch, make_event):
+    handler = Handler()
+    ingestor = EventIngestor(handler)
+    monkeypatch.setattr(main_module, "ingestor", ingestor)
+    client = TestClient(app)
+
+    response = client.post("/api/v1/events", json=make_event(event_id="api_e1").model_dump(mode="json"))
+    assert response.status_code == 202
+    assert response.json() == {"status": "accepted", "event_id": "api_e1", "queue": "local", "duplicate": False}
+    assert handler.seen == []
+
+    asyncio.run(ingestor.drain_local())
+    assert handler.seen == ["api_e1"]
+    assert client.get("/api/v1/ingest").json()["processed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_stream_rejects_instead_of_trimming(fake_redis, make_event):
+    handler = Handler()
+    ingestor = EventIngestor(handler, fake_redis, maxlen=2, consumer_prefix="n1")
+    await ingestor.submit(make_event(event_id="e1"))
+    await ingestor.submit(make_event(event_id="e2"))
+    with pytest.raises(IngestBacklogFull):
+        await ingestor.submit(make_event(event_id="e3"))
+    assert await fake_redis.xlen(ingestor.stream) == 2
+    assert await fake_redis.get(f"{SEEN_KEY_PREFIX}e3") is None
+
+    # Nothing accepted was lost, and the rejected event is taken once there is room.
+    assert await ingestor.poll_once("n1:0") == 2
+    assert (await ingestor.submit(make_event(event_id="e3")))["duplicate"] is False
+    assert await ingestor.poll_once("n1:0") == 1
+    assert handler.seen == ["e1", "e2", "e3"]
+
+
+@pytest.mark.asyncio
+async def test_degraded_submissions_are_durable_and_screened_once(fake_redis, tmp_path, make_event):
+    now = [1000.0]
+    breaker = CircuitBreaker(threshold=1, cooldown=5, clock=lambda: now[0])
+    breaker.record_failure()
+    with pytest.raises(IngestBacklogFull):
+        await EventIngestor(Handler(), fake_redis, breaker=breaker).submit(make_event(event_id="e1"))
+
+    wal = WriteAheadLog(tmp_path)
+    ingestor = EventIngestor(Handler(), fake_redis, breaker=breaker, wal=wal)
+    assert (await ingestor.submit(make_event(event_id="e1")))["queue"] == "wal"
+    assert (await ingestor.submit(make_event(event_id="e1")))["duplicate"] is True
+    await ingestor.submit(make_event(event_id="e2"))
+    await wal.close()
+
+    # A restarted process, still degraded, finds both events in the WAL.
+    handler = Handler()
+    ingestor = EventIngestor(handler, fake_redis, breaker=breaker, wal=WriteAheadLog(tmp_path), consumer_prefix="n1")
+    assert [ingestor.restore_from_wal(kind, data, lsn) for lsn, kind, data in ingestor.wal.records()] == [True, True]
+    assert await ingestor.replay_degraded_writes() == 0
+
+    now[0] += 6
+    await fake_redis.set(f"{SEEN_KEY_PREFIX}e2", "done")  # e2 also arrived through Redis meanwhile
+    assert await ingestor.replay_degraded_writes() == 2
+    assert ingestor.pending_writes == 0
+    assert await ingestor.poll_once("n1:0") == 1
+    assert handler.seen == ["e1"]
+
+
+@pytest.mark.asyncio
+async def test_delivery_attempts_are_shared_by_consumers(fake_redis, make_event):
+    ingestor = EventIngestor(Handler(failures=MAX_ATTEMPTS), fake_redis, consumer_prefix="n1", claim_idle_ms=0)
+    await ingestor.submit(make_event(event_id="e1"))
+    for attempt in range(MAX_ATTEMPTS - 1):
+        # A fresh ingestor per try, as if each consumer process had died.
+        consumer = EventIngestor(ingestor.handler, fake_redis, consumer_prefix=f"n{attempt}", claim_idle_ms=0)
+        assert await consumer.poll_once(f"n{attempt}:0") == 0
+    assert await ingestor.poll_once("n1:0") == 1  # dropped on the last allowed delivery
+    assert await fake_redis.xlen(ingestor.stream) == 0
@@ -0,0 +1,32 @@
+import pytest
+
+from backend.job_codec import JOB_FORMAT_VERSION, L2JobRef, decode_job, encode_job
+
+
+def test_round_trip_is_compact():
+    ref = L2JobRef("user_1", "evt_42", ["R1", "R4"], enqueue_ts=1_700_000_000.1234)
+
+    payload = encode_job(ref)
+
+    assert payload == f'[{JOB_FORMAT_VERSION},"user_1","evt_42",["R1","R4"],1700000000.123,"normal","target"]'
+    decoded = decode_job(payload.encode())
+    assert (decoded.target_id, decoded.trigger_event_id, decoded.triggered_rules) == ("user_1", "evt_42", ["R1", "R4"])
+    assert decoded.enqueue_ts == pytest.approx(1_700_000_000.123)
+
+
+def test_version_1_payloads_decode_into_the_default_lane():
+    decoded = decode_job('[1,"user_1","evt_42",["R1"],1700000000.0]')
+    assert decoded.lane == "normal"
+    assert decode_job(encode_job(L2JobRef("u", "e", [], lane="critical"))).lane == "critical"
+
+
+def test_version_2_payloads_decode_as_receiver_side_jobs():
+    decoded = decode_job('[2,"user_1","evt_42",["R1"],1700000000.0,"critical"]')
+    assert (decoded.lane, decoded.side) == ("critical", "target")
+    assert decode_job(encode_job(L2JobRef("u", "e", ["R6"], side="actor"))).side == "actor"
+
+
+@pytest.mark.parametrize("payload", ["not json", "{}", "[]", '[99,"u","e",[],0]'])
+def test_unknown_or_malformed_payloads_are_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_job(payload)
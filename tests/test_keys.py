@@ -0,0 +1,213 @@
+import time
+
+import pytest
+from fakeredis._socket import BaseFakeSocket
+from fakeredis.aioredis import FakeRedis
+from redis.crc import key_slot
+
+from backend.key_migration import migrate_key_layout
+from backend.keys import LEGACY_KEYS, KeySchema
+from backend.l1_screening import L1Engine
+from backend.models import AccountState
+from backend.state_machine import StateMachine
+from backend.windowing import SlidingWindowStore, WindowSide
+
+CLUSTER = KeySchema("cluster", shards=4)
+
+
+def _hash_tag(key: str) -> str:
+    return key[key.index("{") + 1:key.index("}")]
+
+
+_UNKEYED = {"multi", "exec", "discard", "ping", "keys", "scan", "info", "time", "select", "client", "hello"}
+
+
+def _keys_of(fields: list[bytes]) -> list[bytes]:
+    """The key arguments of one command, as Redis Cluster routes it."""
+    cmd, args = fields[0].decode().lower(), fields[1:]
+    if cmd in _UNKEYED:
+        return []
+    if cmd in ("eval", "evalsha", "zunion", "zinter", "zdiff"):
+        at = 1 if cmd.startswith("eval") else 0
+        return args[at + 1:at + 1 + int(args[at])]
+    if cmd in ("del", "unlink", "exists", "mget", "touch", "watch", "sunion", "sinter", "sdiff", "pfcount", "pfmerge"):
+        return args
+    if cmd in ("rename", "renamenx", "smove", "lmove", "rpoplpush", "copy"):
+        return args[:2]
+    if cmd in ("mset", "msetnx"):
+        return args[::2]
+    return args[:1]
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis(decode_responses=True)
+
+
+def test_cluster_keys_share_the_user_hash_tag():
+    keys = [
+        CLUSTER.window("target", "u:1"),
+        CLUSTER.window("actor", "u:1"),
+        CLUSTER.rollup("target", "1m", "u:1"),
+        CLUSTER.distinct("actor", "u:1", 42),
+        CLUSTER.lock("u:1"),
+        CLUSTER.state("u:1"),
+    ]
+    assert {_hash_tag(k) for k in keys} == {"u:1"}
+    shard = CLUSTER.aggregate_shard("u:1")
+    assert shard in CLUSTER.aggregate_shards
+    assert _hash_tag(CLUSTER.state_counts(shard)) == _hash_tag(CLUSTER.transitions(shard)) == f"s{shard}"
+    assert LEGACY_KEYS.window("target", "u:1") == "susanoh:window:u:1"
+    assert LEGACY_KEYS.aggregate_shards == range(1)
+
+
+@pytest.mark.asyncio
+async def test_state_machine_on_cluster_layout(fake_redis):
+    sm = StateMachine(fake_redis, keys=CLUSTER)
+    users = [f"u_{i}" for i in range(12)]
+    for uid in users:
+        await sm.transition(uid, AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    await sm.apply_l2_verdicts([("u_0", AccountState.BANNED, 95), ("u_1", AccountState.NORMAL, 5)])
+
+    assert not await fake_redis.exists(LEGACY_KEYS.accounts, LEGACY_KEYS.state_counts())
+    assert await fake_redis.get(CLUSTER.state("u_0")) == "BANNED"
+    stats = await sm.get_stats()
+    assert (stats["RESTRICTED_WITHDRAWAL"], stats["BANNED"], stats["NORMAL"]) == (10, 1, 1)
+    assert stats["total_accounts"] == 12
+    assert stats["total_transitions"] == 15
+
+    transitions = await sm.get_transitions(limit=3)
+    assert [log.user_id for log in transitions] == ["u_1", "u_0", "u_0"]
+
+    seen, cursor = [], 0
+    while True:
+        page, cursor = await sm.get_users_page(AccountState.RESTRICTED_WITHDRAWAL, cursor, limit=2)
+        seen += [row["user_id"] for row in page]
+        if cursor == 0:
+            break
+    assert sorted(seen) == sorted(users[2:])
+    assert len(await sm.get_all_users()) == 12
+
+    await fake_redis.hset(CLUSTER.state_counts(CLUSTER.aggregate_shard("u_5")), "NORMAL", 99)
+    counts = await sm.reconcile_state_aggregates()
+    assert counts["NORMAL"] == 1 and counts["RESTRICTED_WITHDRAWAL"] == 10
+
+    await sm.reset()
+    assert await fake_redis.keys("susanoh:*") == []
+
+
+@pytest.mark.asyncio
+async def test_windows_use_cluster_keys(fake_redis, make_event):
+    engine = L1Engine(fake_redis, keys=CLUSTER)
+    await engine.screen(make_event("alice", "bob", 100, "e1"))
+
+    keys = await fake_redis.keys("susanoh:*")
+    assert CLUSTER.window("target", "bob") in keys
+    assert CLUSTER.window("actor", "alice") in keys
+    assert CLUSTER.screening("total_events") in keys
+    assert not any(k.startswith(("susanoh:window:", "susanoh:actor_window:", "susanoh:total_events")) for k in keys)
+    assert (await engine.get_counters())["total_events"] == 1
+
+
+@pytest.mark.asyncio
+async def test_migration_moves_legacy_layout(fake_redis, make_event):
+    legacy_sm = StateMachine(fake_redis, keys=LEGACY_KEYS)
+    legacy_store = SlidingWindowStore(fake_redis, keys=LEGACY_KEYS)
+    for i in range(6):
+        await legacy_sm.transition(f"m_{i}", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+        await legacy_store.add(make_event(f"a_{i}", f"m_{i}", 100, f"e{i}"))
+    await legacy_sm.transition("m_0", AccountState.UNDER_SURVEILLANCE, "TEST", "RULE")
+    await fake_redis.expire(LEGACY_KEYS.window("target", "m_1"), 500)
+    legacy_l1 = L1Engine(fake_redis, optional_rules=set(), keys=LEGACY_KEYS)
+    for i in range(40):
+        await legacy_l1.screen(make_event(f"a_{i % 7}", f"t_{i % 5}", 100 + i, f"s{i}", item_id=f"itm_{i % 3}"))
+    graph = await legacy_l1.flow_graph.snapshot()
+    boards = await legacy_l1.leaderboards.top()
+    price = await legacy_l1.market_prices.estimate("itm_1", time.time())
+    recent = await legacy_l1.get_recent_events(limit=10)
+    assert graph["links"] and boards["receivers"] and price is not None
+
+    dry = await migrate_key_layout(fake_redis, CLUSTER)
+    assert dry["accounts"] == 6 and dry["transitions"] == 7 and dry["renamed"] > 0
+    assert await fake_redis.exists(LEGACY_KEYS.accounts)
+
+    moved = await migrate_key_layout(fake_redis, CLUSTER, apply=True)
+    assert moved == dry
+    assert await fake_redis.keys("susanoh:window:*") == []
+    assert 0 < await fake_redis.ttl(CLUSTER.window("target", "m_1")) <= 500
+
+    sm = StateMachine(fake_redis, keys=CLUSTER)
+    stats = await sm.get_stats()
+    assert (stats["RESTRICTED_WITHDRAWAL"], stats["UNDER_SURVEILLANCE"], stats["total_transitions"]) == (5, 1, 7)
+    assert await sm.get_or_create("m_0") == AccountState.UNDER_SURVEILLANCE
+    store = SlidingWindowStore(fake_redis, keys=CLUSTER)
+    assert len(await store.events(WindowSide.TARGET, "m_2")) == 1
+
+    l1 = L1Engine(fake_redis, optional_rules=set(), keys=CLUSTER)
+    # The rebuilt rank may order equally weighted edges differently.
+    snapshot = await l1.flow_graph.snapshot()
+    assert snapshot["version"] == graph["version"]
+    assert sorted(snapshot["links"], key=str) == sorted(graph["links"], key=str)
+    assert await l1.leaderboards.top() == boards
+    assert await l1.market_prices.estimate("itm_1", time.time()) == price
+    assert await l1.get_recent_events(limit=10) == recent
+    assert await l1.get_counters() == {"total_events": 40, "l1_flags": 0}
+    assert await fake_redis.exists(l1.keys.price_lru)
+    assert [k for k in await fake_redis.keys("susanoh:*") if not k.startswith("susanoh:{")] == []
+
+    assert await migrate_key_layout(fake_redis, CLUSTER, apply=True) == {
+        "accounts": 0, "transitions": 0, "renamed": 0
+    }
+
+
+@pytest.mark.asyncio
+async def test_cluster_layout_keeps_every_multi_key_command_in_one_slot(fake_redis, monkeypatch, make_event):
+    commands: list[tuple[int, list[bytes]]] = []
+    process = BaseFakeSocket._process_command
+
+    def _record(sock, fields):
+        commands.append((id(sock), list(fields)))
+        return process(sock, fields)
+
+    monkeypatch.setattr(BaseFakeSocket, "_process_command", _record)
+
+    engine = L1Engine(fake_redis, optional_rules=set(), keys=CLUSTER)
+    engine.market_prices.max_items = 2
+    sm = StateMachine(fake_redis, keys=CLUSTER)
+    for i in range(300):  # enough updates for a price LRU eviction
+        await engine.screen(make_event(f"a_{i % 7}", f"t_{i % 5}", 100 + i, f"e{i}", item_id=f"itm_{i % 4}"))
+    await engine.flow_graph.snapshot()
+    await engine.leaderboards.top()
+    await engine.get_counters()
+    await sm.transition("t_0", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "R1")
+    await sm.apply_l2_verdicts([("t_0", AccountState.BANNED, 95), ("t_1", AccountState.NORMAL, 5)], ["t_0:e1", "t_1:e2"])
+    await sm._release_claims(["t_0:e1", "t_1:e2"])
+    await sm.reconcile_state_aggregates()
+    await sm.get_stats()
+    await sm.reset()
+    await engine.reset()
+    assert await fake_redis.keys("susanoh:*") == []
+
+    cross_slot, multi_key, transactions = [], set(), {}
+    for sock, fields in commands:
+        cmd = fields[0].decode().lower()
+        keys = _keys_of(fields)
+        if len(keys) > 1:
+            multi_key.add(cmd)
+            if len({key_slot(k) for k in keys}) > 1:
+                cross_slot.append(fields)
+        if cmd == "multi":
+            transactions[sock] = []
+        elif cmd == "exec":
+            queued = transactions.pop(sock, [])
+            if len({key_slot(k) for k in queued}) > 1:
+                cross_slot.append(["MULTI", *queued])
+        elif sock in transactions:
+            transactions[sock] += keys
+    assert cross_slot == []
+    assert {"eval", "zunion", "mget", "del"} <= multi_key
+
+    # The economy-wide views are spread over the aggregate shards, not one hot slot each.
+    for view in (b":recent_events", b":graph:", b":lb:"):
+        slots = {key_slot(k) for _, fields in commands for k in _keys_of(fields) if view in k}
+        assert len(slots) > 1, view
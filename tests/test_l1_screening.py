@@ -1,5 +1,7 @@
+from functools import partial
+
 import pytest
-from backend.models import ActionDetails, ContextMetadata, GameEventLog, AccountState
+from backend.models import AccountState
 from backend.l1_screening import L1Engine
 
 
@@ -8,76 +10,60 @@ def engine():
     return L1Engine()
 
 
-def _make_event(
-    actor="a",
-    target="b",
-    amount=100,
-    market_avg=1000,
-    chat=None,
-    eid="evt_test",
-):
-    return GameEventLog(
-        event_id=eid,
-        actor_id=actor,
-        target_id=target,
-        action_details=ActionDetails(
-            currency_amount=amount,
-            market_avg_price=market_avg,
-        ),
-        context_metadata=ContextMetadata(
-            recent_chat_log=chat,
-        ),
-    )
+@pytest.fixture
+def make_event(make_event):
+    # Small transfers at a known market price, so a test only trips the rule it targets.
+    return partial(make_event, actor="a", target="b", amount=100, event_id="evt_test", market_avg_price=1000)
 
 
 @pytest.mark.asyncio
-async def test_r1_amount_threshold(engine):
+async def test_r1_amount_threshold(engine, make_event):
     """R1: 累計取引額 >= 1,000,000 G"""
-    event = _make_event(amount=1_100_000)
+    event = make_event(amount=1_100_000)
     result = await engine.screen(event)
     assert "R1" in result.triggered_rules
     assert result.screened is True
 
 
 @pytest.mark.asyncio
-async def test_r2_transaction_count(engine):
+async def test_r2_transaction_count(engine, make_event):
     """R2: 取引回数 >= 10回"""
     for i in range(10):
-        result = await engine.screen(_make_event(amount=100, eid=f"evt_{i}"))
+        result = await engine.screen(make_event(amount=100, event_id=f"evt_{i}"))
     assert "R2" in result.triggered_rules
 
 
 @pytest.mark.asyncio
-async def test_r3_market_avg_multiplier(engine):
+async def test_r3_market_avg_multiplier(engine, make_event):
     """R3: 単発取引額が市場平均の100倍以上"""
-    event = _make_event(amount=100_000, market_avg=10)
+    event = make_event(amount=100_000, market_avg_price=10)
     result = await engine.screen(event)
     assert "R3" in result.triggered_rules
 
 
 @pytest.mark.asyncio
-async def test_r4_slang_detection(engine):
+async def test_r4_slang_detection(engine, make_event):
     """R4: 隠語正規表現に一致"""
-    event = _make_event(chat="Dで確認しました。振込お願いします")
+    event = make_event(chat="Dで確認しました。振込お願いします")
     result = await engine.screen(event)
     assert "R4" in result.triggered_rules
     assert result.needs_l2 is True
 
 
 @pytest.mark.asyncio
-async def test_no_trigger_normal_trade(engine):
-    event = _make_event(amount=500, market_avg=1000, chat="よろしく！")
+async def test_no_trigger_normal_trade(engine, make_event):
+    event = make_event(amount=500, market_avg_price=1000, chat="よろしく！")
     result = await engine.screen(event)
     assert result.screened is False
     assert result.triggered_rules == []
 
 
 @pytest.mark.asyncio
-async def test_recent_events(engine):
-    await engine.screen(_make_event(eid="evt_safe", amount=500, market_avg=1000, chat="よろしく"))
-    await engine.screen(_make_event(eid="evt_r4", chat="Dで確認しました。振込お願いします"))
+async def test_recent_events(engine, make_event):
+    await engine.screen(make_event(event_id="evt_safe", amount=500, market_avg_price=1000, chat="よろしく"))
+    await engine.screen(make_event(event_id="evt_r4", chat="Dで確認しました。振込お願いします"))
     for i in range(3):
-        await engine.screen(_make_event(eid=f"evt_{i}"))
+        await engine.screen(make_event(event_id=f"evt_{i}"))
     events = await engine.get_recent_events(limit=3)
     assert len(events) == 3
     assert isinstance(events[0], dict)
@@ -86,8 +72,8 @@ async def test_recent_events(engine):
 
 
 @pytest.mark.asyncio
-async def test_build_analysis_request(engine):
-    event = _make_event(amount=2_000_000, chat="振込完了")
+async def test_build_analysis_request(engine, make_event):
+    event = make_event(amount=2_000_000, chat="振込完了")
     await engine.screen(event)
     req = await engine.build_analysis_request("b", event, ["R1", "R4"], AccountState.RESTRICTED_WITHDRAWAL)
     assert req.user_profile.user_id == "b"
@@ -95,8 +81,8 @@ async def test_build_analysis_request(engine):
 
 
 @pytest.mark.asyncio
-async def test_reset_clears_windows_and_counters(engine):
-    await engine.screen(_make_event(eid="evt_reset", amount=1_200_000))
+async def test_reset_clears_windows_and_counters(engine, make_event):
+    await engine.screen(make_event(event_id="evt_reset", amount=1_200_000))
     assert engine.l1_flag_count > 0
     assert len(engine.recent_events) == 1
 
@@ -105,3 +91,30 @@ async def test_reset_clears_windows_and_counters(engine):
     assert engine.l1_flag_count == 0
     assert len(engine.recent_events) == 0
     assert len(engine.user_windows) == 0
+
+
+@pytest.mark.asyncio
+async def test_outflow_rules_are_opt_in(make_event):
+    default_engine = L1Engine(optional_rules=set())
+    for i in range(5):
+        result = await default_engine.screen(make_event(actor="payer", target=f"t{i}", amount=300_000, market_avg_price=None, event_id=f"e{i}"))
+    assert "R6" not in result.triggered_rules
+    assert "R7" not in result.triggered_rules
+    assert len(default_engine.actor_windows["payer"].events) == 5
+
+
+@pytest.mark.asyncio
+async def test_r6_outflow_velocity_and_r7_fan_out(make_event):
+    engine = L1Engine(optional_rules={"R6", "R7"})
+    for i in range(4):
+        result = await engine.screen(make_event(actor="payer", target=f"t{i}", amount=300_000, market_avg_price=None, event_id=f"e{i}"))
+    assert result.triggered_rules == ["R6"]
+
+    result = await engine.screen(make_event(actor="payer", target="t4", amount=100, event_id="e4"))
+    assert result.triggered_rules == ["R6", "R7"]
+
+    req = await engine.build_analysis_request("payer", make_event(actor="payer", event_id="e4"), ["R6", "R7"], AccountState.NORMAL)
+    assert req.user_profile.total_sent_5min == 1_200_100
+    assert req.user_profile.unique_receivers_5min == 5
+    assert req.user_profile.total_received_5min == 0
+    assert len(req.related_events) == 5
@@ -1,3 +1,4 @@
+import json
 import os
 import pytest
 from backend.models import (
@@ -216,3 +217,78 @@ async def test_analyze_with_overrides_can_exercise_json_parse_fallback():
     finally:
         if old is not None:
             os.environ["GEMINI_API_KEY"] = old
+
+
+def _request_for(user_id: str) -> AnalysisRequest:
+    request = _make_request()
+    request.user_profile.user_id = user_id
+    request.trigger_event.target_id = user_id
+    return request
+
+
+@pytest.mark.asyncio
+async def test_analyze_batch_maps_results_and_falls_back_for_missing_targets():
+    engine = L2Engine()
+    prompts: list[list[str]] = []
+    single_calls: list[str] = []
+
+    async def _batch_call(requests, api_key):
+        prompts.append([r.user_profile.user_id for r in requests])
+        return json.dumps([
+            {"target_id": "u2", "is_fraud": False, "risk_score": 10, "fraud_type": "LEGITIMATE",
+             "recommended_action": "NORMAL", "reasoning": "ok", "confidence": 0.9},
+            {"target_id": "u1", "is_fraud": True, "risk_score": 95, "fraud_type": "RMT_SMURFING",
+             "recommended_action": "BANNED", "reasoning": "smurfing", "confidence": 0.95},
+        ])
+
+    async def _single_call(request, api_key):
+        single_calls.append(request.user_profile.user_id)
+        raise TimeoutError("slow")
+
+    results = await engine.analyze_batch(
+        [_request_for("u1"), _request_for("u2"), _request_for("u3"), _request_for("u1")],
+        api_key="batch-key",
+        gemini_batch_call=_batch_call,
+        gemini_call=_single_call,
+    )
+
+    assert prompts == [["u1", "u2", "u3"]]
+    assert [r.target_id for r in results] == ["u1", "u2", "u3", "u1"]
+    assert results[0].recommended_action == AccountState.BANNED
+    assert results[1].recommended_action == AccountState.NORMAL
+    # u3 was missing from the response and the repeated u1 cannot be told apart in one prompt.
+    assert single_calls == ["u3", "u1"]
+    assert "Local fallback: API error" in results[2].reasoning
+    assert len(await engine.get_analyses()) == 4
+
+
+@pytest.mark.asyncio
+async def test_analyze_batch_api_error_falls_back_for_every_request():
+    engine = L2Engine()
+
+    async def _batch_call(requests, api_key):
+        raise RuntimeError("quota exceeded")
+
+    results = await engine.analyze_batch(
+        [_request_for("u1"), _request_for("u2")],
+        api_key="batch-key",
+        gemini_batch_call=_batch_call,
+    )
+
+    assert [r.target_id for r in results] == ["u1", "u2"]
+    assert all("quota exceeded" in r.reasoning for r in results)
+
+
+@pytest.mark.asyncio
+async def test_max_results_evicts_oldest_in_memory_results():
+    old = os.environ.pop("GEMINI_API_KEY", None)
+    try:
+        engine = L2Engine(max_results=2)
+        for user_id in ("u1", "u2", "u3"):
+            await engine.analyze(_request_for(user_id))
+
+        assert [r.target_id for r in engine.analysis_results] == ["u2", "u3"]
+        assert await engine.get_analysis_count() == 3
+    finally:
+        if old is not None:
+            os.environ["GEMINI_API_KEY"] = old
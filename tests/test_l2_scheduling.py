@@ -0,0 +1,53 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.l2_scheduling import LANES_BY_NAME, LaneMetrics, dispatch_at, lane_for
+from backend.models import AnalysisRequest, GameEventLog, UserProfile
+
+
+def _request(rules, amount=0, senders=0):
+    return AnalysisRequest(
+        trigger_event=GameEventLog(event_id="e1", actor_id="a", target_id="u"),
+        triggered_rules=rules,
+        user_profile=UserProfile(user_id="u", total_received_5min=amount, unique_senders_5min=senders),
+    )
+
+
+def test_smurfing_hubs_outrank_slang_only_hits():
+    assert lane_for(_request(["R4"])).name == "normal"
+    assert lane_for(_request(["R1"], amount=1_500_000)).name == "high"
+    assert lane_for(_request(["R1", "R2"], amount=3_000_000, senders=8)).name == "critical"
+
+
+def test_dispatch_order_is_earliest_deadline_first_with_aging():
+    critical, normal = LANES_BY_NAME["critical"], LANES_BY_NAME["normal"]
+    now = 1_000_000.0
+
+    assert dispatch_at(critical, now) < dispatch_at(normal, now)
+    # A normal job waiting longer than the budget gap is served before a fresh critical one.
+    assert dispatch_at(normal, now - 600) < dispatch_at(critical, now)
+    assert dispatch_at(normal, now).timestamp() <= now
+
+
+@pytest.mark.parametrize("use_redis", [False, True])
+@pytest.mark.asyncio
+async def test_lane_metrics_track_depth_and_wait(use_redis):
+    metrics = LaneMetrics(FakeRedis(decode_responses=True) if use_redis else None)
+    critical = LANES_BY_NAME["critical"]
+
+    await metrics.record_enqueue(critical)
+    await metrics.record_enqueue(critical)
+    await metrics.record_start(critical, 10.0)
+    await metrics.record_start(critical, 50.0)
+    await metrics.record_enqueue(LANES_BY_NAME["normal"])
+
+    snapshot = await metrics.snapshot()
+    assert snapshot["critical"] == {
+        "deadline_seconds": 30,
+        "depth": 0,
+        "started": 2,
+        "avg_wait_seconds": 30.0,
+        "deadline_misses": 1,
+    }
+    assert snapshot["normal"]["depth"] == 1
+    assert snapshot["high"]["started"] == 0
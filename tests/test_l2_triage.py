@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from backend.l2_gemini import L2Engine
+from backend.l2_triage import DEFAULT_WEIGHTS, L2Triage, TriageModel, fit_triage_model
+from backend.models import (
+    AccountState,
+    ActionDetails,
+    AnalysisRequest,
+    ContextMetadata,
+    FraudType,
+    GameEventLog,
+    UserProfile,
+)
+
+
+def _request(rules, *, senders=1, received=1_000, age=365, level=50):
+    return AnalysisRequest(
+        trigger_event=GameEventLog(
+            event_id="evt_triage",
+            actor_id="a",
+            target_id="b",
+            action_details=ActionDetails(currency_amount=received),
+            context_metadata=ContextMetadata(account_age_days=age, actor_level=level),
+        ),
+        triggered_rules=rules,
+        user_profile=UserProfile(
+            user_id="b",
+            current_state=AccountState.RESTRICTED_WITHDRAWAL,
+            total_received_5min=received,
+            unique_senders_5min=senders,
+        ),
+    )
+
+
+def test_obvious_smurfing_is_settled_locally_as_fraud():
+    triage = L2Triage()
+    result = triage.resolve(_request(["R1", "R2", "R3", "R4"], senders=8, received=2_000_000, age=1, level=2))
+    assert result.is_fraud is True
+    assert result.fraud_type == FraudType.RMT_SMURFING
+    # The hand-set weights are not calibrated: they restrict, only Gemini bans.
+    assert (result.risk_score, result.recommended_action) == (70, AccountState.UNDER_SURVEILLANCE)
+    assert triage.counts == {"local_fraud": 1, "local_clear": 0, "escalated": 0}
+
+
+@pytest.mark.parametrize("rule", sorted(r for r in DEFAULT_WEIGHTS if r.startswith("R")))
+def test_hand_set_weights_never_clear_a_single_rule_hit(rule):
+    triage = L2Triage()
+    assert triage.resolve(_request([rule])) is None
+    assert triage.counts == {"local_fraud": 0, "local_clear": 0, "escalated": 1}
+
+
+def test_fitted_model_clears_weak_single_rule_on_veteran_account():
+    samples = [(_request(["R1", "R2", "R3", "R4"], senders=8, received=2_000_000, age=1, level=2), True)] * 20
+    samples += [(_request(["R1"], senders=5, received=1_500_000, age=3, level=3), True)] * 10
+    samples += [(_request([rule]), False) for rule in ("R2", "R3", "R5")] * 10
+    model = fit_triage_model(samples)
+    assert model.probability(_request(["R2"])) < 0.1 < 0.9 < model.probability(samples[0][0])
+
+    result = L2Triage(model).resolve(_request(["R2"]))
+    assert result.is_fraud is False
+    assert result.recommended_action == AccountState.NORMAL
+    assert L2Triage(model).resolve(samples[0][0]).recommended_action == AccountState.BANNED
+
+    with pytest.raises(ValueError):
+        fit_triage_model(samples[:20])
+
+
+def test_ambiguous_middle_band_is_escalated():
+    triage = L2Triage()
+    assert triage.resolve(_request(["R1"], senders=2, received=1_200_000)) is None
+    assert triage.counts["escalated"] == 1
+
+
+def test_triage_is_opt_in_and_band_is_configurable(monkeypatch, tmp_path):
+    monkeypatch.delenv("SUSANOH_L2_TRIAGE", raising=False)
+    assert L2Triage.from_env() is None
+
+    model_path = tmp_path / "triage.json"
+    model_path.write_text(json.dumps({"bias": 0.0, "weights": {}}))
+    monkeypatch.setenv("SUSANOH_L2_TRIAGE", "1")
+    monkeypatch.setenv("SUSANOH_L2_TRIAGE_BAND", "0.2,0.8")
+    monkeypatch.setenv("SUSANOH_L2_TRIAGE_MODEL", str(model_path))
+    triage = L2Triage.from_env()
+    assert (triage.low, triage.high) == (0.2, 0.8)
+    assert triage.model == TriageModel(bias=0.0, weights={})
+    assert triage.calibrated is True
+
+    monkeypatch.setenv("SUSANOH_L2_TRIAGE_MODEL", str(tmp_path / "missing.json"))
+    assert L2Triage.from_env().calibrated is False
+
+    with pytest.raises(ValueError):
+        L2Triage(band=(0.9, 0.1))
+
+
+@pytest.mark.asyncio
+async def test_engine_stores_local_verdicts_and_skips_when_disabled():
+    request = _request(["R1", "R2", "R3", "R4"], senders=8, received=2_000_000, age=1, level=2)
+    assert await L2Engine().try_triage(request) is None
+
+    engine = L2Engine(triage=L2Triage())
+    result = await engine.try_triage(request)
+    assert result is not None
+    assert engine.analysis_results == [result]
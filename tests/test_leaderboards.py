@@ -0,0 +1,64 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.leaderboards import LEADERBOARD_BUCKET_SECONDS, Leaderboards
+from backend.models import GameEventLog
+
+
+async def _record(boards: Leaderboards, event: GameEventLog) -> None:
+    boards.record_local(event)
+    if boards.redis:
+        async with boards.redis.pipeline(transaction=False) as pipe:
+            boards.stage(pipe, event)
+            await pipe.execute()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_heavy_hitters_survive_a_long_tail(use_redis, clock, make_event):
+    boards = Leaderboards(FakeRedis(decode_responses=True) if use_redis else None, capacity=10, clock=clock)
+    for i in range(200):
+        await _record(boards, make_event(f"tail_sender_{i}", f"tail_{i}", 10))
+        if i % 4 == 0:
+            await _record(boards, make_event("whale_sender", "hub", 1_000))
+
+    result = await boards.top(window_seconds=3600, limit=3)
+
+    top = result["receivers"][0]
+    assert top["user_id"] == "hub"
+    assert top["min_amount"] <= 50_000 <= top["amount"]
+    assert result["senders"][0]["user_id"] == "whale_sender"
+    assert len(result["receivers"]) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_steady_small_inflows_outrank_one_off_transfers(use_redis, clock, make_event):
+    # Every one-off receiver beats a single hub transfer, so a board that just
+    # truncates to the largest scores would evict the hub before it adds up.
+    boards = Leaderboards(FakeRedis(decode_responses=True) if use_redis else None, capacity=10, clock=clock)
+    for i in range(600):
+        await _record(boards, make_event(f"big_payer_{i}", f"big_{i}", 100))
+        if i >= 10:  # the board is full of one-off receivers before the hub shows up
+            await _record(boards, make_event(f"payer_{i}", "hub", 50))
+
+    [top] = (await boards.top(window_seconds=3600, limit=1))["receivers"]
+
+    assert top["user_id"] == "hub"
+    assert top["min_amount"] <= 29_500 <= top["amount"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_window_only_merges_recent_buckets(use_redis, clock, make_event):
+    boards = Leaderboards(FakeRedis(decode_responses=True) if use_redis else None, clock=clock)
+    await _record(boards, make_event("a", "old_hub", 5_000))
+    clock.now += 2 * 3600
+    await _record(boards, make_event("b", "new_hub", 100))
+
+    last_hour = await boards.top(window_seconds=3600)
+    last_day = await boards.top(window_seconds=86400)
+
+    assert [e["user_id"] for e in last_hour["receivers"]] == ["new_hub"]
+    assert [e["user_id"] for e in last_day["receivers"]] == ["old_hub", "new_hub"]
+    assert last_hour["window_seconds"] == 3600 // LEADERBOARD_BUCKET_SECONDS * LEADERBOARD_BUCKET_SECONDS
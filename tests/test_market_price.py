@@ -0,0 +1,103 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+import backend.market_price as market_price
+from backend.l1_screening import L1Engine
+from backend.market_price import MIN_SAMPLES, MarketPriceEstimator
+from backend.models import ActionDetails, GameEventLog
+
+T0 = 1_000_000.0
+
+
+def _trade(item: str, price: int, eid: str = "evt", market_avg: int | None = None) -> GameEventLog:
+    return GameEventLog(
+        event_id=eid,
+        actor_id="seller",
+        target_id="buyer",
+        action_details=ActionDetails(currency_amount=price, item_id=item, market_avg_price=market_avg),
+    )
+
+
+async def _observe(estimator: MarketPriceEstimator, event: GameEventLog, ts: float) -> None:
+    estimator.record_local(event, ts)
+    if estimator.redis:
+        async with estimator.redis.pipeline(transaction=False) as pipe:
+            estimator.stage(pipe, event, ts)
+            await pipe.execute()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_median_resists_outliers_and_mean_tracks_prices(use_redis):
+    estimator = MarketPriceEstimator(FakeRedis(decode_responses=True) if use_redis else None)
+    for i in range(50):
+        await _observe(estimator, _trade("itm_sword", 1_000 + (i % 5) * 10), T0 + i)
+    await _observe(estimator, _trade("itm_sword", 5_000_000), T0 + 60)
+
+    estimate = await estimator.estimate("itm_sword", T0 + 60)
+
+    assert estimate.samples == 51
+    assert 950 <= estimate.median <= 1_100
+    assert estimate.mean > 50_000  # the mean is not robust; R3 uses the median
+    assert await estimator.estimate("itm_unknown", T0) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_old_prices_decay_across_epochs(use_redis):
+    estimator = MarketPriceEstimator(FakeRedis(decode_responses=True) if use_redis else None, half_life_seconds=100)
+    for i in range(30):
+        await _observe(estimator, _trade("itm_ore", 100), T0 + i)
+    later = T0 + 600
+    for i in range(30):
+        await _observe(estimator, _trade("itm_ore", 1_000), later + i)
+
+    estimate = await estimator.estimate("itm_ore", later + 30)
+
+    assert 950 <= estimate.median <= 1_050
+    assert estimate.mean > 900
+
+
+@pytest.mark.asyncio
+async def test_redis_state_is_shared_between_nodes():
+    redis = FakeRedis(decode_responses=True)
+    node_a, node_b = MarketPriceEstimator(redis), MarketPriceEstimator(redis)
+    for i in range(10):
+        await _observe(node_a, _trade("itm_gem", 500), T0 + i)
+        await _observe(node_b, _trade("itm_gem", 500), T0 + i)
+
+    estimate = await node_b.estimate("itm_gem", T0 + 10)
+
+    assert estimate.samples == 20
+
+
+@pytest.mark.asyncio
+async def test_item_cardinality_is_bounded(monkeypatch):
+    monkeypatch.setattr(market_price, "EVICT_EVERY", 1)
+    redis = FakeRedis(decode_responses=True)
+    estimator = MarketPriceEstimator(redis, max_items=3)
+    for i in range(5):
+        await _observe(estimator, _trade(f"itm_{i}", 100), T0 + i)
+        await estimator.maybe_evict()
+
+    assert list(estimator._local) == ["itm_2", "itm_3", "itm_4"]
+    assert await redis.zrange(estimator.keys.price_lru, 0, -1) == ["itm_2", "itm_3", "itm_4"]
+    assert await redis.keys("susanoh:price:itm_0:*") == []
+
+
+@pytest.mark.asyncio
+async def test_r3_falls_back_to_learned_price_when_client_price_missing():
+    engine = L1Engine(optional_rules=set())
+    for i in range(MIN_SAMPLES):
+        result = await engine.screen(_trade("itm_wood_stick_01", 10, eid=f"e{i}"))
+        assert "R3" not in result.triggered_rules
+
+    result = await engine.screen(_trade("itm_wood_stick_01", 5_000, eid="dump"))
+
+    assert "R3" in result.triggered_rules
+    assert result.estimated_market_price == pytest.approx(10, rel=0.1)
+
+    # A client-supplied price still takes precedence.
+    result = await engine.screen(_trade("itm_wood_stick_01", 5_000, eid="priced", market_avg=1_000))
+    assert "R3" not in result.triggered_rules
+    assert result.estimated_market_price is None
@@ -6,7 +6,9 @@ from backend.l2_gemini import _local_fallback
 from backend.models import (
     AccountState,
     ActionDetails,
+    ArbitrationResult,
     ContextMetadata,
+    FraudType,
     GameEventLog,
 )
 from backend.persistence import (
@@ -159,3 +161,37 @@ def test_snapshot_appends_to_logs_instead_of_clearing(tmp_path):
         # Total users in DB should be 3 + 2 = 5 (since reset cleared in-memory, but DB rows were kept)
         assert session.query(UserRecord).count() == 5
 
+
+
+def _verdict(user_id: str) -> ArbitrationResult:
+    return ArbitrationResult(
+        target_id=user_id,
+        is_fraud=False,
+        risk_score=10,
+        fraud_type=FraudType.LEGITIMATE,
+        recommended_action=AccountState.NORMAL,
+        reasoning="batch",
+        confidence=0.9,
+    )
+
+
+def test_verdict_batch_is_bulk_inserted(tmp_path):
+    store = PersistenceStore(_sqlite_url(tmp_path))
+    store.init_schema()
+    sm = StateMachine()
+    for user_id in ("user_x", "user_y"):
+        asyncio.run(sm.transition(user_id, AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1"))
+    logs = asyncio.run(sm.apply_l2_verdicts([
+        ("user_x", AccountState.BANNED, 95),
+        ("user_y", AccountState.NORMAL, 10),
+    ]))
+    analyses = [_verdict("user_x"), _verdict("user_y")]
+
+    store.persist_verdict_batch({log.user_id: log.to_state for log in logs}, analyses, logs)
+    store.persist_verdict_batch({}, analyses[:1], [])
+
+    with store.session() as session:
+        users = {r.user_id: r.state for r in session.query(UserRecord).all()}
+        assert users == {"user_x": "BANNED", "user_y": "NORMAL"}
+        assert session.query(AnalysisResultRecord).count() == 3
+        assert session.query(AuditLogRecord).count() == 3
@@ -0,0 +1,67 @@
+import re
+
+from backend.l2_gemini import L2Engine
+from backend.models import ActionDetails, AnalysisRequest, ContextMetadata, GameEventLog, UserProfile
+from backend.prompt_budget import compact_analysis_request, estimate_tokens, format_event_line
+
+SLANG = re.compile(r"振込|口座")
+
+
+def _event(i: int, actor: str = "s0", amount: int = 1_000, chat: str | None = None) -> GameEventLog:
+    return GameEventLog(
+        event_id=f"e{i:04d}",
+        timestamp=f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}Z",
+        actor_id=actor,
+        target_id="victim",
+        action_details=ActionDetails(currency_amount=amount),
+        context_metadata=ContextMetadata(recent_chat_log=chat),
+    )
+
+
+def _request(events: list[GameEventLog]) -> AnalysisRequest:
+    return AnalysisRequest(
+        trigger_event=events[-1],
+        related_events=events,
+        triggered_rules=["R1"],
+        user_profile=UserProfile(user_id="victim"),
+    )
+
+
+def test_estimate_tokens_counts_non_ascii_per_character():
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("振込完了") == 4
+
+
+def test_small_windows_are_left_untouched():
+    request = _request([_event(i) for i in range(5)])
+    assert compact_analysis_request(request, token_budget=1_000) is request
+
+
+def test_large_window_is_summarised_and_keeps_informative_events_under_budget():
+    events = [_event(i, chat="gg") for i in range(2_000)]
+    events[100] = _event(100, amount=900_000)
+    events[200] = _event(200, chat="口座に振込しました")
+    events[300] = _event(300, actor="rare_sender")
+    request = _request(events)
+
+    compacted = compact_analysis_request(request, token_budget=120, max_events=5, slang_pattern=SLANG)
+
+    shown = [e.event_id for e in compacted.related_events]
+    assert {"e0100", "e0200", "e0300"} <= set(shown)
+    assert shown == sorted(shown)
+    assert sum(estimate_tokens(format_event_line(e)) for e in compacted.related_events) <= 120
+    summary = compacted.window_summary
+    assert summary.event_count == 2_000
+    assert summary.shown_events == len(shown)
+    assert summary.distinct_senders == 2
+    assert summary.slang_hits == 1
+    assert summary.max_amount == 900_000
+    assert compact_analysis_request(compacted) is compacted
+
+
+def test_prompt_size_is_bounded_by_the_budget_not_the_window():
+    small = L2Engine._build_prompt(_request([_event(i, actor=f"s{i % 7}") for i in range(50)]))
+    large = L2Engine._build_prompt(_request([_event(i, actor=f"s{i % 7}") for i in range(5_000)]))
+
+    assert "## Window Summary (5000 events" in large
+    assert abs(estimate_tokens(large) - estimate_tokens(small)) < 20
@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+from redis.asyncio.connection import AbstractConnection, BlockingConnectionPool
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError
+
+from backend.redis_client import CircuitBreaker, CircuitOpenError, RedisClient
+from backend.models import AccountState
+from backend.state_machine import StateMachine
+
+# Nothing listens on port 1, so connecting is refused immediately.
+UNREACHABLE_URL = "redis://127.0.0.1:1/0"
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=5, clock=clock)
+
+    breaker.record_failure()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.is_open()
+
+    clock.now += 4.9
+    assert breaker.is_open()
+    clock.now += 0.2
+    assert not breaker.is_open()
+
+    # A failed probe re-opens it for a full cool-down; a success closes it.
+    breaker.record_failure()
+    assert breaker.is_open()
+    breaker.record_success()
+    assert not breaker.is_open()
+    assert breaker.state()["consecutive_failures"] == 0
+
+
+def test_pool_settings_come_from_env(monkeypatch):
+    monkeypatch.setenv("SUSANOH_REDIS_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("SUSANOH_REDIS_HEALTH_CHECK_INTERVAL", "11")
+    client = RedisClient(UNREACHABLE_URL)
+
+    pool = client.get_client().connection_pool
+    assert pool.max_connections == 7
+    assert pool.connection_kwargs["health_check_interval"] == 11
+    assert pool.connection_kwargs["socket_keepalive"] is True
+    assert client.get_arq_pool().connection_pool is not pool
+
+
+def test_disabled_without_url(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    client = RedisClient()
+    assert client.get_client() is None
+    assert client.get_arq_pool() is None
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_fails_fast_without_connecting(monkeypatch):
+    client = RedisClient(UNREACHABLE_URL, breaker=CircuitBreaker(threshold=2, cooldown=60))
+    redis = client.get_client()
+
+    for _ in range(2):
+        with pytest.raises(RedisError) as exc:
+            await redis.get("k")
+        assert not isinstance(exc.value, CircuitOpenError)
+    assert client.breaker.is_open()
+
+    async def fail_connect(*args, **kwargs):
+        raise AssertionError("must not connect while the breaker is open")
+
+    monkeypatch.setattr(BlockingConnectionPool, "ensure_connection", fail_connect)
+    with pytest.raises(CircuitOpenError):
+        await redis.get("k")
+    with pytest.raises(CircuitOpenError):
+        await client.get_arq_pool().enqueue_job("analyze_l2_ref_task", "[]")
+    assert await client.ping() is False
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_engines_fall_back_to_memory_while_breaker_is_open():
+    client = RedisClient(UNREACHABLE_URL, breaker=CircuitBreaker(threshold=1, cooldown=60))
+    client.breaker.record_failure()
+    sm = StateMachine(client.get_client())
+
+    assert await sm.get_or_create("u1") == AccountState.NORMAL
+    await sm.transition("u1", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1", "test")
+    assert await sm.get_or_create("u1") == AccountState.RESTRICTED_WITHDRAWAL
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_half_open_breaker_lets_a_single_probe_through(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 6
+
+    async def asks() -> bool:
+        return breaker.is_open()
+
+    assert not breaker.is_open()
+    assert await asyncio.gather(*(asks() for _ in range(3))) == [True, True, True]
+    assert not breaker.is_open()  # still the probing task
+    assert breaker.state()["open"]
+
+    breaker.record_success()
+    assert await asyncio.gather(asks(), asks()) == [False, False]
+
+
+@pytest.mark.asyncio
+async def test_command_failures_and_successes_reach_the_breaker(monkeypatch):
+    replies: list = []
+
+    async def connect(self):
+        pass
+
+    async def can_read(self, timeout: float = 0):
+        return False
+
+    async def send_packed_command(self, command, check_health=True):
+        pass
+
+    async def read_response(self, *args, **kwargs):
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    for name, fn in [("connect", connect), ("can_read", can_read),
+                     ("send_packed_command", send_packed_command), ("read_response", read_response)]:
+        monkeypatch.setattr(AbstractConnection, name, fn)
+    client = RedisClient(UNREACHABLE_URL, breaker=CircuitBreaker(threshold=2, cooldown=60))
+    redis = client.get_client()
+
+    # The connection is fine; the commands on it time out.
+    replies[:] = [RedisConnectionError("reset by peer"), RedisConnectionError("reset by peer")]
+    for _ in range(2):
+        with pytest.raises(RedisConnectionError):
+            await redis.get("k")
+    assert client.breaker.is_open()
+
+    client.breaker.record_success()
+    client.breaker.record_failure()
+    replies[:] = ["v"]
+    assert await redis.get("k") == "v"
+    assert client.breaker.state()["consecutive_failures"] == 0
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_forwards_get_connection_arguments(monkeypatch):
+    seen = []
+
+    async def get_connection(self, *args, **kwargs):
+        seen.append((args, kwargs))
+
+    monkeypatch.setattr(BlockingConnectionPool, "get_connection", get_connection)
+    pool = RedisClient(UNREACHABLE_URL).get_client().connection_pool
+    await pool.get_connection("GET", "k", hint=1)
+    assert seen == [(("GET", "k"), {"hint": 1})]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("layout", ["legacy", "cluster"])
+async def test_resets_scan_instead_of_blocking_keys(monkeypatch, layout, make_event):
+    from fakeredis.aioredis import FakeRedis
+
+    from backend.keys import KeySchema
+    from backend.l1_screening import L1Engine
+
+    async def _no_keys(self, pattern="*", **kwargs):
+        raise AssertionError(f"KEYS {pattern} blocks the server")
+
+    monkeypatch.setattr(FakeRedis, "keys", _no_keys)
+    fake_redis = FakeRedis(decode_responses=True)
+    keys = KeySchema(layout, shards=4)
+    sm = StateMachine(fake_redis, keys=keys)
+    l1 = L1Engine(fake_redis, keys=keys)
+    for i in range(20):
+        await l1.screen(make_event(f"a{i % 5}", f"u{i % 7}", 1000 + i, f"e{i}", item_id=f"item{i % 3}"))
+    await sm.apply_l2_verdicts([("u1", AccountState.UNDER_SURVEILLANCE, 60)], idempotency_keys=["u1:e1"])
+    assert await fake_redis.dbsize() > 0
+
+    await sm.reset()
+    await l1.reset()
+
+    assert [key async for key in fake_redis.scan_iter()] == []
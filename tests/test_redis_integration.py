@@ -2,6 +2,7 @@ import pytest
 import asyncio
 from unittest.mock import patch
 from fakeredis.aioredis import FakeRedis
+from redis.exceptions import RedisError
 from backend.state_machine import StateMachine
 from backend.l1_screening import L1Engine
 from backend.models import AccountState, GameEventLog, ActionDetails, ContextMetadata
@@ -105,3 +106,218 @@ async def test_redis_timeout_fallback(fake_redis):
         assert result.screened is False
         
     assert "target_3" in engine.user_windows
+
+
+@pytest.mark.asyncio
+async def test_state_counters_track_creation_and_transitions(fake_redis):
+    sm = StateMachine(fake_redis)
+    await sm.get_or_create("u_cnt_1")
+    await sm.get_or_create("u_cnt_1")
+    await sm.get_or_create("u_cnt_2")
+    await sm.transition("u_cnt_1", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+
+    assert await fake_redis.hgetall("susanoh:state_counts") == {
+        "NORMAL": "1",
+        "RESTRICTED_WITHDRAWAL": "1",
+    }
+    with patch.object(fake_redis, "hgetall", wraps=fake_redis.hgetall) as hgetall:
+        stats = await sm.get_stats()
+    assert all(call.args[0] != "susanoh:accounts" for call in hgetall.call_args_list)
+    assert stats["NORMAL"] == 1
+    assert stats["RESTRICTED_WITHDRAWAL"] == 1
+    assert stats["total_accounts"] == 2
+    assert stats["total_transitions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_apply_l2_verdicts_writes_all_transitions_in_two_pipelines(fake_redis):
+    sm = StateMachine(fake_redis)
+    for user_id in ("u_b1", "u_b2", "u_b3"):
+        await sm.transition(user_id, AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+
+    with patch.object(fake_redis, "pipeline", wraps=fake_redis.pipeline) as pipeline:
+        logs = await sm.apply_l2_verdicts([
+            ("u_b1", AccountState.BANNED, 95),
+            ("u_b2", AccountState.NORMAL, 10),
+            ("u_b3", AccountState.UNDER_SURVEILLANCE, 50),
+            ("u_b2", AccountState.BANNED, 90),  # NORMAL cannot be banned by L2
+        ])
+
+    # One for the compare-and-set of every account, one for counters and the audit stream.
+    assert pipeline.call_count == 2
+    assert [(log.user_id, log.to_state) for log in logs] == [
+        ("u_b1", AccountState.UNDER_SURVEILLANCE),
+        ("u_b1", AccountState.BANNED),
+        ("u_b2", AccountState.NORMAL),
+        ("u_b3", AccountState.UNDER_SURVEILLANCE),
+    ]
+    assert await fake_redis.hgetall("susanoh:accounts") == {
+        "u_b1": "BANNED",
+        "u_b2": "NORMAL",
+        "u_b3": "UNDER_SURVEILLANCE",
+    }
+    stats = await sm.get_stats()
+    assert (stats["BANNED"], stats["NORMAL"], stats["UNDER_SURVEILLANCE"], stats["RESTRICTED_WITHDRAWAL"]) == (1, 1, 1, 0)
+    assert stats["total_transitions"] == 7
+
+
+@pytest.mark.asyncio
+async def test_retried_verdicts_are_applied_once(fake_redis):
+    sm = StateMachine(fake_redis)
+    await sm.transition("u_idem", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    verdict = [("u_idem", AccountState.NORMAL, 10)]
+
+    assert len(await sm.apply_l2_verdicts(verdict, idempotency_keys=["u_idem:e1"])) == 1
+    # A newer L1 hit restricts the account again; a retry of the old job must not release it.
+    await sm.transition("u_idem", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    assert await sm.apply_l2_verdicts(verdict, idempotency_keys=["u_idem:e1"]) == []
+    assert await sm.get_or_create("u_idem") == AccountState.RESTRICTED_WITHDRAWAL
+
+
+@pytest.mark.asyncio
+async def test_failed_verdict_write_releases_its_claim(fake_redis):
+    sm = StateMachine(fake_redis)
+    await sm.transition("u_claim", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    verdict = [("u_claim", AccountState.NORMAL, 10)]
+
+    with patch.object(fake_redis, "hmget", side_effect=RedisError("down")):
+        with pytest.raises(RedisError):
+            await sm.apply_l2_verdicts(verdict, idempotency_keys=["u_claim:e1"])
+    assert len(await sm.apply_l2_verdicts(verdict, idempotency_keys=["u_claim:e1"])) == 1
+
+
+@pytest.mark.asyncio
+async def test_reconcile_state_aggregates_repairs_drift(fake_redis):
+    sm = StateMachine(fake_redis)
+    await sm.get_or_create("u_rec_1")
+    await sm.get_or_create("u_rec_2")
+    await sm.transition("u_rec_2", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    await fake_redis.hset("susanoh:state_counts", mapping={"NORMAL": 40, "BANNED": -3})
+
+    counts = await sm.reconcile_state_aggregates()
+
+    assert counts["NORMAL"] == 1
+    assert counts["RESTRICTED_WITHDRAWAL"] == 1
+    assert counts["BANNED"] == 0
+    assert (await sm.get_stats())["total_accounts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reconcile_on_a_bytes_client_keeps_the_counters():
+    from fakeredis import FakeServer
+
+    server = FakeServer()
+    sm = StateMachine(FakeRedis(server=server, decode_responses=True))
+    await sm.get_or_create("u_bytes_1")
+    await sm.transition("u_bytes_2", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+
+    counts = await StateMachine(FakeRedis(server=server)).reconcile_state_aggregates()
+
+    assert (counts["NORMAL"], counts["RESTRICTED_WITHDRAWAL"]) == (1, 1)
+    assert (await sm.get_stats())["RESTRICTED_WITHDRAWAL"] == 1
+    assert await sm.get_users_page(AccountState.NORMAL) == ([{"user_id": "u_bytes_1", "state": "NORMAL"}], 0)
+
+
+@pytest.mark.asyncio
+async def test_racing_transitions_move_the_counters_once(fake_redis):
+    api, worker = StateMachine(fake_redis), StateMachine(fake_redis)
+    await api.transition("u_race", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1")
+    assert await worker.get_or_create("u_race") == AccountState.RESTRICTED_WITHDRAWAL
+
+    # The worker plans a verdict on the state it read; the API releases the account first.
+    with patch.object(worker, "_read_states", return_value=["RESTRICTED_WITHDRAWAL"]) as stale:
+        await api.transition("u_race", AccountState.NORMAL, "TEST", "RULE")
+        logs = await worker.apply_l2_verdicts([("u_race", AccountState.UNDER_SURVEILLANCE, 60)], ["u_race:e1"])
+    assert stale.call_count == 3  # re-planned after every lost compare-and-set
+    assert logs == []
+    assert await fake_redis.hget("susanoh:accounts", "u_race") == "NORMAL"
+
+    # Racing on a stale cached state, the loser re-checks instead of double counting.
+    worker._accounts["u_race"] = AccountState.RESTRICTED_WITHDRAWAL
+    with patch.object(worker, "get_or_create", side_effect=[AccountState.RESTRICTED_WITHDRAWAL, AccountState.NORMAL]):
+        assert not await worker.transition("u_race", AccountState.UNDER_SURVEILLANCE, "TEST", "RULE")
+    stats = await api.get_stats()
+    assert (stats["NORMAL"], stats["RESTRICTED_WITHDRAWAL"], stats["UNDER_SURVEILLANCE"]) == (1, 0, 0)
+    assert stats["total_transitions"] == 2
+
+
+@pytest.mark.asyncio
+async def test_screening_counters_are_not_capped_by_recent_buffer(fake_redis):
+    engine = L1Engine(fake_redis)
+    for i in range(205):
+        await engine.screen(GameEventLog(event_id=f"evt_cnt_{i}", actor_id="a", target_id=f"t_{i}"))
+    await engine.screen(GameEventLog(
+        event_id="evt_cnt_flag",
+        actor_id="a",
+        target_id="t_flag",
+        action_details=ActionDetails(currency_amount=2_000_000),
+    ))
+
+    assert await engine.get_counters() == {"total_events": 206, "l1_flags": 1}
+    assert await fake_redis.llen("susanoh:recent_events") == 200
+
+
+@pytest.mark.asyncio
+async def test_users_page_walks_accounts_with_cursor(fake_redis):
+    sm = StateMachine(fake_redis)
+    for i in range(25):
+        await sm.get_or_create(f"u_page_{i:02d}")
+
+    seen, cursor = [], 0
+    while True:
+        page, cursor = await sm.get_users_page(cursor=cursor, limit=10)
+        seen.extend(row["user_id"] for row in page)
+        if cursor == 0:
+            break
+    assert sorted(seen) == [f"u_page_{i:02d}" for i in range(25)]
+
+
+@pytest.mark.asyncio
+async def test_users_page_state_filter_reads_only_the_state_index(fake_redis):
+    sm = StateMachine(fake_redis)
+    for i in range(5):
+        await sm.get_or_create(f"u_idx_{i}")
+    await sm.transition("u_idx_3", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    await sm.transition("u_idx_3", AccountState.UNDER_SURVEILLANCE, "TEST", "RULE")
+    await sm.transition("u_idx_3", AccountState.BANNED, "TEST", "RULE")
+
+    with patch.object(fake_redis, "hscan", side_effect=AssertionError("accounts hash scanned")):
+        page, cursor = await sm.get_users_page(AccountState.BANNED)
+    assert page == [{"user_id": "u_idx_3", "state": "BANNED"}]
+    assert cursor == 0
+    assert not await fake_redis.sismember("susanoh:state_index:NORMAL", "u_idx_3")
+
+
+@pytest.mark.asyncio
+async def test_reconcile_rebuilds_state_indexes(fake_redis):
+    sm = StateMachine(fake_redis)
+    await sm.get_or_create("u_rb_1")
+    await sm.get_or_create("u_rb_2")
+    await sm.transition("u_rb_2", AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+    await fake_redis.delete("susanoh:state_index:NORMAL")
+    await fake_redis.sadd("susanoh:state_index:BANNED", "ghost")
+
+    await sm.reconcile_state_aggregates()
+
+    assert await fake_redis.smembers("susanoh:state_index:NORMAL") == {"u_rb_1"}
+    assert await fake_redis.smembers("susanoh:state_index:RESTRICTED_WITHDRAWAL") == {"u_rb_2"}
+    assert not await fake_redis.exists("susanoh:state_index:BANNED")
+
+
+@pytest.mark.asyncio
+async def test_screen_updates_both_windows_in_one_pipeline(fake_redis):
+    engine = L1Engine(fake_redis, optional_rules={"R7"})
+    for i in range(5):
+        event = GameEventLog(
+            event_id=f"evt_out_{i}",
+            actor_id="payer",
+            target_id=f"recv_{i}",
+            action_details=ActionDetails(currency_amount=100),
+            context_metadata=ContextMetadata(),
+        )
+        with patch.object(fake_redis, "zrange", side_effect=AssertionError("unpipelined read")):
+            result = await engine.screen(event)
+
+    assert result.triggered_rules == ["R7"]
+    assert await fake_redis.zcard("susanoh:actor_window:payer") == 5
+    assert await fake_redis.zcard("susanoh:window:recv_4") == 1
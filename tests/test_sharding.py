@@ -0,0 +1,161 @@
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.main as main_module
+from backend.main import app, sm
+from backend.sharding import FORWARD_SIGNATURE_HEADER, FORWARDED_HEADER, HashRing, ShardRouter
+
+NODES = ["http://node-a:8000", "http://node-b:8000", "http://node-c:8000"]
+SECRET = "shard-secret"
+
+
+def test_ring_spreads_keys_and_moves_few_on_resize():
+    ring = HashRing(NODES)
+    keys = [f"user_{i}" for i in range(3000)]
+    owners = {key: ring.owner(key) for key in keys}
+
+    counts = Counter(owners.values())
+    assert set(counts) == set(NODES)
+    assert min(counts.values()) > 600
+
+    grown = HashRing([*NODES, "http://node-d:8000"])
+    moved = [key for key in keys if grown.owner(key) != owners[key]]
+    assert all(grown.owner(key) == "http://node-d:8000" for key in moved)
+    assert len(moved) < len(keys) / 2
+
+
+def test_ring_is_independent_of_node_order():
+    assert HashRing(NODES).owner("u1") == HashRing(list(reversed(NODES))).owner("u1")
+    assert HashRing(NODES).version == HashRing(list(reversed(NODES))).version
+
+
+def test_router_from_env(monkeypatch):
+    monkeypatch.setenv("SUSANOH_SHARD_NODES", ",".join(NODES))
+    monkeypatch.setenv("SUSANOH_SHARD_SELF", NODES[1] + "/")
+    monkeypatch.delenv("SUSANOH_SHARD_SECRET", raising=False)
+    with pytest.raises(ValueError):
+        ShardRouter.from_env()
+
+    monkeypatch.setenv("SUSANOH_SHARD_SECRET", SECRET)
+    router = ShardRouter.from_env()
+    assert router.enabled
+    assert router.shard_map()["nodes"] == NODES
+
+    monkeypatch.setenv("SUSANOH_SHARD_SELF", "http://elsewhere:8000")
+    with pytest.raises(ValueError):
+        ShardRouter.from_env()
+
+
+def test_router_is_disabled_without_nodes(monkeypatch):
+    monkeypatch.delenv("SUSANOH_SHARD_NODES", raising=False)
+    router = ShardRouter.from_env()
+    assert not router.enabled
+    assert router.is_local("anyone")
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    forwarded: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        forwarded.append(request)
+        return httpx.Response(200, json={"handled_by": str(request.url.host)})
+
+    router = ShardRouter(
+        NODES, NODES[0], client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), secret=SECRET
+    )
+    monkeypatch.setattr(main_module, "shard_router", router)
+    asyncio.run(sm.reset())
+    return router, forwarded
+
+
+def _user_owned_by(router: ShardRouter, node: str) -> str:
+    return next(f"user_{i}" for i in range(1000) if router.owner(f"user_{i}") == node)
+
+
+def test_events_for_remote_targets_are_forwarded_once(sharded):
+    router, forwarded = sharded
+    remote = _user_owned_by(router, NODES[2])
+    client = TestClient(app)
+
+    event = {"event_id": "evt_fwd", "actor_id": "seller", "target_id": remote, "action_details": {"currency_amount": 10}}
+    resp = client.post("/api/v1/events", json=event, headers={"X-API-KEY": "k"})
+    assert resp.status_code == 200
+    assert resp.json() == {"handled_by": "node-c"}
+    assert len(forwarded) == 1
+    assert forwarded[0].url.path == "/api/v1/events"
+    assert forwarded[0].headers[FORWARDED_HEADER] == NODES[0]
+    assert forwarded[0].headers[FORWARD_SIGNATURE_HEADER] == router.sign(
+        NODES[0], "POST", "/api/v1/events", forwarded[0].content
+    )
+    assert forwarded[0].headers["x-api-key"] == "k"
+    assert remote not in sm.accounts
+
+    # A hop signed by a ring node is processed wherever it lands.
+    body = json.dumps(event).encode()
+    signed = {
+        "content-type": "application/json",
+        FORWARDED_HEADER: NODES[1],
+        FORWARD_SIGNATURE_HEADER: router.sign(NODES[1], "POST", "/api/v1/events", body),
+    }
+    resp = client.post("/api/v1/events", content=body, headers=signed)
+    assert resp.status_code == 200
+    assert "screened" in resp.json()
+    assert len(forwarded) == 1
+
+
+@pytest.mark.parametrize("sender, signed", [
+    (NODES[1], None),  # no signature
+    (NODES[1], "0" * 64),  # wrong signature
+    ("http://attacker:8000", True),  # valid signature, but not a ring node
+])
+def test_unsigned_or_foreign_forward_headers_do_not_bypass_ownership(sharded, sender, signed):
+    router, forwarded = sharded
+    remote = _user_owned_by(router, NODES[2])
+    event = {"event_id": "evt_spoof", "actor_id": "seller", "target_id": remote, "action_details": {"currency_amount": 10}}
+    body = json.dumps(event).encode()
+    headers = {FORWARDED_HEADER: sender}
+    if signed is True:
+        headers[FORWARD_SIGNATURE_HEADER] = router.sign(sender, "POST", "/api/v1/events", body)
+    elif signed:
+        headers[FORWARD_SIGNATURE_HEADER] = signed
+
+    resp = TestClient(app).post("/api/v1/events", content=body, headers={"content-type": "application/json", **headers})
+    assert resp.json() == {"handled_by": "node-c"}
+    assert len(forwarded) == 1
+    assert remote not in sm.accounts
+
+
+def test_local_targets_are_processed_here(sharded):
+    router, forwarded = sharded
+    local = _user_owned_by(router, NODES[0])
+    resp = TestClient(app).post("/api/v1/withdraw", json={"user_id": local, "amount": 1})
+    assert resp.status_code == 200
+    assert forwarded == []
+
+
+def test_unreachable_owner_returns_503(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("refused", request=request)
+
+    router = ShardRouter(
+        NODES, NODES[0], client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), secret=SECRET
+    )
+    monkeypatch.setattr(main_module, "shard_router", router)
+    remote = _user_owned_by(router, NODES[1])
+    resp = TestClient(app).post("/api/v1/withdraw", json={"user_id": remote, "amount": 1})
+    assert resp.status_code == 503
+
+
+def test_shard_map_endpoint(sharded):
+    router, _ = sharded
+    resp = TestClient(app).get("/api/v1/shards", params={"user_id": "u42"})
+    body = resp.json()
+    assert body["nodes"] == NODES
+    assert body["self"] == NODES[0]
+    assert body["owner"] == router.owner("u42")
@@ -0,0 +1,66 @@
+import pytest
+
+from backend.sketches import CountMinSketch, HyperLogLog, SpaceSaving
+
+
+def test_precision_follows_requested_error():
+    assert HyperLogLog.precision_for_error(0.05) == 9
+    assert HyperLogLog.precision_for_error(0.01) == 14
+    assert HyperLogLog.precision_for_error(10.0) == 4
+    with pytest.raises(ValueError):
+        HyperLogLog.precision_for_error(0)
+
+
+def test_small_counts_are_exact_enough():
+    hll = HyperLogLog.for_error(0.05)
+    for i in range(20):
+        hll.add(f"user_{i}")
+        hll.add(f"user_{i}")
+    assert hll.count() == 20
+
+
+@pytest.mark.parametrize("error", [0.05, 0.02])
+def test_large_counts_stay_within_three_sigma(error):
+    hll = HyperLogLog.for_error(error)
+    for i in range(20_000):
+        hll.add(f"mule_{i}")
+    assert abs(hll.count() - 20_000) <= 3 * error * 20_000
+
+
+def test_union_of_buckets_counts_overlap_once():
+    a, b = HyperLogLog(10), HyperLogLog(10)
+    for i in range(300):
+        a.add(f"u{i}")
+    for i in range(200, 500):
+        b.add(f"u{i}")
+    merged = HyperLogLog.union([a, b], 10)
+    assert abs(merged.count() - 500) <= 3 * 1.04 / 32 * 500
+    with pytest.raises(ValueError):
+        merged.merge(HyperLogLog(11))
+
+
+def test_count_min_never_undercounts():
+    cms = CountMinSketch(width=64, depth=4)
+    for i in range(500):
+        cms.add(f"u{i % 50}", i)
+    truth = {f"u{k}": sum(i for i in range(500) if i % 50 == k) for k in range(50)}
+    assert all(cms.estimate(item) >= count for item, count in truth.items())
+
+
+def test_space_saving_keeps_heavy_items_and_merges():
+    a, b = SpaceSaving(capacity=5), SpaceSaving(capacity=5)
+    for i in range(100):
+        a.add(f"noise_{i}")
+        b.add(f"noise_b_{i}")
+        if i % 2 == 0:
+            a.add("heavy", 3)
+            b.add("heavy", 3)
+
+    item, count, error = a.top(1)[0]
+    assert item == "heavy"
+    assert count - error <= 150 <= count
+
+    merged = SpaceSaving.union([a, b], capacity=5)
+    item, count, error = merged.top(1)[0]
+    assert item == "heavy"
+    assert count - error <= 300 <= count
@@ -93,3 +93,18 @@ async def test_reset_clears_runtime_state(sm):
     assert await sm.get_all_users() == []
     assert await sm.get_transitions() == []
     assert (await sm.get_stats())["blocked_withdrawals"] == 0
+
+
+@pytest.mark.asyncio
+async def test_users_page_in_memory_offsets(sm):
+    for i in range(5):
+        await sm.get_or_create(f"u{i}")
+    await sm.transition("u4", AccountState.RESTRICTED_WITHDRAWAL, "L1", "R1")
+
+    first, cursor = await sm.get_users_page(limit=3)
+    second, final = await sm.get_users_page(cursor=cursor, limit=3)
+    assert [row["user_id"] for row in first + second] == [f"u{i}" for i in range(5)]
+    assert final == 0
+
+    restricted, _ = await sm.get_users_page(AccountState.RESTRICTED_WITHDRAWAL)
+    assert restricted == [{"user_id": "u4", "state": "RESTRICTED_WITHDRAWAL"}]
@@ -0,0 +1,106 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.key_migration import LEGACY_TRANSITION_LIST, migrate_key_layout
+from backend.keys import LEGACY_KEYS, KeySchema
+from backend.models import AccountState, TransitionLog
+from backend.persistence import AuditLogRecord, PersistenceStore
+from backend.state_machine import StateMachine
+from backend.transition_stream import PersistenceSink, TransitionStreamConsumer
+
+
+class RecordingSink:
+    def __init__(self, name: str, fail: bool = False) -> None:
+        self.name = name
+        self.fail = fail
+        self.received: list[str] = []
+
+    async def handle(self, entries: list[tuple[str, TransitionLog]]) -> None:
+        if self.fail:
+            raise RuntimeError("sink down")
+        self.received += [log.user_id for _, log in entries]
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis(decode_responses=True)
+
+
+async def _restrict(sm: StateMachine, *user_ids: str) -> None:
+    for user_id in user_ids:
+        await sm.transition(user_id, AccountState.RESTRICTED_WITHDRAWAL, "TEST", "RULE")
+
+
+@pytest.mark.asyncio
+async def test_transition_stream_is_capped_but_counted(fake_redis):
+    sm = StateMachine(fake_redis, keys=LEGACY_KEYS, stream_maxlen=10)
+    await _restrict(sm, *(f"u_{i}" for i in range(300)))
+
+    assert await fake_redis.xlen(LEGACY_KEYS.transitions()) < 300
+    assert (await sm.get_stats())["total_transitions"] == 300
+    assert [log.user_id for log in await sm.get_transitions(limit=2)] == ["u_299", "u_298"]
+    assert len(sm.transition_logs) <= 1000
+
+
+@pytest.mark.asyncio
+async def test_sinks_acknowledge_independently(fake_redis):
+    sm = StateMachine(fake_redis, keys=LEGACY_KEYS)
+    healthy, failing = RecordingSink("audit"), RecordingSink("webhook", fail=True)
+    consumers = [
+        TransitionStreamConsumer(fake_redis, sink, keys=LEGACY_KEYS, consumer="c1", claim_idle_ms=0)
+        for sink in (healthy, failing)
+    ]
+    await _restrict(sm, "a", "b")
+
+    assert await consumers[0].poll_once() == 2
+    with pytest.raises(RuntimeError):
+        await consumers[1].poll_once()
+    assert healthy.received == ["a", "b"]
+    assert (await consumers[0].pending(), await consumers[1].pending()) == (0, 2)
+
+    failing.fail = False
+    await _restrict(sm, "c")
+    assert await consumers[1].poll_once() == 3
+    assert failing.received == ["a", "b", "c"]
+    assert await consumers[1].pending() == 0
+    assert await consumers[0].poll_once() == 1
+
+
+@pytest.mark.asyncio
+async def test_persistence_sink_ignores_redeliveries(fake_redis, tmp_path):
+    store = PersistenceStore(f"sqlite:///{tmp_path / 'stream.db'}")
+    store.init_schema()
+    sm = StateMachine(fake_redis, keys=KeySchema("cluster", shards=3))
+    await _restrict(sm, "p1", "p2", "p3")
+    sink = PersistenceSink(store)
+
+    consumer = TransitionStreamConsumer(fake_redis, sink, keys=sm.keys, consumer="c1")
+    assert await consumer.poll_once() == 3
+    # A consumer that lost its acknowledgements sees everything again.
+    for shard in sm.keys.aggregate_shards:
+        await fake_redis.xgroup_setid(sm.keys.transitions(shard), sink.name, "0")
+    assert await consumer.poll_once() == 3
+
+    with store.session() as session:
+        assert sorted(r.user_id for r in session.query(AuditLogRecord).all()) == ["p1", "p2", "p3"]
+
+
+@pytest.mark.asyncio
+async def test_old_transition_list_moves_into_the_stream(fake_redis):
+    log = TransitionLog(
+        user_id="old",
+        from_state=AccountState.NORMAL,
+        to_state=AccountState.RESTRICTED_WITHDRAWAL,
+        trigger="TEST",
+        triggered_by_rule="RULE",
+        timestamp="2025-01-01T00:00:00Z",
+    )
+    await fake_redis.rpush(LEGACY_TRANSITION_LIST, log.model_dump_json(), log.model_dump_json())
+
+    assert (await migrate_key_layout(fake_redis, LEGACY_KEYS))["transitions"] == 2
+    assert (await migrate_key_layout(fake_redis, LEGACY_KEYS, apply=True))["transitions"] == 2
+    assert not await fake_redis.exists(LEGACY_TRANSITION_LIST)
+
+    sm = StateMachine(fake_redis, keys=LEGACY_KEYS)
+    assert (await sm.get_stats())["total_transitions"] == 2
+    assert [t.user_id for t in await sm.get_transitions()] == ["old", "old"]
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.keys import LEGACY_KEYS
+from backend.l1_screening import L1Engine
+from backend.models import AccountState
+from backend.redis_client import CircuitBreaker
+from backend.state_machine import StateMachine
+from backend.wal import WriteAheadLog
+from backend.windowing import WindowSide
+
+
+@pytest.mark.asyncio
+async def test_group_commit_rotates_and_stops_at_a_torn_tail(tmp_path):
+    wal = WriteAheadLog(tmp_path, segment_bytes=200)
+    for i in range(10):
+        wal.append("note", {"i": i})
+    assert wal.status()["segments"] == 0  # appends never touch the disk
+
+    assert wal.flush() == 10
+    assert wal.commits == 1
+    for i in range(10, 13):
+        wal.append("note", {"i": i})
+    wal.flush()
+    assert len(wal.segments()) == 2
+    with open(wal.segments()[-1], "ab") as f:
+        f.write(b'0badc0de {"kind":"note","da')
+
+    reopened = WriteAheadLog(tmp_path)
+    assert [data["i"] for _, _, data in reopened.records()] == list(range(13))
+    assert [lsn for lsn, _, _ in reopened.records()] == list(range(1, 14))
+    assert reopened.wal_id == wal.wal_id
+    assert reopened.append("note", {"i": 13}) == 14
+    reopened.flush()
+    assert len(reopened.segments()) == 3
+    assert await reopened.checkpoint() == 3
+    assert list(reopened.records()) == []
+
+
+@pytest.mark.asyncio
+async def test_degraded_writes_survive_a_restart(tmp_path, clock, make_event):
+    fake_redis = FakeRedis(decode_responses=True)
+    breaker = CircuitBreaker(threshold=1, cooldown=5, clock=clock)
+    breaker.record_failure()
+
+    wal = WriteAheadLog(tmp_path)
+    sm = StateMachine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    l1 = L1Engine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    await l1.screen(make_event("sender", "mule", 2_000_000, "e1"))
+    await sm.transition("mule", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1")
+    await sm.increment_blocked_withdrawals()
+    await wal.close()
+
+    # A new process, still without Redis, rebuilds memory and its replay journals from the log.
+    wal = WriteAheadLog(tmp_path)
+    sm = StateMachine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    l1 = L1Engine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    restored = [
+        sm.restore_from_wal(kind, data, lsn) or l1.restore_from_wal(kind, data, lsn) for lsn, kind, data in wal.records()
+    ]
+    assert restored == [True] * 5  # window, screened, account created, transition, block
+    assert await sm.get_or_create("mule") == AccountState.RESTRICTED_WITHDRAWAL
+    assert sm.blocked_withdrawals == 1
+    assert [e.event_id for e in await l1.windows.events(WindowSide.TARGET, "mule")] == ["e1"]
+    assert await l1.get_counters() == {"total_events": 1, "l1_flags": 1}
+    assert sm.pending_writes and l1.pending_writes
+
+    clock.now += 6
+    await sm.replay_degraded_writes()
+    await l1.replay_degraded_writes()
+    assert sm.pending_writes == l1.pending_writes == 0
+    assert await fake_redis.hget(LEGACY_KEYS.accounts, "mule") == AccountState.RESTRICTED_WITHDRAWAL.value
+    stats = await sm.get_stats()
+    assert (stats["total_transitions"], stats["blocked_withdrawals"]) == (1, 1)
+    assert await l1.get_counters() == {"total_events": 1, "l1_flags": 1}
+    assert await fake_redis.zcard(LEGACY_KEYS.window("target", "mule")) == 1
+
+    assert await wal.checkpoint() == 1
+    assert list(wal.records()) == []
+
+
+async def _restore_and_replay(fake_redis, breaker, path) -> tuple[StateMachine, L1Engine]:
+    wal = WriteAheadLog(path)
+    sm = StateMachine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    l1 = L1Engine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    for lsn, kind, data in wal.records():
+        sm.restore_from_wal(kind, data, lsn) or l1.restore_from_wal(kind, data, lsn)
+    await sm.replay_degraded_writes()
+    await l1.replay_degraded_writes()
+    return sm, l1
+
+
+@pytest.mark.asyncio
+async def test_replay_after_a_crash_before_the_checkpoint_applies_nothing_twice(tmp_path, clock, make_event):
+    fake_redis = FakeRedis(decode_responses=True)
+    breaker = CircuitBreaker(threshold=1, cooldown=5, clock=clock)
+    breaker.record_failure()
+
+    wal = WriteAheadLog(tmp_path)
+    sm = StateMachine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    l1 = L1Engine(fake_redis, breaker=breaker, keys=LEGACY_KEYS, wal=wal)
+    await l1.screen(make_event("sender", "mule", 2_000_000, "e1"))
+    await sm.transition("mule", AccountState.RESTRICTED_WITHDRAWAL, "L1_SCREENING", "R1")
+    await sm.increment_blocked_withdrawals()
+    await wal.close()
+
+    clock.now += 6
+    # Replayed, then the process dies before it can checkpoint.
+    await _restore_and_replay(fake_redis, breaker, tmp_path)
+    rollup = await fake_redis.hgetall(LEGACY_KEYS.rollup("target", "1m", "mule"))
+
+    sm, l1 = await _restore_and_replay(fake_redis, breaker, tmp_path)
+    assert sm.pending_writes == l1.pending_writes == 0
+    stats = await sm.get_stats()
+    assert (stats["total_transitions"], stats["blocked_withdrawals"]) == (1, 1)
+    assert await l1.get_counters() == {"total_events": 1, "l1_flags": 1}
+    assert await fake_redis.hgetall(LEGACY_KEYS.rollup("target", "1m", "mule")) == rollup
+
+    # Writes journaled after the restart carry newer LSNs and still replay.
+    breaker.record_failure()
+    await sm.increment_blocked_withdrawals()
+    clock.now += 6
+    await sm.replay_degraded_writes()
+    assert (await sm.get_stats())["blocked_withdrawals"] == 2
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_leaves_the_event_loop_free_and_keeps_later_records(tmp_path):
+    wal = WriteAheadLog(tmp_path)
+    wal.append("note", {"i": 0})
+    wal.flush()
+
+    wal._lock.acquire()  # the flusher thread is in the middle of an fsync
+    checkpoint = asyncio.create_task(wal.checkpoint())
+    await asyncio.sleep(0.01)
+    assert not checkpoint.done()
+    wal.append("note", {"i": 1})  # the loop keeps serving writes meanwhile
+    wal._lock.release()
+
+    assert await checkpoint == 1
+    wal.flush()
+    assert [data["i"] for _, _, data in wal.records()] == [1]
@@ -0,0 +1,144 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio.client import Pipeline
+
+from backend.l1_screening import L1Engine
+from backend.models import ActionDetails, GameEventLog
+from backend.windowing import (
+    BUCKET_TIERS,
+    DISTINCT_BUCKET_SECONDS,
+    BucketRing,
+    DistinctCounters,
+    MultiResolutionCounters,
+    SlidingWindowStore,
+    WindowSide,
+    rollup_key,
+)
+
+NOW = datetime.now(UTC).replace(microsecond=0)
+
+
+def _event(actor: str, target: str, amount: int, seconds_ago: float, eid: str) -> GameEventLog:
+    return GameEventLog(
+        event_id=eid,
+        actor_id=actor,
+        target_id=target,
+        timestamp=(NOW - timedelta(seconds=seconds_ago)).isoformat(),
+        action_details=ActionDetails(currency_amount=amount),
+    )
+
+
+def _history() -> list[GameEventLog]:
+    # Oldest first: 20h, 2h, 30min, 3min and 10s before NOW.
+    ages = [72_000, 7_200, 1_800, 180, 10]
+    return [_event("s", "r", 1_000 * (i + 1), age, f"e{i}") for i, age in enumerate(ages)]
+
+
+def test_bucket_ring_reuses_slots_and_ignores_expired_buckets():
+    ring = BucketRing(3)
+    ring.add(10, 5)
+    ring.add(10, 5)
+    ring.add(13, 1)  # same slot as 10, newer bucket resets it
+    ring.add(7, 100)  # older than what the slot holds
+    totals = ring.totals(11, 13)
+    assert (totals.amount, totals.count) == (1, 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_rollups_cover_each_horizon(use_redis):
+    store = SlidingWindowStore(FakeRedis(decode_responses=True) if use_redis else None)
+    for event in _history():
+        stats = await store.add(event)
+
+    horizons = stats[WindowSide.TARGET].horizons
+    assert (horizons["1m"].amount, horizons["1m"].count) == (5_000, 1)
+    assert (horizons["5m"].amount, horizons["5m"].count) == (9_000, 2)
+    assert (horizons["1h"].amount, horizons["1h"].count) == (12_000, 3)
+    assert (horizons["24h"].amount, horizons["24h"].count) == (15_000, 5)
+    assert stats[WindowSide.ACTOR].horizons["24h"].amount == 15_000
+
+    read = await store.read("r", _history()[-1])
+    assert read[WindowSide.TARGET].horizons["1h"].amount == 12_000
+
+
+@pytest.mark.asyncio
+async def test_stale_redis_buckets_are_collected():
+    redis = FakeRedis(decode_responses=True)
+    store = SlidingWindowStore(redis)
+    fine = BUCKET_TIERS[0]
+    key = rollup_key(WindowSide.TARGET, fine, "r")
+    stale_bucket = int(NOW.timestamp() // fine.bucket_seconds) - 10 * fine.slots
+    await redis.hset(key, mapping={f"{stale_bucket - i}:n": 1 for i in range(2 * fine.slots + 1)})
+
+    stats = await store.add(_event("s", "r", 10, 0, "e_now"))
+
+    assert stats[WindowSide.TARGET].horizons["5m"].count == 1
+    assert await redis.hlen(key) == 2  # only the live bucket's amount/count fields remain
+
+
+@pytest.mark.asyncio
+async def test_r8_uses_24h_rollup():
+    engine = L1Engine(optional_rules={"R8"})
+    for i in range(6):
+        result = await engine.screen(_event(f"s{i}", "r", 900_000, 3_600 * (6 - i), f"e{i}"))
+    assert result.triggered_rules == ["R8"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [False, True])
+async def test_approx_distinct_mode_counts_senders_with_sketches(use_redis):
+    store = SlidingWindowStore(
+        FakeRedis(decode_responses=True) if use_redis else None,
+        distinct_mode="approx",
+        distinct_error=0.05,
+    )
+    for i in range(40):
+        stats = await store.add(_event(f"mule_{i % 25}", "hub", 10, 0, f"e{i}"))
+
+    assert stats[WindowSide.TARGET].count == 40
+    assert abs(stats[WindowSide.TARGET].counterparties - 25) <= 2
+    assert stats[WindowSide.ACTOR].counterparties == 1
+
+
+@pytest.mark.asyncio
+async def test_approx_mode_screens_without_reading_the_window_back(monkeypatch):
+    def _no_zrange(*args, **kwargs):
+        raise AssertionError("approx mode must not ZRANGE the window")
+
+    store = SlidingWindowStore(FakeRedis(decode_responses=True), distinct_mode="approx")
+    monkeypatch.setattr(Pipeline, "zrange", _no_zrange)
+    # 600 s of history: only the last 300 s count, to a 10 s rollup bucket.
+    for i in range(60):
+        stats = await store.add(_event(f"mule_{i % 25}", "hub", 10, 600 - 10 * i, f"e{i}"))
+
+    received = stats[WindowSide.TARGET]
+    assert 29 <= received.count <= 31 and received.total_amount == 10 * received.count
+    assert received.events == [] and abs(received.counterparties - 25) <= 2
+    assert set(received.horizons) == {"1m", "5m", "1h", "24h"}
+    assert received.horizons["24h"].count == 60
+
+
+def test_local_rollups_keep_only_the_most_recently_active_users():
+    rollups = MultiResolutionCounters(max_users=2)
+    for user_id in ("a", "b", "a", "c"):
+        rollups.record_local(WindowSide.TARGET, user_id, 1_000.0, 5)
+
+    assert set(rollups.local) == {(WindowSide.TARGET, "a"), (WindowSide.TARGET, "c")}
+    assert rollups.local_totals(WindowSide.TARGET, "a", 1_000.0)["5m"].amount == 10
+
+
+def test_late_distinct_event_does_not_evict_a_live_bucket():
+    counters = DistinctCounters(window_seconds=5 * DISTINCT_BUCKET_SECONDS)
+    for bucket in range(1, 6):
+        counters.record_local(WindowSide.TARGET, "hub", bucket * DISTINCT_BUCKET_SECONDS, f"s{bucket}")
+    counters.record_local(WindowSide.TARGET, "hub", 0, "late")  # already outside the window
+
+    assert counters.local_count(WindowSide.TARGET, "hub", 5 * DISTINCT_BUCKET_SECONDS) == 5
+
+
+def test_unknown_distinct_mode_is_rejected():
+    with pytest.raises(ValueError):
+        SlidingWindowStore(distinct_mode="fuzzy")